@@ -1,11 +1,10 @@
 # app/bot.py (очищенный)
+import asyncio
 import logging
 from telegram.ext import ApplicationBuilder
 
 from database import Database
 from config import Config
-# Убираем старый импорт cryptopay
-# from cryptopay import CryptoPay
 
 # Импортируем все обработчики из пакета
 from app.handlers import (
@@ -15,7 +14,8 @@ from app.handlers import (
     register_lobby_handlers,
     register_game_handlers,
     register_duel_handlers,
-    register_payment_handlers  # ← НОВЫЙ ИМПОРТ
+    register_payment_handlers,  # ← НОВЫЙ ИМПОРТ
+    register_ingest_filter
 )
 
 # Импортируем сервисы
@@ -23,6 +23,23 @@ from app.services.lobby_manager import LobbyManager
 from app.services.game_manager import GameManager
 from app.services.duel_manager import DuelManager
 from app.services.payment_manager import PaymentManager  # ← НОВЫЙ ИМПОРТ
+from app.services.conversation_state import ConversationStateManager
+from app.services.group_filter import GroupMessageFilter
+from app.services.metrics import (
+    registry, MetricsServer, ACTIVE_GAMES, ACTIVE_LOBBIES, ACTIVE_DUELS, EXCHANGE_RATES_AGE
+)
+from app.services.tracing import tracer
+from app.services.crypto_pay_webhook import CryptoPayWebhookServer
+from app.services.payout_queue import PayoutQueue, PayoutPolicy
+from app.services.rollups import RollupService
+from app.services.settlement import SettlementService
+from app.services.matchmaking import MatchmakingService
+from app.services.tournament import TournamentManager
+from app.handlers.game_handlers import notify_quick_match, notify_quick_match_dropped
+from app.handlers.lobby_handlers import (
+    notify_tournament_round, notify_tournament_match, notify_tournament_finished
+)
+from app.utils.telegram_instrumentation import InstrumentedApplication, InstrumentedHTTPXRequest
 
 
 class DiceGameBot:
@@ -31,38 +48,160 @@ class DiceGameBot:
         self.db = Database()
         self.config = Config()
 
-        # Создаем соединение для платежного менеджера
-        db_connection = self.db.get_connection()
+        tracer.configure(
+            enabled=self.config.TRACING_ENABLED,
+            slow_threshold_ms=self.config.TRACE_SLOW_MS,
+            export_path=self.config.TRACE_EXPORT_PATH
+        )
+
+        # Расчеты по играм, дуэлям и лобби - через один леджер
+        # (до PaymentManager: счетчик комиссии в статистике строится по его проводкам)
+        self.settlement = SettlementService(self.db, commission_rate=self.config.COMMISSION_RATE)
 
         # Инициализация менеджеров
         self.payment_manager = PaymentManager(
             database=self.db,
             crypto_pay_token=self.config.CRYPTO_PAY_TOKEN
         )
+        self.payment_manager.converter.max_age = self.config.RATES_MAX_AGE
+        self.payment_manager.converter.max_stale = self.config.RATES_MAX_STALE
+        self.payout_queue = PayoutQueue(
+            self.payment_manager,
+            policy=PayoutPolicy(
+                max_auto_amount=self.config.PAYOUT_AUTO_MAX,
+                daily_limit=self.config.PAYOUT_DAILY_LIMIT
+            ),
+            batch_size=self.config.PAYOUT_BATCH_SIZE,
+            concurrency=self.config.PAYOUT_CONCURRENCY
+        )
+        self.rollups = RollupService(
+            self.db,
+            commission_rate=self.config.COMMISSION_RATE,
+            chunk_size=self.config.ROLLUP_CHUNK_SIZE
+        )
 
-        self.lobby_manager = LobbyManager(self.db)
-        self.game_manager = GameManager(self.db, self.payment_manager)
-        self.duel_manager = DuelManager(self.db, self.payment_manager)
+        self.lobby_manager = LobbyManager(self.db, flush_delay=self.config.LOBBY_FLUSH_DELAY)
+        self.game_manager = GameManager(self.db, self.payment_manager, settlement=self.settlement)
+        self.matchmaking = MatchmakingService(
+            self.game_manager,
+            interval=self.config.MATCHMAKING_INTERVAL,
+            max_wait=self.config.MATCHMAKING_MAX_WAIT,
+            on_match=lambda game: notify_quick_match(game, self),
+            on_dropped=lambda user_id, reason: notify_quick_match_dropped(user_id, reason, self)
+        )
+        self.duel_manager = DuelManager(self.db, self.payment_manager, settlement=self.settlement,
+                                        max_per_chat=self.config.DUELS_PER_CHAT,
+                                        max_per_user=self.config.DUELS_PER_USER)
+        self.conversation_state = ConversationStateManager(
+            self.db,
+            ttl_seconds=self.config.INPUT_STATE_TTL
+        )
+        self.group_filter = GroupMessageFilter(
+            self.conversation_state,
+            bot_id=self._get_bot_id(),
+            max_chats=self.config.GROUP_FILTER_MAX_CHATS
+        )
 
         self.games = {}
         self.active_lobby_games = {}
 
-        self.db_connection = db_connection
+        # Турниры: матчи - игры лобби на двоих в общем словаре active_lobby_games
+        self.tournaments = TournamentManager(
+            self.db,
+            self.settlement,
+            games=self.active_lobby_games,
+            match_rounds=self.config.TOURNAMENT_MATCH_ROUNDS,
+            round_timeout=self.config.TOURNAMENT_ROUND_TIMEOUT,
+            on_round_opened=lambda tournament, match, game: notify_tournament_round(tournament, match, game, self),
+            on_match_finished=lambda tournament, match: notify_tournament_match(tournament, match, self),
+            on_finished=lambda tournament, settlement: notify_tournament_finished(tournament, settlement, self)
+        )
+
+        # Метрики: размеры активных коллекций считаются при запросе /metrics
+        ACTIVE_GAMES.set_function(lambda: len(self.game_manager.active_games))
+        ACTIVE_LOBBIES.set_function(lambda: len(self.lobby_manager.lobbies))
+        ACTIVE_DUELS.set_function(lambda: len(self.duel_manager.active_duels))
+        EXCHANGE_RATES_AGE.set_function(lambda: self.payment_manager.converter.snapshot.age)
+        self.metrics_server = None
+        self.webhook_server = None
 
         # Создаем приложение
-        self.application = ApplicationBuilder().token(self.config.BOT_TOKEN).build()
+        self.application = (
+            ApplicationBuilder()
+            .token(self.config.BOT_TOKEN)
+            .application_class(InstrumentedApplication)
+            .request(InstrumentedHTTPXRequest(connection_pool_size=256))
+            .post_init(self._post_init)
+            .post_shutdown(self._post_shutdown)
+            .build()
+        )
 
         self.setup_cleanup_jobs()
 
         # Регистрируем обработчики
         self.register_handlers()
 
-        print("🤖 Бот инициализирован с платежной системой!")
+        logging.getLogger(__name__).info("🤖 Бот инициализирован с платежной системой!")
 
-    def __del__(self):
-        """Закрытие соединения при уничтожении объекта"""
-        if hasattr(self, 'db_connection'):
-            self.db_connection.close()
+    async def _post_init(self, application):
+        """Запуск фоновых сервисов после инициализации приложения"""
+        self.matchmaking.start()
+
+        # Турниры, прерванные перезапуском: продолжаем или возвращаем взносы
+        try:
+            await self.tournaments.resume()
+        except Exception as e:
+            logging.getLogger(__name__).error(f"❌ Ошибка восстановления турниров: {e}")
+
+        if self.config.METRICS_PORT:
+            try:
+                self.metrics_server = MetricsServer(registry, self.config.METRICS_HOST, self.config.METRICS_PORT)
+                await self.metrics_server.start()
+            except OSError as e:
+                logging.getLogger(__name__).error(f"❌ Не удалось запустить сервер метрик: {e}")
+                self.metrics_server = None
+
+        if self.config.CRYPTO_PAY_WEBHOOK_PORT:
+            try:
+                self.webhook_server = CryptoPayWebhookServer(
+                    self.payment_manager,
+                    self.config.CRYPTO_PAY_TOKEN,
+                    host=self.config.CRYPTO_PAY_WEBHOOK_HOST,
+                    port=self.config.CRYPTO_PAY_WEBHOOK_PORT,
+                    path=self.config.CRYPTO_PAY_WEBHOOK_PATH,
+                    on_deposit=self._notify_deposit
+                )
+                await self.webhook_server.start()
+            except OSError as e:
+                logging.getLogger(__name__).error(f"❌ Не удалось запустить вебхук Crypto Pay: {e}")
+                self.webhook_server = None
+
+    async def _post_shutdown(self, application):
+        """Остановка фоновых сервисов"""
+        await self.matchmaking.stop()
+        self.lobby_manager.flush()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        if self.webhook_server:
+            await self.webhook_server.stop()
+
+    async def _notify_deposit(self, payment):
+        """Уведомление пользователя о зачисленном депозите"""
+        balance = self.payment_manager.get_user_balance(payment.user_id)
+        await self.application.bot.send_message(
+            chat_id=payment.user_id,
+            text=(
+                f"✅ Депозит зачислен: ${payment.amount:.2f}\n"
+                f"💰 Баланс: ${balance:.2f}"
+            )
+        )
+
+    def _get_bot_id(self):
+        """ID бота берем из токена (часть до ':'), без запроса get_me"""
+        try:
+            return int(self.config.BOT_TOKEN.split(':')[0])
+        except (ValueError, AttributeError):
+            return None
 
     def register_handlers(self):
         """Регистрация всех обработчиков в ПРАВИЛЬНОМ ПОРЯДКЕ"""
@@ -75,11 +214,16 @@ class DiceGameBot:
         # ВАЖНО: Порядок регистрации КРИТИЧЕСКИ ВАЖЕН!
         # Сначала самые специфичные обработчики, потом общие
 
-        # 1. Команда /duel (должна быть отдельно, так как это команда)
-        logger.info("🔄 1/8: Регистрация команды /duel...")
-        from app.handlers.duel_handlers import duel_command
+        # 0. Фильтр групповых сообщений (group=-1, до всех обработчиков)
+        logger.info("🔄 0/8: Регистрация фильтра групповых сообщений...")
+        register_ingest_filter(self.application, self)
+
+        # 1. Команды /duel и /duels (должны быть отдельно, так как это команды)
+        logger.info("🔄 1/8: Регистрация команд /duel и /duels...")
+        from app.handlers.duel_handlers import duel_command, duels_command
         from telegram.ext import CommandHandler
         self.application.add_handler(CommandHandler("duel", duel_command))
+        self.application.add_handler(CommandHandler("duels", duels_command))
 
         # 2. Самые специфичные - дуэли (callback с фильтрацией по паттерну)
         logger.info("🔄 2/8: Регистрация обработчиков ДУЭЛЕЙ (callback)...")
@@ -151,6 +295,62 @@ class DiceGameBot:
                 first=30.0  # Запустить через 30 секунд после старта
             )
             logger.info("✅ Фоновая очистка лобби настроена (каждые 60 сек)")
+
+            # Очистка устаревших состояний ввода каждые 5 минут
+            self.application.job_queue.run_repeating(
+                self.cleanup_input_states_job,
+                interval=300.0,
+                first=60.0
+            )
+
+            # Фоновое обновление курсов валют (первое - сразу после старта)
+            self.application.job_queue.run_repeating(
+                self.refresh_exchange_rates_job,
+                interval=float(self.config.RATES_REFRESH_INTERVAL),
+                first=1.0
+            )
+
+            # Пакетная сверка pending депозитов с Crypto Pay
+            if self.config.PAYMENT_POLL_INTERVAL:
+                self.application.job_queue.run_repeating(
+                    self.check_pending_payments_job,
+                    interval=float(self.config.PAYMENT_POLL_INTERVAL),
+                    first=90.0
+                )
+                logger.info(f"✅ Сверка депозитов настроена (каждые {self.config.PAYMENT_POLL_INTERVAL} сек)")
+
+            # Очередь выплат
+            if self.config.PAYOUT_INTERVAL:
+                self.application.job_queue.run_repeating(
+                    self.process_payouts_job,
+                    interval=float(self.config.PAYOUT_INTERVAL),
+                    first=45.0
+                )
+                logger.info(f"✅ Очередь выплат настроена (каждые {self.config.PAYOUT_INTERVAL} сек)")
+
+            # Инкрементальные срезы аналитики по новым играм и платежам
+            if self.config.ROLLUP_INTERVAL:
+                self.application.job_queue.run_repeating(
+                    self.update_rollups_job,
+                    interval=float(self.config.ROLLUP_INTERVAL),
+                    first=120.0
+                )
+
+            # Сверка инкрементальных счетчиков статистики с таблицами
+            if self.config.STATS_RECONCILE_INTERVAL and self.payment_manager.stats:
+                self.application.job_queue.run_repeating(
+                    self.reconcile_stats_job,
+                    interval=float(self.config.STATS_RECONCILE_INTERVAL),
+                    first=float(self.config.STATS_RECONCILE_INTERVAL)
+                )
+
+            # Сверка леджера: ставки = выплаты + комиссия
+            if self.config.LEDGER_RECONCILE_INTERVAL:
+                self.application.job_queue.run_repeating(
+                    self.reconcile_ledger_job,
+                    interval=float(self.config.LEDGER_RECONCILE_INTERVAL),
+                    first=150.0
+                )
         else:
             logger.warning("⚠️ Job queue недоступен, фоновая очистка отключена")
 
@@ -166,6 +366,59 @@ class DiceGameBot:
         except Exception as e:
             logger.error(f"❌ Ошибка очистки лобби: {e}")
 
+    async def cleanup_input_states_job(self, context):
+        """Фоновая задача для очистки устаревших состояний ввода"""
+        logger = logging.getLogger(__name__)
+
+        try:
+            removed_count = self.conversation_state.cleanup_expired()
+            if removed_count > 0:
+                logger.info(f"🧹 Сброшено {removed_count} устаревших состояний ввода")
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки состояний ввода: {e}")
+
+    async def refresh_exchange_rates_job(self, context):
+        """Фоновая задача обновления снимка курсов валют"""
+        try:
+            await self.payment_manager.converter.refresh()
+        except Exception as e:
+            logging.getLogger(__name__).error(f"❌ Ошибка обновления курсов: {e}")
+
+    async def process_payouts_job(self, context):
+        """Фоновая задача: проход очереди выплат"""
+        try:
+            await self.payout_queue.run_once()
+        except Exception as e:
+            logging.getLogger(__name__).error(f"❌ Ошибка очереди выплат: {e}", exc_info=True)
+
+    async def update_rollups_job(self, context):
+        """Фоновая задача: агрегация новых строк в срезы аналитики"""
+        try:
+            await asyncio.to_thread(self.rollups.run_once)
+        except Exception as e:
+            logging.getLogger(__name__).error(f"❌ Ошибка обновления срезов: {e}")
+
+    async def reconcile_stats_job(self, context):
+        """Фоновая задача: полный пересчет счетчиков статистики"""
+        try:
+            await asyncio.to_thread(self.payment_manager.stats.reconcile)
+        except Exception as e:
+            logging.getLogger(__name__).error(f"❌ Ошибка сверки статистики: {e}")
+
+    async def reconcile_ledger_job(self, context):
+        """Фоновая задача: сверка леджера расчетов"""
+        try:
+            await asyncio.to_thread(self.settlement.reconcile)
+        except Exception as e:
+            logging.getLogger(__name__).error(f"❌ Ошибка сверки леджера: {e}")
+
+    async def check_pending_payments_job(self, context):
+        """Фоновая задача пакетной сверки pending депозитов"""
+        await self.payment_manager.check_pending_payments(
+            chunk_size=self.config.INVOICE_BATCH_SIZE,
+            concurrency=self.config.INVOICE_POLL_CONCURRENCY
+        )
+
     def run(self):
         """Запуск бота"""
         logging.info("🤖 Bot is starting with payment system...")
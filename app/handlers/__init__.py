@@ -6,6 +6,7 @@ from .lobby_handlers import register_lobby_handlers
 from .game_handlers import register_game_handlers
 from .duel_handlers import register_duel_handlers
 from .payment_handlers import register_payment_handlers
+from .ingest_filter import register_ingest_filter
 
 __all__ = [
     'register_command_handlers',
@@ -15,4 +16,5 @@ __all__ = [
     'register_game_handlers',
     'register_duel_handlers',
     # 'register_payment_handlers',
+    'register_ingest_filter',
 ]
\ No newline at end of file
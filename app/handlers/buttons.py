@@ -3,6 +3,9 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CallbackQueryHandler
 import logging
 
+from app.utils.logging_setup import SAMPLED
+from app.utils.pagination import page_buttons
+
 logger = logging.getLogger(__name__)
 
 ADMIN_IDS = [942523120, 5558886328]
@@ -32,22 +35,22 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, bot
     data = query.data
     user_id = query.from_user.id
 
-    logger.info(f"🔘 Нажата кнопка: '{data}' пользователем {user_id}")
+    logger.info("🔘 Нажата кнопка: '%s' пользователем %s", data, user_id, extra=SAMPLED)
 
     # ========== ВАЖНО: Пропускаем кнопки ЛОББИ ==========
     lobby_prefixes = ("lobby_bet_", "lobby_size_", "lobby_custom_bet",
                       "lobby_cancel", "lobby_toggle_ready:",
-                      "lobby_start:", "lobby_leave:", "join_lobby:")
+                      "lobby_start:", "lobby_leave:", "join_lobby:", "lobby_browse:")
 
     if any(data.startswith(prefix) for prefix in lobby_prefixes):
-        logger.info(f"🔘 Кнопка лобби '{data}' передана в lobby_handlers")
+        logger.debug("🔘 Кнопка лобби '%s' передана в lobby_handlers", data)
         return
 
     # ========== ВАЖНО: Пропускаем кнопки ДУЭЛЕЙ ==========
     duel_prefixes = ("duel_accept_", "duel_roll_", "duel_cancel_")
 
     if any(data.startswith(prefix) for prefix in duel_prefixes):
-        logger.info(f"🔘 Кнопка дуэли '{data}' передана в duel_handlers")
+        logger.debug("🔘 Кнопка дуэли '%s' передана в duel_handlers", data)
         return
 
     # ========== ВАЖНО: Пропускаем кнопки ПЛАТЕЖЕЙ ==========
@@ -57,12 +60,12 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, bot
     admin_prefixes = ("admin_", "broadcast_")
 
     if any(data.startswith(prefix) for prefix in admin_prefixes):
-        logger.info(f"🔘 Кнопка админ-панели '{data}' передана в админ-обработчик")
+        logger.debug("🔘 Кнопка админ-панели '%s' передана в админ-обработчик", data)
         await handle_admin_callback(update, context, bot)
         return
 
     # if any(data.startswith(prefix) for prefix in payment_prefixes):
-    #     logger.info(f"🔘 Кнопка платежа '{data}' передана в payment_handlers")
+    #     logger.debug("🔘 Кнопка платежа '%s' передана в payment_handlers", data)
     #     return
 
     # ========== ОБРАБОТКА ОСТАЛЬНЫХ КНОПОК ==========
@@ -151,7 +154,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, bot
 
             )
 
-            logger.info(f"✅ Пользователь {user_id} вернулся в главное меню")
+            logger.info("✅ Пользователь %s вернулся в главное меню", user_id, extra=SAMPLED)
 
 
         except Exception as e:
@@ -206,7 +209,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, bot
 
     elif data == "start_deposit_input":
         # Устанавливаем состояние ожидания депозита
-        context.user_data['waiting_for_payment'] = 'deposit'
+        bot.conversation_state.set_state(user_id, bot.conversation_state.QUICK_DEPOSIT)
 
         await query.edit_message_text(
             "💳 **Пополнение баланса**\n\n"
@@ -219,7 +222,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, bot
 
     elif data == "start_withdraw_input":
         # Устанавливаем состояние ожидания вывода
-        context.user_data['waiting_for_payment'] = 'withdraw'
+        bot.conversation_state.set_state(user_id, bot.conversation_state.QUICK_WITHDRAW)
 
         await query.edit_message_text(
             "💸 **Вывод средств**\n\n"
@@ -245,7 +248,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, bot
         await create_game(query, bet_amount, bot)
 
     elif data == "custom_bet":
-        context.user_data['waiting_for_bet'] = True
+        bot.conversation_state.set_state(user_id, bot.conversation_state.BET)
         await ask_custom_bet(query, bot)
 
     elif data == "cancel_game_creation":
@@ -275,8 +278,9 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, bot
     #     context.user_data['waiting_for_withdraw'] = True
     #     await ask_custom_withdraw(query, bot)
 
-    elif data == "payment_history":
-        await show_payment_history(query, bot)
+    elif data == "payment_history" or data.startswith("payment_history:"):
+        page_cursor = data.split(":", 1)[1] if ":" in data else None
+        await show_payment_history(query, bot, page_cursor)
 
     elif data.startswith("duel_"):
         # Если мы здесь - значит это неизвестный тип дуэли
@@ -325,7 +329,7 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
             await query.edit_message_text("❌ Доступ запрещен. Только для администраторов.")
             return
 
-        logger.info(f"🔘 Админ-кнопка: '{data}' пользователем {user_id}")
+        logger.info("🔘 Админ-кнопка: '%s' пользователем %s", data, user_id)
 
         if data == "admin_stats":
             await show_admin_stats(query, bot)
@@ -357,8 +361,9 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
         elif data == "admin_games_active":
             await show_admin_games_active(query, bot)
 
-        elif data == "admin_games_history":
-            await show_admin_games_history(query, bot)
+        elif data == "admin_games_history" or data.startswith("admin_games_history:"):
+            page_cursor = data.split(":", 1)[1] if ":" in data else None
+            await show_admin_games_history(query, bot, page_cursor)
 
         elif data == "admin_broadcast":
             await query.edit_message_text(
@@ -384,8 +389,10 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
             elif data.startswith("broadcast_confirm_"):
                 await process_broadcast_confirmation(query, context, bot)
 
-        elif data == "admin_payments_all":
-            await show_admin_payments_list(query, bot)
+        elif data == "admin_payments_all" or data.startswith("admin_payments_all:"):
+            # admin_payments_all:<курсор>[:статус]
+            _, page_cursor, status = (data.split(":", 2) + [None, None])[:3]
+            await show_admin_payments_list(query, bot, page_cursor, status)
 
         elif data == "admin_payments_pending":
             await show_admin_pending_withdrawals(query, bot)
@@ -435,56 +442,28 @@ async def show_main_menu(query, bot):
     await query.edit_message_text(menu_text, reply_markup=create_main_menu_keyboard())
 
 
+def format_admin_stats(stats: dict) -> str:
+    """Текст статистики бота из счетчиков StatsService"""
+    return (
+        f"📊 **Статистика бота**\n\n"
+        f"👥 **Пользователи:** {int(stats['users'])}\n"
+        f"🎮 **Игры:**\n"
+        f"• Завершено: {int(stats['games_finished'])}\n"
+        f"• Активные: {int(stats['games_active'])}\n"
+        f"• Общий оборот: ${stats['turnover']:.2f}\n\n"
+        f"💰 **Финансы:**\n"
+        f"• Депозиты: ${stats['deposits']:.2f}\n"
+        f"• Выводы: ${stats['withdrawals']:.2f}\n"
+        f"• Выводы в обработке: ${stats['pending_withdrawals']:.2f}\n"
+        f"• Балансы пользователей: ${stats['total_balance']:.2f}\n"
+        f"• Комиссия бота: ${stats['commission']:.2f}"
+    )
+
+
 async def show_admin_stats(query, bot):
-    """Показывает статистику бота"""
+    """Показывает статистику бота (предрассчитанные счетчики, без сканирования таблиц)"""
     try:
-        cursor = bot.db.get_connection().cursor()
-
-        # Пользователи (простой подсчет)
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0] or 0
-
-        # Игры
-        cursor.execute("SELECT COUNT(*) FROM games WHERE status = 'finished'")
-        finished_games = cursor.fetchone()[0] or 0
-
-        cursor.execute("SELECT SUM(bet_amount * 2) FROM games WHERE status = 'finished'")
-        total_bet_result = cursor.fetchone()
-        total_bet = float(total_bet_result[0]) if total_bet_result and total_bet_result[0] else 0.0
-
-        # Активные игры
-        cursor.execute("SELECT COUNT(*) FROM games WHERE status = 'active'")
-        active_games = cursor.fetchone()[0] or 0
-
-        # Платежи
-        cursor.execute("""
-            SELECT 
-                COALESCE(SUM(CASE WHEN payment_type = 'deposit' AND status = 'completed' THEN amount ELSE 0 END), 0),
-                COALESCE(SUM(CASE WHEN payment_type = 'withdraw' AND status = 'completed' THEN amount ELSE 0 END), 0)
-            FROM payments
-        """)
-        payments = cursor.fetchone()
-        total_deposits = float(payments[0]) if payments and payments[0] else 0.0
-        total_withdrawals = float(payments[1]) if payments and payments[1] else 0.0
-
-        # Балансы пользователей
-        cursor.execute("SELECT COALESCE(SUM(balance), 0) FROM users")
-        total_balance_result = cursor.fetchone()
-        total_balance = float(total_balance_result[0]) if total_balance_result and total_balance_result[0] else 0.0
-
-        stats_text = (
-            f"📊 **Статистика бота**\n\n"
-            f"👥 **Пользователи:** {total_users}\n"
-            f"🎮 **Игры:**\n"
-            f"• Завершено: {finished_games}\n"
-            f"• Активные: {active_games}\n"
-            f"• Общий оборот: ${total_bet:.2f}\n\n"
-            f"💰 **Финансы:**\n"
-            f"• Депозиты: ${total_deposits:.2f}\n"
-            f"• Выводы: ${total_withdrawals:.2f}\n"
-            f"• Балансы пользователей: ${total_balance:.2f}\n"
-            f"• Комиссия бота: ${total_deposits - total_withdrawals:.2f}"
-        )
+        stats_text = format_admin_stats(bot.payment_manager.stats.get())
 
         keyboard = [[InlineKeyboardButton("🔄 Обновить", callback_data="admin_stats"),
                      InlineKeyboardButton("🔙 Назад", callback_data="admin_back")]]
@@ -503,7 +482,6 @@ async def show_admin_stats(query, bot):
             f"• `/admin_payments` - просмотр платежей\n"
             f"• `/admin_user <ID>` - информация о пользователе\n\n"
             f"❌ Ошибка: {str(e)[:100]}",
-            await query.edit_message_text(stats_text, reply_markup=reply_markup, parse_mode='Markdown'),
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("🔙 Назад", callback_data="admin_back")]
             ])
@@ -527,54 +505,48 @@ async def show_admin_payments_menu(query):
     )
 
 
-async def show_admin_payments_list(query, bot):
-    """Показывает список всех платежей"""
-    try:
-        cursor = bot.db.get_connection().cursor()
-        cursor.execute("""
-            SELECT payment_id, user_id, amount, payment_type, status, created_at 
-            FROM payments 
-            ORDER BY created_at DESC 
-            LIMIT 15
-        """)
+def format_admin_payments_page(page, status: str = None):
+    """Текст и клавиатура страницы платежей (кнопки и /admin_payments)"""
+    if not page.rows:
+        payment_list = "📭 Платежей не найдено"
+    else:
+        payment_list = f"💰 Платежи ({status}):\n\n" if status else "💰 Последние платежи:\n\n"
+        for payment in page.rows:
+            payment_id, user_id, amount, p_type, p_status, created_at = payment
+            payment_list += f"{payment_id} | 👤{user_id} | {p_type} | ${amount:.2f} | {p_status}\n"
 
-        payments = cursor.fetchall()
+    keyboard = []
+    navigation = page_buttons(page, "admin_payments_all", status or '')
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="admin_payments")])
+    return payment_list, InlineKeyboardMarkup(keyboard)
 
-        if not payments:
-            payment_list = "📭 Платежей не найдено"
-        else:
-            payment_list = "💰 Последние платежи:\n\n"
-            for payment in payments:
-                payment_id, user_id, amount, p_type, status, created_at = payment
-                payment_list += f"{payment_id} | 👤{user_id} | {p_type} | ${amount:.2f} | {status}\n"
 
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_payments")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+async def show_admin_payments_list(query, bot, page_cursor: str = None, status: str = None):
+    """Показывает страницу списка платежей"""
+    try:
+        page = bot.payment_manager.get_payments_page(page_cursor, page_size=15, status=status)
+        payment_list, reply_markup = format_admin_payments_page(page, status)
 
-        # ИСПРАВЛЕНО: используем payment_list вместо text
         await query.edit_message_text(payment_list, reply_markup=reply_markup)
 
     except Exception as e:
         logger.error(f"Ошибка показа платежей: {e}")
         await query.edit_message_text(f"❌ Ошибка: {str(e)}")
 
-    except Exception as e:
-        logger.error(f"Ошибка показа платежей: {e}")
-        await query.edit_message_text(f"❌ Ошибка: {str(e)}")
-
 
 async def show_admin_pending_withdrawals(query, bot):
     """Показывает ожидающие выводы"""
     try:
-        cursor = bot.db.get_connection().cursor()
-        cursor.execute("""
-            SELECT payment_id, user_id, amount, created_at 
-            FROM payments 
-            WHERE payment_type = 'withdraw' AND status = 'pending'
-            ORDER BY created_at DESC
-        """)
-
-        withdrawals = cursor.fetchall()
+        with bot.payment_manager.transaction() as cursor:
+            cursor.execute("""
+                SELECT payment_id, user_id, amount, created_at 
+                FROM payments 
+                WHERE payment_type = 'withdraw' AND status = 'pending'
+                ORDER BY created_at DESC
+            """)
+            withdrawals = cursor.fetchall()
 
         if not withdrawals:
             withdrawals_text = "✅ Нет ожидающих выводов"
@@ -601,22 +573,16 @@ async def show_admin_pending_withdrawals(query, bot):
 async def show_admin_games_active(query, bot):
     """Показывает активные игры"""
     try:
-        cursor = bot.db.get_connection().cursor()
-        # Узнайте структуру таблицы games
-        cursor.execute("PRAGMA table_info(games)")
-        columns = cursor.fetchall()
-        print(f"Структура таблицы games: {columns}")  # Для отладки
-
         # Временный простой запрос
-        cursor.execute("""
-            SELECT id, game_code, bet_amount, status, created_at
-            FROM games 
-            WHERE status = 'active'
-            ORDER BY created_at DESC
-            LIMIT 10
-        """)
-
-        games = cursor.fetchall()
+        with bot.payment_manager.transaction() as cursor:
+            cursor.execute("""
+                SELECT id, game_code, bet_amount, status, created_at
+                FROM games 
+                WHERE status = 'active'
+                ORDER BY created_at DESC
+                LIMIT 10
+            """)
+            games = cursor.fetchall()
 
         if not games:
             games_text = "🎮 Активные игры\n\nНет активных игр"
@@ -639,36 +605,27 @@ async def show_admin_games_active(query, bot):
         await query.edit_message_text(f"❌ Ошибка: {str(e)}")
 
 
-async def show_admin_games_history(query, bot):
-    """Показывает историю игр"""
+async def show_admin_games_history(query, bot, page_cursor: str = None):
+    """Показывает страницу истории игр"""
     try:
-        cursor = bot.db.get_connection().cursor()
-        # Временный простой запрос
-        cursor.execute("""
-            SELECT id, game_code, bet_amount, status, created_at
-            FROM games 
-            WHERE status = 'finished'
-            ORDER BY created_at DESC
-            LIMIT 10
-        """)
+        page = bot.db.get_games_page('finished', page_cursor, page_size=10)
 
-        games = cursor.fetchall()
-
-        if not games:
+        if not page.rows:
             games_text = "📋 История игр\n\nНет завершенных игр"
         else:
             games_text = "📋 Последние игры:\n\n"
-            for game in games:
+            for game in page.rows:
                 game_id, game_code, bet_amount, status, created_at = game
                 games_text += f"🆔 {game_code}\n💰 ${bet_amount:.2f}\n"
 
-        await query.edit_message_text(
-            games_text,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔄 Обновить", callback_data="admin_games_history"),
-                 InlineKeyboardButton("🔙 Назад", callback_data="admin_games")]
-            ])
-        )
+        keyboard = []
+        navigation = page_buttons(page, "admin_games_history")
+        if navigation:
+            keyboard.append(navigation)
+        keyboard.append([InlineKeyboardButton("🔄 Обновить", callback_data="admin_games_history"),
+                         InlineKeyboardButton("🔙 Назад", callback_data="admin_games")])
+
+        await query.edit_message_text(games_text, reply_markup=InlineKeyboardMarkup(keyboard))
 
     except Exception as e:
         logger.error(f"Ошибка показа истории игр: {e}")
@@ -736,10 +693,10 @@ async def process_broadcast_confirmation(query, context, bot):
 
         await query.edit_message_text("📢 Рассылка начата...")
 
-        # Получаем всех пользователей
-        cursor = bot.db.get_connection().cursor()
-        cursor.execute("SELECT telegram_id FROM users")
-        users = cursor.fetchall()
+        # Получаем всех пользователей (соединение закрывается до рассылки)
+        with bot.payment_manager.transaction() as cursor:
+            cursor.execute("SELECT telegram_id FROM users")
+            users = cursor.fetchall()
 
         success_count = 0
         fail_count = 0
@@ -981,21 +938,14 @@ async def ask_custom_deposit(query, bot):
 
 
 async def process_withdraw(query, amount, bot):
-    """Обрабатывает вывод - временная заглушка"""
+    """Создает заявку на вывод выбранной суммы"""
     user_id = query.from_user.id
-    user = bot.db.get_user(user_id)
-
-    if not user:
-        await query.edit_message_text("❌ Пользователь не найден")
-        return
-
-    current_balance = user[4]
 
-    if current_balance < amount:
+    # Списание и заявка - одна транзакция в PaymentManager
+    payment, error = await bot.payment_manager.create_withdrawal(user_id, amount)
+    if error:
         await query.edit_message_text(
-            f"❌ Недостаточно средств!\n"
-            f"Ваш баланс: ${current_balance:.2f}\n"
-            f"Требуется: ${amount:.2f}",
+            f"❌ {error}",
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("💳 Пополнить", callback_data="deposit")],
                 [InlineKeyboardButton("🔙 Назад", callback_data="withdraw")]
@@ -1003,20 +953,6 @@ async def process_withdraw(query, amount, bot):
         )
         return
 
-    # Списываем средства
-    bot.db.update_balance(user_id, -amount)
-
-    # Создаем запись о выводе в базе
-    try:
-        cursor = bot.db.get_connection().cursor()
-        cursor.execute("""
-            INSERT INTO payments (user_id, amount, payment_type, status, description)
-            VALUES (?, ?, 'withdraw', 'pending', ?)
-        """, (user_id, amount, f"Запрос на вывод ${amount:.2f}"))
-        bot.db.get_connection().commit()
-    except Exception as e:
-        logger.error(f"Ошибка создания записи о выводе: {e}")
-
     await query.edit_message_text(
         f"💸 Заявка на вывод ${amount:.2f} создана!\n\n"
         "📋 **Информация:**\n"
@@ -1054,44 +990,16 @@ async def ask_custom_withdraw(query, bot):
 async def process_withdraw_in_buttons(query, amount: float, bot):
     """Обработка вывода из кнопок в buttons.py"""
     user_id = query.from_user.id
-    user = bot.db.get_user(user_id)
 
-    if not user:
-        await query.answer("❌ Пользователь не найден", show_alert=True)
+    # Списание и заявка - одна транзакция в PaymentManager
+    payment, error = await bot.payment_manager.create_withdrawal(user_id, amount)
+    if error:
+        await query.answer(f"❌ {error}", show_alert=True)
         return
 
-    current_balance = user[4]
-
-    if current_balance < amount:
-        await query.answer(
-            f"❌ Недостаточно средств!\n"
-            f"Ваш баланс: ${current_balance:.2f}\n"
-            f"Требуется: ${amount:.2f}",
-            show_alert=True
-        )
-        return
-
-    # Списываем средства
-    bot.db.update_balance(user_id, -amount)
-
-    # Создаем запись о выводе в базе
-    try:
-        cursor = bot.db.get_connection().cursor()
-        cursor.execute("""
-            INSERT INTO payments (user_id, amount, payment_type, status, description)
-            VALUES (?, ?, 'withdraw', 'pending', ?)
-        """, (user_id, amount, f"Запрос на вывод ${amount:.2f}"))
-        bot.db.get_connection().commit()
-
-        payment_id = cursor.lastrowid
-
-    except Exception as e:
-        logger.error(f"Ошибка создания записи о выводе: {e}")
-        await query.answer("❌ Ошибка создания заявки", show_alert=True)
-        return
-
-    commission = amount * 0.08
-    receive_amount = amount - commission
+    payment_id = payment.payment_id
+    receive_amount = payment.amount
+    commission = amount - receive_amount
 
     keyboard = [
         [InlineKeyboardButton("📋 Главное меню", callback_data="main_menu")]
@@ -1186,28 +1094,20 @@ async def copy_command(query, game_code, bot):
     )
 
 
-async def show_payment_history(query, bot):
-    """Показывает историю платежей пользователя"""
+async def show_payment_history(query, bot, page_cursor: str = None):
+    """Показывает страницу истории платежей пользователя"""
     user_id = query.from_user.id
 
     try:
-        cursor = bot.db.get_connection().cursor()
-        cursor.execute("""
-            SELECT payment_id, amount, payment_type, status, created_at, description
-            FROM payments 
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-            LIMIT 10
-        """, (user_id,))
-
-        payments = cursor.fetchall()
+        page = bot.payment_manager.get_user_payments_page(user_id, page_cursor, page_size=10)
+        payments = page.rows
 
         if not payments:
             history_text = "📭 У вас пока нет платежей"
         else:
             history_text = "📋 История ваших платежей:\n\n"
             for payment in payments:
-                payment_id, amount, p_type, status, created_at, description = payment
+                payment_id, amount, currency, status, p_type, created_at, description = payment
 
                 # Иконки для типов платежей
                 if p_type == "deposit":
@@ -1228,7 +1128,7 @@ async def show_payment_history(query, bot):
                     status_icon = "❓"
 
                 # Форматируем дату
-                date_str = created_at.split()[0] if created_at else "неизвестно"
+                date_str = created_at[:10] if created_at else "неизвестно"
 
                 history_text += f"{icon} ${amount:.2f} | {status_icon} {status}\n"
                 history_text += f"📅 {date_str}"
@@ -1236,7 +1136,11 @@ async def show_payment_history(query, bot):
                     history_text += f" | {description[:30]}"
                 history_text += "\n────────────────\n"
 
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]]
+        keyboard = []
+        navigation = page_buttons(page, "payment_history")
+        if navigation:
+            keyboard.append(navigation)
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="main_menu")])
         reply_markup = InlineKeyboardMarkup(keyboard)
 
         await query.edit_message_text(history_text, reply_markup=reply_markup)
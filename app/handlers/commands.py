@@ -3,6 +3,8 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CommandHandler
 import logging
 from app.handlers.lobby_handlers import get_lobby_keyboard
+from app.services.rollups import format_rollups
+from app.utils.logging_setup import SAMPLED
 
 logger = logging.getLogger(__name__)
 
@@ -34,7 +36,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE, bot):
         help_text = (
             "🎯 **Команды для игры в группах:**\n\n"
             "/duel <ставка> - создать дуэль\n"
-            "Пример: /duel 10\n\n"
+            "Пример: /duel 10\n"
+            "/duels - открытые дуэли чата\n\n"
             "/join <код> - присоединиться к игре\n\n"
             "📱 *Для пополнения баланса перейдите в личный чат с ботом*"
         )
@@ -50,7 +53,9 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE, bot):
             "💸 Команды:\n"
             "/menu - открыть меню\n"
             "/join [ID] - присоединиться к игре\n"
-            "/duel [ставка] - создать дуэль (в группах)"
+            "/fastroll - быстрый режим: бот бросает все кости сразу\n"
+            "/duel [ставка] - создать дуэль (в группах)\n"
+            "/tournament [взнос] [участников] - турнир на выбывание"
         )
 
     await update.message.reply_text(help_text, parse_mode='Markdown')
@@ -90,6 +95,14 @@ def register_command_handlers(application, bot):
                                            lambda update, context: admin_payments_command(update, context, bot)))
     application.add_handler(CommandHandler("admin_broadcast",
                                            lambda update, context: admin_broadcast_command(update, context, bot)))
+    application.add_handler(CommandHandler("admin_groups",
+                                           lambda update, context: admin_groups_command(update, context, bot)))
+    application.add_handler(CommandHandler("admin_payouts",
+                                           lambda update, context: admin_payouts_command(update, context, bot)))
+    application.add_handler(CommandHandler("approve_payout",
+                                           lambda update, context: approve_payout_command(update, context, bot)))
+    application.add_handler(CommandHandler("admin_rollups",
+                                           lambda update, context: admin_rollups_command(update, context, bot)))
 
 
 
@@ -98,8 +111,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE, bot)
     user = update.effective_user
     chat = update.effective_chat
 
-    logger.info(f"👤 /start от {user.id} ({user.username}) в чате {chat.type}")
-    logger.info(f"📦 Аргументы: {context.args}")
+    logger.info("👤 /start от %s (%s) в чате %s", user.id, user.username, chat.type, extra=SAMPLED)
+    logger.debug("📦 Аргументы: %s", context.args)
 
     # Блокируем старт в групповых чатах
     if chat.type in ["group", "supergroup"]:
@@ -119,7 +132,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE, bot)
     # 1. Присоединение к лобби через глубокую ссылку
     if context.args and context.args[0].startswith('joinlobby_'):
         lobby_id = context.args[0][10:]  # Убираем 'joinlobby_'
-        logger.info(f"🔗 Присоединение к лобби через deep link: {lobby_id}")
+        logger.info("🔗 Присоединение к лобби через deep link: %s", lobby_id, extra=SAMPLED)
 
         await join_lobby_from_deeplink(update, lobby_id, bot)
         return
@@ -127,7 +140,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE, bot)
     # 2. Присоединение к игре 1 на 1 через глубокую ссылку
     if context.args and context.args[0].startswith('join_'):
         game_code = context.args[0][5:]  # Убираем 'join_'
-        logger.info(f"🔗 Присоединение к игре через deep link: {game_code}")
+        logger.info("🔗 Присоединение к игре через deep link: %s", game_code, extra=SAMPLED)
 
         # ВЫЗЫВАЕМ join_game_command вместо заглушки
         # Нужно имитировать вызов команды /join
@@ -138,7 +151,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE, bot)
     # 3. Старая обработка (для обратной совместимости)
     if context.args and context.args[0].startswith('join'):
         game_code = context.args[0][4:]  # Убираем 'join'
-        logger.info(f"🔗 Старый формат deep link: {game_code}")
+        logger.info("🔗 Старый формат deep link: %s", game_code, extra=SAMPLED)
 
         await update.message.reply_text(
             f"🎮 Присоединение к игре {game_code}\n\n"
@@ -334,44 +347,16 @@ async def withdraw_command(update: Update, context: ContextTypes.DEFAULT_TYPE, b
             return
 
         user_id = update.effective_user.id
-        user = bot.db.get_user(user_id)
-
-        if not user:
-            await update.message.reply_text("❌ Пользователь не найден")
-            return
-
-        current_balance = user[4]
-
-        if current_balance < amount:
-            await update.message.reply_text(
-                f"❌ Недостаточно средств!\n"
-                f"Ваш баланс: ${current_balance:.2f}\n"
-                f"Требуется: ${amount:.2f}"
-            )
-            return
 
-        # Списываем средства
-        bot.db.update_balance(user_id, -amount)
-
-        # Создаем запись о выводе
-        try:
-            cursor = bot.db.get_connection().cursor()
-            cursor.execute("""
-                INSERT INTO payments (user_id, amount, payment_type, status, description)
-                VALUES (?, ?, 'withdraw', 'pending', ?)
-            """, (user_id, amount, f"Запрос на вывод ${amount:.2f}"))
-            bot.db.get_connection().commit()
-
-            payment_id = cursor.lastrowid
-
-        except Exception as e:
-            logger.error(f"Ошибка создания записи о выводе: {e}")
-            bot.db.update_balance(user_id, amount)  # Возвращаем средства
-            await update.message.reply_text("❌ Ошибка создания заявки")
+        # Списание и заявка - одна транзакция в PaymentManager
+        payment, error = await bot.payment_manager.create_withdrawal(user_id, amount)
+        if error:
+            await update.message.reply_text(f"❌ {error}")
             return
 
-        commission = amount * 0.08
-        receive_amount = amount - commission
+        payment_id = payment.payment_id
+        receive_amount = payment.amount
+        commission = amount - receive_amount
 
         await update.message.reply_text(
             f"✅ **Запрос на вывод создан!**\n\n"
@@ -415,7 +400,7 @@ async def join_lobby_from_deeplink(update, lobby_id, bot):
     user_id = user.id
     username = user.username or user.first_name
 
-    logger.info(f"🎮 Присоединение к лобби {lobby_id} пользователем {username}")
+    logger.info("🎮 Присоединение к лобби %s пользователем %s", lobby_id, username, extra=SAMPLED)
 
     # Проверяем существует ли лобби
     lobby = bot.lobby_manager.get_lobby(lobby_id)
@@ -430,7 +415,7 @@ async def join_lobby_from_deeplink(update, lobby_id, bot):
         return
 
     # Проверяем не присоединился ли уже
-    if any(p.id == user_id for p in lobby.players):
+    if lobby.get_player(user_id):
         await update.message.reply_text("❌ Вы уже в этом лобби!")
 
         # Даже если уже в лобби, отправляем персональное сообщение
@@ -460,9 +445,7 @@ async def join_lobby_from_deeplink(update, lobby_id, bot):
         bot.db.update_balance(user_id, -lobby.bet_amount)
 
         # Помечаем игрока как оплатившего
-        player = lobby.get_player(user_id)
-        if player:
-            player.paid = True
+        lobby.mark_player_paid(user_id)
 
         # Сохраняем лобби
         bot.lobby_manager.save_lobby_to_db(lobby)
@@ -523,7 +506,7 @@ async def send_personal_lobby_message_to_user(user_id, lobby, bot):
             return
 
         # Создаем текст сообщения
-        ready_count = sum(1 for p in lobby.players if p.ready)
+        ready_count = lobby.ready_count
         player_status = "✅ Готов" if player.ready else "❌ Не готов"
 
         message_text = (
@@ -577,7 +560,7 @@ async def send_personal_lobby_message_to_user(user_id, lobby, bot):
             parse_mode='Markdown'
         )
 
-        logger.info(f"✅ Персональное сообщение лобби отправлено игроку {user_id}")
+        logger.debug("✅ Персональное сообщение лобби отправлено игроку %s", user_id)
 
     except Exception as e:
         logger.error(f"❌ Ошибка отправки персонального сообщения лобби: {e}")
@@ -600,15 +583,19 @@ async def join_game_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
             await update.message.reply_text(f"❌ {error}")
             return
 
+        from app.handlers.game_handlers import roll_button, fairness_commit_text
+
         # Успех
-        keyboard = [[InlineKeyboardButton("🎲 Бросить кости", callback_data=f"roll_{game.id}")]]
+        keyboard = [[roll_button(game)]]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
         await update.message.reply_text(
             f"✅ Вы присоединились к игре {game.game_code}!\n"
             f"💰 Ставка: ${game.bet_amount:.0f}\n"
+            f"{fairness_commit_text(game)}"
             f"🎲 Готовы бросить кости?",
-            reply_markup=reply_markup
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
         )
 
         # Уведомляем создателя
@@ -672,60 +659,10 @@ async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
 
     try:
-        # Получаем статистику из БД
-        cursor = bot.db.get_connection().cursor()
-
-        # Пользователи
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0]
-
-        # Активные пользователи за 24 часа
-        cursor.execute("""
-            SELECT COUNT(*) FROM users 
-            WHERE last_active > datetime('now', '-1 day')
-        """)
-        active_users = cursor.fetchone()[0]
-
-        # Игры
-        cursor.execute("SELECT COUNT(*) FROM games WHERE status = 'finished'")
-        finished_games = cursor.fetchone()[0]
-
-        cursor.execute("SELECT SUM(bet_amount * 2) FROM games WHERE status = 'finished'")
-        total_bet = cursor.fetchone()[0] or 0
-
-        cursor.execute("SELECT COUNT(*) FROM games WHERE status = 'active'")
-        active_games = cursor.fetchone()[0]
-
-        # Платежи
-        cursor.execute("""
-            SELECT 
-                SUM(CASE WHEN payment_type = 'deposit' AND status = 'completed' THEN amount ELSE 0 END),
-                SUM(CASE WHEN payment_type = 'withdraw' AND status = 'completed' THEN amount ELSE 0 END)
-            FROM payments
-        """)
-        payments = cursor.fetchone()
-        total_deposits = payments[0] or 0
-        total_withdrawals = payments[1] or 0
-
-        # Балансы
-        cursor.execute("SELECT SUM(balance) FROM users")
-        total_balance = cursor.fetchone()[0] or 0
-
-        stats_text = (
-            f"📊 **Статистика бота**\n\n"
-            f"👥 Пользователи:\n"
-            f"• Всего: {total_users}\n"
-            f"• Активные (24ч): {active_users}\n\n"
-            f"🎮 Игры:\n"
-            f"• Завершено: {finished_games}\n"
-            f"• Активные: {active_games}\n"
-            f"• Общий оборот: ${total_bet:.2f}\n\n"
-            f"💰 Финансы:\n"
-            f"• Депозиты: ${total_deposits:.2f}\n"
-            f"• Выводы: ${total_withdrawals:.2f}\n"
-            f"• Балансы пользователей: ${total_balance:.2f}\n"
-            f"• Комиссия бота: ${total_deposits - total_withdrawals:.2f}"
-        )
+        from app.handlers.buttons import format_admin_stats
+
+        # Счетчики обновляются триггерами при каждой записи - чтение O(1)
+        stats_text = format_admin_stats(bot.payment_manager.stats.get())
 
         await update.message.reply_text(stats_text, parse_mode='Markdown')
 
@@ -734,6 +671,79 @@ async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text(f"❌ Ошибка: {str(e)}")
 
 
+async def admin_groups_command(update: Update, context: ContextTypes.DEFAULT_TYPE, bot):
+    """Статистика фильтра групповых сообщений: /admin_groups"""
+    if not await check_admin(update, context):
+        return
+
+    processed, dropped = bot.group_filter.get_totals()
+    top_chats = bot.group_filter.get_top_chats(limit=10)
+
+    text = (
+        f"👥 Фильтр групповых сообщений\n\n"
+        f"✅ Обработано: {processed}\n"
+        f"🗑 Отброшено: {dropped}\n"
+    )
+
+    if top_chats:
+        text += "\n📊 Самые активные чаты:\n"
+        for chat_id, chat_processed, chat_dropped in top_chats:
+            text += f"• {chat_id}: ✅ {chat_processed} | 🗑 {chat_dropped}\n"
+
+    await update.message.reply_text(text)
+
+
+async def admin_payouts_command(update: Update, context: ContextTypes.DEFAULT_TYPE, bot):
+    """Выводы, ожидающие ручной проверки: /admin_payouts"""
+    if not await check_admin(update, context):
+        return
+
+    queue = bot.payout_queue.get_review_queue(limit=20)
+    if not queue:
+        await update.message.reply_text("📭 Нет выводов на проверке")
+        return
+
+    text = "🔍 Выводы на проверке:\n\n"
+    for payment_id, user_id, amount, created_at in queue:
+        text += f"🆔 {payment_id}\n👤 {user_id} | ${amount:.2f} | {created_at[:16]}\n"
+    text += "\nОдобрить: /approve_payout <payment_id>"
+
+    await update.message.reply_text(text)
+
+
+async def approve_payout_command(update: Update, context: ContextTypes.DEFAULT_TYPE, bot):
+    """Одобрение вывода: /approve_payout <payment_id>"""
+    if not await check_admin(update, context):
+        return
+
+    if not context.args:
+        await update.message.reply_text("❌ Использование: /approve_payout <payment_id>")
+        return
+
+    success, error = bot.payout_queue.approve(context.args[0])
+    if success:
+        await update.message.reply_text(f"✅ Вывод {context.args[0]} одобрен и будет выплачен")
+    else:
+        await update.message.reply_text(f"❌ {error}")
+
+
+async def admin_rollups_command(update: Update, context: ContextTypes.DEFAULT_TYPE, bot):
+    """Аналитика по срезам: /admin_rollups [hour|day] [количество]"""
+    if not await check_admin(update, context):
+        return
+
+    granularity = context.args[0] if context.args else 'hour'
+    try:
+        limit = min(int(context.args[1]), 48) if len(context.args) > 1 else 24
+        buckets = bot.rollups.get_range(granularity, limit)
+    except ValueError:
+        await update.message.reply_text("❌ Использование: /admin_rollups [hour|day] [количество]")
+        return
+
+    title = "📈 По часам" if granularity == 'hour' else "📈 По дням"
+    await update.message.reply_text(f"{title}\n\n{format_rollups(buckets)}"[:4000])
+
+
 async def admin_user_command(update: Update, context: ContextTypes.DEFAULT_TYPE, bot):
     """Информация о пользователе: /admin_user <user_id>"""
     if not await check_admin(update, context):
@@ -753,16 +763,15 @@ async def admin_user_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
             return
 
         # Получаем статистику игр
-        cursor = bot.db.get_connection().cursor()
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_games,
-                SUM(CASE WHEN (p1_tg_id = ? AND winner_id = ?) OR (p2_tg_id = ? AND winner_id = ?) THEN 1 ELSE 0 END) as wins
-            FROM games 
-            WHERE status = 'finished'
-        """, (user_id, user_id, user_id, user_id))
-
-        games_stats = cursor.fetchone()
+        with bot.payment_manager.transaction() as cursor:
+            cursor.execute("""
+                SELECT 
+                    COUNT(*) as total_games,
+                    SUM(CASE WHEN (p1_tg_id = ? AND winner_id = ?) OR (p2_tg_id = ? AND winner_id = ?) THEN 1 ELSE 0 END) as wins
+                FROM games 
+                WHERE status = 'finished'
+            """, (user_id, user_id, user_id, user_id))
+            games_stats = cursor.fetchone()
         total_games = games_stats[0] or 0
         wins = games_stats[1] or 0
 
@@ -830,43 +839,18 @@ async def admin_payments_command(update: Update, context: ContextTypes.DEFAULT_T
         return
 
     try:
-        status_filter = context.args[0] if context.args else None
-
-        cursor = bot.db.get_connection().cursor()
-
-        if status_filter:
-            cursor.execute("""
-                SELECT payment_id, user_id, amount, payment_type, status, created_at 
-                FROM payments 
-                WHERE status = ? 
-                ORDER BY created_at DESC 
-                LIMIT 20
-            """, (status_filter,))
-        else:
-            cursor.execute("""
-                SELECT payment_id, user_id, amount, payment_type, status, created_at 
-                FROM payments 
-                ORDER BY created_at DESC 
-                LIMIT 20
-            """)
+        from app.handlers.buttons import format_admin_payments_page
 
-        payments = cursor.fetchall()
+        status_filter = context.args[0] if context.args else None
+        page = bot.payment_manager.get_payments_page(page_size=15, status=status_filter)
 
-        if not payments:
+        if not page.rows:
             await update.message.reply_text("📭 Платежей не найдено")
             return
 
-        payment_list = "💰 **Последние платежи:**\n\n"
-        for payment in payments:
-            payment_id, user_id, amount, p_type, status, created_at = payment
-            payment_list += (
-                f"🆔 {payment_id}\n"
-                f"👤 {user_id} | {p_type} | ${amount:.2f}\n"
-                f"📊 {status} | {created_at}\n"
-                f"────────────────────\n"
-            )
-
-        await update.message.reply_text(payment_list[:4000], parse_mode='Markdown')
+        # Следующие страницы листаются кнопками (keyset-курсор в callback_data)
+        payment_list, reply_markup = format_admin_payments_page(page, status_filter)
+        await update.message.reply_text(payment_list, reply_markup=reply_markup)
 
     except Exception as e:
         logger.error(f"Ошибка admin_payments: {e}")
@@ -62,6 +62,43 @@ async def duel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await create_open_duel(update, context, bet_amount)
 
 
+async def duels_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/duels - открытые дуэли чата (кнопки принять для ожидающих)"""
+    chat = update.effective_chat
+
+    if chat.type not in ["group", "supergroup"]:
+        await update.message.reply_text("⚔ Дуэли доступны только в групповых чатах!")
+        return
+
+    bot = context.application.bot_data.get('bot_instance')
+    if not bot or not hasattr(bot, 'duel_manager'):
+        await update.message.reply_text("❌ Система дуэлей не инициализирована")
+        return
+
+    duels = bot.duel_manager.get_chat_duels(chat.id)
+    if not duels:
+        await update.message.reply_text("⚔ В чате нет открытых дуэлей. Создайте: `/duel 10`",
+                                        parse_mode='Markdown')
+        return
+
+    lines = [f"⚔ ОТКРЫТЫЕ ДУЭЛИ ({len(duels)}):\n"]
+    keyboard = []
+    for duel in duels:
+        if duel.status == "waiting":
+            lines.append(f"⏳ {duel.creator_name} - ${duel.bet_amount:.0f} (ID: {duel.duel_id})")
+            keyboard.append([InlineKeyboardButton(
+                f"⚔ Принять: {duel.creator_name} ${duel.bet_amount:.0f}",
+                callback_data=f"duel_accept_{duel.duel_id}"
+            )])
+        else:
+            lines.append(f"🎲 {duel.creator_name} vs {duel.opponent_name} - ${duel.bet_amount:.0f}")
+
+    await update.message.reply_text(
+        "\n".join(lines),
+        reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
+    )
+
+
 async def create_open_duel(update: Update, context: ContextTypes.DEFAULT_TYPE, bet_amount: float):
     """Создает открытую дуэль (любой может принять)"""
     chat = update.effective_chat
@@ -145,7 +182,7 @@ async def create_targeted_duel(update: Update, context: ContextTypes.DEFAULT_TYP
 async def handle_duel_accept(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка принятия дуэли"""
     query = update.callback_query
-    print(f"🔥 DEBUG: Duel accept called! data={query.data}")
+    logger.debug("Duel accept: data=%s", query.data)
     await query.answer()
 
     try:
@@ -347,8 +384,18 @@ async def handle_duel_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 
 async def process_duel_result(duel, chat_id: int, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатывает результат завершенной дуэли"""
+    """Обрабатывает результат завершенной дуэли (расчет проводит DuelManager.settle_duel)"""
     try:
+        duel_manager = context.application.bot_data['bot_instance'].duel_manager
+
+        # Расчет проводится при завершении дуэли; повторный вызов вернет уже проведенный
+        settlement = duel_manager.settlement.get("duel", duel.duel_id)
+        if not settlement:
+            settlement, error = duel_manager.settle_duel(duel)
+            if error:
+                logger.error(f"❌ Расчет по дуэли {duel.duel_id} не проведен: {error}")
+                return
+
         result_text = (
             f"🏆 ДУЭЛЬ ЗАВЕРШЕНА!\n\n"
             f"🎯 {duel.creator_name}: {duel.creator_total} очков\n"
@@ -358,7 +405,7 @@ async def process_duel_result(duel, chat_id: int, context: ContextTypes.DEFAULT_
         if duel.winner_id:
             winner_name = duel.creator_name if duel.winner_id == duel.creator_id else duel.opponent_name
             result_text += f"🏆 ПОБЕДИТЕЛЬ: {winner_name}!\n"
-            result_text += f"💰 Выигрыш: ${duel.bet_amount * 2 * 0.92:.0f}\n"
+            result_text += f"💰 Выигрыш: ${settlement.payout(duel.winner_id):.2f} зачислен на баланс\n"
         else:
             result_text += "🤝 НИЧЬЯ!\n"
             result_text += "💰 Ставки возвращены обоим игрокам\n"
@@ -372,8 +419,6 @@ async def process_duel_result(duel, chat_id: int, context: ContextTypes.DEFAULT_
             parse_mode='Markdown'
         )
 
-        # TODO: Обработка выплат через crypto_pay
-
     except Exception as e:
         logger.error(f"Ошибка обработки результата дуэли: {e}")
 
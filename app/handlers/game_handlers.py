@@ -1,12 +1,44 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CallbackQueryHandler, CommandHandler, MessageHandler, filters
 from app.handlers.commands import show_main_menu_from_message
+from app.handlers.messages import handle_lobby_bet_input
+from app.handlers.payment_handlers import handle_deposit_amount_input, handle_withdraw_amount_input
+from app.services.conversation_state import ConversationStateManager
+from app.services.matchmaking import BET_TIERS
+from app.services.tracing import tracer
+from app.utils.logging_setup import SAMPLED
+from typing import Optional
 import logging
 import asyncio
 
 logger = logging.getLogger(__name__)
 
 
+def roll_button(game) -> InlineKeyboardButton:
+    """Кнопка броска: в быстром режиме бот бросает все три кости сразу"""
+    label = "⚡ Бросить 3 кости" if game.fast else "🎲 Бросить кости"
+    return InlineKeyboardButton(label, callback_data=f"roll_{game.id}")
+
+
+def fairness_commit_text(game, markdown: bool = True) -> str:
+    """Хеш сида быстрой игры, публикуемый до бросков"""
+    if not game.fast:
+        return ""
+    seed_hash = f"`{game.seed_hash}`" if markdown else game.seed_hash
+    return f"⚡ Быстрый режим\n🔐 Хеш сида: {seed_hash}\n\n"
+
+
+def fairness_reveal_text(game) -> str:
+    """Раскрытие сида в итогах быстрой игры"""
+    if not game.fast:
+        return ""
+    return (
+        f"\n\n🔐 Сид игры: {game.server_seed}\n"
+        f"#️⃣ SHA-256 сида: {game.seed_hash}\n"
+        "Бросок = HMAC-SHA256(сид, \"ID_игрока:номер_броска\"), байт < 252 → байт % 6 + 1"
+    )
+
+
 # ============ ОБРАБОТЧИКИ ИГР 1 НА 1 ============
 
 async def show_bet_options(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -19,287 +51,263 @@ async def show_bet_options(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "💰 Введите сумму ставки в долларах (минимум: $1, максимум: $1000):\n\n"
         "Пример: 15 (для ставки $15)\n"
         "Или 50.5 (для ставки $50.50)\n\n"
-        "❌ Для отмены нажмите /cancel"
+        "⚡ Или найдите соперника автоматически - без кода приглашения\n\n"
+        "❌ Для отмены нажмите /cancel",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⚡ Быстрый подбор соперника",
+                                                                  callback_data="quick_match_menu")]])
     )
 
     # Устанавливаем состояние ожидания ввода суммы
-    context.user_data['waiting_for_bet'] = True
-    context.user_data['action'] = 'create_game'
+    bot = context.application.bot_data.get('bot_instance')
+    if bot:
+        bot.conversation_state.set_state(
+            query.from_user.id,
+            bot.conversation_state.BET,
+            {'action': 'create_game'}
+        )
 
 
 async def handle_bet_and_payment_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатывает ввод суммы для ставок И платежей"""
+    """Обрабатывает ввод суммы для ставок И платежей (диспетчер по состоянию пользователя)"""
+    if not update.message or not update.message.text or not update.effective_user:
+        return
 
-    logger.info(f"=" * 50)
-    logger.info(f"🔴 ВЫЗВАН ОБРАБОТЧИК ВВОДА!")
-    logger.info(f"🔴 Пользователь: {update.effective_user.id}")
-    logger.info(f"🔴 Сообщение: '{update.message.text if update.message else 'НЕТ'}'")
-    logger.info(f"🔴 user_data: {dict(context.user_data)}")
-    logger.info(f"=" * 50)
+    bot = context.application.bot_data.get('bot_instance')
+    if not bot:
+        return
 
-    # Проверяем, ждем ли мы ввод ставки ИЛИ платежа
-    waiting_for_bet = context.user_data.get('waiting_for_bet')
-    waiting_for_payment = context.user_data.get('waiting_for_payment')
+    user_id = update.effective_user.id
 
-    logger.info(f"🔍 Результат проверки: bet={waiting_for_bet}, payment={waiting_for_payment}")
+    # Быстрый путь: бот ничего не ждет от пользователя
+    if not bot.conversation_state.has_pending(user_id):
+        return
 
-    if not waiting_for_bet and not waiting_for_payment:
-        logger.info("🔍 Нет ожидающих состояний, выходим")
-        return  # Ничего не ждем
+    state, state_data = bot.conversation_state.get_state(user_id)
+    handler = INPUT_STATE_HANDLERS.get(state)
+    if not handler:
+        logger.warning(f"⚠️ Нет обработчика для состояния '{state}', сбрасываем")
+        bot.conversation_state.clear_state(user_id)
+        return
 
-    try:
-        user_id = update.effective_user.id
-        message_text = update.message.text.strip()
+    message_text = update.message.text.strip()
+    logger.info("🔍 Ввод от %s в состоянии '%s': '%s'", user_id, state, message_text[:20], extra=SAMPLED)
 
+    try:
         # Проверяем отмену
         if message_text.lower() == '/cancel':
-            # Очищаем ВСЕ состояния
-            context.user_data.pop('waiting_for_bet', None)
-            context.user_data.pop('waiting_for_payment', None)
-
-            logger.info(f"🔍 Отмена операции пользователем {user_id}")
+            bot.conversation_state.clear_state(user_id)
+            logger.info("🔍 Отмена операции пользователем %s", user_id, extra=SAMPLED)
 
             await update.message.reply_text("❌ Операция отменена")
-
-            # Возвращаем в главное меню
-            bot = context.application.bot_data.get('bot_instance')
-            if bot:
-                from app.handlers.commands import show_main_menu_from_message
-                await show_main_menu_from_message(update, bot)
+            await show_main_menu_from_message(update, bot)
             return
 
-        # Пробуем преобразовать в число
-        try:
-            amount = float(message_text)
-            logger.info(f"🔍 Преобразовано в число: {amount}")
-        except ValueError:
-            await update.message.reply_text(
-                "❌ Пожалуйста, введите число\n\n"
-                "Пример: 15 (для $15)\n"
-                "Или: 25.5 (для $25.50)\n\n"
-                "💵 Введите сумму:"
-            )
-            return
-
-        # ========== РАЗДЕЛЕНИЕ ЛОГИКИ ==========
-
-        if waiting_for_payment == 'deposit':
-            logger.info(f"💰 Обработка ДЕПОЗИТА на сумму ${amount:.2f}")
-
-            # ОБРАБОТКА ДЕПОЗИТА
-            if amount < 1:
-                await update.message.reply_text("❌ Минимальная сумма: $1\n\n💵 Введите сумму:")
-                return
-
-            if amount > 1000:
-                await update.message.reply_text("❌ Максимальная сумма: $1000\n\n💵 Введите сумму:")
-                return
-
-            # Очищаем состояние
-            context.user_data.pop('waiting_for_payment', None)
+        await handler(update, context, bot, message_text)
 
-            # Получаем бота
-            bot = context.application.bot_data.get('bot_instance')
-            if not bot:
-                await update.message.reply_text("❌ Ошибка системы")
-                return
+    except Exception as e:
+        logger.error(f"❌ Ошибка обработки ввода: {e}")
+        await update.message.reply_text(f"❌ Ошибка: {str(e)}")
 
-            # Пополняем баланс
-            bot.db.update_balance(user_id, amount)
 
-            # Получаем новый баланс
-            user = bot.db.get_user(user_id)
-            new_balance = user[4] if user else amount
+async def _parse_amount_input(update: Update, message_text: str) -> Optional[float]:
+    """Преобразует ввод в сумму, при ошибке просит ввести число еще раз"""
+    try:
+        return float(message_text)
+    except ValueError:
+        await update.message.reply_text(
+            "❌ Пожалуйста, введите число\n\n"
+            "Пример: 15 (для $15)\n"
+            "Или: 25.5 (для $25.50)\n\n"
+            "💵 Введите сумму:"
+        )
+        return None
 
-            logger.info(f"💰 Баланс пользователя {user_id} пополнен на ${amount:.2f}, новый баланс: ${new_balance:.2f}")
 
-            await update.message.reply_text(
-                f"✅ Баланс пополнен на ${amount:.2f}\n"
-                f"💰 Новый баланс: ${new_balance:.2f}",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("📋 Главное меню", callback_data="main_menu")]
-                ])
-            )
-            return
+async def handle_quick_deposit_input(update: Update, context: ContextTypes.DEFAULT_TYPE, bot, message_text: str):
+    """Пополнение баланса на введенную сумму (из главного меню)"""
+    amount = await _parse_amount_input(update, message_text)
+    if amount is None:
+        return
 
-        elif waiting_for_payment == 'withdraw':
-            logger.info(f"💰 Обработка ВЫВОДА на сумму ${amount:.2f}")
+    user_id = update.effective_user.id
+    logger.info("💰 Обработка ДЕПОЗИТА на сумму $%.2f", amount, extra=SAMPLED)
 
-            # ОБРАБОТКА ВЫВОДА
-            if amount < 1:
-                await update.message.reply_text("❌ Минимальная сумма: $1\n\n💵 Введите сумму:")
-                return
+    if amount < 1:
+        await update.message.reply_text("❌ Минимальная сумма: $1\n\n💵 Введите сумму:")
+        return
 
-            # Очищаем состояние
-            context.user_data.pop('waiting_for_payment', None)
+    if amount > 1000:
+        await update.message.reply_text("❌ Максимальная сумма: $1000\n\n💵 Введите сумму:")
+        return
 
-            # Получаем бота
-            bot = context.application.bot_data.get('bot_instance')
-            if not bot:
-                await update.message.reply_text("❌ Ошибка системы")
-                return
+    # Очищаем состояние
+    bot.conversation_state.clear_state(user_id)
 
-            # Проверяем баланс
-            user = bot.db.get_user(user_id)
-            if not user:
-                await update.message.reply_text("❌ Пользователь не найден")
-                return
+    # Пополняем баланс
+    bot.db.update_balance(user_id, amount)
 
-            current_balance = user[4]
-
-            if current_balance < amount:
-                await update.message.reply_text(
-                    f"❌ Недостаточно средств!\n"
-                    f"Ваш баланс: ${current_balance:.2f}\n"
-                    f"Требуется: ${amount:.2f}",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("💳 Пополнить", callback_data="deposit")],
-                        [InlineKeyboardButton("📋 Главное меню", callback_data="main_menu")]
-                    ])
-                )
-                return
+    # Получаем новый баланс
+    user = bot.db.get_user(user_id)
+    new_balance = user[4] if user else amount
 
-            # Списываем средства
-            bot.db.update_balance(user_id, -amount)
+    logger.info("💰 Баланс пользователя %s пополнен на $%.2f, новый баланс: $%.2f", user_id, amount, new_balance)
 
-            # Создаем запись о выводе
-            try:
-                # Коммитим любые ожидающие транзакции
-                bot.db.get_connection().commit()
+    await update.message.reply_text(
+        f"✅ Баланс пополнен на ${amount:.2f}\n"
+        f"💰 Новый баланс: ${new_balance:.2f}",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("📋 Главное меню", callback_data="main_menu")]
+        ])
+    )
 
-                cursor = bot.db.get_connection().cursor()
 
-                # ВАЖНО: добавляем created_at
-                cursor.execute("""
-                    INSERT INTO payments (user_id, amount, payment_type, status, description, created_at)
-                    VALUES (?, ?, 'withdraw', 'pending', ?, datetime('now'))
-                """, (user_id, amount, f"Запрос на вывод ${amount:.2f}"))
+async def handle_quick_withdraw_input(update: Update, context: ContextTypes.DEFAULT_TYPE, bot, message_text: str):
+    """Заявка на вывод введенной суммы (из главного меню)"""
+    amount = await _parse_amount_input(update, message_text)
+    if amount is None:
+        return
 
-                bot.db.get_connection().commit()
+    user_id = update.effective_user.id
+    logger.info("💰 Обработка ВЫВОДА на сумму $%.2f", amount, extra=SAMPLED)
 
-                payment_id = cursor.lastrowid
-                cursor.close()
+    if amount < 1:
+        await update.message.reply_text("❌ Минимальная сумма: $1\n\n💵 Введите сумму:")
+        return
 
-                logger.info(f"💰 Создана заявка на вывод ID: {payment_id}")
+    # Очищаем состояние
+    bot.conversation_state.clear_state(user_id)
 
-            except Exception as e:
-                logger.error(f"Ошибка создания записи о выводе: {e}")
+    # Списание и заявка - одна транзакция в PaymentManager; ответ уже после нее
+    payment, error = await bot.payment_manager.create_withdrawal(user_id, amount)
+    if error:
+        await update.message.reply_text(
+            f"❌ {error}",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("💳 Пополнить", callback_data="deposit")],
+                [InlineKeyboardButton("📋 Главное меню", callback_data="main_menu")]
+            ])
+        )
+        return
+
+    payment_id = payment.payment_id
+    logger.debug("💰 Создана заявка на вывод ID: %s", payment_id)
+
+    receive_amount = payment.amount
+    commission = amount - receive_amount
+
+    await update.message.reply_text(
+        f"✅ **Запрос на вывод создан!**\n\n"
+        f"📝 ID заявки: `{payment_id}`\n"
+        f"💵 Запрошено: ${amount:.2f}\n"
+        f"📊 Комиссия (8%): ${commission:.2f}\n"
+        f"💰 К получению: ${receive_amount:.2f}\n\n"
+        f"⏳ Обычно обработка занимает 1-24 часа.\n"
+        f"👨‍💼 Для ускорения обратитесь к @admin",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("📋 Главное меню", callback_data="main_menu")]
+        ]),
+        parse_mode='Markdown'
+    )
 
-                # Пробуем вернуть средства
-                try:
-                    bot.db.get_connection().commit()
-                    bot.db.update_balance(user_id, amount)
-                    bot.db.get_connection().commit()
-                except Exception as e2:
-                    logger.error(f"Ошибка возврата средств: {e2}")
+    logger.info("💸 Вывод: пользователь %s запросил вывод $%.2f, ID заявки: %s", user_id, amount, payment_id)
 
-                await update.message.reply_text(
-                    "❌ Ошибка создания заявки. Средства возвращены на баланс.",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("📋 Главное меню", callback_data="main_menu")]
-                    ])
-                )
-                return
 
-            commission = amount * 0.08
-            receive_amount = amount - commission
+async def handle_game_bet_input(update: Update, context: ContextTypes.DEFAULT_TYPE, bot, message_text: str):
+    """Создание игры 1 на 1 с введенной ставкой"""
+    amount = await _parse_amount_input(update, message_text)
+    if amount is None:
+        return
 
-            await update.message.reply_text(
-                f"✅ **Запрос на вывод создан!**\n\n"
-                f"📝 ID заявки: `{payment_id}`\n"
-                f"💵 Запрошено: ${amount:.2f}\n"
-                f"📊 Комиссия (8%): ${commission:.2f}\n"
-                f"💰 К получению: ${receive_amount:.2f}\n\n"
-                f"⏳ Обычно обработка занимает 1-24 часа.\n"
-                f"👨‍💼 Для ускорения обратитесь к @admin",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("📋 Главное меню", callback_data="main_menu")]
-                ]),
-                parse_mode='Markdown'
-            )
+    user_id = update.effective_user.id
+    logger.info("🎲 Обработка СТАВКИ на сумму $%.2f", amount, extra=SAMPLED)
 
-            logger.info(f"💸 Вывод: пользователь {user_id} запросил вывод ${amount:.2f}, ID заявки: {payment_id}")
-            return
+    # Проверяем минимальную и максимальную сумму
+    if amount < 1:
+        await update.message.reply_text("❌ Минимальная ставка: $1\n\n💰 Введите сумму ставки:")
+        return
 
-        elif waiting_for_bet:
-            logger.info(f"🎲 Обработка СТАВКИ на сумму ${amount:.2f}")
+    if amount > 1000:
+        await update.message.reply_text("❌ Максимальная ставка: $1000\n\n💰 Введите сумму ставки:")
+        return
 
-            # ОРИГИНАЛЬНАЯ ЛОГИКА ДЛЯ СТАВОК
-            # Проверяем минимальную и максимальную сумму
-            if amount < 1:
-                await update.message.reply_text("❌ Минимальная ставка: $1\n\n💰 Введите сумму ставки:")
-                return
+    # Очищаем состояние
+    bot.conversation_state.clear_state(user_id)
 
-            if amount > 1000:
-                await update.message.reply_text("❌ Максимальная ставка: $1000\n\n💰 Введите сумму ставки:")
-                return
+    if not hasattr(bot, 'game_manager'):
+        await update.message.reply_text("❌ Ошибка: система игр не инициализирована")
+        return
 
-            # Очищаем состояние
-            context.user_data.pop('waiting_for_bet', None)
+    game_manager = bot.game_manager
+    user_name = update.effective_user.username or update.effective_user.first_name
 
-            # Создаем игру
-            bot = context.application.bot_data.get('bot_instance')
-            if not bot or not hasattr(bot, 'game_manager'):
-                await update.message.reply_text("❌ Ошибка: система игр не инициализирована")
-                return
+    # Создаем игру
+    game, error = game_manager.create_game(
+        creator_id=user_id,
+        creator_name=user_name,
+        bet_amount=amount
+    )
 
-            game_manager = bot.game_manager
-            user_name = update.effective_user.username or update.effective_user.first_name
+    if error:
+        await update.message.reply_text(f"❌ {error}")
+        return
+
+    # Инициализируем хранилище message_id если нужно
+    if not hasattr(game_manager, 'game_messages'):
+        game_manager.game_messages = {}
+
+    if game.id not in game_manager.game_messages:
+        game_manager.game_messages[game.id] = []
+
+    # Клавиатура для создателя
+    keyboard = [
+        [roll_button(game)],
+        [InlineKeyboardButton("❌ Отменить игру", callback_data=f"cancel_active_game_{game.id}")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    # Сообщение создателю
+    game_message_text = (
+        f"🎲 Игра создана!\n"
+        f"💰 Ставка: ${game.bet_amount:.2f}\n\n"
+        f"🆔 Код игры: `{game.game_code}`\n\n"
+        f"{fairness_commit_text(game)}"
+        "📤 **Отправьте следующее сообщение другу!**"
+    )
 
-            # Создаем игру
-            game, error = game_manager.create_game(
-                creator_id=user_id,
-                creator_name=user_name,
-                bet_amount=amount
-            )
+    game_message = await update.message.reply_text(
+        game_message_text,
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
 
-            if error:
-                await update.message.reply_text(f"❌ {error}")
-                return
+    # Сохраняем ID этого сообщения
+    game_msg_data = {
+        "chat_id": update.message.chat_id,
+        "message_id": game_message.message_id
+    }
+    logger.debug("🔍 СООБЩЕНИЕ ОБ ИГРЕ: %s", game_msg_data)
+    if game_msg_data not in game_manager.game_messages[game.id]:
+        game_manager.game_messages[game.id].append(game_msg_data)
 
-            # Инициализируем хранилище message_id если нужно
-            if not hasattr(game_manager, 'game_messages'):
-                game_manager.game_messages = {}
-
-            if game.id not in game_manager.game_messages:
-                game_manager.game_messages[game.id] = []
-
-            # Клавиатура для создателя
-            keyboard = [
-                [InlineKeyboardButton("🎲 Бросить кости", callback_data=f"roll_{game.id}")],
-                [InlineKeyboardButton("❌ Отменить игру", callback_data=f"cancel_active_game_{game.id}")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            # Сообщение создателю
-            game_message_text = (
-                f"🎲 Игра создана!\n"
-                f"💰 Ставка: ${game.bet_amount:.2f}\n\n"
-                f"🆔 Код игры: `{game.game_code}`\n\n"
-                "📤 **Отправьте следующее сообщение другу!**"
-            )
+    # Отправляем приглашение для пересылки
+    await send_game_invite_from_message(update, game, context)
 
-            game_message = await update.message.reply_text(
-                game_message_text,
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
 
-            # Сохраняем ID этого сообщения
-            game_msg_data = {
-                "chat_id": update.message.chat_id,
-                "message_id": game_message.message_id
-            }
-            logger.info(f"🔍 СООБЩЕНИЕ ОБ ИГРЕ: {game_msg_data}")
-            if game_msg_data not in game_manager.game_messages[game.id]:
-                game_manager.game_messages[game.id].append(game_msg_data)
+async def handle_lobby_bet_state_input(update: Update, context: ContextTypes.DEFAULT_TYPE, bot, message_text: str):
+    """Произвольная ставка для лобби"""
+    bot.conversation_state.clear_state(update.effective_user.id)
+    await handle_lobby_bet_input(update, message_text, bot)
 
-            # Отправляем приглашение для пересылки
-            await send_game_invite_from_message(update, game, context)
 
-    except Exception as e:
-        logger.error(f"❌ Ошибка обработки ввода: {e}")
-        await update.message.reply_text(f"❌ Ошибка: {str(e)}")
+# Таблица диспетчеризации: состояние -> обработчик ввода
+INPUT_STATE_HANDLERS = {
+    ConversationStateManager.BET: handle_game_bet_input,
+    ConversationStateManager.LOBBY_BET: handle_lobby_bet_state_input,
+    ConversationStateManager.DEPOSIT: handle_deposit_amount_input,
+    ConversationStateManager.WITHDRAW: handle_withdraw_amount_input,
+    ConversationStateManager.QUICK_DEPOSIT: handle_quick_deposit_input,
+    ConversationStateManager.QUICK_WITHDRAW: handle_quick_withdraw_input,
+}
 
 
 async def send_game_invite_from_message(update: Update, game, context):
@@ -317,6 +325,7 @@ async def send_game_invite_from_message(update: Update, game, context):
             f"💰 Ставка: ${game.bet_amount:.2f}\n"
             f"🎯 Формат: 1 на 1\n"
             f"🆔 Код: `{game.game_code}`\n\n"
+            f"{fairness_commit_text(game)}"
             f"🎯 [Присоединиться к игре]({deep_link_url})\n\n"
             f"💰 *Победитель забирает ${game.bet_amount * 2 * 0.92:.2f} (за вычетом комиссии 8%)*"
         )
@@ -381,12 +390,19 @@ async def handle_dice_roll(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Извлекаем ID игры
         game_id = int(query.data.split("_")[1])
 
+        # Быстрый режим: без анимации Telegram, все броски одним сообщением
+        game = game_manager.load_game(game_id)
+        if game and game.fast:
+            await handle_fast_roll(query, context, bot, game_id)
+            return
+
         # Отправляем анимированные кости
         dice_message = await query.message.reply_dice(emoji="🎲")
         dice_value = dice_message.dice.value
 
         # Ждем анимацию
-        await asyncio.sleep(3)
+        with tracer.span('dice_animation_wait'):
+            await asyncio.sleep(3)
 
         # Обрабатываем бросок
         game, error = await game_manager.process_dice_roll(
@@ -438,6 +454,32 @@ async def handle_dice_roll(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer(f"❌ Ошибка броска: {str(e)}", show_alert=True)
 
 
+async def handle_fast_roll(query, context, bot, game_id: int):
+    """Быстрый режим: бот бросает оставшиеся кости из сида игры, итог - одним сообщением"""
+    game, rolls, error = await bot.game_manager.process_fast_rolls(game_id, query.from_user.id)
+    if error:
+        await query.answer(f"❌ {error}", show_alert=True)
+        return
+
+    current_rolls = game.get_rolls(query.from_user.id)
+    player_name = game.player1_name if query.from_user.id == game.player1_id else game.player2_name
+
+    message_text = (
+        f"⚡ {player_name} - быстрый бросок\n"
+        f"🎲 Выпало: {', '.join(map(str, rolls))}\n\n"
+        f"📊 Ваши броски: {', '.join(map(str, current_rolls))}\n"
+        f"💰 Сумма: {sum(current_rolls)}\n\n"
+        "✅ Вы завершили все броски!"
+    )
+    reply_markup = None
+    if game.status != "finished":
+        reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("⏳ Ожидаем соперника", callback_data="waiting")]])
+    await query.message.reply_text(message_text, reply_markup=reply_markup)
+
+    if game.status == "finished":
+        await process_game_result(game, context, bot)
+
+
 async def cancel_active_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отменяет активную игру и удаляет все сообщения"""
     query = update.callback_query
@@ -506,14 +548,16 @@ async def join_game_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         # Отправляем сообщение о присоединении
-        keyboard = [[InlineKeyboardButton("🎲 Бросить кости", callback_data=f"roll_{game.id}")]]
+        keyboard = [[roll_button(game)]]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
         await update.message.reply_text(
             f"✅ Вы присоединились к игре {game.game_code}!\n"
             f"💰 Ставка: ${game.bet_amount:.0f}\n"
+            f"{fairness_commit_text(game)}"
             f"🎲 Готовы бросить кости?",
-            reply_markup=reply_markup
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
         )
 
         # Уведомляем создателя игры
@@ -582,7 +626,7 @@ async def send_game_invite(query, game, context):
 
 
 async def process_game_result(game, context, bot=None):  # ← ДОБАВЛЯЕМ bot
-    """Обрабатывает результат завершенной игры"""
+    """Уведомляет игроков о результате (выплату уже провел GameManager.settle_game)"""
     try:
         # Получаем бота из context если не передали
         if not bot:
@@ -592,20 +636,25 @@ async def process_game_result(game, context, bot=None):  # ← ДОБАВЛЯЕ
             logger.error("Бот не найден в контексте")
             return
 
-        # Общий банк и комиссия
-        total_bank = game.bet_amount * 2
-        commission = total_bank * 0.08
-        winner_amount = total_bank - commission
+        # Расчет проводится при завершении игры; повторный вызов вернет уже проведенный
+        settlement = bot.game_manager.settlement.get("game", game.id)
+        if not settlement:
+            settlement, error = bot.game_manager.settle_game(game)
+            if error:
+                logger.error(f"❌ Расчет по игре {game.id} не проведен: {error}")
+                return
 
         if game.winner_id:
             winner_name = game.player1_name if game.winner_id == game.player1_id else game.player2_name
             loser_name = game.player2_name if game.winner_id == game.player1_id else game.player1_name
+            winner_amount = settlement.payout(game.winner_id)
 
             # Уведомляем победителя
             winner_text = (
                 f"🏆 Поздравляем с победой!\n"
-                f"💰 Ваш выигрыш: ${winner_amount:.2f}\n"
+                f"💰 Ваш выигрыш: ${winner_amount:.2f} (зачислен на баланс)\n"
                 f"🎮 Противник: {loser_name}"
+                f"{fairness_reveal_text(game)}"
             )
 
             # Уведомляем проигравшего
@@ -613,6 +662,7 @@ async def process_game_result(game, context, bot=None):  # ← ДОБАВЛЯЕ
                 f"😔 Вы проиграли\n"
                 f"💰 Потеряно: ${game.bet_amount:.2f}\n"
                 f"🎮 Победитель: {winner_name}"
+                f"{fairness_reveal_text(game)}"
             )
 
             await context.bot.send_message(chat_id=game.winner_id, text=winner_text)
@@ -620,65 +670,51 @@ async def process_game_result(game, context, bot=None):  # ← ДОБАВЛЯЕ
                 chat_id=game.player2_id if game.winner_id == game.player1_id else game.player1_id,
                 text=loser_text
             )
-
-            # Создаем выплату через payment_manager (если он есть)
-            if hasattr(bot, 'payment_manager') and bot.payment_manager:
-                try:
-                    payment, error = await bot.payment_manager.create_withdrawal(
-                        user_id=game.winner_id,
-                        amount_usd=winner_amount,
-                        description=f"Выигрыш в игре #{game.game_code}"
-                    )
-
-                    if payment:
-                        logger.info(f"✅ Чек создан для победителя {winner_name}: ${winner_amount:.2f}")
-                        await context.bot.send_message(
-                            chat_id=game.winner_id,
-                            text=f"💰 Чек на ${winner_amount:.2f} создан! Ожидайте выплаты."
-                        )
-                    else:
-                        logger.error(f"❌ Ошибка создания чека: {error}")
-                        # Альтернатива: зачисляем на баланс
-                        bot.db.update_balance(game.winner_id, winner_amount)
-                except Exception as e:
-                    logger.error(f"❌ Ошибка payment_manager: {e}")
-                    # Запасной вариант
-                    bot.db.update_balance(game.winner_id, winner_amount)
-            else:
-                # Если нет payment_manager, просто обновляем баланс
-                bot.db.update_balance(game.winner_id, winner_amount)
-                logger.info(f"⚠️ PaymentManager не доступен, баланс обновлен")
         else:
-            # Ничья - возвращаем ставки
-            bot.db.update_balance(game.player1_id, game.bet_amount)
-            bot.db.update_balance(game.player2_id, game.bet_amount)
-
-            draw_text = "🤝 Ничья! Ставки возвращены."
+            draw_text = "🤝 Ничья! Ставки возвращены." + fairness_reveal_text(game)
             await context.bot.send_message(chat_id=game.player1_id, text=draw_text)
             await context.bot.send_message(chat_id=game.player2_id, text=draw_text)
 
-        logger.info(f"🎮 Игра {game.id} завершена. Победитель: {game.winner_id}")
+        logger.info("🎮 Игра %s завершена. Победитель: %s", game.id, game.winner_id)
 
     except Exception as e:
         logger.error(f"❌ Ошибка обработки результата: {e}")
 
 
+async def fast_roll_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /fastroll - включает/выключает быстрый режим бросков для новых игр"""
+    bot = context.application.bot_data.get('bot_instance')
+    if not bot:
+        return
+
+    user_id = update.effective_user.id
+    enabled = not bot.db.get_fast_roll(user_id)
+    bot.db.set_fast_roll(user_id, enabled)
+
+    if enabled:
+        await update.message.reply_text(
+            "⚡ Быстрый режим включен\n\n"
+            "В ваших новых играх кости бросает бот - все три броска сразу, без анимации, "
+            "если соперник тоже включил /fastroll.\n"
+            "🔐 Хеш сида публикуется при создании игры, сам сид - в итогах: "
+            "по нему можно проверить каждый бросок.\n\n"
+            "Выключить: /fastroll"
+        )
+    else:
+        await update.message.reply_text("🎲 Быстрый режим выключен: броски снова через кубик Telegram")
+
+
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /cancel"""
-    # Проверяем, находимся ли мы в состоянии ожидания ставки
-    if context.user_data.get('waiting_for_bet'):
-        # Очищаем состояние
-        context.user_data.pop('waiting_for_bet', None)
-        context.user_data.pop('action', None)
+    bot = context.application.bot_data.get('bot_instance')
 
-        await update.message.reply_text("✅ Создание игры отменено")
+    # Проверяем, находимся ли мы в состоянии ожидания ввода
+    if bot and bot.conversation_state.clear_state(update.effective_user.id):
+        await update.message.reply_text("✅ Операция отменена")
 
         # Пытаемся вернуть в главное меню
         try:
-            from app.handlers.commands import show_main_menu_from_message
-            bot = context.application.bot_data.get('bot_instance')
-            if bot:
-                await show_main_menu_from_message(update, bot)
+            await show_main_menu_from_message(update, bot)
         except Exception as e:
             logger.error(f"Ошибка возврата в меню: {e}")
             # Если не получилось - просто отправляем текст
@@ -750,6 +786,92 @@ async def send_game_invite_from_message(update: Update, game, context):
             return None
 
 
+# ============ БЫСТРЫЙ ПОДБОР СОПЕРНИКА ============
+
+async def handle_quick_match(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопки подбора: quick_match_menu, quick_match:<ставка>, quick_match_cancel"""
+    query = update.callback_query
+    await query.answer()
+
+    bot = context.application.bot_data.get('bot_instance')
+    if not bot or not getattr(bot, 'matchmaking', None):
+        await query.answer("❌ Подбор соперников недоступен", show_alert=True)
+        return
+
+    matchmaking = bot.matchmaking
+    user_id = query.from_user.id
+    # Подбор вместо ввода ставки текстом
+    bot.conversation_state.clear_state(user_id)
+
+    if query.data == "quick_match_cancel":
+        matchmaking.dequeue(user_id)
+        await query.edit_message_text(
+            "❌ Поиск соперника отменен",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("📋 Главное меню", callback_data="main_menu")]])
+        )
+        return
+
+    if query.data == "quick_match_menu":
+        keyboard = [
+            [InlineKeyboardButton(f"${tier} (в очереди: {matchmaking.queue_depth(tier)})",
+                                  callback_data=f"quick_match:{tier}")]
+            for tier in BET_TIERS
+        ]
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="main_menu")])
+        await query.edit_message_text(
+            "⚡ Быстрый подбор соперника\n\n"
+            "Выберите ставку - бот сам найдет игрока с такой же ставкой.\n"
+            "Ставка списывается только когда соперник найден.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return
+
+    tier = float(query.data.split(":")[1])
+    username = query.from_user.username or query.from_user.first_name
+    ok, error = matchmaking.enqueue(user_id, username, tier)
+    if not ok:
+        await query.answer(f"❌ {error}", show_alert=True)
+        return
+
+    await query.edit_message_text(
+        f"🔎 Ищем соперника со ставкой ${tier:g}...\n"
+        f"👥 В очереди: {matchmaking.queue_depth(tier)}\n\n"
+        "Мы пришлем сообщение, как только игра будет создана.",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Отменить поиск",
+                                                                  callback_data="quick_match_cancel")]])
+    )
+
+
+async def notify_quick_match(game, bot):
+    """Сообщает обоим игрокам о найденной игре"""
+    keyboard = InlineKeyboardMarkup([[roll_button(game)]])
+    for player_id, opponent in ((game.player1_id, game.player2_name), (game.player2_id, game.player1_name)):
+        await bot.application.bot.send_message(
+            chat_id=player_id,
+            text=(
+                f"✅ Соперник найден: {opponent}\n"
+                f"💰 Ставка: ${game.bet_amount:.2f} (списана)\n"
+                f"🆔 Игра: {game.game_code}\n\n"
+                f"{fairness_commit_text(game, markdown=False)}"
+                "🎲 Бросайте кости!"
+            ),
+            reply_markup=keyboard
+        )
+
+
+async def notify_quick_match_dropped(user_id, reason, bot):
+    """Сообщает игроку, что он снят с очереди подбора"""
+    text = {
+        "timeout": "⌛ Соперник не найден. Попробуйте еще раз или выберите другую ставку.",
+        "insufficient_funds": "❌ Поиск остановлен: недостаточно средств для ставки.",
+    }.get(reason, "❌ Поиск соперника остановлен")
+    await bot.application.bot.send_message(
+        chat_id=user_id,
+        text=text,
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⚡ Искать снова", callback_data="quick_match_menu")]])
+    )
+
+
 # ============ РЕГИСТРАЦИЯ ОБРАБОТЧИКОВ ============
 
 def register_game_handlers(application, bot):
@@ -761,10 +883,12 @@ def register_game_handlers(application, bot):
     application.add_handler(CallbackQueryHandler(show_bet_options, pattern=r"^find_game$"))
     application.add_handler(CallbackQueryHandler(handle_dice_roll, pattern=r"^roll_"))
     application.add_handler(CallbackQueryHandler(cancel_active_game, pattern=r"^cancel_active_game_"))
+    application.add_handler(CallbackQueryHandler(handle_quick_match, pattern=r"^quick_match"))
 
     # Command handlers - ВАЖНО: регистрируем ДО MessageHandler!
     application.add_handler(CommandHandler("cancel", cancel_command))
     application.add_handler(CommandHandler("join", join_game_command))
+    application.add_handler(CommandHandler("fastroll", fast_roll_command))
 
     # Текстовый обработчик для ввода ставки И платежей
     application.add_handler(MessageHandler(
@@ -0,0 +1,23 @@
+# app/handlers/ingest_filter.py
+from telegram import Update
+from telegram.ext import ContextTypes, TypeHandler, ApplicationHandlerStop
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def register_ingest_filter(application, bot):
+    """Регистрирует фильтр входящих обновлений (до всех остальных обработчиков)"""
+    # group=-1 выполняется раньше обработчиков из group=0
+    application.add_handler(TypeHandler(
+        Update,
+        lambda update, context: group_ingest_filter(update, context, bot)
+    ), group=-1)
+
+    logger.info("✅ Фильтр групповых сообщений зарегистрирован")
+
+
+async def group_ingest_filter(update: Update, context: ContextTypes.DEFAULT_TYPE, bot):
+    """Отбрасывает нерелевантные сообщения групп до диспетчеризации и логирования"""
+    if not bot.group_filter.should_process(update):
+        raise ApplicationHandlerStop
@@ -1,15 +1,23 @@
 # app/handlers/lobby_handlers.py
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CallbackQueryHandler, CommandHandler, MessageHandler, filters
-from datetime import datetime
 import logging
 import asyncio
 
 
-from app.models.lobby import LobbyPlayer
+from app.models.lobby import LobbyPlayer, TOURNAMENT_FORMATS
+from app.services.lobby_rounds import LobbyRoundGame
+from app.utils.logging_setup import SAMPLED
 
 logger = logging.getLogger(__name__)
 
+DICE_ANIMATION_SECONDS = 3  # Длительность анимации 🎲 в Telegram
+SETTLE_ATTEMPTS = 3  # Попытки расчета игры лобби, затем возврат ставок
+SETTLE_RETRY_SECONDS = 30
+
+# Фоновые задачи (повторные расчеты): ссылки держим, пока задача не завершится
+_background_tasks = set()
+
 
 def register_lobby_handlers(application, bot):
     """Регистрируем обработчики лобби"""
@@ -18,7 +26,7 @@ def register_lobby_handlers(application, bot):
     # Обработчики для кнопок создания лобби
     application.add_handler(CallbackQueryHandler(
         lambda update, context: handle_lobby_callback(update, context, bot),
-        pattern=r"^(lobby_bet_|lobby_size_|lobby_custom_bet|lobby_cancel|create_lobby_menu)"
+        pattern=r"^(lobby_bet_|lobby_size_|lobby_custom_bet|lobby_cancel|create_lobby_menu|lobby_browse:)"
     ))
 
     # Обработчики действий в лобби
@@ -27,6 +35,12 @@ def register_lobby_handlers(application, bot):
         pattern=r"^(lobby_toggle_ready:|lobby_start:|lobby_leave:|join_lobby:|lobby_roll:)"
     ))
 
+    # Турнир поверх лобби
+    application.add_handler(CommandHandler(
+        "tournament",
+        lambda update, context: tournament_command(update, context, bot)
+    ))
+
 
 
 async def handle_lobby_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, bot):
@@ -37,7 +51,7 @@ async def handle_lobby_callback(update: Update, context: ContextTypes.DEFAULT_TY
     data = query.data
     user_id = query.from_user.id
 
-    logger.info(f"🎮 Кнопка лобби: '{data}' от {user_id}")
+    logger.info("🎮 Кнопка лобби: '%s' от %s", data, user_id, extra=SAMPLED)
 
     if data == "create_lobby_menu":
         await show_lobby_menu(query, bot)
@@ -54,7 +68,7 @@ async def handle_lobby_callback(update: Update, context: ContextTypes.DEFAULT_TY
 
     elif data == "lobby_custom_bet":
         # Запрос произвольной ставки
-        context.user_data['waiting_for_lobby_bet'] = True
+        bot.conversation_state.set_state(user_id, bot.conversation_state.LOBBY_BET)
         await ask_custom_lobby_bet(query, bot)
 
     elif data.startswith("lobby_size_"):
@@ -74,11 +88,11 @@ async def handle_lobby_actions(update: Update, context: ContextTypes.DEFAULT_TYP
     user_id = query.from_user.id
     username = query.from_user.username or query.from_user.first_name
 
-    logger.info(f"🎮 Действие в лобби: '{data}' от {username}")
+    logger.info("🎮 Действие в лобби: '%s' от %s", data, username, extra=SAMPLED)
 
     if data.startswith("lobby_toggle_ready:"):
         # ОТЛАДКА
-        logger.info(f"🔥 Нажата кнопка готовности: {data}")
+        logger.debug("🔥 Нажата кнопка готовности: %s", data)
 
         parts = data.split(":")
         if len(parts) < 3:
@@ -93,13 +107,13 @@ async def handle_lobby_actions(update: Update, context: ContextTypes.DEFAULT_TYP
             await query.answer("❌ Вы можете менять только свой статус!", show_alert=True)
             return
 
-        logger.info(f"🔄 Переключение готовности: lobby_id={lobby_id}, player_id={player_id}")
+        logger.debug("🔄 Переключение готовности: lobby_id=%s, player_id=%s", lobby_id, player_id)
 
         await toggle_ready_callback(query, lobby_id, player_id, bot)
         return
 
     elif data.startswith("lobby_start:"):
-        logger.info(f"🚀 Нажата кнопка начала игры: {data}")
+        logger.debug("🚀 Нажата кнопка начала игры: %s", data)
 
         lobby_id = data.split(":")[1]
         await start_lobby_game(query, lobby_id, user_id, bot)
@@ -113,10 +127,12 @@ async def handle_lobby_actions(update: Update, context: ContextTypes.DEFAULT_TYP
         await join_lobby_callback(query, lobby_id, user_id, username, bot)
 
     elif data.startswith("lobby_roll:"):
+        # lobby_roll:<game_id>:<player_id>:<раунд>
         parts = data.split(":")
         game_id = parts[1]
         player_id = int(parts[2])
-        await handle_lobby_roll(query, game_id, player_id, bot, context)
+        round_number = int(parts[3]) if len(parts) > 3 else None
+        await handle_lobby_roll(query, game_id, player_id, bot, context, round_number)
 
     else:
         logger.warning(f"⚠️ Неизвестный callback: {data}")
@@ -165,7 +181,7 @@ async def create_lobby_with_bet(query, bet_amount, max_players, bot):
     user_id = query.from_user.id
     username = query.from_user.username or query.from_user.first_name
 
-    logger.info(f"🎲 Создание лобби: ставка ${bet_amount}, игроков: {max_players}")
+    logger.info("🎲 Создание лобби: ставка $%s, игроков: %s", bet_amount, max_players)
 
     # Проверяем баланс
     user = bot.db.get_user(user_id)
@@ -312,9 +328,7 @@ async def join_lobby_callback(query, lobby_id, user_id, username, bot):
         bot.db.update_balance(user_id, -lobby.bet_amount)
 
         # Помечаем игрока как оплатившего
-        player = lobby.get_player(user_id)
-        if player:
-            player.paid = True
+        lobby.mark_player_paid(user_id)
 
         await query.answer(f"✅ Вы присоединились! Ставка ${lobby.bet_amount:.0f} списана.",
                            show_alert=True)
@@ -346,7 +360,7 @@ async def join_lobby_callback(query, lobby_id, user_id, username, bot):
                     chat_id=lobby.creator_id,
                     text=f"🔄 Лобби #{lobby_id} обновлено:\n\n"
                          f"👥 Игроков: {len(lobby.players)}/{lobby.max_players}\n"
-                         f"✅ Готовы: {sum(1 for p in lobby.players if p.ready)}/{len(lobby.players)}\n\n"
+                         f"✅ Готовы: {lobby.ready_count}/{len(lobby.players)}\n\n"
                          f"Когда все будут готовы, нажмите '▶️ Начать игру'",
                     reply_markup=get_lobby_keyboard(lobby)
                 )
@@ -373,7 +387,7 @@ async def send_personal_lobby_message(user_id, lobby, bot):
             f"👤 Создатель: {lobby.creator_name}\n"
             f"💰 Ставка: ${lobby.bet_amount:.0f}\n"
             f"👥 Игроков: {len(lobby.players)}/{lobby.max_players}\n"
-            f"✅ Готовы: {sum(1 for p in lobby.players if p.ready)}/{len(lobby.players)}\n"
+            f"✅ Готовы: {lobby.ready_count}/{len(lobby.players)}\n"
             f"🆔 Код: `{lobby.id}`\n\n"
             f"📊 Ваш статус: {player_status}\n\n"
         )
@@ -391,14 +405,15 @@ async def send_personal_lobby_message(user_id, lobby, bot):
         buttons = []
 
         if lobby.status == "waiting":
-            # Кнопка переключения готовности
-            ready_text = "✅ Я готов!" if not player.ready else "⏸ Я не готов"
-            buttons.append([
-                InlineKeyboardButton(
-                    ready_text,
-                    callback_data=f"lobby_toggle_ready:{lobby.id}:{user_id}"
-                )
-            ])
+            # Кнопка переключения готовности (в турнире не нужна - старт по регистрации)
+            if not lobby.tournament:
+                ready_text = "✅ Я готов!" if not player.ready else "⏸ Я не готов"
+                buttons.append([
+                    InlineKeyboardButton(
+                        ready_text,
+                        callback_data=f"lobby_toggle_ready:{lobby.id}:{user_id}"
+                    )
+                ])
 
             # Кнопка выхода
             buttons.append([
@@ -409,7 +424,7 @@ async def send_personal_lobby_message(user_id, lobby, bot):
             ])
 
             # Кнопка "Начать игру" только для создателя
-            if user_id == lobby.creator_id and lobby.all_players_ready():
+            if user_id == lobby.creator_id and _can_start(lobby):
                 buttons.append([
                     InlineKeyboardButton(
                         "🚀 Начать игру",
@@ -434,7 +449,7 @@ async def send_personal_lobby_message(user_id, lobby, bot):
 async def toggle_ready_callback(query, lobby_id, player_id, bot):
     """Переключает статус готовности игрока - УПРОЩЕННАЯ ВЕРСИЯ"""
 
-    logger.info(f"🔄 Начало toggle_ready_callback: lobby_id={lobby_id}, player_id={player_id}")
+    logger.debug("🔄 Начало toggle_ready_callback: lobby_id=%s, player_id=%s", lobby_id, player_id)
 
     # Получаем лобби
     lobby = bot.lobby_manager.get_lobby(lobby_id)
@@ -450,26 +465,24 @@ async def toggle_ready_callback(query, lobby_id, player_id, bot):
         await query.answer("❌ Игрок не найден в лобби", show_alert=True)
         return
 
-    logger.info(f"✅ Игрок найден: {player.username}, текущий статус: {player.ready}")
+    logger.debug("✅ Игрок найден: %s, текущий статус: %s", player.username, player.ready)
 
     # Меняем статус готовности
-    player.ready = not player.ready
-    logger.info(f"🔄 Новый статус игрока: {player.ready}")
+    lobby.toggle_player_ready(player_id)
+    logger.debug("🔄 Новый статус игрока: %s", player.ready)
 
     # Сохраняем в БД
     try:
         bot.lobby_manager.save_lobby_to_db(lobby)
-        logger.info(f"💾 Лобби сохранено в БД")
+        logger.debug("💾 Лобби сохранено в БД")
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения лобби: {e}")
 
     # Обновляем сообщение лобби у всех игроков
-    ready_count = sum(1 for p in lobby.players if p.ready)
-
     # 1. Обновляем сообщение у нажавшего игрока
     try:
         await send_personal_lobby_message(player_id, lobby, bot)
-        logger.info(f"📨 Сообщение обновлено для игрока {player_id}")
+        logger.debug("📨 Сообщение обновлено для игрока %s", player_id)
     except Exception as e:
         logger.error(f"❌ Ошибка обновления сообщения игрока: {e}")
 
@@ -477,7 +490,7 @@ async def toggle_ready_callback(query, lobby_id, player_id, bot):
     if player_id != lobby.creator_id:
         try:
             await send_personal_lobby_message(lobby.creator_id, lobby, bot)
-            logger.info(f"📨 Сообщение обновлено для создателя {lobby.creator_id}")
+            logger.debug("📨 Сообщение обновлено для создателя %s", lobby.creator_id)
         except Exception as e:
             logger.error(f"❌ Ошибка обновления сообщения создателя: {e}")
 
@@ -485,7 +498,7 @@ async def toggle_ready_callback(query, lobby_id, player_id, bot):
     status = "готов" if player.ready else "не готов"
     await query.answer(f"✅ Вы теперь {status}")
 
-    logger.info(f"✅ toggle_ready_callback завершено успешно")
+    logger.debug("✅ toggle_ready_callback завершено успешно")
 
     # Если все готовы - уведомляем создателя
     if lobby.all_players_ready() and lobby.is_full():
@@ -506,16 +519,15 @@ async def leave_lobby_callback(query, lobby_id, user_id, bot):
         await query.answer("❌ Лобби не найдено", show_alert=True)
         return
 
-    # Возвращаем ставку если игрок оплатил
+    # Выходим из лобби (после начала игры не выйти), затем возвращаем ставку
     player = lobby.get_player(user_id)
-    if player and player.paid:
-        bot.db.update_balance(user_id, lobby.bet_amount)
-        print(f"💰 Возвращена ставка ${lobby.bet_amount} игроку {user_id}")
-
-    # Выходим из лобби
     success, message = bot.lobby_manager.leave_lobby(lobby_id, user_id)
 
     if success:
+        if player and player.paid:
+            bot.db.update_balance(user_id, lobby.bet_amount)
+            logger.info("💰 Возвращена ставка $%s игроку %s", lobby.bet_amount, user_id)
+
         # Сохраняем изменения
         if "удалено" not in message:
             bot.lobby_manager.save_lobby_to_db(lobby)
@@ -548,6 +560,10 @@ async def start_lobby_game(query, lobby_id, user_id, bot):
         await query.answer("❌ Только создатель может начать игру", show_alert=True)
         return
 
+    if lobby.tournament:
+        await start_tournament(query, lobby, bot)
+        return
+
     # Проверяем что все готовы и лобби заполнено
     if not lobby.all_players_ready():
         await query.answer("❌ Не все игроки готовы", show_alert=True)
@@ -558,11 +574,10 @@ async def start_lobby_game(query, lobby_id, user_id, bot):
         await query.answer("❌ Нужно минимум 2 игрока для начала игры", show_alert=True)
         return
 
-    logger.info(f"🚀 Создатель {user_id} начинает игру в лобби {lobby_id}")
+    logger.info("🚀 Создатель %s начинает игру в лобби %s", user_id, lobby_id)
 
     # Меняем статус лобби
-    lobby.status = "active"
-    bot.lobby_manager.save_lobby_to_db(lobby)
+    bot.lobby_manager.start_lobby(lobby)
 
     # Создаем структуру игры - ИСПОЛЬЗУЕМ active_lobby_games
     game_id = f"lobby_{lobby_id}"
@@ -572,22 +587,18 @@ async def start_lobby_game(query, lobby_id, user_id, bot):
         logger.warning("⚠️ bot не имеет active_lobby_games, создаем...")
         bot.active_lobby_games = {}
 
-    bot.active_lobby_games[game_id] = {
-        "lobby_id": lobby_id,
-        "players": lobby.players,
-        "current_player_index": 0,
-        "rolls": {p.id: [] for p in lobby.players},
-        "max_rolls": 3,
-        "status": "active",
-        "bet_amount": lobby.bet_amount,
-        "created_at": datetime.now().isoformat()
-    }
+    game = LobbyRoundGame(
+        game_id, lobby_id, lobby.players, lobby.bet_amount,
+        rounds=3,
+        round_timeout=bot.config.LOBBY_ROUND_TIMEOUT,
+        on_round_closed=lambda game, result: on_lobby_round_closed(game, result, bot)
+    )
+    bot.active_lobby_games[game_id] = game
 
-    logger.info(f"🎮 Создана лобби-игра {game_id} с {len(lobby.players)} игроками")
+    logger.info("🎮 Создана лобби-игра %s с %s игроками", game_id, len(lobby.players))
 
     # Уведомляем всех игроков
     player_list = "\n".join([f"👤 {p.username}" for p in lobby.players])
-    first_player = lobby.players[0]
 
     game_message = (
         f"🚀 **Игра началась!**\n\n"
@@ -595,54 +606,45 @@ async def start_lobby_game(query, lobby_id, user_id, bot):
         f"💰 Ставка: ${lobby.bet_amount:.0f} с игрока\n"
         f"🏦 Общий банк: ${lobby.bet_amount * len(lobby.players):.0f}\n\n"
         f"👥 Игроки:\n{player_list}\n\n"
-        f"🎯 Первый ход: **{first_player.username}**\n"
-        f"🎲 Каждый игрок делает 3 броска"
+        f"🎲 {game.rounds} раунда, в каждом все бросают одновременно\n"
+        f"⏳ На бросок {game.round_timeout:.0f} сек, иначе за вас бросит бот\n"
+        f"📨 Кнопка броска пришла каждому в личные сообщения"
     )
 
-    # Кнопка для первого игрока
-    keyboard = InlineKeyboardMarkup([[
-        InlineKeyboardButton("🎲 Бросить кости",
-                             callback_data=f"lobby_roll:{game_id}:{first_player.id}")
-    ]])
-
-    # Отправляем сообщение в чат создателя
     try:
-        await query.edit_message_text(game_message, reply_markup=keyboard, parse_mode='Markdown')
-        logger.info(f"📨 Сообщение об игре отправлено создателю {user_id}")
+        await query.edit_message_text(game_message, parse_mode='Markdown')
     except Exception as e:
         logger.error(f"❌ Ошибка редактирования сообщения: {e}")
-        # Пытаемся отправить новое сообщение
-        try:
-            await query.message.reply_text(game_message, reply_markup=keyboard, parse_mode='Markdown')
-        except Exception as e2:
-            logger.error(f"❌ Ошибка отправки нового сообщения: {e2}")
 
-    # Отправляем уведомления остальным игрокам
-    for player in lobby.players:
-        # Пропускаем создателя (ему уже отправили)
-        if player.id == user_id:
-            continue
+    # Таймер раунда стартует, когда кнопки уже у игроков
+    await send_round_buttons(game, lobby, bot)
+    game.start()
 
-        try:
-            player_message = (
-                f"🎮 **Игра в лобби #{lobby.id} началась!**\n\n"
-                f"💰 Ваша ставка: ${lobby.bet_amount:.0f}\n"
-                f"👥 Игроков: {len(lobby.players)}\n"
-                f"🏦 Общий банк: ${lobby.bet_amount * len(lobby.players):.0f}\n\n"
-                f"🎯 Первый ход: {first_player.username}\n"
-                f"⏳ Ожидайте своего хода..."
-            )
 
+async def send_round_buttons(game, lobby, bot):
+    """Рассылает всем игрокам кнопку броска текущего раунда (параллельно)"""
+
+    async def send(player):
+        keyboard = InlineKeyboardMarkup([[
+            InlineKeyboardButton(
+                f"🎲 Бросить (раунд {game.round_number}/{game.rounds})",
+                callback_data=f"lobby_roll:{game.game_id}:{player.id}:{game.round_number}"
+            )
+        ]])
+        try:
             await bot.application.bot.send_message(
                 chat_id=player.id,
-                text=player_message,
+                text=f"🎮 **Лобби #{lobby.id}: раунд {game.round_number}/{game.rounds}**\n\n"
+                     f"💰 Ставка: ${lobby.bet_amount:.0f}\n"
+                     f"⏳ Бросьте кости в течение {game.round_timeout:.0f} сек",
+                reply_markup=keyboard,
                 parse_mode='Markdown'
             )
-            logger.info(f"📨 Уведомление отправлено игроку {player.id}")
-
         except Exception as e:
             logger.error(f"❌ Ошибка уведомления игрока {player.id}: {e}")
 
+    await asyncio.gather(*(send(player) for player in game.players.values()))
+
 
 async def start_lobby_game_auto(lobby_id, bot):
     """Автоматический запуск игры по таймеру"""
@@ -650,7 +652,7 @@ async def start_lobby_game_auto(lobby_id, bot):
     if not lobby:
         return
 
-    logger.info(f"🚀 Автозапуск игры в лобби {lobby_id}")
+    logger.info("🚀 Автозапуск игры в лобби %s", lobby_id)
 
     try:
         await bot.application.bot.edit_message_text(
@@ -665,12 +667,19 @@ async def start_lobby_game_auto(lobby_id, bot):
         logger.error(f"❌ Ошибка автозапуска: {e}")
 
 
+def _can_start(lobby):
+    """Турнир - от двух оплативших участников, обычное лобби - когда все готовы"""
+    if lobby.tournament:
+        return lobby.paid_count >= 2
+    return lobby.all_players_ready()
+
+
 def get_lobby_keyboard(lobby):
     """Создает клавиатуру для сообщения лобби"""
     buttons = []
 
-    # Кнопки готовности для каждого игрока
-    for player in lobby.players:
+    # Кнопки готовности для каждого игрока (турнир стартует без готовности)
+    for player in lobby.players if not lobby.tournament else ():
         status_emoji = "✅" if player.ready else "❌"
         buttons.append([
             InlineKeyboardButton(
@@ -680,8 +689,17 @@ def get_lobby_keyboard(lobby):
         ])
 
     # Кнопка "Начать игру" для создателя (показывается всем если все готовы)
-    ready_count = sum(1 for p in lobby.players if p.ready)
-    if ready_count == len(lobby.players) and len(lobby.players) >= 2:
+    ready_count = lobby.ready_count
+    if lobby.tournament:
+        if _can_start(lobby):
+            buttons.append([
+                InlineKeyboardButton("🏆 НАЧАТЬ ТУРНИР", callback_data=f"lobby_start:{lobby.id}")
+            ])
+        else:
+            buttons.append([
+                InlineKeyboardButton(f"⏳ Участников: {len(lobby.players)}", callback_data="refresh_lobby")
+            ])
+    elif ready_count == len(lobby.players) and len(lobby.players) >= 2:
         buttons.append([
             InlineKeyboardButton("🚀 НАЧАТЬ ИГРУ", callback_data=f"lobby_start:{lobby.id}")
         ])
@@ -773,6 +791,7 @@ async def show_lobby_menu(query, bot):
         [InlineKeyboardButton("$50", callback_data="lobby_bet_50")],
         [InlineKeyboardButton("$100", callback_data="lobby_bet_100")],
         [InlineKeyboardButton("💵 Произвольная ставка", callback_data="lobby_custom_bet")],
+        [InlineKeyboardButton("🔎 Найти открытое лобби", callback_data="lobby_browse:*:0")],
         [InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -780,6 +799,58 @@ async def show_lobby_menu(query, bot):
     await query.edit_message_text(menu_text, reply_markup=reply_markup, parse_mode='Markdown')
 
 
+LOBBY_BET_PRESETS = (1, 5, 10, 25, 50, 100)
+BROWSE_PAGE_SIZE = 8
+
+
+def format_lobby_browser(lobby_manager, bet=None, page=0):
+    """Страница поиска открытых лобби: (текст, клавиатура)"""
+    lobbies, has_more = lobby_manager.browse_lobbies(bet, page, BROWSE_PAGE_SIZE)
+    bet_key = "*" if bet is None else f"{bet:g}"
+    total = lobby_manager.index.count_open(bet)
+
+    text = (
+        f"🔎 **Открытые лобби** ({'все ставки' if bet is None else f'ставка ${bet:g}'})\n"
+        f"📋 Найдено: {total}\n\n"
+    )
+    text += "Нажмите на лобби, чтобы присоединиться:" if lobbies else "📭 Нет открытых лобби - создайте свое!"
+
+    # Фильтр по ставке
+    filters_row = [InlineKeyboardButton(("• Все •" if bet is None else "Все"), callback_data="lobby_browse:*:0")]
+    filters_row += [
+        InlineKeyboardButton(f"• ${preset} •" if bet == preset else f"${preset}",
+                             callback_data=f"lobby_browse:{preset}:0")
+        for preset in LOBBY_BET_PRESETS
+    ]
+    keyboard = [filters_row[:4], filters_row[4:]]
+
+    for lobby in lobbies:
+        free = lobby.max_players - lobby.get_player_count()
+        keyboard.append([InlineKeyboardButton(
+            f"💰 ${lobby.bet_amount:g} · 👥 {lobby.get_player_count()}/{lobby.max_players} · "
+            f"мест: {free} · {lobby.creator_name}",
+            callback_data=f"join_lobby:{lobby.id}"
+        )])
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=f"lobby_browse:{bet_key}:{page - 1}"))
+    if has_more:
+        nav.append(InlineKeyboardButton("➡️", callback_data=f"lobby_browse:{bet_key}:{page + 1}"))
+    if nav:
+        keyboard.append(nav)
+
+    keyboard.append([InlineKeyboardButton("👥 Создать лобби", callback_data="create_lobby_menu")])
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="main_menu")])
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+async def show_lobby_browser(query, bot, bet=None, page=0):
+    """Показывает поиск открытых лобби по ставке"""
+    text, reply_markup = format_lobby_browser(bot.lobby_manager, bet, page)
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+
 async def handle_lobby_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, bot):
     """Обработчик кнопок создания лобби"""
     query = update.callback_query
@@ -788,12 +859,18 @@ async def handle_lobby_callback(update: Update, context: ContextTypes.DEFAULT_TY
     data = query.data
     user_id = query.from_user.id
 
-    logger.info(f"🎮 Кнопка лобби: '{data}' от {user_id}")
+    logger.info("🎮 Кнопка лобби: '%s' от %s", data, user_id, extra=SAMPLED)
 
     if data == "create_lobby_menu":
         await show_lobby_menu(query, bot)
         return
 
+    elif data.startswith("lobby_browse:"):
+        # Поиск лобби: lobby_browse:<ставка или *>:<страница>
+        _, bet_key, page = data.split(":")
+        bet = None if bet_key == "*" else float(bet_key)
+        await show_lobby_browser(query, bot, bet, int(page))
+
     elif data == "lobby_cancel":
         await show_main_menu(query, bot)
         return
@@ -805,7 +882,7 @@ async def handle_lobby_callback(update: Update, context: ContextTypes.DEFAULT_TY
 
     elif data == "lobby_custom_bet":
         # Запрос произвольной ставки
-        context.user_data['waiting_for_lobby_bet'] = True
+        bot.conversation_state.set_state(user_id, bot.conversation_state.LOBBY_BET)
         await ask_custom_lobby_bet(query, bot)
 
     elif data.startswith("lobby_size_"):
@@ -816,118 +893,107 @@ async def handle_lobby_callback(update: Update, context: ContextTypes.DEFAULT_TY
         await create_lobby_with_bet(query, bet_amount, max_players, bot)
 
 
-async def handle_lobby_roll(query, game_id, player_id, bot, context):
-    """Обработчик броска костей в лобби"""
-    # Проверяем что пользователь - тот кто должен бросать
+async def handle_lobby_roll(query, game_id, player_id, bot, context, round_number=None):
+    """Бросок игрока в текущем раунде (все игроки бросают одновременно)"""
     if query.from_user.id != player_id:
-        await query.answer("❌ Сейчас не ваш ход!", show_alert=True)
+        await query.answer("❌ Это не ваша кнопка!", show_alert=True)
         return
 
-    # Используем active_lobby_games
     game = bot.active_lobby_games.get(game_id) if hasattr(bot, 'active_lobby_games') else None
     if not game:
         await query.answer("❌ Игра не найдена", show_alert=True)
         return
 
-    lobby = bot.lobby_manager.get_lobby(game["lobby_id"])
-    if not lobby:
-        await query.answer("❌ Лобби не найдено", show_alert=True)
+    ok, error = game.can_roll(player_id, round_number)
+    if not ok:
+        await query.answer(f"❌ {error}", show_alert=True)
         return
 
-    # Проверяем чей сейчас ход
-    current_player = game["players"][game["current_player_index"]]
-    if current_player.id != player_id:
-        await query.answer("❌ Сейчас не ваш ход!", show_alert=True)
-        return
+    # Убираем кнопку, чтобы не было повторных нажатий
+    try:
+        await query.edit_message_reply_markup(reply_markup=None)
+    except Exception:
+        pass
 
-    # Бросаем кости
     dice_message = await query.message.reply_dice(emoji="🎲")
     dice_value = dice_message.dice.value
 
-    # Ждем анимацию
-    await asyncio.sleep(3)
+    accepted, error = await game.roll(player_id, dice_value, round_number)
+    if not accepted:
+        await query.message.reply_text(f"❌ {error}. Бросок не засчитан.")
+        return
 
-    # Сохраняем бросок
-    if player_id not in game["rolls"]:
-        game["rolls"][player_id] = []
-    game["rolls"][player_id].append(dice_value)
-    rolls_count = len(game["rolls"][player_id])
+    if game.status == "active" and game.round_number == round_number:
+        await query.message.reply_text(
+            f"✅ Бросок засчитан: {dice_value}\n"
+            f"⏳ Ждем остальных игроков ({len(game.waiting_for())})..."
+        )
 
-    # Получаем имя игрока
-    player_name = next((p.username for p in lobby.players if p.id == player_id), "Игрок")
 
-    # Формируем сообщение
-    roll_message = (
-        f"🎲 {player_name} бросает кости!\n\n"
-        f"🎯 Выпало: {dice_value}\n"
-        f"📊 Бросок {rolls_count}/{game['max_rolls']}\n"
-    )
+async def on_lobby_round_closed(game, result, bot):
+    """Раунд закрыт: рассылаем итоги и кнопки следующего раунда или завершаем игру"""
+    lobby = bot.lobby_manager.get_lobby(game.lobby_id)
+    if not lobby:
+        game.cancel()
+        return
 
-    # Показываем текущие результаты
-    results = []
-    for player in lobby.players:
-        player_rolls = game["rolls"].get(player.id, [])
-        total = sum(player_rolls)
-        rolls_str = ", ".join(map(str, player_rolls)) if player_rolls else "—"
-        results.append(f"👤 {player.username}: {rolls_str} (Сумма: {total})")
+    # Даем доиграть анимации последних бросков (один раз на раунд, а не на бросок)
+    await asyncio.sleep(DICE_ANIMATION_SECONDS)
 
-    if results:
-        roll_message += "\n📈 Текущие результаты:\n" + "\n".join(results)
+    lines = []
+    for player, total, rolls in game.totals():
+        mark = " 🤖" if player.id in result.auto_rolled else ""
+        lines.append(f"👤 {player.username}: {result.rolls[player.id]}{mark} (Сумма: {total})")
 
-    # Проверяем завершил ли игрок свои броски
-    if rolls_count >= game["max_rolls"]:
-        # Игрок завершил все броски
-        roll_message += f"\n\n✅ {player_name} завершил все броски!"
+    round_text = (
+        f"🎲 Лобби #{lobby.id}: раунд {result.round_number}/{game.rounds} завершен\n\n"
+        + "\n".join(lines)
+    )
+    if result.auto_rolled:
+        round_text += "\n\n🤖 - не успели, бросок сделал бот"
 
-        # Переходим к следующему игроку
-        game["current_player_index"] += 1
-        logger.info(f"🔄 Текущий индекс игрока: {game['current_player_index']}, всего игроков: {len(game['players'])}")
+    await asyncio.gather(*(
+        _send_safe(bot, player.id, round_text) for player in game.players.values()
+    ))
 
-        if game["current_player_index"] < len(game["players"]):
-            next_player = game["players"][game["current_player_index"]]
-            roll_message += f"\n\n➡️ Следующий ход: **{next_player.username}**"
+    if result.finished:
+        await finish_lobby_game(game.game_id, lobby, bot)
+    else:
+        await send_round_buttons(game, lobby, bot)
 
-            # Кнопка для следующего игрока
-            keyboard = InlineKeyboardMarkup([[
-                InlineKeyboardButton("🎲 Бросить кости",
-                                     callback_data=f"lobby_roll:{game_id}:{next_player.id}")
-            ]])
 
-            await query.message.reply_text(roll_message, reply_markup=keyboard, parse_mode='Markdown')
+async def _send_safe(bot, chat_id, text):
+    try:
+        await bot.application.bot.send_message(chat_id=chat_id, text=text)
+    except Exception as e:
+        logger.error(f"❌ Ошибка отправки игроку {chat_id}: {e}")
 
-            # Также отправляем уведомление следующему игроку
-            try:
-                await bot.application.bot.send_message(
-                    chat_id=next_player.id,
-                    text=f"🎮 **Ваш ход в лобби #{lobby.id}!**\n\n"
-                         f"💰 Ставка: ${lobby.bet_amount:.0f}\n"
-                         f"👥 Игроков: {len(lobby.players)}\n\n"
-                         f"🎲 Нажмите кнопку ниже, чтобы бросить кости:",
-                    reply_markup=keyboard,
-                    parse_mode='Markdown'
-                )
-            except Exception as e:
-                logger.error(f"❌ Ошибка уведомления следующего игрока: {e}")
 
-        else:
-            # Все игроки завершили броски
-            roll_message += "\n\n🏁 **Все игроки завершили броски!**\nПодсчитываем результаты..."
-            await query.message.reply_text(roll_message, parse_mode='Markdown')
+def _settle_lobby_game(bot, game_id, stakes, winners=(), cancelled=False):
+    """Проводит расчет игры лобби; None - расчет не удался, его можно повторить"""
+    try:
+        settlement = bot.settlement.plan("lobby", game_id, stakes, winners, cancelled)
+        if bot.settlement.settle_many([settlement]):
+            return settlement
+        return bot.settlement.get("lobby", game_id)  # Проведен прошлой попыткой
+    except Exception as e:
+        logger.error(f"❌ Расчет по игре лобби {game_id} не проведен: {e}")
+        return None
 
-            # Завершаем игру
-            await finish_lobby_game(game_id, lobby, bot)
-    else:
-        # У игрока еще есть броски
-        keyboard = InlineKeyboardMarkup([[
-            InlineKeyboardButton("🎲 Бросить снова",
-                                 callback_data=f"lobby_roll:{game_id}:{player_id}")
-        ]])
 
-        await query.message.reply_text(roll_message, reply_markup=keyboard, parse_mode='Markdown')
+async def _retry_finish_lobby_game(game_id, lobby, bot, attempt):
+    await asyncio.sleep(SETTLE_RETRY_SECONDS)
+    await finish_lobby_game(game_id, lobby, bot, attempt)
 
 
-async def finish_lobby_game(game_id, lobby, bot):
-    """Завершает игру в лобби и определяет победителя"""
+async def finish_lobby_game(game_id, lobby, bot, attempt: int = 1):
+    """
+    Завершает игру в лобби и определяет победителя
+
+    Пока расчет не проведен, выигрыш не объявляется и лобби с игрой не
+    удаляются: расчет повторяется, после SETTLE_ATTEMPTS неудач ставки
+    возвращаются. Не удался и возврат - игра остается для ручного разбора.
+    """
     # Используем active_lobby_games вместо games
     game = bot.active_lobby_games.get(game_id) if hasattr(bot, 'active_lobby_games') else None
     if not game:
@@ -936,34 +1002,49 @@ async def finish_lobby_game(game_id, lobby, bot):
 
     # Вычисляем результаты
     results = []
-    for player in lobby.players:
-        player_rolls = game["rolls"].get(player.id, [])
-        total = sum(player_rolls)
+    for player, total, player_rolls in game.totals():
         results.append({
             "player": player,
             "total": total,
             "rolls": player_rolls
         })
 
-    # Сортируем по убыванию суммы
-    results.sort(key=lambda x: x["total"], reverse=True)
+    # Ничья (делят первое место) - ставки возвращаются, иначе банк победителю за вычетом комиссии.
+    # Ставки - по игрокам игры: тот же состав, по которому считались итоги
+    draw = len(results) > 1 and results[0]["total"] == results[1]["total"]
+    players = list(game.players.values())
+    stakes = {player.id: lobby.bet_amount for player in players}
+    settlement = _settle_lobby_game(bot, game_id, stakes, winners=[] if draw else [results[0]["player"].id])
+
+    if settlement is None and attempt < SETTLE_ATTEMPTS:
+        if attempt == 1:
+            await asyncio.gather(*(
+                _send_safe(bot, player.id, f"⏳ Лобби #{lobby.id}: подводим итоги, расчет задерживается. "
+                                           f"Ставки сохранены, результат придет отдельным сообщением")
+                for player in players
+            ))
+        task = asyncio.create_task(_retry_finish_lobby_game(game_id, lobby, bot, attempt + 1))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        return
 
-    # Проверяем на ничью
-    if len(results) > 1 and results[0]["total"] == results[1]["total"]:
-        # Ничья - возвращаем деньги
-        for player in lobby.players:
-            bot.db.update_balance(player.id, lobby.bet_amount)
-            logger.info(f"💰 Возвращена ставка ${lobby.bet_amount:.0f} игроку {player.id} (ничья)")
+    if settlement is None:
+        settlement = _settle_lobby_game(bot, game_id, stakes, cancelled=True)
+        if settlement is None:
+            logger.error(f"❌ Игра лобби {game_id}: ни расчет, ни возврат не проведены, нужен ручной разбор")
+            return
 
-        # Сообщение о ничье
+    if settlement.outcome != "win":
+        # Сообщение о ничье или отмене (ставки возвращены)
         results_text = "\n".join([f"👤 {r['player'].username}: Сумма {r['total']} ({', '.join(map(str, r['rolls']))})"
                                   for r in results])
+        title = "🤝 **НИЧЬЯ!**" if settlement.outcome == "draw" else "⚠️ **Расчет не удался, игра отменена**"
 
         winner_message = (
-            f"🤝 **НИЧЬЯ!**\n\n"
+            f"{title}\n\n"
             f"🎲 Лобби #{lobby.id}\n"
             f"💰 Ставка: ${lobby.bet_amount:.0f} с игрока\n"
-            f"👥 Игроков: {len(lobby.players)}\n\n"
+            f"👥 Игроков: {len(players)}\n\n"
             f"📊 Результаты:\n{results_text}\n\n"
             f"💰 Ставки возвращены всем игрокам"
         )
@@ -971,13 +1052,10 @@ async def finish_lobby_game(game_id, lobby, bot):
     else:
         # Есть победитель
         winner = results[0]["player"]
-        total_bank = lobby.bet_amount * len(lobby.players)
-        winner_prize = total_bank * 0.92  # 8% комиссия
-        commission = total_bank * 0.08
-
-        # Начисляем выигрыш
-        bot.db.update_balance(winner.id, winner_prize)
-        logger.info(f"🏆 Победитель {winner.id} получает ${winner_prize:.0f} (комиссия: ${commission:.0f})")
+        total_bank = settlement.pot
+        winner_prize = settlement.payout(winner.id)
+        commission = settlement.commission
+        logger.info("🏆 Победитель %s получает $%.2f (комиссия: $%.2f)", winner.id, winner_prize, commission)
 
         # Формируем сообщение
         results_text = "\n".join(
@@ -988,7 +1066,7 @@ async def finish_lobby_game(game_id, lobby, bot):
             f"🏆 **ПОБЕДИТЕЛЬ: {winner.username}!**\n\n"
             f"🎲 Лобби #{lobby.id}\n"
             f"💰 Ставка: ${lobby.bet_amount:.0f} с игрока\n"
-            f"👥 Игроков: {len(lobby.players)}\n"
+            f"👥 Игроков: {len(players)}\n"
             f"🏦 Общий банк: ${total_bank:.0f}\n"
             f"💸 Выигрыш: ${winner_prize:.0f} (комиссия 8%: ${commission:.0f})\n\n"
             f"📊 Результаты:\n{results_text}"
@@ -1007,8 +1085,8 @@ async def finish_lobby_game(game_id, lobby, bot):
         except Exception as e:
             logger.error(f"❌ Ошибка отправки сообщения победителю {winner.id}: {e}")
 
-    # Отправляем результат всем игрокам в лобби
-    for player in lobby.players:
+    # Отправляем результат всем игрокам игры
+    for player in players:
         try:
             # Не отправляем победителю повторно (ему уже отправили)
             if 'winner' in locals() and player.id == winner.id:
@@ -1019,7 +1097,7 @@ async def finish_lobby_game(game_id, lobby, bot):
                 text=winner_message,
                 parse_mode='Markdown'
             )
-            logger.info(f"📨 Результат отправлен игроку {player.id}")
+            logger.debug("📨 Результат отправлен игроку %s", player.id)
         except Exception as e:
             logger.error(f"❌ Ошибка отправки результата игроку {player.id}: {e}")
 
@@ -1037,13 +1115,178 @@ async def finish_lobby_game(game_id, lobby, bot):
     # Удаляем лобби из менеджера
     try:
         bot.lobby_manager.delete_lobby(lobby.id)
-        logger.info(f"🗑️ Лобби {lobby.id} удалено")
+        logger.info("🗑️ Лобби %s удалено", lobby.id)
     except Exception as e:
         logger.error(f"❌ Ошибка удаления лобби: {e}")
 
     # Удаляем игру из active_lobby_games
     if hasattr(bot, 'active_lobby_games') and game_id in bot.active_lobby_games:
         del bot.active_lobby_games[game_id]
-        logger.info(f"🗑️ Лобби-игра {game_id} удалена из активных игр")
+        logger.info("🗑️ Лобби-игра %s удалена из активных игр", game_id)
     else:
-        logger.warning(f"⚠️ Игра {game_id} не найдена в active_lobby_games для удаления")
\ No newline at end of file
+        logger.warning(f"⚠️ Игра {game_id} не найдена в active_lobby_games для удаления")
+
+# ==================== ТУРНИРЫ ====================
+
+async def tournament_command(update: Update, context: ContextTypes.DEFAULT_TYPE, bot):
+    """/tournament <ставка> <участников> [swiss] - турнир на выбывание или по швейцарской системе"""
+    user = update.effective_user
+    username = user.username or user.first_name
+    args = context.args or []
+
+    try:
+        bet_amount = float(args[0])
+        max_players = int(args[1])
+    except (IndexError, ValueError):
+        await update.message.reply_text(
+            "Использование:\n"
+            "`/tournament 10 64` - турнир на выбывание: взнос $10, до 64 участников\n"
+            "`/tournament 10 64 swiss` - швейцарская система\n\n"
+            "Банк взносов за вычетом комиссии получает чемпион.",
+            parse_mode='Markdown'
+        )
+        return
+
+    tournament_format = args[2].lower() if len(args) > 2 else "single"
+    if tournament_format not in TOURNAMENT_FORMATS:
+        await update.message.reply_text("❌ Формат турнира: single или swiss")
+        return
+    if bet_amount < 1:
+        await update.message.reply_text("❌ Минимальный взнос: $1")
+        return
+    if not 2 <= max_players <= bot.config.TOURNAMENT_MAX_PLAYERS:
+        await update.message.reply_text(f"❌ Участников: от 2 до {bot.config.TOURNAMENT_MAX_PLAYERS}")
+        return
+
+    user_data = bot.db.get_user(user.id)
+    if not user_data or user_data[4] < bet_amount:
+        await update.message.reply_text(f"❌ Недостаточно средств! Нужно: ${bet_amount:.0f}")
+        return
+
+    # Списываем взнос создателя
+    bot.db.update_balance(user.id, -bet_amount)
+
+    lobby = bot.lobby_manager.create_lobby(
+        creator_id=user.id,
+        creator_name=username,
+        bet_amount=bet_amount,
+        max_players=max_players,
+        tournament=tournament_format
+    )
+
+    bot_info = await bot.application.bot.get_me()
+    deep_link_url = f"https://t.me/{bot_info.username}?start=joinlobby_{lobby.id}"
+
+    message = await update.message.reply_text(
+        f"{lobby.get_lobby_text()}\n\n🎯 Регистрация: {deep_link_url}",
+        reply_markup=get_lobby_keyboard(lobby),
+        disable_web_page_preview=True
+    )
+    lobby.message_chat_id = message.chat_id
+    lobby.message_id = message.message_id
+    logger.info("🏆 %s открыл регистрацию на турнир %s (%s, $%.0f, до %s участников)",
+                username, lobby.id, tournament_format, bet_amount, max_players)
+
+
+async def start_tournament(query, lobby, bot):
+    """Старт турнира: жеребьевка и первый раунд матчей"""
+    if not _can_start(lobby):
+        await query.answer("❌ Нужно минимум 2 участника", show_alert=True)
+        return
+
+    # Лобби закрывается для входа до жеребьевки; не запустился - открывается снова,
+    # иначе взносы зависнут в лобби, которое нельзя ни начать, ни покинуть
+    bot.lobby_manager.start_lobby(lobby)
+    tournament, error = await bot.tournaments.start(lobby)
+    if error:
+        bot.lobby_manager.reopen_lobby(lobby)
+        logger.error(f"❌ Турнир {lobby.id} не запущен: {error}")
+        await query.answer(f"❌ {error}", show_alert=True)
+        return
+
+    bracket = tournament.bracket
+    try:
+        await query.edit_message_text(
+            f"🏆 Турнир #{tournament.id} начался!\n\n"
+            f"📋 {TOURNAMENT_FORMATS[bracket.format].capitalize()}\n"
+            f"👥 Участников: {len(bracket.players)}\n"
+            f"🔄 Раундов: {bracket.total_rounds}\n"
+            f"🏦 Банк: ${tournament.bet_amount * len(bracket.players):.0f}\n\n"
+            f"📨 Соперника и кнопку броска каждый получит в личные сообщения"
+        )
+    except Exception as e:
+        logger.error(f"❌ Ошибка редактирования сообщения турнира: {e}")
+
+
+async def notify_tournament_round(tournament, match, game, bot):
+    """Кнопка броска обоим игрокам матча (очередной раунд или переигровка ничьей)"""
+    bracket = tournament.bracket
+    extra = game.round_number > bot.tournaments.match_rounds
+
+    async def send(player_id, opponent_id):
+        keyboard = InlineKeyboardMarkup([[
+            InlineKeyboardButton(
+                f"🎲 Бросить ({game.round_number}/{game.rounds})",
+                callback_data=f"lobby_roll:{game.game_id}:{player_id}:{game.round_number}"
+            )
+        ]])
+        text = (
+            f"🏆 Турнир #{tournament.id}: раунд {match.round_number}/{bracket.total_rounds}\n"
+            f"⚔ Соперник: {tournament.name(opponent_id)}\n"
+            f"📊 Счет: {sum(game.rolls[player_id])}:{sum(game.rolls[opponent_id])}\n"
+        )
+        if extra:
+            text += "🤝 Ничья - дополнительный бросок!\n"
+        text += f"⏳ Бросьте кости в течение {game.round_timeout:.0f} сек, иначе за вас бросит бот"
+        try:
+            await bot.application.bot.send_message(chat_id=player_id, text=text, reply_markup=keyboard)
+        except Exception as e:
+            logger.error(f"❌ Ошибка уведомления игрока {player_id}: {e}")
+
+    await asyncio.gather(send(match.player_a, match.player_b), send(match.player_b, match.player_a))
+
+
+async def notify_tournament_match(tournament, match, bot):
+    """Итог матча обоим игрокам"""
+    bracket = tournament.bracket
+    loser_id = match.player_b if match.winner_id == match.player_a else match.player_a
+    header = f"🏆 Турнир #{tournament.id}: раунд {match.round_number}/{bracket.total_rounds}\n"
+
+    if bracket.format == "single":
+        winner_text = f"{header}✅ Победа над {tournament.name(loser_id)}! Вы проходите дальше"
+        loser_text = f"{header}❌ Поражение от {tournament.name(match.winner_id)}. Вы выбыли из турнира"
+    else:
+        next_round = "Следующий раунд - когда закончатся все матчи" \
+            if match.round_number < bracket.total_rounds else "Итоги - когда закончатся все матчи"
+        winner_text = f"{header}✅ Победа над {tournament.name(loser_id)}!\n{next_round}"
+        loser_text = f"{header}❌ Поражение от {tournament.name(match.winner_id)}\n{next_round}"
+
+    await asyncio.gather(_send_safe(bot, match.winner_id, winner_text), _send_safe(bot, loser_id, loser_text))
+
+
+async def notify_tournament_finished(tournament, settlement, bot):
+    """Итоги турнира всем участникам и в чат регистрации; лобби турнира удаляется"""
+    bracket = tournament.bracket
+    champion = bracket.champion
+    prize = settlement.payout(champion) if settlement else 0.0
+
+    places = "\n".join(
+        f"{place}. {tournament.name(player_id)} - побед: {wins}"
+        for place, (player_id, wins) in enumerate(bracket.standings()[:3], start=1)
+    )
+    text = (
+        f"🏆 Турнир #{tournament.id} завершен!\n\n"
+        f"👑 Чемпион: {tournament.name(champion)}\n"
+        f"💰 Приз: ${prize:.2f} (зачислен на баланс)\n"
+        f"👥 Участников: {len(bracket.players)}\n\n"
+        f"📊 Лучшие:\n{places}"
+    )
+
+    lobby = bot.lobby_manager.get_lobby(tournament.lobby_id)
+    chats = list(bracket.players)
+    if lobby and lobby.message_chat_id and lobby.message_chat_id not in chats:
+        chats.append(lobby.message_chat_id)
+    await asyncio.gather(*(_send_safe(bot, chat_id, text) for chat_id in chats))
+
+    if lobby:
+        bot.lobby_manager.delete_lobby(lobby.id)
@@ -10,12 +10,6 @@ def register_message_handlers(application, bot):
     """Регистрируем обработчики текстовых сообщений"""
     logger.info("💬 Регистрируем обработчики сообщений")
 
-    # Обработчик произвольных ставок
-    application.add_handler(MessageHandler(
-        filters.TEXT & ~filters.COMMAND,
-        lambda update, context: handle_bet_message(update, context)
-    ))
-
     # Обработчик текстовых сообщений (не команд)
     application.add_handler(MessageHandler(
         filters.TEXT & ~filters.COMMAND,
@@ -25,44 +19,25 @@ def register_message_handlers(application, bot):
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE, bot):
     """Обработчик текстовых сообщений"""
+    if not update.message or not update.message.text or not update.effective_user:
+        return
+
     chat = update.effective_chat
     user_id = update.effective_user.id
-    message_text = update.message.text.strip()
-
-    logger.info(f"💬 Сообщение от {user_id}: '{message_text[:50]}...' в чате {chat.type}")
+    has_pending = bot.conversation_state.has_pending(user_id)
 
     # ────────── ГРУППЫ ──────────
-    if chat.type in ["group", "supergroup"]:
-        # В группах обрабатываем только числовые вводы для ожидаемых действий
-        if not (context.user_data.get('waiting_for_bet') or
-                context.user_data.get('waiting_for_deposit') or
-                context.user_data.get('waiting_for_withdraw')):
-            return  # Игнорируем все сообщения в группах
+    # В группах обрабатываем только ввод для ожидаемых действий
+    if chat.type in ["group", "supergroup"] and not has_pending:
+        return  # Игнорируем все сообщения в группах
 
-    # ────────── ПРИВАТНЫЙ ЧАТ ──────────
-
-    # 1. Ожидаем ввод ставки для ОБЫЧНОЙ игры
-    if context.user_data.get('waiting_for_bet'):
-        context.user_data['waiting_for_bet'] = False
-        await handle_bet_input(update, message_text, bot)
-        return
-
-    # 2. Ожидаем ввод ставки для ЛОББИ
-    elif context.user_data.get('waiting_for_lobby_bet'):
-        context.user_data['waiting_for_lobby_bet'] = False
-        await handle_lobby_bet_input(update, message_text, bot)
-        return
-
-    # 3. Ожидаем ввод депозита
-    elif context.user_data.get('waiting_for_deposit'):
-        context.user_data['waiting_for_deposit'] = False
-        await handle_deposit_input(update, message_text, bot)
-        return
+    message_text = update.message.text.strip()
+    logger.debug("💬 Сообщение от %s: '%s...' в чате %s", user_id, message_text[:50], chat.type)
 
-    # 4. Ожидаем ввод вывода
-    elif context.user_data.get('waiting_for_withdraw'):
-        context.user_data['waiting_for_withdraw'] = False
-        await handle_withdraw_input(update, message_text, bot)
+    # Ожидаем ввод (ставка, лобби, депозит, вывод) - диспетчер по состоянию
+    if has_pending:
+        from app.handlers.game_handlers import handle_bet_and_payment_input
+        await handle_bet_and_payment_input(update, context)
         return
 
     # Если сообщение не число - показываем меню (только в приватном чате)
@@ -79,98 +54,6 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE, bot
                 await show_menu_from_message(update, bot)
 
 
-async def handle_bet_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка произвольной суммы ставки"""
-    if not update.message or not update.message.text:
-        return
-
-    user = update.effective_user
-    text = update.message.text.strip()
-
-    try:
-        bot = context.application.bot_data.get('bot_instance')
-        if not bot:
-            return
-
-        # Проверяем, ожидаем ли мы ставку
-        if context.user_data.get('waiting_for_bet'):
-            del context.user_data['waiting_for_bet']
-
-            try:
-                amount = float(text)
-
-                # Проверки суммы
-                if amount < 1.0:
-                    await update.message.reply_text("❌ Минимальная ставка: $1")
-                    return
-
-                if amount > 1000.0:
-                    await update.message.reply_text("❌ Максимальная ставка: $1000")
-                    return
-
-                # Проверяем баланс
-                user_data = bot.db.get_user(user.id)
-                if not user_data:
-                    await update.message.reply_text("❌ Пользователь не найден")
-                    return
-
-                balance = user_data[4]
-                if balance < amount:
-                    await update.message.reply_text(
-                        f"❌ Недостаточно средств!\n"
-                        f"Ваш баланс: ${balance:.0f}\n"
-                        f"Требуется: ${amount:.0f}",
-                        reply_markup=InlineKeyboardMarkup([
-                            [InlineKeyboardButton("💳 Пополнить", callback_data="deposit")],
-                            [InlineKeyboardButton("🔙 Назад", callback_data="find_game")]
-                        ])
-                    )
-                    return
-
-                # Создаем игру (заглушка)
-                await update.message.reply_text(
-                    f"🎲 Создание игры на ${amount:.0f}\n\n"
-                    "⚠️ Функция в разработке...\n"
-                    "Скоро будет доступно!",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("📋 Главное меню", callback_data="main_menu")]
-                    ])
-                )
-
-            except ValueError:
-                await update.message.reply_text(
-                    "❌ Пожалуйста, введите корректную сумму (например: 15 или 75.5)",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("🔙 Назад", callback_data="find_game")]
-                    ])
-                )
-
-    except Exception as e:
-        logger.error(f"Ошибка обработки ставки: {e}")
-        await update.message.reply_text("❌ Произошла ошибка при создании игры")
-
-
-async def handle_bet_input(update, message_text, bot):
-    """Обрабатывает ввод ставки для обычной игры"""
-    try:
-        bet_amount = float(message_text)
-        if bet_amount < 1:
-            await update.message.reply_text("❌ Минимальная ставка $1")
-            return
-
-        # TODO: Реализовать создание игры
-        await update.message.reply_text(
-            f"🎲 Ставка: ${bet_amount:.0f}\n\n"
-            "⚠️ Создание игры в разработке...",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("📋 Меню", callback_data="main_menu")]
-            ])
-        )
-
-    except ValueError:
-        await update.message.reply_text("❌ Введите корректную сумму (например: 25 или 50.5)")
-
-
 async def handle_lobby_bet_input(update, message_text, bot):
     """Обрабатывает ввод ставки для лобби"""
     try:
@@ -200,45 +83,6 @@ async def handle_lobby_bet_input(update, message_text, bot):
         await update.message.reply_text("❌ Введите корректную сумму (например: 25 или 50.5)")
 
 
-async def handle_deposit_input(update, message_text, bot):
-    """Обрабатывает ввод суммы депозита"""
-    try:
-        amount = float(message_text)
-        if amount < 1:
-            await update.message.reply_text("❌ Минимальная сумма $1")
-            return
-
-        # TODO: Реализовать депозит
-        await update.message.reply_text(
-            f"💳 Депозит на ${amount:.0f}\n\n"
-            "⚠️ Функция в разработке...",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("📋 Меню", callback_data="main_menu")]
-            ])
-        )
-
-    except ValueError:
-        await update.message.reply_text("❌ Введите корректную сумму")
-
-
-async def handle_withdraw_input(update, message_text, bot):
-    """Обрабатывает ввод суммы вывода"""
-    try:
-        amount = float(message_text)
-
-        # TODO: Реализовать вывод
-        await update.message.reply_text(
-            f"💸 Вывод ${amount:.0f}\n\n"
-            "⚠️ Функция в разработке...",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("📋 Меню", callback_data="main_menu")]
-            ])
-        )
-
-    except ValueError:
-        await update.message.reply_text("❌ Введите корректную сумму")
-
-
 async def show_menu_from_message(update, bot):
     """Показывает меню из текстового сообщения"""
     user_id = update.effective_user.id
@@ -3,6 +3,9 @@ from telegram.ext import ContextTypes, CallbackQueryHandler, MessageHandler, fil
 import logging
 import re
 
+from app.utils.logging_setup import SAMPLED
+from app.utils.pagination import page_buttons
+
 logger = logging.getLogger(__name__)
 
 
@@ -65,7 +68,7 @@ async def deposit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 pass  # Не число, показываем запрос суммы
 
         # Запрашиваем сумму
-        context.user_data['waiting_for_deposit'] = True
+        bot.conversation_state.set_state(user.id, bot.conversation_state.DEPOSIT)
 
         await update.message.reply_text(
             f"💳 Пополнение баланса\n\n"
@@ -158,7 +161,7 @@ async def withdraw_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 pass  # Не число, показываем запрос суммы
 
         # Запрашиваем сумму
-        context.user_data['waiting_for_withdraw'] = True
+        bot.conversation_state.set_state(user.id, bot.conversation_state.WITHDRAW)
 
         await update.message.reply_text(
             f"💸 Вывод средств\n\n"
@@ -241,7 +244,7 @@ async def payment_callback_handler(update: Update, context: ContextTypes.DEFAULT
     data = query.data
     user_id = query.from_user.id
 
-    logger.info(f"💰 Payment callback: '{data}' от пользователя {user_id}")
+    logger.info("💰 Payment callback: '%s' от пользователя %s", data, user_id, extra=SAMPLED)
 
     try:
         bot = context.application.bot_data.get('bot_instance')
@@ -253,9 +256,9 @@ async def payment_callback_handler(update: Update, context: ContextTypes.DEFAULT
 
         # КНОПКА "ПОПОЛНИТЬ БАЛАНС"
         if data == "deposit":
-            print(f"🔍 DEBUG: Обработка deposit")
+            logger.debug("Обработка deposit")
             # Запрашиваем сумму депозита
-            context.user_data['waiting_for_deposit'] = True
+            bot.conversation_state.set_state(user_id, bot.conversation_state.DEPOSIT)
 
             balance = bot.payment_manager.get_user_balance(user_id)
 
@@ -274,7 +277,7 @@ async def payment_callback_handler(update: Update, context: ContextTypes.DEFAULT
 
         # КНОПКА "ВЫВЕСТИ СРЕДСТВА"
         elif data == "withdraw":
-            print(f"🔍 DEBUG: Обработка withdraw")
+            logger.debug("Обработка withdraw")
             balance = bot.payment_manager.get_user_balance(user_id)
 
             if balance < 5.0:
@@ -287,7 +290,7 @@ async def payment_callback_handler(update: Update, context: ContextTypes.DEFAULT
                 return
 
             # Запрашиваем сумму вывода
-            context.user_data['waiting_for_withdraw'] = True
+            bot.conversation_state.set_state(user_id, bot.conversation_state.WITHDRAW)
 
             await query.edit_message_text(
                 f"💸 Вывод средств\n\n"
@@ -389,19 +392,20 @@ async def payment_callback_handler(update: Update, context: ContextTypes.DEFAULT
 
         # ПРОВЕРКА СТАТУСА ДЕПОЗИТА
         elif data.startswith("check_deposit_"):
-            payment_id = data.split("_")[2]
+            payment_id = data[len("check_deposit_"):]
             await check_deposit_status(query, payment_id, bot)
             return
 
         # ОТМЕНА ВЫВОДА
         elif data.startswith("cancel_withdraw_"):
-            payment_id = data.split("_")[2]
+            payment_id = data[len("cancel_withdraw_"):]
             await cancel_withdrawal(query, payment_id, bot, user_id)
             return
 
         # ИСТОРИЯ ПЛАТЕЖЕЙ
-        elif data == "payment_history":
-            await show_payment_history(query, bot, user_id)
+        elif data == "payment_history" or data.startswith("payment_history:"):
+            page_cursor = data.split(":", 1)[1] if ":" in data else None
+            await show_payment_history(query, bot, user_id, page_cursor)
             return
 
 
@@ -409,13 +413,13 @@ async def payment_callback_handler(update: Update, context: ContextTypes.DEFAULT
 
         # КНОПКА "ПРОИЗВОЛЬНАЯ СТАВКА" - должна быть в buttons.py
         elif data == "custom_bet":
-            print(f"🔍 DEBUG: custom_bet попала в payment_handlers, перенаправляем...")
+            logger.debug("custom_bet попала в payment_handlers, перенаправляем")
             try:
                 # Импортируем функцию из buttons.py
                 from app.handlers.buttons import ask_custom_bet
                 await ask_custom_bet(query, bot)
             except ImportError as e:
-                print(f"🔍 DEBUG: Ошибка импорта ask_custom_bet: {e}")
+                logger.error("Ошибка импорта ask_custom_bet: %s", e)
                 # Показываем простой запрос
                 await query.edit_message_text(
                     "💵 Введите сумму ставки (минимум $1):\n\n"
@@ -428,8 +432,8 @@ async def payment_callback_handler(update: Update, context: ContextTypes.DEFAULT
 
         # КНОПКА "custom_deposit"
         elif data == "custom_deposit":
-            print(f"🔍 DEBUG: Обработка custom_deposit")
-            context.user_data['waiting_for_deposit'] = True
+            logger.debug("Обработка custom_deposit")
+            bot.conversation_state.set_state(user_id, bot.conversation_state.DEPOSIT)
             await query.edit_message_text(
                 "💵 Произвольная сумма депозита\n\n"
                 "Введите сумму в USD (например: 15.5 или 75):\n\n"
@@ -444,8 +448,8 @@ async def payment_callback_handler(update: Update, context: ContextTypes.DEFAULT
 
         # КНОПКА "custom_withdraw"
         elif data == "custom_withdraw":
-            print(f"🔍 DEBUG: Обработка custom_withdraw")
-            context.user_data['waiting_for_withdraw'] = True
+            logger.debug("Обработка custom_withdraw")
+            bot.conversation_state.set_state(user_id, bot.conversation_state.WITHDRAW)
             balance = bot.payment_manager.get_user_balance(user_id)
 
             await query.edit_message_text(
@@ -464,7 +468,7 @@ async def payment_callback_handler(update: Update, context: ContextTypes.DEFAULT
 
         # ОТМЕНА ПЛАТЕЖНОЙ ОПЕРАЦИИ
         elif data == "payment_cancel":
-            logger.info(f"💰 Отмена платежной операции пользователем {user_id}")
+            logger.info("💰 Отмена платежной операции пользователем %s", user_id, extra=SAMPLED)
 
             # Просто показываем главное меню
             user_data = bot.db.get_user(user_id)
@@ -715,9 +719,10 @@ async def cancel_withdrawal(query, payment_id: str, bot, user_id: int):
     )
 
 
-async def show_payment_history(query, bot, user_id: int):
-    """Показать историю платежей"""
-    payments = bot.payment_manager.get_user_payments(user_id, limit=15)
+async def show_payment_history(query, bot, user_id: int, page_cursor: str = None):
+    """Показать страницу истории платежей"""
+    page = bot.payment_manager.get_user_payments_page(user_id, page_cursor, page_size=15)
+    payments = page.rows
 
     if not payments:
         await query.edit_message_text(
@@ -748,6 +753,9 @@ async def show_payment_history(query, bot, user_id: int):
         [InlineKeyboardButton("💸 Вывести", callback_data="withdraw")],
         [InlineKeyboardButton("📋 Главное меню", callback_data="main_menu")]
     ]
+    navigation = page_buttons(page, "payment_history")
+    if navigation:
+        keyboard.insert(0, navigation)
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     await query.edit_message_text(
@@ -759,120 +767,105 @@ async def show_payment_history(query, bot, user_id: int):
 
 # ==================== ОБРАБОТЧИКИ СООБЩЕНИЙ ====================
 
-async def handle_payment_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка текстовых сообщений для платежей"""
-    # Проверяем, что есть сообщение
-    if not update.message or not update.message.text:
-        return
-
+async def handle_deposit_amount_input(update: Update, context: ContextTypes.DEFAULT_TYPE, bot, text: str):
+    """Обработка произвольной суммы депозита (состояние DEPOSIT)"""
     user = update.effective_user
-    text = update.message.text.strip()
+    bot.conversation_state.clear_state(user.id)
 
     try:
-        bot = context.application.bot_data.get('bot_instance')
-        if not bot:
+        amount = float(text)
+        if amount < 1.0:
+            await update.message.reply_text("❌ Минимальная сумма депозита: $1")
+            return
+        if amount > 10000.0:
+            await update.message.reply_text("❌ Максимальная сумма депозита: $10,000")
             return
 
-        # Обработка произвольной суммы депозита
-        if context.user_data.get('waiting_for_deposit'):
-            del context.user_data['waiting_for_deposit']
-
-            try:
-                amount = float(text)
-                if amount < 1.0:
-                    await update.message.reply_text("❌ Минимальная сумма депозита: $1")
-                    return
-                if amount > 10000.0:
-                    await update.message.reply_text("❌ Максимальная сумма депозита: $10,000")
-                    return
-
-                # Создаем депозит
-                payment, pay_url, error = await bot.payment_manager.create_deposit(
-                    user_id=user.id,
-                    amount_usd=amount,
-                    description=f"Депозит от {user.first_name}"
-                )
+        # Создаем депозит
+        payment, pay_url, error = await bot.payment_manager.create_deposit(
+            user_id=user.id,
+            amount_usd=amount,
+            description=f"Депозит от {user.first_name}"
+        )
 
-                if error:
-                    await update.message.reply_text(f"❌ {error}")
-                    return
+        if error:
+            await update.message.reply_text(f"❌ {error}")
+            return
 
-                keyboard = [
-                    [InlineKeyboardButton("💳 Оплатить", url=pay_url)],
-                    [InlineKeyboardButton("🔄 Проверить статус", callback_data=f"check_deposit_{payment.payment_id}")],
-                    [InlineKeyboardButton("📋 Главное меню", callback_data="main_menu")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+        keyboard = [
+            [InlineKeyboardButton("💳 Оплатить", url=pay_url)],
+            [InlineKeyboardButton("🔄 Проверить статус", callback_data=f"check_deposit_{payment.payment_id}")],
+            [InlineKeyboardButton("📋 Главное меню", callback_data="main_menu")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
 
-                await update.message.reply_text(
-                    f"💰 **Счет на оплату создан!**\n\n"
-                    f"📝 ID платежа: `{payment.payment_id}`\n"
-                    f"💵 Сумма: ${amount:.2f}\n"
-                    f"⏳ Срок действия: 1 час\n\n"
-                    f"Нажмите кнопку ниже для оплаты:",
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
+        await update.message.reply_text(
+            f"💰 **Счет на оплату создан!**\n\n"
+            f"📝 ID платежа: `{payment.payment_id}`\n"
+            f"💵 Сумма: ${amount:.2f}\n"
+            f"⏳ Срок действия: 1 час\n\n"
+            f"Нажмите кнопку ниже для оплаты:",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
 
-            except ValueError:
-                await update.message.reply_text("❌ Пожалуйста, введите корректную сумму (например: 15.5 или 75)")
+    except ValueError:
+        await update.message.reply_text("❌ Пожалуйста, введите корректную сумму (например: 15.5 или 75)")
 
-        # Обработка произвольной суммы вывода
-        elif context.user_data.get('waiting_for_withdraw'):
-            del context.user_data['waiting_for_withdraw']
 
-            try:
-                amount = float(text)
-                balance = bot.payment_manager.get_user_balance(user.id)
+async def handle_withdraw_amount_input(update: Update, context: ContextTypes.DEFAULT_TYPE, bot, text: str):
+    """Обработка произвольной суммы вывода (состояние WITHDRAW)"""
+    user = update.effective_user
+    bot.conversation_state.clear_state(user.id)
 
-                if amount < 5.0:
-                    await update.message.reply_text("❌ Минимальная сумма вывода: $5")
-                    return
-                if amount > 5000.0:
-                    await update.message.reply_text("❌ Максимальная сумма вывода: $5,000")
-                    return
-                if amount > balance:
-                    await update.message.reply_text(f"❌ Недостаточно средств. Доступно: ${balance:.2f}")
-                    return
+    try:
+        amount = float(text)
+        balance = bot.payment_manager.get_user_balance(user.id)
 
-                # Создаем запрос на вывод
-                payment, error = await bot.payment_manager.create_withdrawal(
-                    user_id=user.id,
-                    amount_usd=amount,
-                    description=f"Вывод средств от {user.first_name}"
-                )
+        if amount < 5.0:
+            await update.message.reply_text("❌ Минимальная сумма вывода: $5")
+            return
+        if amount > 5000.0:
+            await update.message.reply_text("❌ Максимальная сумма вывода: $5,000")
+            return
+        if amount > balance:
+            await update.message.reply_text(f"❌ Недостаточно средств. Доступно: ${balance:.2f}")
+            return
 
-                if error:
-                    await update.message.reply_text(f"❌ {error}")
-                    return
+        # Создаем запрос на вывод
+        payment, error = await bot.payment_manager.create_withdrawal(
+            user_id=user.id,
+            amount_usd=amount,
+            description=f"Вывод средств от {user.first_name}"
+        )
 
-                commission = amount * 0.08
-                receive_amount = amount - commission
+        if error:
+            await update.message.reply_text(f"❌ {error}")
+            return
 
-                keyboard = [
-                    [InlineKeyboardButton("❌ Отменить вывод", callback_data=f"cancel_withdraw_{payment.payment_id}")],
-                    [InlineKeyboardButton("📋 Главное меню", callback_data="main_menu")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+        commission = amount * 0.08
+        receive_amount = amount - commission
 
-                await update.message.reply_text(
-                    f"✅ **Запрос на вывод создан!**\n\n"
-                    f"📝 ID заявки: `{payment.payment_id}`\n"
-                    f"💵 Запрошено: ${amount:.2f}\n"
-                    f"📊 Комиссия (8%): ${commission:.2f}\n"
-                    f"💰 К получению: ${receive_amount:.2f}\n\n"
-                    f"⏳ Обычно обработка занимает 1-24 часа.\n"
-                    f"Вы можете отменить заявку в течение 10 минут.",
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
+        keyboard = [
+            [InlineKeyboardButton("❌ Отменить вывод", callback_data=f"cancel_withdraw_{payment.payment_id}")],
+            [InlineKeyboardButton("📋 Главное меню", callback_data="main_menu")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
 
-            except ValueError:
-                await update.message.reply_text("❌ Пожалуйста, введите корректную сумму (например: 25.5 или 100)")
+        await update.message.reply_text(
+            f"✅ **Запрос на вывод создан!**\n\n"
+            f"📝 ID заявки: `{payment.payment_id}`\n"
+            f"💵 Запрошено: ${amount:.2f}\n"
+            f"📊 Комиссия (8%): ${commission:.2f}\n"
+            f"💰 К получению: ${receive_amount:.2f}\n\n"
+            f"⏳ Обычно обработка занимает 1-24 часа.\n"
+            f"Вы можете отменить заявку в течение 10 минут.",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
 
-    except Exception as e:
-        logger.error(f"Ошибка в handle_payment_message: {e}")
-        await update.message.reply_text("❌ Произошла ошибка при обработке запроса")
+    except ValueError:
+        await update.message.reply_text("❌ Пожалуйста, введите корректную сумму (например: 25.5 или 100)")
 
 
 # ==================== РЕГИСТРАЦИЯ ОБРАБОТЧИКОВ ====================
@@ -893,11 +886,7 @@ def register_payment_handlers(application, bot):
         pattern=r"^(deposit|withdraw|check_deposit|cancel_withdraw|payment_history|custom_|deposit_|withdraw_)"
     ))
 
-    # Обработчики сообщений для произвольных сумм
-    application.add_handler(MessageHandler(
-        filters.TEXT & ~filters.COMMAND,
-        handle_payment_message
-    ))
+    # Ввод произвольных сумм обрабатывается диспетчером состояний в game_handlers
 
     logger.info("✅ Обработчики платежей зарегистрированы")
 
@@ -1,7 +1,6 @@
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional, List, Dict
-import random
 
 
 @dataclass
@@ -93,9 +92,3 @@ class Duel:
         elif user_id == self.opponent_id:
             return self.opponent_name
         return None
-
-    @staticmethod
-    def generate_duel_id() -> str:
-        """Генерирует ID дуэли (8 символов)"""
-        import string
-        return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
\ No newline at end of file
@@ -1,8 +1,6 @@
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional, List
-import random
-import string
 
 
 @dataclass
@@ -22,6 +20,7 @@ class PvPGame:
     player2_total: int = 0
     winner_id: Optional[int] = None
     created_at: datetime = None
+    server_seed: Optional[str] = None  # Быстрый режим: сид бросков (раскрывается в итогах)
 
     def __post_init__(self):
         if self.player1_rolls is None:
@@ -31,6 +30,21 @@ class PvPGame:
         if self.created_at is None:
             self.created_at = datetime.now()
 
+    @property
+    def fast(self) -> bool:
+        """Быстрый режим: броски генерирует бот, без анимации Telegram"""
+        return self.server_seed is not None
+
+    @property
+    def seed_hash(self) -> Optional[str]:
+        """Хеш сида, публикуемый при старте игры"""
+        from app.services.fair_dice import hash_seed  # app.services импортирует модели
+        return hash_seed(self.server_seed) if self.server_seed else None
+
+    def get_rolls(self, player_id: int) -> List[int]:
+        """Броски игрока"""
+        return self.player1_rolls if player_id == self.player1_id else self.player2_rolls
+
     def add_roll(self, player_id: int, dice_value: int) -> bool:
         """Добавляет бросок игроку"""
         if player_id == self.player1_id:
@@ -71,8 +85,3 @@ class PvPGame:
             return self.player2_id
         else:
             return None  # Ничья
-
-    @staticmethod
-    def generate_game_code() -> str:
-        """Генерирует код игры (6 символов)"""
-        return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
@@ -1,25 +1,43 @@
 # app/models/lobby.py
+import itertools
 import time
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional
+from typing import Dict, List, Optional, Set, Tuple
 import json
 
+TEXT_PLAYERS_LIMIT = 20  # игроков в тексте лобби (турнир может собрать сотни)
+TOURNAMENT_FORMATS = {"single": "олимпийская система", "swiss": "швейцарская система"}
+
 
-@dataclass
 class LobbyPlayer:
-    """Игрок в лобби"""
-    id: int
-    username: str
-    ready: bool = False
-    paid: bool = False
-    last_roll: Optional[int] = None
+    """Игрок в лобби (готовность и оплата меняются только через Lobby - так счетчики лобби не расходятся)"""
+    __slots__ = ('id', 'username', '_ready', '_paid', 'last_roll')
+
+    def __init__(self, id: int, username: str, ready: bool = False, paid: bool = False,
+                 last_roll: Optional[int] = None):
+        self.id = id
+        self.username = username
+        self._ready = ready
+        self._paid = paid
+        self.last_roll = last_roll
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    @property
+    def paid(self) -> bool:
+        return self._paid
+
+    def __repr__(self) -> str:
+        return f"LobbyPlayer(id={self.id}, username={self.username!r}, ready={self._ready}, paid={self._paid})"
 
     def to_dict(self) -> Dict:
         return {
             'id': self.id,
             'username': self.username,
-            'ready': self.ready,
-            'paid': self.paid,
+            'ready': self._ready,
+            'paid': self._paid,
             'last_roll': self.last_roll
         }
 
@@ -36,63 +54,118 @@ class LobbyPlayer:
 
 @dataclass
 class Lobby:
-    """Модель лобби"""
+    """
+    Модель лобби
+
+    Игроки хранятся в словаре по ID в порядке входа, а число готовых и
+    оплативших поддерживается при каждом изменении - поиск игрока и
+    счетчики для клавиатуры лобби стоят O(1) даже для сотен игроков.
+    """
     id: str
     creator_id: int
     creator_name: str
     max_players: int
     bet_amount: float = 0.0
-    players: List[LobbyPlayer] = field(default_factory=list)
     status: str = "waiting"  # waiting, active, finished
     timer_started: bool = False
     timer_expires_at: Optional[float] = None
     message_chat_id: Optional[int] = None
     message_id: Optional[int] = None
     created_at: float = field(default_factory=time.time)
+    tournament: Optional[str] = None  # формат турнира (single, swiss); None - обычная игра лобби
+    ready_count: int = field(default=0, init=False)
+    paid_count: int = field(default=0, init=False)
+    _players: Dict[int, LobbyPlayer] = field(default_factory=dict, init=False, repr=False)
+    # Изменения с последнего сохранения: игроки для UPSERT и вышедшие игроки
+    _changed: Set[int] = field(default_factory=set, init=False, repr=False)
+    _removed: Set[int] = field(default_factory=set, init=False, repr=False)
+
+    @property
+    def players(self):
+        """Игроки в порядке входа (представление словаря: len и итерация без копирования)"""
+        return self._players.values()
 
     def add_player(self, player: LobbyPlayer) -> bool:
         """Добавляет игрока в лобби"""
-        if len(self.players) >= self.max_players:
+        if len(self._players) >= self.max_players:
             return False
-        if any(p.id == player.id for p in self.players):
+        if player.id in self._players:
             return False
-        self.players.append(player)
+        self._players[player.id] = player
+        self._changed.add(player.id)
+        self._removed.discard(player.id)
+        self.ready_count += player.ready
+        self.paid_count += player.paid
         return True
 
     def remove_player(self, user_id: int) -> bool:
         """Удаляет игрока из лобби"""
-        initial_count = len(self.players)
-        self.players = [p for p in self.players if p.id != user_id]
-        return len(self.players) != initial_count
+        player = self._players.pop(user_id, None)
+        if not player:
+            return False
+        self._changed.discard(user_id)
+        self._removed.add(user_id)
+        self.ready_count -= player.ready
+        self.paid_count -= player.paid
+        return True
 
     def get_player(self, user_id: int) -> Optional[LobbyPlayer]:
         """Получает игрока по ID"""
-        for player in self.players:
-            if player.id == user_id:
-                return player
-        return None
+        return self._players.get(user_id)
+
+    def first_player(self) -> Optional[LobbyPlayer]:
+        """Игрок, вошедший раньше всех"""
+        return next(iter(self._players.values()), None)
+
+    def set_player_ready(self, user_id: int, ready: bool) -> bool:
+        """Устанавливает готовность игрока"""
+        player = self._players.get(user_id)
+        if not player:
+            return False
+        if player.ready != ready:
+            player._ready = ready
+            self._changed.add(user_id)
+            self.ready_count += 1 if ready else -1
+        return True
 
     def toggle_player_ready(self, user_id: int) -> bool:
         """Переключает статус готовности игрока"""
-        player = self.get_player(user_id)
-        if player:
-            player.ready = not player.ready
-            return True
-        return False
+        player = self._players.get(user_id)
+        return bool(player) and self.set_player_ready(user_id, not player.ready)
+
+    def mark_player_paid(self, user_id: int) -> bool:
+        """Отмечает, что игрок внес ставку"""
+        player = self._players.get(user_id)
+        if not player:
+            return False
+        if not player.paid:
+            player._paid = True
+            self._changed.add(user_id)
+            self.paid_count += 1
+        return True
+
+    def pending_changes(self) -> Tuple[List[LobbyPlayer], List[int]]:
+        """Измененные игроки и ID вышедших с последнего сохранения"""
+        return [self._players[user_id] for user_id in self._changed], list(self._removed)
+
+    def clear_changes(self):
+        """Изменения сохранены в БД"""
+        self._changed.clear()
+        self._removed.clear()
 
     def all_players_ready(self) -> bool:
         """Все ли игроки готовы?"""
-        if len(self.players) < self.max_players:
+        if len(self._players) < self.max_players:
             return False
-        return all(p.ready for p in self.players)
+        return self.ready_count == len(self._players)
 
     def get_player_count(self) -> int:
         """Количество игроков в лобби"""
-        return len(self.players)
+        return len(self._players)
 
     def is_full(self) -> bool:
         """Заполнено ли лобби?"""
-        return len(self.players) >= self.max_players
+        return len(self._players) >= self.max_players
 
     def to_dict(self) -> Dict:
         """Конвертирует лобби в словарь для сохранения"""
@@ -108,36 +181,39 @@ class Lobby:
             'timer_expires_at': self.timer_expires_at,
             'message_chat_id': self.message_chat_id,
             'message_id': self.message_id,
-            'created_at': self.created_at
+            'created_at': self.created_at,
+            'tournament': self.tournament
         }
 
     @classmethod
     def from_dict(cls, data: Dict) -> 'Lobby':
         """Создает лобби из словаря"""
-        players_data = data.get('players', [])
-        players = [LobbyPlayer.from_dict(p) for p in players_data]
-
-        return cls(
+        lobby = cls(
             id=data['id'],
             creator_id=data['creator_id'],
             creator_name=data['creator_name'],
             max_players=data['max_players'],
             bet_amount=data.get('bet_amount', 0.0),
-            players=players,
             status=data.get('status', 'waiting'),
             timer_started=data.get('timer_started', False),
             timer_expires_at=data.get('timer_expires_at'),
             message_chat_id=data.get('message_chat_id'),
             message_id=data.get('message_id'),
-            created_at=data.get('created_at', time.time())
+            created_at=data.get('created_at', time.time()),
+            tournament=data.get('tournament')
         )
+        for player_data in data.get('players', []):
+            lobby.add_player(LobbyPlayer.from_dict(player_data))
+        return lobby
 
     def get_lobby_text(self) -> str:
         """Формирует текст сообщения лобби"""
         players_text = "\n".join(
             f"{p.username} — {'✅' if p.ready else '❌'}"
-            for p in self.players
+            for p in itertools.islice(self.players, TEXT_PLAYERS_LIMIT)
         )
+        if len(self._players) > TEXT_PLAYERS_LIMIT:
+            players_text += f"\n... и еще {len(self._players) - TEXT_PLAYERS_LIMIT}"
 
         timer_info = ""
         if self.timer_started and self.timer_expires_at:
@@ -151,8 +227,13 @@ class Lobby:
             total_bank = self.bet_amount * self.max_players
             bet_info += f"🏦 Общий банк: ${total_bank:.0f}\n"
 
+        tournament_info = ""
+        if self.tournament:
+            tournament_info = f"🏆 Турнир: {TOURNAMENT_FORMATS.get(self.tournament, self.tournament)}\n"
+
         return (
             f"🎲 Лобби #{self.id}\n"
+            f"{tournament_info}"
             f"{bet_info}"
             f"👤 Владелец: {self.creator_name}\n"
             f"👥 Игроки ({len(self.players)}/{self.max_players}):\n{players_text}"
@@ -1,9 +1,11 @@
 import sqlite3
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
 import logging
-import uuid
+
+from app.utils.pagination import Page, fetch_page
 
 logger = logging.getLogger(__name__)
 
@@ -15,73 +17,129 @@ class Payment:
     user_id: int
     amount: float
     currency: str = "USD"
-    status: str = "pending"  # pending, completed, failed, refunded, cancelled
+    status: str = "pending"  # pending, review, approved, processing, completed, failed, refunded, cancelled
     payment_type: str = "deposit"  # deposit, withdraw
     crypto_pay_id: Optional[str] = None
     created_at: Optional[str] = None
     completed_at: Optional[str] = None
     description: Optional[str] = None
+    version: int = 0  # Растет при каждой смене статуса (compare-and-swap)
 
     def __post_init__(self):
         if self.created_at is None:
             self.created_at = datetime.now().isoformat()
 
 
+# Допустимые переходы статусов платежа
+PAYMENT_TRANSITIONS = {
+    "pending": {"pending", "completed", "expired", "failed", "cancelled", "processing"},
+    "review": {"approved", "cancelled"},
+    "approved": {"processing", "cancelled"},
+    "processing": {"completed", "approved", "failed", "review"},
+    "completed": {"refunded"},
+    "expired": set(),
+    "failed": set(),
+    "cancelled": set(),
+    "refunded": set(),
+}
+
+# Финальные статусы: проставляется completed_at
+FINAL_STATUSES = {"completed", "failed", "cancelled", "expired", "refunded"}
+
+
+class InvalidTransitionError(Exception):
+    """Недопустимая смена статуса платежа"""
+
+
 class PaymentModel:
     """Работа с платежами в базе данных"""
 
-    def __init__(self, db_connection: sqlite3.Connection):
-        self.db = db_connection
+    def __init__(self, database):
+        """
+        Args:
+            database: объект Database (свое соединение на каждую операцию)
+                      или соединение SQLite (общее, для отладочных скриптов)
+        """
+        if hasattr(database, 'get_connection'):
+            self._connect = database.get_connection
+            self.db = None
+        else:
+            self._connect = None
+            self.db = database
         self._init_table()
 
+    @contextmanager
+    def transaction(self, cursor: sqlite3.Cursor = None):
+        """Курсор транзакции вызывающего (если передан) или новой транзакции"""
+        if cursor is not None:
+            yield cursor
+            return
+
+        conn = self._connect() if self._connect else self.db
+        try:
+            with conn:
+                yield conn.cursor()
+        finally:
+            if self._connect:
+                conn.close()
+
     def _init_table(self):
         """Инициализация таблицы платежей"""
-        cursor = self.db.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS payments (
-                payment_id TEXT PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                amount REAL NOT NULL,
-                currency TEXT DEFAULT 'USD',
-                status TEXT DEFAULT 'pending',
-                payment_type TEXT NOT NULL,
-                crypto_pay_id TEXT,
-                created_at TEXT NOT NULL,
-                completed_at TEXT,
-                description TEXT,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
+        with self.transaction() as cursor:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS payments (
+                    payment_id TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    amount REAL NOT NULL,
+                    currency TEXT DEFAULT 'USD',
+                    status TEXT DEFAULT 'pending',
+                    payment_type TEXT NOT NULL,
+                    crypto_pay_id TEXT,
+                    created_at TEXT NOT NULL,
+                    completed_at TEXT,
+                    description TEXT,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id)
+                )
+            ''')
 
-        # Индексы для быстрого поиска
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_user_id ON payments(user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_status ON payments(status)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_crypto_pay_id ON payments(crypto_pay_id)')
+            # Счетчик попыток перевода (очередь выплат) и версия для compare-and-swap
+            cursor.execute("PRAGMA table_info(payments)")
+            columns = [column[1] for column in cursor.fetchall()]
+            if 'attempts' not in columns:
+                cursor.execute('ALTER TABLE payments ADD COLUMN attempts INTEGER DEFAULT 0')
+            if 'version' not in columns:
+                cursor.execute('ALTER TABLE payments ADD COLUMN version INTEGER DEFAULT 0')
+
+            # Индексы для быстрого поиска; составные (..., created_at) обслуживают keyset-страницы
+            cursor.execute('DROP INDEX IF EXISTS idx_payments_user_id')
+            cursor.execute('DROP INDEX IF EXISTS idx_payments_status')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_user_created ON payments(user_id, created_at)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_status_created ON payments(status, created_at)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_created ON payments(created_at)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_crypto_pay_id ON payments(crypto_pay_id)')
 
-        self.db.commit()
         logger.info("✅ Таблица payments создана/проверена")
 
-    def create_payment(self, payment: Payment) -> bool:
-        """Создание нового платежа"""
+    def create_payment(self, payment: Payment, cursor: sqlite3.Cursor = None) -> bool:
+        """Создание нового платежа (в транзакции вызывающего, если передан cursor)"""
         try:
-            cursor = self.db.cursor()
-            cursor.execute('''
-                INSERT INTO payments 
-                (payment_id, user_id, amount, currency, status, payment_type, 
-                 crypto_pay_id, created_at, description)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                payment.payment_id,
-                payment.user_id,
-                payment.amount,
-                payment.currency,
-                payment.status,
-                payment.payment_type,
-                payment.crypto_pay_id,
-                payment.created_at,
-                payment.description
-            ))
-            self.db.commit()
+            with self.transaction(cursor) as cursor:
+                cursor.execute('''
+                    INSERT INTO payments 
+                    (payment_id, user_id, amount, currency, status, payment_type, 
+                     crypto_pay_id, created_at, description)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    payment.payment_id,
+                    payment.user_id,
+                    payment.amount,
+                    payment.currency,
+                    payment.status,
+                    payment.payment_type,
+                    payment.crypto_pay_id,
+                    payment.created_at,
+                    payment.description
+                ))
             logger.info(f"✅ Платеж {payment.payment_id} создан для пользователя {payment.user_id}")
             return True
         except sqlite3.Error as e:
@@ -90,96 +148,134 @@ class PaymentModel:
 
     def get_payment(self, payment_id: str) -> Optional[Payment]:
         """Получение платежа по ID"""
-        cursor = self.db.cursor()
-        cursor.execute('''
-            SELECT payment_id, user_id, amount, currency, status, 
-                   payment_type, crypto_pay_id, created_at, completed_at, description
-            FROM payments WHERE payment_id = ?
-        ''', (payment_id,))
-
-        row = cursor.fetchone()
+        with self.transaction() as cursor:
+            cursor.execute('''
+                SELECT payment_id, user_id, amount, currency, status, 
+                       payment_type, crypto_pay_id, created_at, completed_at, description, version
+                FROM payments WHERE payment_id = ?
+            ''', (payment_id,))
+            row = cursor.fetchone()
+
         if row:
             return Payment(*row)
         return None
 
     def get_payment_by_crypto_id(self, crypto_pay_id: str) -> Optional[Payment]:
         """Получение платежа по crypto_pay_id"""
-        cursor = self.db.cursor()
-        cursor.execute('''
-            SELECT payment_id, user_id, amount, currency, status, 
-                   payment_type, crypto_pay_id, created_at, completed_at, description
-            FROM payments WHERE crypto_pay_id = ?
-        ''', (crypto_pay_id,))
-
-        row = cursor.fetchone()
+        with self.transaction() as cursor:
+            cursor.execute('''
+                SELECT payment_id, user_id, amount, currency, status, 
+                       payment_type, crypto_pay_id, created_at, completed_at, description, version
+                FROM payments WHERE crypto_pay_id = ?
+            ''', (crypto_pay_id,))
+            row = cursor.fetchone()
+
         if row:
             return Payment(*row)
         return None
 
-    def update_payment_status(self, payment_id: str, status: str, crypto_pay_id: str = None) -> bool:
-        """Обновление статуса платежа"""
-        try:
-            cursor = self.db.cursor()
+    def transition(self, payment_id: str, from_status: str, to_status: str,
+                   version: Optional[int] = None, crypto_pay_id: str = None,
+                   cursor: sqlite3.Cursor = None) -> bool:
+        """
+        Смена статуса по принципу compare-and-swap
 
-            if crypto_pay_id:
-                cursor.execute('''
-                    UPDATE payments 
-                    SET status = ?, crypto_pay_id = ?, completed_at = ?
-                    WHERE payment_id = ?
-                ''', (status, crypto_pay_id, datetime.now().isoformat(), payment_id))
-            elif status in ["completed", "failed", "cancelled"]:
-                cursor.execute('''
-                    UPDATE payments 
-                    SET status = ?, completed_at = ?
-                    WHERE payment_id = ?
-                ''', (status, datetime.now().isoformat(), payment_id))
-            else:
-                cursor.execute('''
-                    UPDATE payments 
-                    SET status = ?
-                    WHERE payment_id = ?
-                ''', (status, payment_id))
+        UPDATE выполняется только если платеж все еще в from_status
+        (и в версии version, если она передана). False - платеж уже
+        изменил кто-то другой, повторять действие не нужно.
+        Если передан cursor, изменение входит в транзакцию вызывающего.
 
-            self.db.commit()
-            logger.info(f"✅ Платеж {payment_id} обновлен: статус={status}")
-            return True
-        except sqlite3.Error as e:
+        Raises:
+            InvalidTransitionError: переход не разрешен PAYMENT_TRANSITIONS
+        """
+        if to_status not in PAYMENT_TRANSITIONS.get(from_status, ()):
+            raise InvalidTransitionError(f"{payment_id}: {from_status} -> {to_status}")
+
+        query = '''
+            UPDATE payments
+            SET status = ?, version = version + 1,
+                crypto_pay_id = COALESCE(?, crypto_pay_id),
+                completed_at = CASE WHEN ? THEN ? ELSE completed_at END
+            WHERE payment_id = ? AND status = ?
+        '''
+        params = [to_status, crypto_pay_id, to_status in FINAL_STATUSES,
+                  datetime.now().isoformat(), payment_id, from_status]
+        if version is not None:
+            query += ' AND version = ?'
+            params.append(version)
+
+        with self.transaction(cursor) as cursor:
+            cursor.execute(query, params)
+            changed = cursor.rowcount == 1
+
+        if changed:
+            logger.info(f"✅ Платеж {payment_id}: {from_status} -> {to_status}")
+        else:
+            logger.debug("Платеж %s уже не в статусе %s (версия %s)", payment_id, from_status, version)
+        return changed
+
+    def update_payment_status(self, payment_id: str, status: str, crypto_pay_id: str = None) -> bool:
+        """Обновление статуса платежа от текущего состояния (CAS по версии)"""
+        try:
+            payment = self.get_payment(payment_id)
+            if payment is None:
+                return False
+            return self.transition(payment_id, payment.status, status,
+                                   version=payment.version, crypto_pay_id=crypto_pay_id)
+        except (sqlite3.Error, InvalidTransitionError) as e:
             logger.error(f"❌ Ошибка обновления платежа {payment_id}: {e}")
             return False
 
     def get_user_payments(self, user_id: int, limit: int = 10, payment_type: str = None) -> list:
-        """Получение платежей пользователя"""
-        cursor = self.db.cursor()
+        """Получение последних платежей пользователя"""
+        return self.get_user_payments_page(user_id, page_size=limit, payment_type=payment_type).rows
 
+    def get_user_payments_page(self, user_id: int, page_cursor: str = None, page_size: int = 10,
+                               payment_type: str = None) -> Page:
+        """Страница истории платежей пользователя (keyset по created_at)"""
+        where, params = 'user_id = ?', (user_id,)
         if payment_type:
-            cursor.execute('''
-                SELECT payment_id, amount, currency, status, payment_type, created_at, description
-                FROM payments 
-                WHERE user_id = ? AND payment_type = ?
-                ORDER BY created_at DESC
-                LIMIT ?
-            ''', (user_id, payment_type, limit))
-        else:
-            cursor.execute('''
-                SELECT payment_id, amount, currency, status, payment_type, created_at, description
-                FROM payments 
-                WHERE user_id = ?
-                ORDER BY created_at DESC
-                LIMIT ?
-            ''', (user_id, limit))
+            where, params = where + ' AND payment_type = ?', params + (payment_type,)
+
+        with self.transaction() as cursor:
+            return fetch_page(
+                cursor, 'payments',
+                'payment_id, amount, currency, status, payment_type, created_at, description',
+                where, params, page_cursor=page_cursor, page_size=page_size
+            )
+
+    def get_payments_page(self, page_cursor: str = None, page_size: int = 15, status: str = None) -> Page:
+        """Страница всех платежей для администратора, опционально по статусу"""
+        where, params = ('status = ?', (status,)) if status else ('', ())
 
-        return cursor.fetchall()
+        with self.transaction() as cursor:
+            return fetch_page(
+                cursor, 'payments',
+                'payment_id, user_id, amount, payment_type, status, created_at',
+                where, params, page_cursor=page_cursor, page_size=page_size
+            )
 
     def get_pending_payments(self, hours: int = 24) -> list:
         """Получение pending платежей за последние N часов"""
-        cursor = self.db.cursor()
-        time_threshold = datetime.now().isoformat()
+        with self.transaction() as cursor:
+            cursor.execute('''
+                SELECT payment_id, user_id, amount, payment_type, created_at
+                FROM payments 
+                WHERE status = 'pending' 
+                AND datetime(created_at) > datetime('now', ?)
+            ''', (f'-{hours} hours',))
+
+            return cursor.fetchall()
 
-        cursor.execute('''
-            SELECT payment_id, user_id, amount, payment_type, created_at
-            FROM payments 
-            WHERE status = 'pending' 
-            AND datetime(created_at) > datetime('now', ?)
-        ''', (f'-{hours} hours',))
+    def get_pending_deposits(self, hours: int = 24) -> list:
+        """Pending депозиты с привязанным инвойсом за последние N часов"""
+        with self.transaction() as cursor:
+            cursor.execute('''
+                SELECT payment_id, user_id, amount, crypto_pay_id, created_at
+                FROM payments 
+                WHERE status = 'pending' AND payment_type = 'deposit'
+                AND crypto_pay_id IS NOT NULL
+                AND datetime(created_at) > datetime('now', ?)
+            ''', (f'-{hours} hours',))
 
-        return cursor.fetchall()
\ No newline at end of file
+            return cursor.fetchall()
@@ -2,5 +2,7 @@
 from .lobby_manager import LobbyManager
 from .game_manager import GameManager
 from .duel_manager import DuelManager
+from .conversation_state import ConversationStateManager
+from .group_filter import GroupMessageFilter
 
-__all__ = ['LobbyManager', 'GameManager', 'DuelManager']
\ No newline at end of file
+__all__ = ['LobbyManager', 'GameManager', 'DuelManager', 'ConversationStateManager', 'GroupMessageFilter']
\ No newline at end of file
@@ -0,0 +1,129 @@
+# app/services/conversation_state.py
+import json
+import time
+import logging
+from typing import Dict, Optional, Tuple, Any
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationStateManager:
+    """Менеджер состояний ввода пользователей (что бот ждет от пользователя)"""
+
+    # Состояния ожидания ввода
+    BET = 'bet'                            # Сумма ставки для игры 1 на 1
+    LOBBY_BET = 'lobby_bet'                # Сумма ставки для лобби
+    DEPOSIT = 'deposit'                    # Сумма депозита через Crypto Pay
+    WITHDRAW = 'withdraw'                  # Сумма вывода через Crypto Pay
+    QUICK_DEPOSIT = 'quick_deposit'        # Пополнение из главного меню
+    QUICK_WITHDRAW = 'quick_withdraw'      # Вывод из главного меню
+
+    STATES = (BET, LOBBY_BET, DEPOSIT, WITHDRAW, QUICK_DEPOSIT, QUICK_WITHDRAW)
+
+    def __init__(self, db, ttl_seconds: int = 600):
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        # user_id -> (state, data, expires_at)
+        self.states: Dict[int, Tuple[str, Dict[str, Any], float]] = {}
+        self.load_from_db()
+        logger.info("🔄 Менеджер состояний ввода инициализирован")
+
+    def set_state(self, user_id: int, state: str, data: Optional[Dict[str, Any]] = None):
+        """Переводит пользователя в состояние ожидания ввода"""
+        if state not in self.STATES:
+            raise ValueError(f"Неизвестное состояние: {state}")
+
+        expires_at = time.time() + self.ttl_seconds
+        data = data or {}
+        self.states[user_id] = (state, data, expires_at)
+        self._save_state(user_id, state, data, expires_at)
+
+    def get_state(self, user_id: int) -> Tuple[Optional[str], Dict[str, Any]]:
+        """Возвращает текущее состояние пользователя (устаревшие сбрасываются)"""
+        entry = self.states.get(user_id)
+        if entry is None:
+            return None, {}
+
+        state, data, expires_at = entry
+        if expires_at < time.time():
+            self.clear_state(user_id)
+            return None, {}
+
+        return state, data
+
+    def has_pending(self, user_id: int) -> bool:
+        """Быстрая проверка: ждет ли бот ввода от пользователя"""
+        entry = self.states.get(user_id)
+        return entry is not None and entry[2] >= time.time()
+
+    def clear_state(self, user_id: int) -> Optional[str]:
+        """Сбрасывает состояние пользователя, возвращает предыдущее"""
+        entry = self.states.pop(user_id, None)
+        if entry is None:
+            return None
+
+        self._delete_state(user_id)
+        return entry[0]
+
+    def cleanup_expired(self) -> int:
+        """Удаляет устаревшие состояния"""
+        now = time.time()
+        expired = [user_id for user_id, entry in self.states.items() if entry[2] < now]
+
+        for user_id in expired:
+            del self.states[user_id]
+
+        try:
+            conn = self.db.get_connection()
+            conn.execute('DELETE FROM conversation_states WHERE expires_at < ?', (now,))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки состояний в БД: {e}")
+
+        return len(expired)
+
+    def load_from_db(self):
+        """Восстанавливает незавершенные состояния после перезапуска"""
+        try:
+            conn = self.db.get_connection()
+            cursor = conn.cursor()
+            now = time.time()
+
+            cursor.execute('DELETE FROM conversation_states WHERE expires_at < ?', (now,))
+            cursor.execute('SELECT user_id, state, data, expires_at FROM conversation_states')
+
+            for user_id, state, data, expires_at in cursor.fetchall():
+                if state in self.STATES:
+                    self.states[user_id] = (state, json.loads(data or '{}'), expires_at)
+
+            conn.commit()
+            conn.close()
+
+            if self.states:
+                logger.info(f"📥 Восстановлено {len(self.states)} состояний ввода")
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки состояний из БД: {e}")
+
+    def _save_state(self, user_id: int, state: str, data: Dict[str, Any], expires_at: float):
+        """Сохраняет состояние в БД"""
+        try:
+            conn = self.db.get_connection()
+            conn.execute('''
+                INSERT OR REPLACE INTO conversation_states (user_id, state, data, expires_at)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, state, json.dumps(data), expires_at))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения состояния {user_id}: {e}")
+
+    def _delete_state(self, user_id: int):
+        """Удаляет состояние из БД"""
+        try:
+            conn = self.db.get_connection()
+            conn.execute('DELETE FROM conversation_states WHERE user_id = ?', (user_id,))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"❌ Ошибка удаления состояния {user_id}: {e}")
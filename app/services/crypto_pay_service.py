@@ -1,15 +1,47 @@
 import httpx
 import logging
 import asyncio
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Mapping
+from types import MappingProxyType
+from dataclasses import dataclass, field
 from uuid import uuid4
 import json
 import time
 
+from app.services.metrics import CRYPTO_PAY_SECONDS, CRYPTO_PAY_REQUESTS_TOTAL
+from app.services.tracing import tracer
+from app.services.http_client import ResilientHttpClient, RequestPolicy, CircuitOpenError
+
 logger = logging.getLogger(__name__)
 
 TEST_MODE = True
 
+# Таймауты и повторы по эндпоинтам. Повторяются только идемпотентные запросы:
+# чтения и transfer (дубли отсекаются по spend_id). createInvoice/createCheck не повторяем.
+DEFAULT_READ_POLICY = RequestPolicy(timeout=5.0, retries=2)
+DEFAULT_WRITE_POLICY = RequestPolicy(timeout=10.0, retries=0)
+ENDPOINT_POLICIES = {
+    "getInvoices": RequestPolicy(timeout=5.0, retries=2, hedge_after=1.5),
+    "getExchangeRates": RequestPolicy(timeout=5.0, retries=2, hedge_after=1.5),
+    "createInvoice": RequestPolicy(timeout=10.0, retries=0),
+    "createCheck": RequestPolicy(timeout=10.0, retries=0),
+    "transfer": RequestPolicy(timeout=15.0, retries=2),
+}
+
+
+class CryptoPayAPIError(Exception):
+    """Crypto Pay ответил ошибкой: запрос точно не выполнен"""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.name = name
+
+
+# Срок жизни счетов: инвойс создается с expires_in, чек живет 24 часа
+INVOICE_LIFETIME = 3600
+CHECK_LIFETIME = 24 * 3600
+
+
 class CryptoPayService:
     """Сервис для работы с Crypto Pay API"""
 
@@ -27,41 +59,76 @@ class CryptoPayService:
 
     def _init_client(self):
         """Инициализация HTTP клиента"""
-        self.client = httpx.AsyncClient(
+        self.client = ResilientHttpClient(
+            service="crypto_pay",
             headers={
                 "Crypto-Pay-API-Token": self.api_token,
                 "Content-Type": "application/json"
-            },
-            timeout=30.0
+            }
         )
 
-    async def _make_request(self, method: str, endpoint: str, **kwargs) -> Optional[Dict[str, Any]]:
-        """Универсальный метод для запросов к API"""
+    async def _make_request(self, method: str, endpoint: str, raise_api_errors: bool = False,
+                            **kwargs) -> Optional[Dict[str, Any]]:
+        """
+        Универсальный метод для запросов к API
+
+        None - ошибка или неизвестный исход (таймаут, 5xx). С raise_api_errors
+        явный отказ API (ok: false) поднимает CryptoPayAPIError, чтобы
+        вызывающий мог отличить его от неизвестного исхода.
+        """
+        start = time.perf_counter()
+        outcome = 'ok'
+        policy = ENDPOINT_POLICIES.get(endpoint) or (
+            DEFAULT_READ_POLICY if method.upper() == "GET" else DEFAULT_WRITE_POLICY
+        )
         try:
             url = f"{self.base_url}/{endpoint}"
 
-            if method.upper() == "GET":
-                response = await self.client.get(url, params=kwargs.get('params'))
-            else:
-                response = await self.client.post(url, json=kwargs.get('json'))
-
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("ok"):
-                    return data.get("result")
+            with tracer.span(f'crypto_pay.{endpoint}') as span:
+                if method.upper() == "GET":
+                    response = await self.client.request("GET", url, endpoint, policy, params=kwargs.get('params'))
                 else:
-                    logger.error(f"❌ API Error: {data.get('error', {})}")
+                    response = await self.client.request("POST", url, endpoint, policy, json=kwargs.get('json'))
+                span.set('status', response.status_code)
+
+            data = None
+            if response.status_code < 500:
+                try:
+                    data = response.json()
+                except ValueError:
+                    pass
+            if response.status_code == 200 and isinstance(data, dict) and data.get("ok"):
+                return data.get("result")
+            if isinstance(data, dict) and data.get("ok") is False:
+                outcome = 'api_error'
+                error = data.get('error', {})
+                logger.error(f"❌ API Error: {error}")
+                if raise_api_errors:
+                    name = error.get("name") if isinstance(error, dict) else None
+                    raise CryptoPayAPIError(str(name or error))
             else:
+                outcome = f'http_{response.status_code}'
                 logger.error(f"❌ HTTP {response.status_code}: {response.text}")
 
             return None
 
+        except CryptoPayAPIError:
+            raise
+        except CircuitOpenError:
+            outcome = 'circuit_open'
+            logger.warning(f"⚠️ Crypto Pay недоступен, запрос {endpoint} отклонен без ожидания")
+            return None
         except httpx.TimeoutException:
-            logger.error("❌ Timeout при запросе к Crypto Pay API")
+            outcome = 'timeout'
+            logger.error(f"❌ Timeout при запросе к Crypto Pay API ({endpoint})")
             return None
         except Exception as e:
+            outcome = 'error'
             logger.error(f"❌ Ошибка Crypto Pay API: {e}")
             return None
+        finally:
+            CRYPTO_PAY_SECONDS.observe(time.perf_counter() - start, endpoint)
+            CRYPTO_PAY_REQUESTS_TOTAL.inc(endpoint, outcome)
 
     async def create_invoice(
             self,
@@ -73,10 +140,12 @@ class CryptoPayService:
         """Создание чека для оплаты"""
         if self.test_mode:
             logger.info(f"🔧 ТЕСТОВЫЙ РЕЖИМ: Создание инвойса на ${amount}")
+            # Уникальный ID: по нему вебхук и сверка находят платеж
+            test_id = f"test_invoice_{uuid4().hex[:12]}"
 
             return {
-                "invoice_id": f"test_invoice_{int(time.time())}",
-                "pay_url": f"https://t.me/CryptoBot?start=test_invoice_{int(time.time())}",
+                "invoice_id": test_id,
+                "pay_url": f"https://t.me/CryptoBot?start={test_id}",
                 "status": "active",
                 "payload": payload or f"test_{uuid4().hex[:8]}",
                 "asset": asset,
@@ -99,7 +168,7 @@ class CryptoPayService:
                 "payload": payload,
                 "allow_comments": False,
                 "allow_anonymous": False,
-                "expires_in": 3600  # 1 час
+                "expires_in": INVOICE_LIFETIME
             }
         )
 
@@ -127,10 +196,11 @@ class CryptoPayService:
         """
         if self.test_mode:
             logger.info(f"🔧 ТЕСТОВЫЙ РЕЖИМ: Создание чека на ${amount}")
+            test_id = f"test_check_{uuid4().hex[:12]}"
 
             return {
-                "invoice_id": f"test_check_{int(time.time())}",
-                "pay_url": f"https://t.me/CryptoBot?start=test_check_{int(time.time())}",
+                "invoice_id": test_id,
+                "pay_url": f"https://t.me/CryptoBot?start={test_id}",
                 "status": "active",
                 "payload": payload or f"test_{uuid4().hex[:8]}",
                 "asset": asset,
@@ -177,7 +247,15 @@ class CryptoPayService:
             spend_id: Optional[str] = None,
             comment: str = "Вывод средств"
     ) -> Optional[Dict[str, Any]]:
-        """Вывод средств пользователю"""
+        """
+        Вывод средств пользователю
+
+        None - исход неизвестен (таймаут, сбой сети): перевод мог пройти,
+        повторять только с тем же spend_id.
+
+        Raises:
+            CryptoPayAPIError: API отклонил перевод, деньги не отправлены
+        """
         if self.test_mode:
             logger.info(f"🔧 ТЕСТОВЫЙ РЕЖИМ: Вывод ${amount} пользователю {user_id}")
 
@@ -194,6 +272,7 @@ class CryptoPayService:
         transfer = await self._make_request(
             "POST",
             "transfer",
+            raise_api_errors=True,
             json={
                 "user_id": user_id,
                 "asset": asset,
@@ -230,6 +309,35 @@ class CryptoPayService:
         result = await self._make_request("GET", "getInvoices", params=params)
         return result.get("items") if result else None
 
+    async def get_invoice_statuses(
+            self,
+            invoice_ids: List[str],
+            chunk_size: int = 100,
+            concurrency: int = 4
+    ) -> Dict[str, str]:
+        """
+        Пакетная проверка статусов инвойсов
+
+        ID делятся на пачки по chunk_size (getInvoices принимает список через запятую),
+        пачки запрашиваются параллельно, но не более concurrency одновременно.
+
+        Returns:
+            {invoice_id: status} - только для инвойсов, которые вернул API
+        """
+        chunks = [invoice_ids[i:i + chunk_size] for i in range(0, len(invoice_ids), chunk_size)]
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def fetch_chunk(chunk: List[str]) -> Optional[List[Dict[str, Any]]]:
+            async with semaphore:
+                return await self.get_invoices(invoice_ids=chunk, count=len(chunk))
+
+        statuses = {}
+        for items in await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunks)):
+            for invoice in items or []:
+                statuses[str(invoice.get("invoice_id"))] = invoice.get("status")
+
+        return statuses
+
     async def get_transfers(
             self,
             transfer_ids: Optional[List[str]] = None,
@@ -297,35 +405,116 @@ class CryptoPayService:
 
 
 # Утилитарные функции для конвертации валют
-class CurrencyConverter:
-    """Конвертер валют (упрощенный)"""
 
-    @staticmethod
-    async def usd_to_crypto(amount_usd: float, asset: str = "USDT") -> float:
-        """
-        Конвертация USD в криптовалюту
-        В реальном приложении нужно использовать актуальные курсы
-        """
-        # Примерные курсы (должны получаться из API)
-        rates = {
-            "USDT": 1.0,  # 1 USDT ≈ 1 USD
-            "TON": 4.5,  # 1 TON ≈ 4.5 USD
-            "BTC": 50000.0,  # 1 BTC ≈ 50000 USD
-            "ETH": 3000.0,  # 1 ETH ≈ 3000 USD
-        }
-
-        rate = rates.get(asset, 1.0)
-        return amount_usd / rate
-
-    @staticmethod
-    async def crypto_to_usd(amount_crypto: float, asset: str = "USDT") -> float:
+# Стартовые курсы (USD за 1 единицу) - до первого успешного обновления из API
+DEFAULT_RATES = {
+    "USDT": 1.0,  # 1 USDT ≈ 1 USD
+    "TON": 4.5,  # 1 TON ≈ 4.5 USD
+    "BTC": 50000.0,  # 1 BTC ≈ 50000 USD
+    "ETH": 3000.0,  # 1 ETH ≈ 3000 USD
+}
+
+# Стейблкоины: курс не устаревает
+PEGGED_ASSETS = frozenset({"USDT", "USDC"})
+
+
+class RateUnavailableError(Exception):
+    """Нет актуального курса для актива"""
+
+
+@dataclass(frozen=True)
+class RateSnapshot:
+    """Неизменяемый снимок курсов: читается без блокировок и ожидания"""
+    rates: Mapping[str, float]
+    fetched_at: float  # time.monotonic() последнего обновления
+    source: str = "api"  # api или default
+    updated: Mapping[str, float] = field(default_factory=dict)  # актив -> когда его курс пришел из API
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+    def asset_age(self, asset: str) -> float:
+        """Возраст курса актива; стартовый курс, не пришедший из API, бесконечно стар"""
+        return time.monotonic() - self.updated.get(asset, float('-inf'))
+
+
+class CurrencyConverter:
+    """
+    Конвертер валют по снимку курсов
+
+    Снимок обновляется фоновой задачей (refresh), а конвертация -
+    это поиск в словаре без сетевых запросов. При ошибке обновления
+    остается последний известный снимок. Возраст считается по каждому
+    активу: курс старше max_stale (в том числе стартовый DEFAULT_RATES,
+    так и не подтвержденный API) не используется для волатильных активов.
+    """
+
+    def __init__(self, crypto_pay: Optional['CryptoPayService'] = None,
+                 max_age: float = 300.0, max_stale: float = 3600.0):
+        self.crypto_pay = crypto_pay
+        self.max_age = max_age
+        self.max_stale = max_stale
+        self.snapshot = RateSnapshot(MappingProxyType(dict(DEFAULT_RATES)), float('-inf'), "default")
+        self._warned_snapshot: Optional[RateSnapshot] = None
+
+    async def refresh(self) -> bool:
+        """Загружает курсы из Crypto Pay и атомарно заменяет снимок"""
+        if self.crypto_pay is None:
+            return False
+
+        items = await self.crypto_pay.get_exchange_rates()
+        rates = {}
+        for item in items or []:
+            if item.get("is_valid") and item.get("target") == "USD":
+                try:
+                    rate = float(item["rate"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if rate > 0:
+                    rates[item["source"]] = rate
+
+        if not rates:
+            logger.warning(f"⚠️ Курсы не обновлены, используется снимок возрастом {self.snapshot.age:.0f} сек")
+            return False
+
+        # Активы, которых нет в ответе, остаются из предыдущего снимка со своим
+        # временем получения и стареют, пока API снова не вернет их курс
+        now = time.monotonic()
+        merged = dict(self.snapshot.rates)
+        merged.update(rates)
+        updated = dict(self.snapshot.updated)
+        updated.update(dict.fromkeys(rates, now))
+        self.snapshot = RateSnapshot(MappingProxyType(merged), now, "api", MappingProxyType(updated))
+        logger.debug("Курсы обновлены: %s", rates)
+        return True
+
+    def get_rate(self, asset: str) -> float:
+        """Курс актива в USD из текущего снимка"""
+        snapshot = self.snapshot
+        rate = snapshot.rates.get(asset)
+        if rate is None:
+            raise RateUnavailableError(f"Курс {asset} недоступен")
+
+        if asset in PEGGED_ASSETS:
+            return rate
+
+        age = snapshot.asset_age(asset)
+        if age > self.max_age:
+            if age == float('inf'):
+                raise RateUnavailableError(f"Курс {asset} еще не получен из API")
+            if age > self.max_stale:
+                raise RateUnavailableError(f"Курс {asset} устарел ({age / 60:.0f} мин)")
+            if self._warned_snapshot is not snapshot:
+                self._warned_snapshot = snapshot
+                logger.warning(f"⚠️ Курс {asset} устарел ({age:.0f} сек), используется последний снимок")
+
+        return rate
+
+    def usd_to_crypto(self, amount_usd: float, asset: str = "USDT") -> float:
+        """Конвертация USD в криптовалюту"""
+        return amount_usd / self.get_rate(asset)
+
+    def crypto_to_usd(self, amount_crypto: float, asset: str = "USDT") -> float:
         """Конвертация криптовалюты в USD"""
-        rates = {
-            "USDT": 1.0,
-            "TON": 4.5,
-            "BTC": 50000.0,
-            "ETH": 3000.0,
-        }
-
-        rate = rates.get(asset, 1.0)
-        return amount_crypto * rate
\ No newline at end of file
+        return amount_crypto * self.get_rate(asset)
@@ -0,0 +1,116 @@
+# app/services/crypto_pay_webhook.py
+import hmac
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from app.services.metrics import CRYPTO_PAY_WEBHOOKS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 64 * 1024
+
+
+def verify_signature(api_token: str, body: bytes, signature: Optional[str]) -> bool:
+    """
+    Проверка подписи вебхука Crypto Pay
+
+    Подпись - HMAC-SHA256 тела запроса, ключ - SHA256 от токена API.
+    Документация: https://help.crypt.bot/crypto-pay-api#verifying-webhook-updates
+    """
+    if not signature:
+        return False
+    secret = hashlib.sha256(api_token.encode()).digest()
+    expected = hmac.new(secret, body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature.strip().lower())
+
+
+class CryptoPayWebhookServer:
+    """Минимальный HTTP-сервер для вебхуков Crypto Pay (POST invoice_paid)"""
+
+    def __init__(self, payment_manager, api_token: str, host: str = '0.0.0.0', port: int = 8081,
+                 path: str = '/crypto-pay/webhook',
+                 on_deposit: Optional[Callable[[object], Awaitable[None]]] = None):
+        self.payment_manager = payment_manager
+        self.api_token = api_token
+        self.host = host
+        self.port = port
+        self.path = path
+        self.on_deposit = on_deposit
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"🪝 Вебхук Crypto Pay принимается на http://{self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def process(self, body: bytes, signature: Optional[str]) -> Tuple[str, str]:
+        """Проверяет и применяет одно обновление; возвращает (HTTP-статус, outcome)"""
+        if not verify_signature(self.api_token, body, signature):
+            return '401 Unauthorized', 'bad_signature'
+
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return '400 Bad Request', 'bad_json'
+
+        if update.get('update_type') != 'invoice_paid':
+            return '200 OK', 'ignored'
+
+        invoice = update.get('payload') or {}
+        payment, error = self.payment_manager.apply_paid_invoice(invoice)
+        if error:
+            # 200, чтобы Crypto Pay не повторял доставку неизвестного нам инвойса
+            logger.warning(f"⚠️ Вебхук Crypto Pay: {error}")
+            return '200 OK', 'unknown_invoice'
+        if payment is None:
+            return '200 OK', 'duplicate'
+
+        if self.on_deposit:
+            try:
+                await self.on_deposit(payment)
+            except Exception as e:
+                logger.error(f"❌ Ошибка уведомления о депозите {payment.payment_id}: {e}")
+        return '200 OK', 'credited'
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        status, outcome = '400 Bad Request', 'bad_request'
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            headers: Dict[str, str] = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            parts = request_line.decode('latin-1').split()
+            length = int(headers.get('content-length', 0))
+            if len(parts) < 2 or parts[0] != 'POST' or parts[1].split('?')[0] != self.path:
+                status, outcome = '404 Not Found', 'not_found'
+            elif length > MAX_BODY_SIZE:
+                status, outcome = '413 Payload Too Large', 'too_large'
+            else:
+                body = await asyncio.wait_for(reader.readexactly(length), timeout=5)
+                status, outcome = await self.process(body, headers.get('crypto-pay-api-signature'))
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки вебхука Crypto Pay: {e}")
+            status, outcome = '500 Internal Server Error', 'error'
+        finally:
+            CRYPTO_PAY_WEBHOOKS_TOTAL.inc(outcome)
+            try:
+                writer.write(
+                    f'HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'.encode('latin-1')
+                )
+                await writer.drain()
+            except Exception:
+                pass
+            writer.close()
@@ -1,32 +1,47 @@
 # app/services/duel_manager.py
 import logging
-from typing import Optional, Dict, Tuple, List
+from typing import Optional, Dict, Tuple, List, Set
 from datetime import datetime
-import uuid
-import asyncio
 
 from ..models.duel import Duel
+from .id_allocator import IdAllocator
+from .settlement import SettlementService
+from .tracing import tracer
 
 
 class DuelManager:
-    """Менеджер дуэлей в групповых чатах"""
+    """
+    Менеджер дуэлей в групповых чатах
 
-    def __init__(self, database, payment_manager=None):
+    Состояние дуэли живет только под ее duel_id; chat_duels и user_duels -
+    вторичные индексы открытых (waiting/active) дуэлей для лимитов и списков.
+    В одном чате идет до max_per_chat дуэлей одновременно, у игрока - до
+    max_per_user открытых дуэлей.
+    """
+
+    def __init__(self, database, payment_manager=None, settlement: Optional[SettlementService] = None,
+                 max_per_chat: int = 20, max_per_user: int = 3):
         self.db = database
         self.payment_manager = payment_manager
+        self.settlement = settlement or SettlementService(database)
+        self.max_per_chat = max_per_chat
+        self.max_per_user = max_per_user
         self.active_duels: Dict[str, Duel] = {}  # duel_id -> Duel
-        self.chat_duels: Dict[int, str] = {}  # chat_id -> duel_id (активная дуэль в чате)
+        self.chat_duels: Dict[int, Dict[str, None]] = {}  # chat_id -> открытые дуэли (в порядке создания)
+        self.user_duels: Dict[int, Set[str]] = {}  # user_id -> открытые дуэли игрока
+        self.ids = IdAllocator('duel', database, length=8)
         self.logger = logging.getLogger(__name__)
 
+    @tracer.traced()
     def create_duel(self, chat_id: int, creator_id: int, creator_name: str,
                     bet_amount: float) -> Tuple[Optional[Duel], Optional[str]]:
         """Создает новую дуэль в чате"""
         try:
-            # Проверяем, нет ли уже активной дуэли в чате
-            if chat_id in self.chat_duels:
-                active_duel = self.active_duels.get(self.chat_duels[chat_id])
-                if active_duel and active_duel.status in ["waiting", "active"]:
-                    return None, "В этом чате уже есть активная дуэль!"
+            # Лимиты открытых дуэлей в чате и у игрока
+            if len(self.chat_duels.get(chat_id, ())) >= self.max_per_chat:
+                return None, f"В этом чате уже {self.max_per_chat} открытых дуэлей, дождитесь окончания"
+            if len(self.user_duels.get(creator_id, ())) >= self.max_per_user:
+                return None, f"У вас уже {self.max_per_user} открытых дуэлей"
 
             # Проверяем баланс создателя
             user = self.db.get_user(creator_id)
@@ -36,11 +51,8 @@ class DuelManager:
             if user[4] < bet_amount:
                 return None, f"Недостаточно средств. Баланс: ${user[4]:.0f}"
 
-            # Резервируем средства
-            self.db.update_balance(creator_id, -bet_amount)
-
-            # Создаем дуэль
-            duel_id = Duel.generate_duel_id()
+            # Создаем дуэль (ID может потребовать запроса к БД - до списания ставки)
+            duel_id = self.ids.next_code()
             duel = Duel(
                 duel_id=duel_id,
                 chat_id=chat_id,
@@ -50,17 +62,22 @@ class DuelManager:
                 status="waiting"
             )
 
+            # Резервируем средства
+            self.db.update_balance(creator_id, -bet_amount)
+
             # Сохраняем
             self.active_duels[duel_id] = duel
-            self.chat_duels[chat_id] = duel_id
+            self.chat_duels.setdefault(chat_id, {})[duel_id] = None
+            self._track_user(creator_id, duel_id)
 
-            self.logger.info(f"Создана дуэль {duel_id} в чате {chat_id}")
+            self.logger.info("Создана дуэль %s в чате %s", duel_id, chat_id)
             return duel, None
 
         except Exception as e:
             self.logger.error(f"Ошибка создания дуэли: {e}")
             return None, f"Ошибка создания дуэли: {str(e)}"
 
+    @tracer.traced()
     def accept_duel(self, duel_id: str, opponent_id: int,
                     opponent_name: str) -> Tuple[Optional[Duel], Optional[str]]:
         """Принимает дуэль"""
@@ -83,6 +100,9 @@ class DuelManager:
             if user[4] < duel.bet_amount:
                 return None, f"Недостаточно средств. Нужно: ${duel.bet_amount:.0f}"
 
+            if len(self.user_duels.get(opponent_id, ())) >= self.max_per_user:
+                return None, f"У вас уже {self.max_per_user} открытых дуэлей"
+
             # Резервируем средства оппонента
             self.db.update_balance(opponent_id, -duel.bet_amount)
 
@@ -91,14 +111,16 @@ class DuelManager:
             duel.opponent_name = opponent_name
             duel.status = "active"
             duel.started_at = datetime.now()
+            self._track_user(opponent_id, duel_id)
 
-            self.logger.info(f"Дуэль {duel_id} принята игроком {opponent_name}")
+            self.logger.info("Дуэль %s принята игроком %s", duel_id, opponent_name)
             return duel, None
 
         except Exception as e:
             self.logger.error(f"Ошибка принятия дуэли: {e}")
             return None, f"Ошибка принятия дуэли: {str(e)}"
 
+    @tracer.traced()
     def process_duel_roll(self, duel_id: str, player_id: int,
                           dice_value: int) -> Tuple[Optional[Duel], Optional[str]]:
         """Обрабатывает бросок в дуэли"""
@@ -123,8 +145,10 @@ class DuelManager:
                 duel.status = "finished"
                 duel.finished_at = datetime.now()
                 duel.winner_id = duel.calculate_winner()
+                self._untrack(duel)
 
-                asyncio.create_task(self._process_duel_payout(duel))
+                # Выплата победителю или возврат обеим ставкам при ничьей
+                self.settle_duel(duel)
 
             return duel, None
 
@@ -146,26 +170,39 @@ class DuelManager:
                 return False, "Только создатель может отменить дуэль"
 
             # Возвращаем средства создателю
-            self.db.update_balance(user_id, duel.bet_amount)
+            self.settle_duel(duel, cancelled=True)
 
             # Удаляем дуэль
             del self.active_duels[duel_id]
-            if duel.chat_id in self.chat_duels:
-                del self.chat_duels[duel.chat_id]
+            self._untrack(duel)
 
-            self.logger.info(f"Дуэль {duel_id} отменена")
+            self.logger.info("Дуэль %s отменена", duel_id)
             return True, None
 
         except Exception as e:
             self.logger.error(f"Ошибка отмены дуэли: {e}")
             return False, f"Ошибка отмены: {str(e)}"
 
-    def get_duel_by_chat(self, chat_id: int) -> Optional[Duel]:
-        """Получает активную дуэль в чате"""
-        duel_id = self.chat_duels.get(chat_id)
-        if duel_id:
-            return self.active_duels.get(duel_id)
-        return None
+    def get_chat_duels(self, chat_id: int) -> List[Duel]:
+        """Открытые дуэли чата в порядке создания"""
+        return [self.active_duels[duel_id] for duel_id in self.chat_duels.get(chat_id, ())]
+
+    def _track_user(self, user_id: int, duel_id: str):
+        self.user_duels.setdefault(user_id, set()).add(duel_id)
+
+    def _untrack(self, duel: Duel):
+        """Убирает дуэль из индексов открытых дуэлей (завершена, отменена или удалена)"""
+        chat = self.chat_duels.get(duel.chat_id)
+        if chat is not None:
+            chat.pop(duel.duel_id, None)
+            if not chat:
+                del self.chat_duels[duel.chat_id]
+        for user_id in (duel.creator_id, duel.opponent_id):
+            duels = self.user_duels.get(user_id)
+            if duels is not None:
+                duels.discard(duel.duel_id)
+                if not duels:
+                    del self.user_duels[user_id]
 
     def get_duel_by_id(self, duel_id: str) -> Optional[Duel]:
         """Получает дуэль по ID"""
@@ -173,23 +210,28 @@ class DuelManager:
 
 
     def cleanup_old_duels(self, hours_old: int = 24):
-        """Очищает старые дуэли"""
+        """Очищает старые дуэли, незавершенные ставки возвращаются одной транзакцией"""
         try:
             now = datetime.now()
             to_remove = []
+            refunds = []
 
             for duel_id, duel in self.active_duels.items():
                 if duel.created_at and (now - duel.created_at).total_seconds() > hours_old * 3600:
                     to_remove.append(duel_id)
 
-                    # Возвращаем средства если дуэль была в ожидании
-                    if duel.status == "waiting" and duel.creator_id:
-                        self.db.update_balance(duel.creator_id, duel.bet_amount)
+                    # Возвращаем средства, если дуэль не завершилась
+                    if duel.status in ("waiting", "active"):
+                        refunds.append(self.settlement.plan("duel", duel.duel_id, self._stakes(duel),
+                                                            cancelled=True))
+
+            if refunds:
+                self.settlement.settle_many(refunds)
 
             for duel_id in to_remove:
                 duel = self.active_duels.pop(duel_id, None)
-                if duel and duel.chat_id in self.chat_duels:
-                    del self.chat_duels[duel.chat_id]
+                if duel:
+                    self._untrack(duel)
 
             if to_remove:
                 self.logger.info(f"Очищено {len(to_remove)} старых дуэлей")
@@ -197,44 +239,11 @@ class DuelManager:
         except Exception as e:
             self.logger.error(f"Ошибка очистки старых дуэлей: {e}")
 
-    async def _process_duel_payout(self, duel: Duel):
-        """Обрабатывает выплаты по завершенной дуэли"""
-        try:
-            if not duel.winner_id:
-                self.logger.error(f"Нет победителя в дуэли {duel.duel_id}")
-                return
-
-            # Общий банк = 2 ставки
-            total_bank = duel.bet_amount * 2
-            commission = total_bank * 0.08  # 8% комиссия
-            winner_amount = total_bank - commission
-
-            # Создаем выплату победителю через payment_manager
-            if self.payment_manager:
-                try:
-                    payment, error = await self.payment_manager.create_withdrawal(
-                        user_id=duel.winner_id,
-                        amount_usd=winner_amount,
-                        description=f"Выигрыш в дуэли #{duel.duel_id}"
-                    )
-
-                    if payment:
-                        self.logger.info(
-                            f"✅ Выплата создана для дуэли {duel.duel_id}: {winner_amount:.2f}$ для пользователя {duel.winner_id}")
-                    else:
-                        self.logger.error(f"❌ Ошибка создания выплаты для дуэли {duel.duel_id}: {error}")
-
-                        # Если ошибка в payment_manager, хотя бы зачисляем на баланс
-                        self.db.update_balance(duel.winner_id, winner_amount)
-                        self.logger.info(f"⚠️ Средства зачислены на баланс из-за ошибки платежа")
-                except Exception as e:
-                    self.logger.error(f"❌ Исключение в payment_manager: {e}")
-                    # Запасной вариант: зачисляем на баланс
-                    self.db.update_balance(duel.winner_id, winner_amount)
-            else:
-                # Если нет payment_manager, просто обновляем баланс
-                self.db.update_balance(duel.winner_id, winner_amount)
-                self.logger.info(f"⚠️ PaymentManager не доступен, баланс обновлен: +{winner_amount:.2f}$")
+    @staticmethod
+    def _stakes(duel: Duel) -> Dict[int, float]:
+        return {player_id: duel.bet_amount for player_id in (duel.creator_id, duel.opponent_id) if player_id}
 
-        except Exception as e:
-            self.logger.error(f"❌ Критическая ошибка в _process_duel_payout: {e}")
\ No newline at end of file
+    def settle_duel(self, duel: Duel, cancelled: bool = False):
+        """Расчет по дуэли через леджер (повторный вызов ничего не выплатит)"""
+        winners = [duel.winner_id] if duel.winner_id and not cancelled else []
+        return self.settlement.settle("duel", duel.duel_id, self._stakes(duel), winners, cancelled=cancelled)
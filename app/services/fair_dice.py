@@ -0,0 +1,57 @@
+# app/services/fair_dice.py
+import hashlib
+import hmac
+import secrets
+from typing import List
+
+
+def hash_seed(server_seed: str) -> str:
+    """Публикуемый хеш сида (commit)"""
+    return hashlib.sha256(server_seed.encode()).hexdigest()
+
+
+def derive_roll(server_seed: str, player_id: int, nonce: int) -> int:
+    """
+    Бросок 1..6 из HMAC-SHA256(сид, "игрок:номер")
+
+    Байты дайджеста >= 252 отбрасываются, чтобы остаток от деления на 6
+    был равномерным. Если дайджест кончился (вероятность ~1e-58),
+    хешируем дальше со счетчиком.
+    """
+    round_ = 0
+    while True:
+        message = f"{player_id}:{nonce}:{round_}" if round_ else f"{player_id}:{nonce}"
+        digest = hmac.new(server_seed.encode(), message.encode(), hashlib.sha256).digest()
+        for byte in digest:
+            if byte < 252:
+                return byte % 6 + 1
+        round_ += 1
+
+
+def verify_rolls(server_seed: str, seed_hash: str, player_id: int, rolls: List[int]) -> bool:
+    """Проверка игроком: сид соответствует хешу и порождает эти броски"""
+    if not hmac.compare_digest(hash_seed(server_seed), seed_hash):
+        return False
+    return rolls == [derive_roll(server_seed, player_id, nonce) for nonce in range(len(rolls))]
+
+
+class FairDice:
+    """
+    Быстрые броски с доказуемой честностью (commit-reveal)
+
+    Сид генерируется CSPRNG при создании игры, игрокам сразу публикуется
+    его SHA-256. Броски детерминированно выводятся из сида, ID игрока и
+    номера броска, а сам сид раскрывается в итогах игры - любой может
+    пересчитать хеш и броски и убедиться, что их не подменили.
+    """
+
+    def __init__(self, server_seed: str = None):
+        self.server_seed = server_seed or secrets.token_hex(32)
+        self.seed_hash = hash_seed(self.server_seed)
+
+    def roll(self, player_id: int, nonce: int) -> int:
+        return derive_roll(self.server_seed, player_id, nonce)
+
+    def roll_many(self, player_id: int, count: int, start: int = 0) -> List[int]:
+        """Броски с номерами start..start+count-1"""
+        return [self.roll(player_id, nonce) for nonce in range(start, start + count)]
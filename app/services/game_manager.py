@@ -2,22 +2,32 @@ import logging
 from typing import Optional, Dict, Tuple, List
 from datetime import datetime
 from ..models.game import PvPGame
+from .tracing import tracer
+from .fair_dice import FairDice
+from .settlement import SettlementService
 import asyncio
 
 
 class GameManager:
     """Менеджер игр 1 на 1"""
 
-    def __init__(self, database, payment_manager=None):
+    def __init__(self, database, payment_manager=None, settlement: Optional[SettlementService] = None):
         self.db = database
         self.payment_manager = payment_manager
+        self.settlement = settlement or SettlementService(database)
         self.active_games: Dict[int, PvPGame] = {}
         self.game_messages: Dict[int, List[Dict[str, int]]] = {}
         self.logger = logging.getLogger(__name__)
 
-    def create_game(self, creator_id: int, creator_name: str,
-                    bet_amount: float) -> Tuple[Optional[PvPGame], Optional[str]]:
-        """Создает новую игру 1 на 1"""
+    @tracer.traced()
+    def create_game(self, creator_id: int, creator_name: str, bet_amount: float,
+                    fast: Optional[bool] = None) -> Tuple[Optional[PvPGame], Optional[str]]:
+        """
+        Создает новую игру 1 на 1 (fast=None - по настройке создателя)
+
+        Быстрый режим здесь только предлагается: при входе соперника он
+        сохраняется, если соперник тоже его включил (см. join_game).
+        """
         try:
             # Проверяем баланс
             user = self.db.get_user(creator_id)
@@ -43,16 +53,58 @@ class GameManager:
                 status="waiting"
             )
 
+            # Быстрый режим: сид фиксируется до первого броска, игрокам публикуется его хеш
+            if fast is None:
+                fast = self.db.get_fast_roll(creator_id)
+            if fast:
+                game.server_seed = FairDice().server_seed
+                self.db.set_game_seed(game_id, game.server_seed)
+
             # Сохраняем в активных играх
             self.active_games[game_id] = game
 
-            self.logger.info(f"Создана игра {game_code} пользователем {creator_name}")
+            self.logger.info("Создана игра %s пользователем %s", game_code, creator_name)
             return game, None
 
         except Exception as e:
             self.logger.error(f"Ошибка создания игры: {e}")
             return None, f"Ошибка создания игры: {str(e)}"
 
+    @tracer.traced()
+    def create_matched_game(self, player1_id: int, player1_name: str, player2_id: int, player2_name: str,
+                            bet_amount: float) -> Tuple[Optional[PvPGame], Optional[int]]:
+        """
+        Создает игру для пары из очереди подбора (сразу активную)
+
+        Возвращает (игра, None) или (None, ID игрока, у которого не хватило
+        средств). Быстрый режим - если его включили оба игрока.
+        """
+        server_seed = None
+        if self.db.get_fast_roll(player1_id) and self.db.get_fast_roll(player2_id):
+            server_seed = FairDice().server_seed
+
+        game_id, game_code, short_player = self.db.create_matched_game(
+            player1_id, player2_id, bet_amount, server_seed)
+        if not game_id:
+            return None, short_player
+
+        game = PvPGame(
+            id=game_id,
+            game_code=game_code,
+            player1_id=player1_id,
+            player1_name=player1_name,
+            player2_id=player2_id,
+            player2_name=player2_name,
+            bet_amount=bet_amount,
+            status="active",
+            server_seed=server_seed
+        )
+        self.active_games[game_id] = game
+
+        self.logger.info("Подбор: игра %s %s vs %s ($%.2f)", game_code, player1_name, player2_name, bet_amount)
+        return game, None
+
+    @tracer.traced()
     def join_game(self, game_code: str, player_id: int,
                   player_name: str) -> Tuple[Optional[PvPGame], Optional[str]]:
         """Присоединяет второго игрока к игре"""
@@ -76,14 +128,11 @@ class GameManager:
             if user[4] < game_data[3]:  # bet_amount
                 return None, f"Недостаточно средств. Нужно: ${game_data[3]:.0f}"
 
-            # Присоединяем в БД
+            # Присоединяем в БД (там же резервируется ставка)
             success, message = self.db.join_game(game_code, player_id)
             if not success:
                 return None, message
 
-            # Резервируем средства
-            self.db.update_balance(player_id, -game_data[3])
-
             # Обновляем объект игры
             if game_id in self.active_games:
                 game = self.active_games[game_id]
@@ -100,42 +149,79 @@ class GameManager:
                     player2_id=player_id,
                     player2_name=player_name,
                     bet_amount=game_data[3],
-                    status="active"
+                    status="active",
+                    server_seed=self.db.get_game_seed(game_id)
                 )
                 self.active_games[game_id] = game
 
-            self.logger.info(f"Игрок {player_name} присоединился к игре {game_code}")
+            # Быстрый режим - только если его включили оба игрока (как при подборе).
+            # Броски возможны лишь в активной игре, поэтому сид еще не использован
+            if game.fast and not self.db.get_fast_roll(player_id):
+                game.server_seed = None
+                self.db.set_game_seed(game_id, None)
+                self.logger.info("Игра %s: соперник не включил быстрый режим, игра обычная", game_code)
+
+            self.logger.info("Игрок %s присоединился к игре %s", player_name, game_code)
             return game, None
 
         except Exception as e:
             self.logger.error(f"Ошибка присоединения к игре: {e}")
             return None, f"Ошибка присоединения: {str(e)}"
 
+    def load_game(self, game_id: int) -> Optional[PvPGame]:
+        """Активная игра по ID (после перезапуска - восстанавливается из БД)"""
+        if game_id not in self.active_games:
+            # Пробуем загрузить из БД
+            game_data = self.db.get_game_by_id(game_id)
+            if not game_data:
+                return None
+
+            # Создаем объект из БД
+            game = PvPGame(
+                id=game_id,
+                game_code=game_data[2],
+                player1_id=game_data[15],
+                player1_name=game_data[17] or "Игрок 1",
+                player2_id=game_data[16],
+                player2_name=game_data[18] or "Игрок 2",
+                bet_amount=game_data[3],
+                status=game_data[7],  # status из БД
+                server_seed=self.db.get_game_seed(game_id)
+            )
+            self.active_games[game_id] = game
+
+        return self.active_games[game_id]
+
+    @tracer.traced()
+    async def process_fast_rolls(self, game_id: int,
+                                 player_id: int) -> Tuple[Optional[PvPGame], Optional[List[int]], Optional[str]]:
+        """Быстрый режим: все оставшиеся броски игрока за один вызов"""
+        game = self.load_game(game_id)
+        if not game:
+            return None, None, "Игра не найдена"
+        if not game.fast:
+            return None, None, "Игра не в быстром режиме"
+        if player_id not in [game.player1_id, game.player2_id]:
+            return None, None, "Вы не участвуете в этой игре"
+
+        done = len(game.get_rolls(player_id))
+        if done >= 3:
+            return None, None, "Вы уже сделали все броски"
+        rolls = FairDice(game.server_seed).roll_many(player_id, 3 - done, start=done)
+        for value in rolls:
+            game, error = await self.process_dice_roll(game_id, player_id, value)
+            if error:
+                return None, None, error
+        return game, rolls, None
+
+    @tracer.traced()
     async def process_dice_roll(self, game_id: int, player_id: int,
                                 dice_value: int) -> Tuple[Optional[PvPGame], Optional[str]]:
         """Обрабатывает бросок костей"""
         try:
-            # Проверяем, что игра существует
-            if game_id not in self.active_games:
-                # Пробуем загрузить из БД
-                game_data = self.db.get_game_by_id(game_id)
-                if not game_data:
-                    return None, "Игра не найдена"
-
-                # Создаем объект из БД
-                game = PvPGame(
-                    id=game_id,
-                    game_code=game_data[2],
-                    player1_id=game_data[15],
-                    player1_name=game_data[17] or "Игрок 1",
-                    player2_id=game_data[16],
-                    player2_name=game_data[18] or "Игрок 2",
-                    bet_amount=game_data[3],
-                    status=game_data[7]  # status из БД
-                )
-                self.active_games[game_id] = game
-
-            game = self.active_games[game_id]
+            game = self.load_game(game_id)
+            if not game:
+                return None, "Игра не найдена"
 
             # Проверяем, что игрок участвует в игре
             if player_id not in [game.player1_id, game.player2_id]:
@@ -159,10 +245,10 @@ class GameManager:
                 game.winner_id = game.calculate_winner()
 
                 # Сохраняем в БД
-                self.db.finish_game(game_id, None)
+                self.db.finish_game(game_id)
 
-                # Обрабатываем выплату победителю
-                await self._process_game_payout(game)
+                # Выплата победителю или возврат ставок при ничьей
+                self.settle_game(game)
 
                 return game, None
 
@@ -174,109 +260,13 @@ class GameManager:
             return None, f"Ошибка броска: {str(e)}"
 
 
-    async def _process_game_payout(self, game):
-        """Обрабатывает выплаты по завершенной игре"""
-        try:
-            if not game.winner_id:
-                self.logger.error(f"Нет победителя в игре {game.id}")
-                return
-
-            # Общий банк = 2 ставки
-            total_bank = game.bet_amount * 2
-            commission = total_bank * 0.08  # 8% комиссия
-            winner_amount = total_bank - commission
-
-            # Создаем выплату победителю через payment_manager
-            if self.payment_manager:
-                try:
-                    payment, error = await self.payment_manager.create_withdrawal(
-                        user_id=game.winner_id,
-                        amount_usd=winner_amount,
-                        description=f"Выигрыш в игре #{game.game_code}"
-                    )
-
-                    if payment:
-                        self.logger.info(
-                            f"✅ Выплата создана для игры {game.game_code}: {winner_amount:.2f}$ для пользователя {game.winner_id}")
-                    else:
-                        self.logger.error(f"❌ Ошибка создания выплаты для игры {game.game_code}: {error}")
-
-                        # Если ошибка в payment_manager, хотя бы зачисляем на баланс
-                        self.db.update_balance(game.winner_id, winner_amount)
-                        self.logger.info(f"⚠️ Средства зачислены на баланс из-за ошибки платежа")
-                except Exception as e:
-                    self.logger.error(f"❌ Исключение в payment_manager: {e}")
-                    # Запасной вариант: зачисляем на баланс
-                    self.db.update_balance(game.winner_id, winner_amount)
-            else:
-                # Если нет payment_manager, просто обновляем баланс
-                self.db.update_balance(game.winner_id, winner_amount)
-                self.logger.info(f"⚠️ PaymentManager не доступен, баланс обновлен: +{winner_amount:.2f}$")
-
-        except Exception as e:
-            self.logger.error(f"❌ Критическая ошибка в _process_game_payout: {e}")
-
-    async def process_game_result(self, game, context, bot):
-        """Обрабатывает результат завершенной игры с выплатой"""
-        try:
-            total_bank = game.bet_amount * 2
-            commission = total_bank * 0.08  # 8%
-            winner_amount = total_bank - commission
-
-            winner_id = game.winner_id
-            winner_name = game.player1_name if winner_id == game.player1_id else game.player2_name
-
-            # 1. Уведомляем игроков
-            winner_text = (
-                f"🏆 Поздравляем с победой!\n"
-                f"💰 Ваш выигрыш: ${winner_amount:.2f}\n"
-                f"🎮 Противник: {game.player2_name if winner_id == game.player1_id else game.player1_name}"
-            )
-
-            loser_id = game.player2_id if winner_id == game.player1_id else game.player1_id
-            loser_text = (
-                f"😔 Вы проиграли\n"
-                f"💰 Потеряно: ${game.bet_amount:.2f}\n"
-                f"🎮 Победитель: {winner_name}"
-            )
-
-            await context.bot.send_message(chat_id=winner_id, text=winner_text)
-            await context.bot.send_message(chat_id=loser_id, text=loser_text)
-
-            # 2. Создаем чек победителю через payment_manager
-            if hasattr(bot, 'payment_manager'):
-                try:
-                    # Создаем выплату победителю
-                    payment, error = await bot.payment_manager.create_withdrawal(
-                        user_id=winner_id,
-                        amount_usd=winner_amount,
-                        description=f"Выигрыш в игре #{game.id}"
-                    )
-
-                    if payment:
-                        self.logger.info(
-                            f"✅ Чек создан для победителя {winner_name}: ${winner_amount:.2f}")
-                        await context.bot.send_message(
-                            chat_id=winner_id,
-                            text=f"💰 Чек на ${winner_amount:.2f} создан! Ожидайте выплаты."
-                        )
-                    else:
-                        self.logger.error(f"❌ Ошибка создания чека: {error}")
-                        await context.bot.send_message(
-                            chat_id=winner_id,
-                            text=f"⚠️ Ошибка выплаты: {error}"
-                        )
-                except Exception as e:
-                    self.logger.error(f"❌ Ошибка payment_manager: {e}")
-
-            # 3. Обновляем статистику в БД
-            bot.db.update_balance(winner_id, winner_amount)
-
-            self.logger.info(f"🎮 Игра {game.id} завершена. Победитель: {winner_name}")
-
-        except Exception as e:
-            self.logger.error(f"❌ Ошибка обработки результата: {e}")
+    def settle_game(self, game: PvPGame, cancelled: bool = False):
+        """Расчет по игре через леджер (повторный вызов ничего не выплатит)"""
+        stakes = {player_id: game.bet_amount for player_id in (game.player1_id, game.player2_id) if player_id}
+        winners = [game.winner_id] if game.winner_id and not cancelled else []
+        return self.settlement.settle("game", game.id, stakes, winners, cancelled=cancelled)
 
+    @tracer.traced()
     async def cancel_game(self, game_id: int, user_id: int, context=None) -> Tuple[bool, Optional[str]]:
         """Отменяет игру и возвращает средства"""
         try:
@@ -293,16 +283,16 @@ class GameManager:
             if game_data[16] is not None:
                 return False, "Нельзя отменить игру с присоединившимся игроком"
 
-            # Возвращаем средства
-            bet_amount = game_data[3]
-            self.db.update_balance(user_id, bet_amount)
+            # Отменяем в БД: условие status = 'waiting' не даст отменить дважды
+            if not self.db.cancel_game(game_id):
+                return False, "Игру уже нельзя отменить"
 
-            # Удаляем игру из БД
-            self.db.cancel_game(game_id)
+            # Возвращаем ставку через леджер
+            self.settlement.settle("game", game_id, {user_id: game_data[3]}, cancelled=True)
 
             # Удаляем только сохраненные сообщения (теперь их 2)
             if context and game_id in self.game_messages:
-                self.logger.info(f"Удаляем сообщения игры {game_id}: {self.game_messages[game_id]}")
+                self.logger.debug("Удаляем сообщения игры %s: %s", game_id, self.game_messages[game_id])
 
                 for msg_data in self.game_messages[game_id]:
                     try:
@@ -320,7 +310,7 @@ class GameManager:
             if game_id in self.active_games:
                 del self.active_games[game_id]
 
-            self.logger.info(f"Игра {game_id} отменена пользователем {user_id}")
+            self.logger.info("Игра %s отменена пользователем %s", game_id, user_id)
             return True, None
 
         except Exception as e:
@@ -355,39 +345,23 @@ class GameManager:
         return None
 
     def cleanup_old_games(self, timeout_minutes=5):
-        """Удаляет игры старше указанного времени"""
-        import time
-        import logging
-        logger = logging.getLogger(__name__)
-
-        current_time = time.time()
-        timeout_seconds = timeout_minutes * 60
-
-        games_to_remove = []
-
-        for game_id, game in list(self.active_games.items()):
-            if hasattr(game, 'created_at'):
-                game_age = current_time - game.created_at
-
-                # Удаляем игры которые ждут второго игрока слишком долго
-                if game_age > timeout_seconds and game.status == 'waiting':
-                    games_to_remove.append(game_id)
-
+        """Отменяет игры, которые слишком долго ждут второго игрока"""
+        games_to_remove = [
+            game_id for game_id, game in self.active_games.items()
+            if game.status == 'waiting'
+            and (datetime.now() - game.created_at).total_seconds() > timeout_minutes * 60
+        ]
+
+        refunds = []
         for game_id in games_to_remove:
-            game = self.active_games[game_id]
-
-            # Возвращаем ставку создателю
-            if hasattr(game, 'player1_id') and hasattr(game, 'bet_amount'):
-                try:
-                    self.db.update_balance(game.player1_id, game.bet_amount)
-                    logger.info(f"💰 Возвращена ставка ${game.bet_amount:.0f} игроку {game.player1_id}")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка возврата ставки: {e}")
-
-            # Удаляем игру
-            del self.active_games[game_id]
-            logger.info(f"🗑️ Удалена старая игра {game_id}")
-
+            game = self.active_games.pop(game_id)
+            # Возвращаем ставку создателю, только если игру еще можно отменить
+            if self.db.cancel_game(game_id):
+                refunds.append(self.settlement.plan("game", game_id, {game.player1_id: game.bet_amount},
+                                                    cancelled=True))
+            self.logger.info("🗑️ Удалена старая игра %s", game_id)
+
+        # Возвраты - одной транзакцией леджера
+        if refunds:
+            self.settlement.settle_many(refunds)
         return len(games_to_remove)
-
-
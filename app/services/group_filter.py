@@ -0,0 +1,83 @@
+# app/services/group_filter.py
+import logging
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class GroupMessageFilter:
+    """
+    Фильтр сообщений групповых чатов: отсекает шум до обработчиков
+
+    Статистика хранится по max_chats последним активным чатам; давно
+    молчавшие вытесняются, их счетчики остаются только в общих итогах.
+    """
+
+    GROUP_CHAT_TYPES = ("group", "supergroup")
+
+    def __init__(self, conversation_state, bot_id: Optional[int] = None, max_chats: int = 10000):
+        self.conversation_state = conversation_state
+        self.bot_id = bot_id
+        self.max_chats = max_chats
+        # chat_id -> [обработано, отброшено], от давно молчавших к активным
+        self.chat_stats: "OrderedDict[int, List[int]]" = OrderedDict()
+        self.totals = [0, 0]
+        logger.info("🔄 Фильтр групповых сообщений инициализирован")
+
+    def should_process(self, update) -> bool:
+        """Решает, нужно ли передавать обновление обработчикам"""
+        message = update.message or update.edited_message
+        chat = update.effective_chat
+
+        # Кнопки, приватные чаты и служебные обновления не фильтруем
+        if message is None or chat is None or chat.type not in self.GROUP_CHAT_TYPES:
+            return True
+
+        process = (
+            self._is_command(message)
+            or self._is_reply_to_bot(message)
+            or (message.from_user is not None
+                and self.conversation_state.has_pending(message.from_user.id))
+        )
+
+        counters = self.chat_stats.get(chat.id)
+        if counters is None:
+            counters = self.chat_stats[chat.id] = [0, 0]
+            if len(self.chat_stats) > self.max_chats:
+                self.chat_stats.popitem(last=False)
+        else:
+            self.chat_stats.move_to_end(chat.id)
+        counters[0 if process else 1] += 1
+        self.totals[0 if process else 1] += 1
+
+        return process
+
+    def get_chat_stats(self, chat_id: int) -> Tuple[int, int]:
+        """Возвращает (обработано, отброшено) для чата"""
+        counters = self.chat_stats.get(chat_id, (0, 0))
+        return counters[0], counters[1]
+
+    def get_totals(self) -> Tuple[int, int]:
+        """Возвращает (обработано, отброшено) по всем группам, включая вытесненные"""
+        return self.totals[0], self.totals[1]
+
+    def get_top_chats(self, limit: int = 10) -> List[Tuple[int, int, int]]:
+        """Самые шумные чаты: [(chat_id, обработано, отброшено)]"""
+        rows = [(chat_id, counters[0], counters[1]) for chat_id, counters in self.chat_stats.items()]
+        rows.sort(key=lambda row: row[1] + row[2], reverse=True)
+        return rows[:limit]
+
+    @staticmethod
+    def _is_command(message) -> bool:
+        text = message.text or message.caption
+        return bool(text) and text.startswith('/')
+
+    def _is_reply_to_bot(self, message) -> bool:
+        reply = message.reply_to_message
+        if reply is None or reply.from_user is None:
+            return False
+
+        if self.bot_id is not None:
+            return reply.from_user.id == self.bot_id
+        return reply.from_user.is_bot
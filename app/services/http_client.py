@@ -0,0 +1,194 @@
+# app/services/http_client.py
+import time
+import random
+import asyncio
+import logging
+from typing import NamedTuple, Optional
+
+import httpx
+
+from app.services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401 - HTTP/2 для httpx (pip install httpx[http2])
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Коды, после которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+HTTP_RETRIES_TOTAL = registry.counter(
+    'dicebot_http_retries_total', 'Повторные попытки исходящих HTTP-запросов', ('service', 'endpoint'))
+HTTP_HEDGES_TOTAL = registry.counter(
+    'dicebot_http_hedged_requests_total', 'Дублирующие (hedged) HTTP-запросы', ('service', 'endpoint'))
+HTTP_CIRCUIT_REJECTED_TOTAL = registry.counter(
+    'dicebot_http_circuit_rejected_total', 'Запросы, отклоненные открытым предохранителем', ('service',))
+
+
+class RequestPolicy(NamedTuple):
+    """Политика запроса к эндпоинту"""
+    timeout: float = 10.0
+    retries: int = 0  # Повторы только для идемпотентных запросов
+    hedge_after: Optional[float] = None  # Через сколько секунд отправить дублирующий запрос
+
+
+class CircuitOpenError(Exception):
+    """Предохранитель открыт: сервис недоступен, запрос не отправлялся"""
+
+
+class CircuitBreaker:
+    """Предохранитель: после серии ошибок сразу отклоняет запросы на reset_timeout секунд"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+
+        # HALF_OPEN: пропускаем только один пробный запрос
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def release_probe(self):
+        """Пробный запрос завершился без исхода (отмена, ошибка не сети): пропускаем следующий"""
+        self._probe_in_flight = False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("✅ Предохранитель закрыт: сервис снова отвечает")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"⚠️ Предохранитель открыт на {self.reset_timeout:.0f} сек "
+                               f"после {self.failures} ошибок подряд")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+
+class ResilientHttpClient:
+    """
+    HTTP-клиент с пулом keep-alive соединений, таймаутами по эндпоинтам,
+    повторами с джиттером, hedged-запросами и предохранителем
+    """
+
+    def __init__(self, service: str, headers: Optional[dict] = None,
+                 max_connections: int = 20, max_keepalive: int = 10, keepalive_expiry: float = 30.0,
+                 backoff_base: float = 0.2, backoff_max: float = 2.0,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.service = service
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.client = httpx.AsyncClient(
+            headers=headers,
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry
+            ),
+            timeout=10.0
+        )
+
+    async def request(self, method: str, url: str, endpoint: str, policy: RequestPolicy,
+                      **kwargs) -> httpx.Response:
+        """
+        Выполняет запрос по политике эндпоинта
+
+        Raises:
+            CircuitOpenError: предохранитель открыт
+            httpx.HTTPError: сетевая ошибка/таймаут после всех попыток
+        """
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                HTTP_CIRCUIT_REJECTED_TOTAL.inc(self.service)
+                raise CircuitOpenError(f"{self.service} недоступен (предохранитель открыт)")
+
+            try:
+                response = await self._send_hedged(method, url, endpoint, policy, **kwargs)
+            except httpx.TransportError:
+                self.breaker.record_failure()
+                if attempt >= policy.retries:
+                    raise
+            except BaseException:
+                # Отмена или ошибка не сети (например, httpx.DecodingError) ничего не
+                # говорит о сервисе, но пробный запрос должен освободиться, иначе
+                # предохранитель навсегда останется в HALF_OPEN
+                self.breaker.release_probe()
+                raise
+            else:
+                if response.status_code not in RETRYABLE_STATUSES:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                if attempt >= policy.retries:
+                    return response
+
+            attempt += 1
+            HTTP_RETRIES_TOTAL.inc(self.service, endpoint)
+            await asyncio.sleep(self._backoff(attempt))
+
+    def _backoff(self, attempt: int) -> float:
+        """Экспоненциальная задержка с полным джиттером"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _send(self, method: str, url: str, policy: RequestPolicy, **kwargs) -> httpx.Response:
+        return await self.client.request(method, url, timeout=policy.timeout, **kwargs)
+
+    async def _send_hedged(self, method: str, url: str, endpoint: str, policy: RequestPolicy,
+                           **kwargs) -> httpx.Response:
+        """Если ответа нет дольше hedge_after, отправляет второй запрос и берет первый успешный"""
+        if policy.hedge_after is None:
+            return await self._send(method, url, policy, **kwargs)
+
+        primary = asyncio.ensure_future(self._send(method, url, policy, **kwargs))
+        done, _ = await asyncio.wait({primary}, timeout=policy.hedge_after)
+        if done:
+            return primary.result()
+
+        HTTP_HEDGES_TOTAL.inc(self.service, endpoint)
+        hedge = asyncio.ensure_future(self._send(method, url, policy, **kwargs))
+        pending = {primary, hedge}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                if not pending:
+                    # Обе попытки упали - пробрасываем ошибку основной
+                    return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def aclose(self):
+        await self.client.aclose()
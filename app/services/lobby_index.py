@@ -0,0 +1,103 @@
+# app/services/lobby_index.py
+import bisect
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+class LobbyIndex:
+    """
+    Индекс ожидающих лобби для поиска по ставке и свободным местам
+
+    Лобби разложены по корзинам (ставка, свободных мест); ставки хранятся
+    отсортированным списком, поэтому диапазон ставок находится бинарным
+    поиском за O(log n), а перенос лобби между корзинами при входе/выходе
+    игрока стоит O(1). Внутри корзины - порядок создания (старые первыми),
+    а почти заполненные лобби идут раньше: так лобби быстрее стартуют.
+    """
+
+    def __init__(self):
+        self._bets: List[float] = []  # отсортированные ставки, у которых есть лобби
+        self._buckets: Dict[float, Dict[int, Dict[str, None]]] = {}  # ставка -> свободно -> лобби
+        self._where: Dict[str, Tuple[float, int]] = {}  # лобби -> (ставка, свободно)
+        self._open_counts: Dict[float, int] = {}  # ставка -> лобби со свободными местами
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, lobby_id: str) -> bool:
+        return lobby_id in self._where
+
+    # ==================== ОБНОВЛЕНИЕ ====================
+
+    def update(self, lobby):
+        """Переносит лобби в корзину по текущему числу мест (или убирает, если игра началась)"""
+        if lobby.status != "waiting":
+            self.remove(lobby.id)
+            return
+
+        key = (lobby.bet_amount, lobby.max_players - lobby.get_player_count())
+        if self._where.get(lobby.id) == key:
+            return
+        self.remove(lobby.id)
+
+        bet, free = key
+        seats = self._buckets.get(bet)
+        if seats is None:
+            seats = self._buckets[bet] = {}
+            bisect.insort(self._bets, bet)
+        seats.setdefault(free, {})[lobby.id] = None
+        self._where[lobby.id] = key
+        if free > 0:
+            self._open_counts[bet] = self._open_counts.get(bet, 0) + 1
+
+    def remove(self, lobby_id: str):
+        key = self._where.pop(lobby_id, None)
+        if key is None:
+            return
+
+        bet, free = key
+        seats = self._buckets[bet]
+        del seats[free][lobby_id]
+        if not seats[free]:
+            del seats[free]
+        if free > 0:
+            self._open_counts[bet] -= 1
+            if not self._open_counts[bet]:
+                del self._open_counts[bet]
+        if not seats:
+            del self._buckets[bet]
+            del self._bets[bisect.bisect_left(self._bets, bet)]
+
+    # ==================== ПОИСК ====================
+
+    def iter_open(self, min_bet: Optional[float] = None, max_bet: Optional[float] = None,
+                  min_free: int = 1) -> Iterator[str]:
+        """ID лобби со ставкой в [min_bet, max_bet] и не меньше min_free свободных мест"""
+        start = 0 if min_bet is None else bisect.bisect_left(self._bets, min_bet)
+        stop = len(self._bets) if max_bet is None else bisect.bisect_right(self._bets, max_bet)
+        for bet in self._bets[start:stop]:
+            seats = self._buckets[bet]
+            for free in sorted(seats):
+                if free >= min_free:
+                    yield from seats[free]
+
+    def find(self, min_bet: Optional[float] = None, max_bet: Optional[float] = None,
+             min_free: int = 1) -> Optional[str]:
+        """Первое подходящее лобби"""
+        return next(self.iter_open(min_bet, max_bet, min_free), None)
+
+    def page(self, bet: Optional[float] = None, page: int = 0,
+             page_size: int = 8) -> Tuple[List[str], bool]:
+        """Страница открытых лобби (bet=None - все ставки); (ID, есть ли следующая)"""
+        found = list(islice(self.iter_open(bet, bet), page * page_size, (page + 1) * page_size + 1))
+        return found[:page_size], len(found) > page_size
+
+    def count_open(self, bet: Optional[float] = None) -> int:
+        """Число лобби со свободными местами"""
+        if bet is None:
+            return sum(self._open_counts.values())
+        return self._open_counts.get(bet, 0)
+
+    def waiting_ids(self) -> Iterator[str]:
+        """Все ожидающие лобби, включая заполненные"""
+        return iter(self._where)
@@ -1,27 +1,38 @@
 # app/services/lobby_manager.py
-import uuid
-import json
 import asyncio
 import logging
 import time
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 
 from app.models.lobby import Lobby, LobbyPlayer
+from app.services.id_allocator import IdAllocator
+from app.services.lobby_index import LobbyIndex
+from app.services.metrics import registry
+from app.services.tracing import tracer
+from app.utils.logging_setup import SAMPLED
 
 logger = logging.getLogger(__name__)
 
+LOBBY_WRITES_TOTAL = registry.counter(
+    'dicebot_lobby_writes_total', 'Сохранения лобби: запрошенные и записанные строки', ('kind',))
+
 
 class LobbyManager:
     """Менеджер для управления лобби"""
 
-    def __init__(self, db):
+    def __init__(self, db, flush_delay: float = 0.5):
         self.db = db
         self.lobbies: Dict[str, Lobby] = {}  # lobby_id -> Lobby object
+        self.index = LobbyIndex()  # ожидающие лобби по ставке и свободным местам
+        self.ids = IdAllocator('lobby', db, length=8)
+        self.flush_delay = flush_delay
+        self._pending: Dict[str, Lobby] = {}  # лобби, ждущие записи в БД
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
         logger.info("🔄 Менеджер лобби инициализирован")
 
     def create_lobby(self, creator_id: int, creator_name: str,
-                     bet_amount: float, max_players: int) -> Lobby:
-        """Создает новое лобби"""
+                     bet_amount: float, max_players: int, tournament: Optional[str] = None) -> Lobby:
+        """Создает новое лобби (tournament - формат турнира вместо одной общей игры)"""
         lobby_id = self._generate_lobby_id()
 
         # Создаем лобби
@@ -30,7 +41,8 @@ class LobbyManager:
             creator_id=creator_id,
             creator_name=creator_name,
             max_players=max_players,
-            bet_amount=bet_amount
+            bet_amount=bet_amount,
+            tournament=tournament
         )
 
         # Добавляем создателя как игрока
@@ -43,7 +55,8 @@ class LobbyManager:
 
         # Сохраняем
         self.lobbies[lobby_id] = lobby
-        logger.info(f"🎲 Создано лобби {lobby_id} для {creator_name}")
+        self.index.update(lobby)
+        logger.info("🎲 Создано лобби %s для %s", lobby_id, creator_name)
 
         return lobby
 
@@ -51,12 +64,16 @@ class LobbyManager:
         """Получает лобби по ID"""
         return self.lobbies.get(lobby_id)
 
+    @tracer.traced()
     def join_lobby(self, lobby_id: str, user_id: int, username: str) -> tuple[bool, str]:
         """Присоединяет игрока к лобби"""
         lobby = self.get_lobby(lobby_id)
         if not lobby:
             return False, "Лобби не найдено"
 
+        if lobby.status != "waiting":
+            return False, "Игра уже началась"
+
         if lobby.is_full():
             return False, "Лобби заполнено"
 
@@ -71,7 +88,8 @@ class LobbyManager:
         )
 
         if lobby.add_player(player):
-            logger.info(f"👤 Игрок {username} присоединился к лобби {lobby_id}")
+            self.index.update(lobby)
+            logger.info("👤 Игрок %s присоединился к лобби %s", username, lobby_id, extra=SAMPLED)
             return True, "Вы присоединились к лобби"
 
         return False, "Ошибка присоединения"
@@ -85,9 +103,14 @@ class LobbyManager:
         if not lobby.get_player(user_id):
             return False, "Вы не в этом лобби"
 
+        # Ставки начатой игры уже в банке: выход с возвратом закрыт
+        if lobby.status != "waiting":
+            return False, "Игра уже началась"
+
         # Удаляем игрока
         lobby.remove_player(user_id)
-        logger.info(f"👤 Игрок {user_id} вышел из лобби {lobby_id}")
+        self.index.update(lobby)
+        logger.info("👤 Игрок %s вышел из лобби %s", user_id, lobby_id, extra=SAMPLED)
 
         # Если лобби пустое - удаляем его
         if not lobby.players:
@@ -96,13 +119,14 @@ class LobbyManager:
 
         # Если вышел создатель - назначаем нового
         if user_id == lobby.creator_id and lobby.players:
-            new_creator = lobby.players[0]
+            new_creator = lobby.first_player()
             lobby.creator_id = new_creator.id
             lobby.creator_name = new_creator.username
-            logger.info(f"👑 Новый владелец лобби {lobby_id}: {new_creator.username}")
+            logger.info("👑 Новый владелец лобби %s: %s", lobby_id, new_creator.username)
 
         return True, "Вы вышли из лобби"
 
+    @tracer.traced()
     def toggle_ready(self, lobby_id: str, user_id: int) -> tuple[bool, str]:
         """Переключает статус готовности игрока"""
         lobby = self.get_lobby(lobby_id)
@@ -113,9 +137,9 @@ class LobbyManager:
         if not player:
             return False, "Вы не в этом лобби"
 
-        player.ready = not player.ready
+        lobby.toggle_player_ready(user_id)
         status = "готов" if player.ready else "не готов"
-        logger.info(f"✅ Игрок {player.username} теперь {status}")
+        logger.info("✅ Игрок %s теперь %s", player.username, status, extra=SAMPLED)
 
         return True, f"Вы теперь {status}"
 
@@ -123,11 +147,15 @@ class LobbyManager:
         """Удаляет лобби"""
         if lobby_id in self.lobbies:
             del self.lobbies[lobby_id]
-            logger.info(f"🗑 Удалено лобби {lobby_id}")
+            logger.info("🗑 Удалено лобби %s", lobby_id)
+        self.index.remove(lobby_id)
+        # Отложенная запись удаленного лобби не должна воскресить его в БД
+        self._pending.pop(lobby_id, None)
+        self._delete_from_db(lobby_id)
 
     def _generate_lobby_id(self) -> str:
         """Генерирует уникальный ID для лобби"""
-        return uuid.uuid4().hex[:8].upper()
+        return self.ids.next_code()
 
     async def start_lobby_timer(self, lobby_id: str, callback_func, timeout: int = 30):
         """Запускает таймер для лобби"""
@@ -156,64 +184,121 @@ class LobbyManager:
             logger.error(f"❌ Ошибка таймера лобби {lobby_id}: {e}")
 
     def get_active_lobbies(self) -> Dict[str, Lobby]:
-        """Получает все активные лобби"""
-        return {lid: lobby for lid, lobby in self.lobbies.items()
-                if lobby.status == "waiting"}
-
-    def save_lobby_to_db(self, lobby: Lobby):
-        """Сохраняет лобби в базу данных"""
+        """Получает все ожидающие лобби (из индекса, без обхода завершенных)"""
+        return {lid: self.lobbies[lid] for lid in self.index.waiting_ids()}
+
+    def start_lobby(self, lobby: Lobby):
+        """Переводит лобби в игру: оно пропадает из поиска"""
+        lobby.status = "active"
+        self.index.update(lobby)
+        self.save_lobby_to_db(lobby)
+
+    def reopen_lobby(self, lobby: Lobby):
+        """Возвращает лобби в ожидание (игра не запустилась): оно снова в поиске"""
+        lobby.status = "waiting"
+        self.index.update(lobby)
+        self.save_lobby_to_db(lobby)
+
+    def browse_lobbies(self, bet: Optional[float] = None, page: int = 0,
+                       page_size: int = 8) -> Tuple[List[Lobby], bool]:
+        """Страница открытых лобби для поиска: (лобби, есть ли следующая страница)"""
+        lobby_ids, has_more = self.index.page(bet, page, page_size)
+        return [self.lobbies[lobby_id] for lobby_id in lobby_ids], has_more
+
+    def save_lobby_to_db(self, lobby: Lobby) -> bool:
+        """
+        Ставит лобби в очередь на сохранение (write-behind)
+
+        Изменения одного лобби за flush_delay секунд сливаются в одну запись:
+        строка лобби + UPSERT только измененных игроков. Вне event loop
+        (скрипты, тесты) и при flush_delay = 0 пишет сразу.
+        """
+        self._pending[lobby.id] = lobby
+        LOBBY_WRITES_TOTAL.inc("requested")
+
+        if self.flush_delay <= 0:
+            return self.flush()
         try:
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-
-            # Преобразуем игроков в JSON
-            players_json = json.dumps([p.to_dict() for p in lobby.players])
-
-            # Проверяем существует ли лобби в БД
-            cursor.execute("SELECT id FROM lobbies WHERE id = ?", (lobby.id,))
-            exists = cursor.fetchone()
-
-            if exists:
-                # Обновляем существующее
-                cursor.execute('''
-                    UPDATE lobbies 
-                    SET creator_id = ?, creator_name = ?, max_players = ?, 
-                        bet_amount = ?, players = ?, status = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                ''', (
-                    lobby.creator_id,
-                    lobby.creator_name,
-                    lobby.max_players,
-                    lobby.bet_amount,
-                    players_json,
-                    lobby.status,
-                    lobby.id
-                ))
-            else:
-                # Вставляем новое
-                cursor.execute('''
-                    INSERT INTO lobbies 
-                    (id, creator_id, creator_name, max_players, bet_amount, players, status)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    lobby.id,
-                    lobby.creator_id,
-                    lobby.creator_name,
-                    lobby.max_players,
-                    lobby.bet_amount,
-                    players_json,
-                    lobby.status
-                ))
-
-            conn.commit()
-            conn.close()
-            logger.debug(f"💾 Лобби {lobby.id} сохранено в БД")
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self.flush()
+
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.flush_delay, self._flush_scheduled)
+        return True
+
+    def _flush_scheduled(self):
+        self._flush_handle = None
+        self.flush()
+
+    @tracer.traced()
+    def flush(self) -> bool:
+        """Записывает все отложенные изменения лобби одной транзакцией"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
             return True
 
+        pending, self._pending = self._pending, {}
+        rows, removed = [], []
+        for lobby_id, lobby in pending.items():
+            changed, removed_ids = lobby.pending_changes()
+            rows.extend((lobby_id, p.id, p.username, p.ready, p.paid, p.last_roll) for p in changed)
+            removed.extend((lobby_id, user_id) for user_id in removed_ids)
+
+        try:
+            conn = self.db.get_connection()
+            try:
+                with conn:
+                    conn.executemany('''
+                        INSERT INTO lobbies (id, creator_id, creator_name, max_players, bet_amount, status)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (id) DO UPDATE SET
+                            creator_id = excluded.creator_id,
+                            creator_name = excluded.creator_name,
+                            status = excluded.status,
+                            updated_at = CURRENT_TIMESTAMP
+                    ''', [(lobby.id, lobby.creator_id, lobby.creator_name, lobby.max_players,
+                           lobby.bet_amount, lobby.status) for lobby in pending.values()])
+                    conn.executemany('''
+                        INSERT INTO lobby_players (lobby_id, player_id, username, ready, paid, last_roll)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (lobby_id, player_id) DO UPDATE SET
+                            ready = excluded.ready,
+                            paid = excluded.paid,
+                            last_roll = excluded.last_roll
+                    ''', rows)
+                    conn.executemany('DELETE FROM lobby_players WHERE lobby_id = ? AND player_id = ?', removed)
+            finally:
+                conn.close()
         except Exception as e:
-            logger.error(f"❌ Ошибка сохранения лобби {lobby.id}: {e}")
+            logger.error(f"❌ Ошибка сохранения лобби {', '.join(pending)}: {e}")
+            # Изменения остаются в лобби - попадут в следующую запись
+            for lobby_id, lobby in pending.items():
+                self._pending.setdefault(lobby_id, lobby)
             return False
 
+        for lobby in pending.values():
+            lobby.clear_changes()
+        LOBBY_WRITES_TOTAL.inc("lobby", amount=len(pending))
+        LOBBY_WRITES_TOTAL.inc("player", amount=len(rows) + len(removed))
+        logger.debug("💾 Сохранено лобби: %s, строк игроков: %s", len(pending), len(rows) + len(removed))
+        return True
+
+    def _delete_from_db(self, lobby_id: str):
+        """Удаляет лобби и его игроков из БД"""
+        try:
+            conn = self.db.get_connection()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM lobby_players WHERE lobby_id = ?", (lobby_id,))
+                    conn.execute("DELETE FROM lobbies WHERE id = ?", (lobby_id,))
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"❌ Ошибка удаления лобби {lobby_id} из БД: {e}")
+
     def cleanup_old_lobbies(self, timeout_minutes=5):
         """Удаляет лобби старше указанного времени (по умолчанию 5 минут)"""
         # Убираем import time - он уже в начале файла
@@ -241,7 +326,7 @@ class LobbyManager:
         for lobby_id, lobby in lobbies_to_remove:
             # Возвращаем ставку создателю если он один и оплатил
             if len(lobby.players) == 1:
-                creator = lobby.players[0]
+                creator = lobby.first_player()
                 if creator.paid and lobby.bet_amount > 0:
                     try:
                         self.db.update_balance(creator.id, lobby.bet_amount)
@@ -250,18 +335,11 @@ class LobbyManager:
                     except Exception as e:
                         logger.error(f"❌ Ошибка возврата ставки создателю {creator.id}: {e}")
 
-            # Удаляем из памяти
+            # Удаляем из памяти и из БД
             del self.lobbies[lobby_id]
-
-            # Удаляем из БД
-            try:
-                conn = self.db.get_connection()
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM lobbies WHERE id = ?", (lobby_id,))
-                conn.commit()
-                conn.close()
-            except Exception as e:
-                logger.error(f"❌ Ошибка удаления лобби {lobby_id} из БД: {e}")
+            self.index.remove(lobby_id)
+            self._pending.pop(lobby_id, None)
+            self._delete_from_db(lobby_id)
 
             age_minutes = lobby_age // 60
             logger.info(
@@ -0,0 +1,186 @@
+# app/services/lobby_rounds.py
+import asyncio
+import logging
+import secrets
+import time
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from app.utils.logging_setup import SAMPLED
+
+logger = logging.getLogger(__name__)
+
+
+class RoundResult(NamedTuple):
+    round_number: int
+    rolls: Dict[int, int]  # игрок -> бросок этого раунда
+    auto_rolled: List[int]  # не успели до дедлайна: бросок сделал бот
+    finished: bool
+
+
+class LobbyRoundGame:
+    """
+    Игра лобби с одновременными ходами
+
+    Игра идет раундами: в каждом раунде все игроки бросают кости
+    параллельно, раунд закрывается, когда бросили все или истек дедлайн
+    (за не успевших бросает бот). Длительность игры - O(раундов),
+    а не O(игроков × бросков). Броски и закрытие раунда сериализуются
+    замком игры, поэтому бросок не попадет в уже закрытый раунд.
+
+    on_round_closed вызывается вне замка в фоновой задаче, поэтому
+    последний бросок не ждет рассылки итогов. Номер следующего раунда к
+    этому моменту уже известен (для кнопок), а сам раунд и его таймер
+    открываются только после того, как уведомление отработало.
+    """
+
+    def __init__(self, game_id: str, lobby_id: str, players, bet_amount: float,
+                 rounds: int = 3, round_timeout: float = 30.0,
+                 on_round_closed: Optional[Callable[['LobbyRoundGame', RoundResult], Awaitable]] = None):
+        self.game_id = game_id
+        self.lobby_id = lobby_id
+        self.players = {player.id: player for player in players}
+        self.bet_amount = bet_amount
+        self.rounds = rounds
+        self.round_timeout = round_timeout
+        self.on_round_closed = on_round_closed
+
+        self.rolls: Dict[int, List[int]] = {player_id: [] for player_id in self.players}
+        self.round_number = 1  # раунд, кнопки которого рассылаются; открыт после start()
+        self.round_deadline: Optional[float] = None
+        self.status = "active"  # active, finished
+        self._round_open = False
+        self._pending: Dict[int, int] = {}  # броски текущего раунда
+        self._lock = asyncio.Lock()
+        self._deadline_task: Optional[asyncio.Task] = None
+        self._notify_task: Optional[asyncio.Task] = None
+
+    # ==================== РАУНДЫ ====================
+
+    def start(self):
+        """Открывает первый раунд (после рассылки его кнопок)"""
+        if self.status == "active" and not self._round_open:
+            self._open_round()
+
+    def _open_round(self):
+        self._round_open = True
+        self.round_deadline = time.time() + self.round_timeout
+        self._deadline_task = asyncio.create_task(self._close_on_deadline(self.round_number))
+        logger.info("🎲 %s: раунд %s/%s открыт", self.game_id, self.round_number, self.rounds, extra=SAMPLED)
+
+    async def _close_on_deadline(self, round_number: int):
+        await asyncio.sleep(self.round_timeout)
+        async with self._lock:
+            if not (self._round_open and self.round_number == round_number):
+                return
+            result = self._close_round()
+        await self._after_round(result)
+
+    def _close_round(self) -> RoundResult:
+        """Закрывает текущий раунд (вызывается под замком)"""
+        if self._deadline_task and self._deadline_task is not asyncio.current_task():
+            self._deadline_task.cancel()
+        self._deadline_task = None
+        self._round_open = False
+
+        auto_rolled = [player_id for player_id in self.players if player_id not in self._pending]
+        for player_id in auto_rolled:
+            self._pending[player_id] = secrets.randbelow(6) + 1
+        for player_id, value in self._pending.items():
+            self.rolls[player_id].append(value)
+
+        finished = self.round_number >= self.rounds
+        result = RoundResult(self.round_number, dict(self._pending), auto_rolled, finished)
+        self._pending = {}
+        if finished:
+            self.status = "finished"
+        else:
+            self.round_number += 1
+        return result
+
+    async def _after_round(self, result: RoundResult):
+        """Уведомление о закрытом раунде, затем открытие следующего (вне замка)"""
+        if self.on_round_closed:
+            try:
+                await self.on_round_closed(self, result)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки раунда {result.round_number} игры {self.game_id}: {e}")
+
+        async with self._lock:
+            if self.status == "active" and not self._round_open:
+                self._open_round()
+
+    # ==================== БРОСКИ ====================
+
+    def can_roll(self, player_id: int, round_number: int = None) -> Tuple[bool, Optional[str]]:
+        """Быстрая проверка до броска кубика (без замка)"""
+        if self.status != "active":
+            return False, "Игра завершена"
+        if player_id not in self.players:
+            return False, "Вы не участвуете в этой игре"
+        if round_number is not None and round_number != self.round_number:
+            return False, "Раунд уже закрыт"
+        if not self._round_open:
+            return False, "Раунд еще не начался, попробуйте через пару секунд"
+        if player_id in self._pending:
+            return False, "Вы уже бросили в этом раунде"
+        return True, None
+
+    async def roll(self, player_id: int, value: int, round_number: int = None) -> Tuple[bool, Optional[str]]:
+        """
+        Засчитывает бросок игрока в текущем раунде
+
+        round_number - раунд, в котором игрок нажал кнопку: бросок,
+        пришедший после закрытия этого раунда, отклоняется. Последний
+        бросок закрывает раунд, а уведомление о его итогах уходит в фон.
+        """
+        result = None
+        async with self._lock:
+            ok, error = self.can_roll(player_id, round_number)
+            if not ok:
+                return False, error
+
+            self._pending[player_id] = value
+            if len(self._pending) == len(self.players):
+                result = self._close_round()
+
+        if result:
+            # Ссылку держим: иначе задачу может собрать сборщик мусора
+            self._notify_task = asyncio.create_task(self._after_round(result))
+        return True, None
+
+    async def wait_notified(self):
+        """Дожидается уведомления о последнем закрытом раунде (и вложенных)"""
+        while self._notify_task and not self._notify_task.done():
+            await asyncio.shield(self._notify_task)
+
+    def add_round(self):
+        """
+        Дополнительный раунд после завершения (переигровка ничьей)
+
+        Вызывается из on_round_closed последнего раунда: номер раунда
+        растет сразу (для кнопок), раунд откроется после уведомления.
+        """
+        self.rounds += 1
+        self.round_number += 1
+        self.status = "active"
+
+    def cancel(self):
+        """Останавливает таймер раунда (игра снята)"""
+        self.status = "finished"
+        self._round_open = False
+        if self._deadline_task:
+            self._deadline_task.cancel()
+            self._deadline_task = None
+
+    # ==================== ИТОГИ ====================
+
+    def totals(self) -> List[Tuple[object, int, List[int]]]:
+        """(игрок, сумма, броски) по убыванию суммы"""
+        results = [(player, sum(self.rolls[player_id]), self.rolls[player_id])
+                   for player_id, player in self.players.items()]
+        results.sort(key=lambda item: item[1], reverse=True)
+        return results
+
+    def waiting_for(self) -> List[int]:
+        """Игроки, еще не бросившие в текущем раунде"""
+        return [player_id for player_id in self.players if player_id not in self._pending]
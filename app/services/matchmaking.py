@@ -0,0 +1,190 @@
+# app/services/matchmaking.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from app.services.metrics import registry
+from app.services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+BET_TIERS = (1, 5, 10, 25, 50, 100)
+
+MATCHMAKING_WAIT_SECONDS = registry.histogram(
+    'dicebot_matchmaking_wait_seconds', 'Время от входа в очередь подбора до игры', ('tier',),
+    buckets=(1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0))
+MATCHMAKING_MATCHES_TOTAL = registry.counter(
+    'dicebot_matchmaking_matches_total', 'Игры, созданные подбором соперника', ('tier',))
+MATCHMAKING_DROPPED_TOTAL = registry.counter(
+    'dicebot_matchmaking_dropped_total', 'Игроки, снятые с очереди подбора', ('reason',))
+MATCHMAKING_QUEUE_DEPTH = registry.gauge(
+    'dicebot_matchmaking_queue_depth', 'Игроки в очереди подбора')
+
+
+class QueueEntry(NamedTuple):
+    user_id: int
+    username: str
+    tier: float
+    enqueued_at: float
+
+
+class MatchmakingService:
+    """
+    Очередь быстрого подбора соперника для игр 1 на 1
+
+    Игроки встают в очередь своей ставки (тира); фоновый цикл раз в
+    interval секунд разбирает очереди пачкой и сводит игроков в пары по
+    порядку входа. Игра создается сразу с двумя игроками, обе ставки
+    списываются в одной транзакции (GameManager.create_matched_game).
+    Если у игрока не хватило средств, он снимается с очереди, а его пара
+    возвращается в начало очереди. При сбое создания игры в начало
+    очереди возвращаются оба игрока.
+    """
+
+    def __init__(self, game_manager, interval: float = 1.0, max_wait: float = 300.0,
+                 on_match: Optional[Callable[[object], Awaitable]] = None,
+                 on_dropped: Optional[Callable[[int, str], Awaitable]] = None):
+        self.game_manager = game_manager
+        self.interval = interval
+        self.max_wait = max_wait
+        self.on_match = on_match
+        self.on_dropped = on_dropped
+
+        self._queues: Dict[float, OrderedDict] = {tier: OrderedDict() for tier in BET_TIERS}
+        self._tier_of: Dict[int, float] = {}  # игрок -> тир, в очереди которого он стоит
+        self._task: Optional[asyncio.Task] = None
+        MATCHMAKING_QUEUE_DEPTH.set_function(lambda: len(self._tier_of))
+
+    # ==================== ОЧЕРЕДЬ ====================
+
+    def enqueue(self, user_id: int, username: str, tier: float) -> Tuple[bool, Optional[str]]:
+        """Ставит игрока в очередь тира"""
+        if tier not in self._queues:
+            return False, "Неизвестная ставка"
+        if user_id in self._tier_of:
+            return False, f"Вы уже ищете соперника (${self._tier_of[user_id]:g})"
+
+        user = self.game_manager.db.get_user(user_id)
+        if not user:
+            return False, "Пользователь не найден"
+        if user[4] < tier:
+            return False, f"Недостаточно средств. Баланс: ${user[4]:.2f}"
+
+        self._queues[tier][user_id] = QueueEntry(user_id, username, tier, time.time())
+        self._tier_of[user_id] = tier
+        logger.info(f"🔎 {username} ищет соперника (${tier:g}), в очереди: {len(self._queues[tier])}")
+        return True, None
+
+    def dequeue(self, user_id: int) -> bool:
+        """Убирает игрока из очереди (отмена поиска)"""
+        tier = self._tier_of.pop(user_id, None)
+        if tier is None:
+            return False
+        del self._queues[tier][user_id]
+        return True
+
+    def queue_depth(self, tier: Optional[float] = None) -> int:
+        if tier is None:
+            return len(self._tier_of)
+        return len(self._queues.get(tier, ()))
+
+    def is_queued(self, user_id: int) -> bool:
+        return user_id in self._tier_of
+
+    # ==================== ПОДБОР ====================
+
+    @tracer.traced()
+    def match_once(self) -> Tuple[List[object], List[Tuple[int, str]]]:
+        """Один проход подбора по всем тирам: (созданные игры, [(снятый игрок, причина)])"""
+        games, dropped = [], []
+        now = time.time()
+
+        for tier, queue in self._queues.items():
+            # Истекшие ожидания
+            while queue:
+                entry = next(iter(queue.values()))
+                if now - entry.enqueued_at < self.max_wait:
+                    break
+                self.dequeue(entry.user_id)
+                dropped.append((entry.user_id, "timeout"))
+
+            while len(queue) >= 2:
+                first = self._pop(queue)
+                second = self._pop(queue)
+
+                try:
+                    game, short_player = self.game_manager.create_matched_game(
+                        first.user_id, first.username, second.user_id, second.username, tier)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка создания игры подбора (${tier:g}): {e}")
+                    game, short_player = None, None
+
+                if not game and short_player is None:
+                    # Сбой не по вине игроков: пара возвращается в начало очереди,
+                    # тир разбирается в следующем проходе
+                    self._push_front(queue, second)
+                    self._push_front(queue, first)
+                    break
+                if not game:
+                    # Пара без средств выбывает, второй игрок остается первым в очереди
+                    keep = second if short_player == first.user_id else first
+                    self._push_front(queue, keep)
+                    dropped.append((short_player, "insufficient_funds"))
+                    continue
+
+                for entry in (first, second):
+                    MATCHMAKING_WAIT_SECONDS.observe(now - entry.enqueued_at, f"{tier:g}")
+                MATCHMAKING_MATCHES_TOTAL.inc(f"{tier:g}")
+                games.append(game)
+
+        for _, reason in dropped:
+            MATCHMAKING_DROPPED_TOTAL.inc(reason)
+        return games, dropped
+
+    def _pop(self, queue: OrderedDict) -> QueueEntry:
+        _, entry = queue.popitem(last=False)
+        del self._tier_of[entry.user_id]
+        return entry
+
+    def _push_front(self, queue: OrderedDict, entry: QueueEntry):
+        queue[entry.user_id] = entry
+        queue.move_to_end(entry.user_id, last=False)
+        self._tier_of[entry.user_id] = entry.tier
+
+    async def run_once(self):
+        """Проход подбора и уведомления игроков"""
+        games, dropped = self.match_once()
+        notifications = []
+        if self.on_match:
+            notifications += [self.on_match(game) for game in games]
+        if self.on_dropped:
+            notifications += [self.on_dropped(user_id, reason) for user_id, reason in dropped]
+        for result in await asyncio.gather(*notifications, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(f"❌ Ошибка уведомления подбора: {result}")
+
+    # ==================== ФОНОВЫЙ ЦИКЛ ====================
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🔎 Подбор соперников запущен (раз в {self.interval} сек)")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"❌ Ошибка подбора соперников: {e}")
@@ -0,0 +1,296 @@
+# app/services/metrics.py
+import re
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from bisect import bisect_left
+from typing import Callable, Collection, Dict, List, Optional, Tuple
+
+from app.services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+    """Монотонно растущий счетчик"""
+
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1.0):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def get(self, *label_values: str) -> float:
+        return self.values.get(label_values, 0.0)
+
+    def render(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.label_names, labels)} {value}'
+                for labels, value in sorted(self.values.items())]
+
+
+class Gauge:
+    """Текущее значение, вычисляется при каждом запросе /metrics"""
+
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.callback: Optional[Callable[[], float]] = None
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, callback: Callable[[], float]):
+        self.callback = callback
+
+    def get(self) -> float:
+        if self.callback is not None:
+            try:
+                return float(self.callback())
+            except Exception as e:
+                logger.error(f"❌ Ошибка вычисления метрики {self.name}: {e}")
+                return 0.0
+        return self.value
+
+    def render(self) -> List[str]:
+        return [f'{self.name} {self.get()}']
+
+
+class Histogram:
+    """Распределение длительностей по корзинам"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        # labels -> [счетчики по корзинам..., +Inf], сумма
+        self.series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1][0] += value
+
+    def count(self, *label_values: str) -> int:
+        series = self.series.get(label_values)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = []
+        for labels, (counts, total) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f'{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}')
+            cumulative += counts[-1]
+            le = 'le="+Inf"'
+            lines.append(f'{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.label_names, labels)} {total[0]}')
+            lines.append(f'{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """Реестр метрик в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._register(Gauge(name, documentation))
+
+    def histogram(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            return self.metrics[metric.name]
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Глобальный реестр (как config = Config())
+registry = MetricsRegistry()
+
+UPDATES_TOTAL = registry.counter(
+    'dicebot_updates_total', 'Обработанные обновления Telegram', ('kind',))
+HANDLER_SECONDS = registry.histogram(
+    'dicebot_handler_seconds', 'Время обработки обновления', ('kind',))
+DB_QUERY_SECONDS = registry.histogram(
+    'dicebot_db_query_seconds', 'Время выполнения SQL-запроса', ('operation',))
+DB_ERRORS_TOTAL = registry.counter(
+    'dicebot_db_errors_total', 'Ошибки SQL-запросов', ('operation',))
+CRYPTO_PAY_SECONDS = registry.histogram(
+    'dicebot_crypto_pay_request_seconds', 'Время запроса к Crypto Pay API', ('endpoint',))
+CRYPTO_PAY_REQUESTS_TOTAL = registry.counter(
+    'dicebot_crypto_pay_requests_total', 'Запросы к Crypto Pay API', ('endpoint', 'outcome'))
+CRYPTO_PAY_WEBHOOKS_TOTAL = registry.counter(
+    'dicebot_crypto_pay_webhooks_total', 'Входящие вебхуки Crypto Pay', ('outcome',))
+TELEGRAM_API_SECONDS = registry.histogram(
+    'dicebot_telegram_api_seconds', 'Время запроса к Telegram Bot API', ('method',))
+TELEGRAM_API_ERRORS_TOTAL = registry.counter(
+    'dicebot_telegram_api_errors_total', 'Ошибки запросов к Telegram Bot API', ('method', 'error'))
+EXCHANGE_RATES_AGE = registry.gauge('dicebot_exchange_rates_age_seconds', 'Возраст снимка курсов валют')
+ACTIVE_GAMES = registry.gauge('dicebot_active_games', 'Активные игры 1 на 1')
+ACTIVE_LOBBIES = registry.gauge('dicebot_active_lobbies', 'Открытые лобби')
+ACTIVE_DUELS = registry.gauge('dicebot_active_duels', 'Активные дуэли')
+
+_SQL_OPERATION = re.compile(r'^\s*(\w+)')
+
+
+def sql_operation(sql: str) -> str:
+    """SELECT/INSERT/UPDATE/... - метка для метрик SQL"""
+    match = _SQL_OPERATION.match(sql)
+    return match.group(1).upper() if match else 'OTHER'
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Курсор SQLite, замеряющий время каждого запроса (метрика + спан трассы)"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        operation = sql_operation(sql)
+        try:
+            with tracer.span('sql', operation=operation):
+                return super().execute(sql, parameters)
+        except sqlite3.Error:
+            DB_ERRORS_TOTAL.inc(operation)
+            raise
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - start, operation)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        operation = sql_operation(sql)
+        try:
+            with tracer.span('sql', operation=operation, many=True):
+                return super().executemany(sql, seq_of_parameters)
+        except sqlite3.Error:
+            DB_ERRORS_TOTAL.inc(operation)
+            raise
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - start, operation)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Соединение SQLite, создающее инструментированные курсоры"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+_UPDATE_KIND = re.compile(r'^[a-z]+(?:_[a-z]+)*')
+
+
+def update_kind(update, commands: Collection[str] = frozenset()) -> str:
+    """
+    Метка типа обновления с ограниченной кардинальностью
+
+    Команды вне commands (зарегистрированных в приложении) сводятся
+    в command:other, иначе произвольный текст после / плодит метки.
+    """
+    if update.callback_query is not None:
+        match = _UPDATE_KIND.match(update.callback_query.data or '')
+        return f'callback:{match.group(0)}' if match else 'callback'
+
+    message = update.message or update.edited_message
+    if message is not None:
+        text = message.text or ''
+        if text.startswith('/'):
+            words = text[1:].split(maxsplit=1)
+            command = words[0].split('@')[0].lower() if words else ''
+            return f'command:{command}' if command in commands else 'command:other'
+        return 'message'
+
+    return 'other'
+
+
+class MetricsServer:
+    """Минимальный HTTP-сервер для GET /metrics"""
+
+    def __init__(self, registry: MetricsRegistry, host: str = '127.0.0.1', port: int = 9100):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"📈 Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Заголовки запроса нам не нужны, просто дочитываем их
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, content_type = '200 OK', 'text/plain; version=0.0.4; charset=utf-8'
+                body = self.registry.render().encode('utf-8')
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain', b'Not Found\n'
+
+            writer.write(
+                f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug("Ошибка запроса к /metrics: %s", e)
+        finally:
+            writer.close()
@@ -1,11 +1,16 @@
 import logging
 import asyncio
+import sqlite3
 from typing import Optional, Tuple, Dict, Any, List
 from uuid import uuid4
-from datetime import datetime, timedelta
 
 from app.models.payment import Payment, PaymentModel
-from app.services.crypto_pay_service import CryptoPayService, CurrencyConverter
+from app.services.crypto_pay_service import (
+    CryptoPayService, CurrencyConverter, RateUnavailableError, CryptoPayAPIError, CHECK_LIFETIME
+)
+from app.services.stats import StatsService
+from app.services.tracing import tracer
+from app.utils.pagination import Page
 
 logger = logging.getLogger(__name__)
 
@@ -21,60 +26,37 @@ class PaymentManager:
             database: объект Database или соединение SQLite
             crypto_pay_token: токен Crypto Pay
         """
-        # Сохраняем оригинальный объект
+        # Сохраняем оригинальный объект; соединения открываются на каждую операцию
+        # (общее соединение на все корутины перемешивало бы транзакции)
         self.database = database
 
-        # Получаем соединение для работы с БД
-        if hasattr(database, 'get_connection'):
-            # Это объект Database
-            self.connection = database.get_connection()
-        else:
-            # Это сырое соединение SQLite
-            self.connection = database
-
-        # Алиас для совместимости (если где-то используется self.db)
-        self.db = self.connection
-
         # Инициализируем модель платежей
-        self.payment_model = PaymentModel(self.connection)
+        self.payment_model = PaymentModel(database)
+
+        # Счетчики админ-статистики (триггеры на users/games/payments)
+        self.stats = StatsService(database) if hasattr(database, 'get_connection') else None
 
         # Инициализируем сервисы
         self.crypto_pay = CryptoPayService(crypto_pay_token)
-        self.converter = CurrencyConverter()
+        self.converter = CurrencyConverter(self.crypto_pay)
 
         logger.info("✅ PaymentManager инициализирован")
 
-    def _get_connection(self):
-        """Получение соединения с БД"""
-        if self.database:
-            return self.database.get_connection()
-        else:
-            # Возвращаем соединение из модели (осторожно с закрытием!)
-            return self.payment_model.db
+    def transaction(self):
+        """Курсор в рамках одной транзакции (commit при успехе, rollback при ошибке)"""
+        return self.payment_model.transaction()
 
     def _execute_query(self, query, params=()):
-        """Выполнение SQL запроса с автоматическим управлением соединением"""
-        print(f"🔍 DEBUG: Выполняем запрос: {query}")
-        print(f"🔍 DEBUG: Параметры: {params}")
+        """Выполнение SQL запроса в отдельной транзакции"""
+        logger.debug("SQL: %s | params=%s", query, params)
 
-        if self.database:
-            conn = self.database.get_connection()
-            cursor = conn.cursor()
+        with self.transaction() as cursor:
             cursor.execute(query, params)
-            result = cursor.fetchall()
-            conn.commit()
-            conn.close()
-            return result
-        else:
-            # Для сырого соединения
-            cursor = self.payment_model.db.cursor()
-            cursor.execute(query, params)
-            result = cursor.fetchall()
-            self.payment_model.db.commit()
-            return result
+            return cursor.fetchall()
 
     # ==================== ДЕПОЗИТЫ ====================
 
+    @tracer.traced()
     async def create_deposit(
             self,
             user_id: int,
@@ -103,7 +85,10 @@ class PaymentManager:
                 return None, None, "Максимальная сумма депозита: $10,000"
 
             # Конвертируем USD в криптовалюту
-            amount_crypto = await self.converter.usd_to_crypto(amount_usd, asset)
+            try:
+                amount_crypto = self.converter.usd_to_crypto(amount_usd, asset)
+            except RateUnavailableError as e:
+                return None, None, f"{e}, попробуйте позже"
 
             # Создаем уникальный ID платежа
             payment_id = f"dep_{uuid4().hex[:12].upper()}"
@@ -149,10 +134,14 @@ class PaymentManager:
             logger.error(f"❌ Ошибка создания депозита: {e}", exc_info=True)
             return None, None, f"Внутренняя ошибка: {str(e)}"
 
+    @tracer.traced()
     async def check_deposit_status(self, payment_id: str) -> Tuple[Optional[str], Optional[str]]:
         """
         Проверка статуса депозита
 
+        Читает только локальное состояние: зачисление делает вебхук Crypto Pay
+        (apply_paid_invoice), а пропущенные вебхуки подбирает check_pending_payments.
+
         Returns:
             (status, error_message)
         """
@@ -161,40 +150,48 @@ class PaymentManager:
             if not payment:
                 return None, "Платеж не найден"
 
-            if payment.status == "completed":
-                return "completed", None
+            return payment.status, None
 
-            if not payment.crypto_pay_id:
-                return payment.status, None
+        except Exception as e:
+            logger.error(f"❌ Ошибка проверки депозита {payment_id}: {e}")
+            return None, str(e)
 
-            # Проверяем статус в Crypto Pay
-            is_paid = await self.crypto_pay.is_invoice_paid(payment.crypto_pay_id)
+    @tracer.traced()
+    def apply_paid_invoice(self, invoice: Dict[str, Any]) -> Tuple[Optional[Payment], Optional[str]]:
+        """
+        Зачисление оплаченного инвойса (из вебхука invoice_paid)
 
-            if is_paid:
-                # Зачисляем средства
-                cursor = self.connection.cursor()
-                cursor.execute('''UPDATE users SET balance = balance + ? WHERE telegram_id = ?''', (payment.amount, payment.user_id))
+        Идемпотентно: повторная доставка того же инвойса ничего не меняет.
 
-                self.payment_model.update_payment_status(payment_id, "completed")
-                self.database.commit()
+        Returns:
+            (Payment, error_message) - Payment только если средства зачислены именно сейчас
+        """
+        invoice_id = invoice.get("invoice_id")
+        payment = None
+        if invoice_id is not None:
+            payment = self.payment_model.get_payment_by_crypto_id(str(invoice_id))
+        if payment is None and invoice.get("payload"):
+            payment = self.payment_model.get_payment(invoice["payload"])
 
-                logger.info(f"✅ Депозит завершен: {payment_id}, зачислено ${payment.amount:.2f}")
-                return "completed", None
+        if payment is None:
+            return None, f"Платеж для инвойса {invoice_id} не найден"
 
-            # Проверяем не истек ли срок
-            created_at = datetime.fromisoformat(payment.created_at)
-            if datetime.now() - created_at > timedelta(hours=1):
-                self.payment_model.update_payment_status(payment_id, "expired")
-                return "expired", None
+        if payment.payment_type != "deposit":
+            return None, f"Платеж {payment.payment_id} не является депозитом"
 
-            return payment.status, None
+        completed, _ = self._apply_deposit_results(
+            [(payment.payment_id, payment.user_id, payment.amount)], []
+        )
+        if not completed:
+            logger.info(f"ℹ️ Инвойс {invoice_id} уже обработан (платеж {payment.payment_id}: {payment.status})")
+            return None, None
 
-        except Exception as e:
-            logger.error(f"❌ Ошибка проверки депозита {payment_id}: {e}")
-            return None, str(e)
+        logger.info(f"✅ Депозит завершен: {payment.payment_id}, зачислено ${payment.amount:.2f}")
+        return payment, None
 
     # ==================== ВЫВОД СРЕДСТВ ====================
 
+    @tracer.traced()
     async def create_withdrawal(
             self,
             user_id: int,
@@ -210,17 +207,15 @@ class PaymentManager:
         """
         try:
             # Проверяем баланс пользователя
-            cursor = self.connection.cursor()
-            cursor.execute('''
+            results = self._execute_query('''
                 SELECT balance, crypto_pay_id FROM users 
                 WHERE telegram_id = ?
             ''', (user_id,))
 
-            user_data = cursor.fetchone()
-            if not user_data:
+            if not results:
                 return None, "Пользователь не найден"
 
-            current_balance, crypto_pay_id = user_data
+            current_balance, crypto_pay_id = results[0]
 
             # Проверки
             if amount_usd < 1.0:
@@ -253,18 +248,19 @@ class PaymentManager:
                 description=description or f"Вывод ${amount_usd:.2f} (комиссия: ${commission:.2f})"
             )
 
-            # Сохраняем в БД
-            if not self.payment_model.create_payment(payment):
-                return None, "Ошибка создания платежа"
-
-            # Резервируем средства
-            cursor.execute('''
-                UPDATE users 
-                SET balance = balance - ?
-                WHERE telegram_id = ?
-            ''', (amount_usd, user_id))
+            # Резервируем средства и сохраняем платеж в одной транзакции;
+            # условие balance >= ? защищает от параллельных выводов
+            with self.transaction() as tx:
+                tx.execute('''
+                    UPDATE users 
+                    SET balance = balance - ?
+                    WHERE telegram_id = ? AND balance >= ?
+                ''', (amount_usd, user_id, amount_usd))
+                if tx.rowcount != 1:
+                    return None, "Недостаточно средств"
 
-            self.database.commit()
+                if not self.payment_model.create_payment(payment, cursor=tx):
+                    raise sqlite3.Error("Ошибка создания платежа")
 
             logger.info(f"✅ Запрос на вывод создан: {payment_id} для пользователя {user_id}")
             return payment, None
@@ -273,70 +269,112 @@ class PaymentManager:
             logger.error(f"❌ Ошибка создания вывода: {e}", exc_info=True)
             return None, f"Внутренняя ошибка: {str(e)}"
 
+    @tracer.traced()
     async def process_withdrawal(self, payment_id: str) -> Tuple[bool, Optional[str]]:
-        """Обработка вывода средств (должен выполняться администратором)"""
+        """Ручная обработка одного вывода (обычно выводы обрабатывает PayoutQueue)"""
         try:
             payment = self.payment_model.get_payment(payment_id)
             if not payment:
                 return False, "Платеж не найден"
 
-            if payment.status != "pending":
+            if payment.status not in ("pending", "approved"):
                 return False, f"Платеж уже обработан: {payment.status}"
 
-            # Получаем crypto_pay_id пользователя
-            cursor = self.connection.cursor()
-            cursor.execute(
-                'SELECT crypto_pay_id FROM users WHERE telegram_id = ?',  # ← ИСПРАВЛЕНО
+            # Забираем платеж: параллельный вызов или очередь выплат получат False
+            if not self.payment_model.transition(payment_id, payment.status, "processing",
+                                                 version=payment.version):
+                return False, "Платеж уже обрабатывается"
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки вывода {payment_id}: {e}", exc_info=True)
+            return False, str(e)
+
+        # После захвата платеж не должен остаться в processing: при любой
+        # ошибке исход считается неизвестным и вывод уходит на проверку
+        outcome = "unknown"
+        crypto_pay_id = None
+        try:
+            results = self._execute_query(
+                'SELECT crypto_pay_id FROM users WHERE telegram_id = ?',
                 (payment.user_id,)
             )
-            user_data = cursor.fetchone()
+            crypto_pay_id = results[0][0] if results else None
+            outcome = await self.send_withdrawal(payment_id, payment.amount, crypto_pay_id)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки вывода {payment_id}: {e}", exc_info=True)
+        finally:
+            with self.transaction() as tx:
+                status = self.record_withdrawal(tx, payment_id, payment.user_id, payment.amount, outcome)
 
-            if not user_data or not user_data[0]:
-                # Возвращаем средства
-                cursor.execute('''
-                    UPDATE users 
-                    SET balance = balance + ?
-                    WHERE telegram_id = ?  # ← ИСПРАВЛЕНО
-                ''', (payment.amount, payment.user_id))
+        if status == "review":
+            return False, "Нет ответа от платежной системы, вывод передан на проверку"
+        if not crypto_pay_id:
+            return False, "У пользователя не привязан Crypto Pay"
+        if status != "completed":
+            return False, "Ошибка перевода в платежной системе"
 
-                self.payment_model.update_payment_status(payment_id, "failed")
-                self.database.commit()
-                return False, "У пользователя не привязан Crypto Pay"
+        logger.info(f"✅ Вывод обработан: {payment_id}, отправлено ${payment.amount:.2f}")
+        return True, None
 
-            crypto_pay_user_id = int(user_data[0])
+    async def send_withdrawal(self, payment_id: str, amount: float, crypto_pay_id: Optional[str]) -> str:
+        """
+        Перевод вывода в Crypto Pay; spend_id = payment_id
 
+        Returns:
+            "ok" - перевод выполнен; "rejected" - деньги точно не ушли
+            (отказ API, нет аккаунта или курса); "unknown" - ответа нет
+            (таймаут, сбой сети), перевод мог пройти
+        """
+        if not crypto_pay_id:
+            return "rejected"
+
+        try:
             # Конвертируем USD в криптовалюту (по умолчанию USDT)
-            amount_crypto = await self.converter.usd_to_crypto(payment.amount, "USDT")
+            amount_crypto = self.converter.usd_to_crypto(amount, "USDT")
+        except Exception as e:
+            logger.error(f"❌ Перевод {payment_id} не отправлен: {e}")
+            return "rejected"
 
-            # Выполняем перевод
+        try:
+            # spend_id = payment_id: повтор не приведет к двойному переводу
             transfer = await self.crypto_pay.transfer(
-                user_id=crypto_pay_user_id,
+                user_id=int(crypto_pay_id),
                 amount=amount_crypto,
                 asset="USDT",
+                spend_id=payment_id,
                 comment=f"Вывод средств #{payment_id}"
             )
+        except CryptoPayAPIError as e:
+            logger.error(f"❌ Перевод {payment_id} отклонен: {e.name}")
+            return "rejected"
+        except Exception as e:
+            logger.error(f"❌ Ошибка перевода {payment_id}: {e}")
+            return "unknown"
+        return "ok" if transfer is not None else "unknown"
 
-            if not transfer:
-                # Возвращаем средства при ошибке
-                cursor.execute('''
-                    UPDATE users 
-                    SET balance = balance + ?
-                    WHERE telegram_id = ?  # ← ИСПРАВЛЕНО
-                ''', (payment.amount, payment.user_id))
-
-                self.payment_model.update_payment_status(payment_id, "failed")
-                self.database.commit()
-                return False, "Ошибка перевода в платежной системе"
+    def record_withdrawal(self, cursor, payment_id: str, user_id: int, amount: float,
+                          outcome: str, retry: bool = False) -> str:
+        """
+        Записывает исход перевода в транзакции вызывающего; возвращает новый статус
 
-            # Обновляем статус платежа
-            self.payment_model.update_payment_status(payment_id, "completed")
+        Средства возвращаются только при rejected. При unknown перевод мог
+        пройти: вывод уходит на ручную проверку, после одобрения повтор
+        идет с тем же spend_id. retry - вернуть неудачный вывод в очередь.
+        """
+        if outcome == "ok":
+            self.payment_model.transition(payment_id, "processing", "completed", cursor=cursor)
+            return "completed"
 
-            logger.info(f"✅ Вывод обработан: {payment_id}, отправлено ${payment.amount:.2f}")
-            return True, None
+        cursor.execute('UPDATE payments SET attempts = attempts + 1 WHERE payment_id = ?', (payment_id,))
+        if retry:
+            status = "approved"
+        else:
+            status = "failed" if outcome == "rejected" else "review"
 
-        except Exception as e:
-            logger.error(f"❌ Ошибка обработки вывода {payment_id}: {e}", exc_info=True)
-            return False, str(e)
+        if self.payment_model.transition(payment_id, "processing", status, cursor=cursor) and status == "failed":
+            # Возвращаем средства вместе со сменой статуса
+            cursor.execute('UPDATE users SET balance = balance + ? WHERE telegram_id = ?',
+                           (amount, user_id))
+        return status
 
     async def cancel_withdrawal(self, payment_id: str, user_id: int = None) -> Tuple[bool, Optional[str]]:
         """Отмена запроса на вывод"""
@@ -345,18 +383,24 @@ class PaymentManager:
             if not payment:
                 return False, "Платеж не найден"
 
-            if payment.status != "pending":
+            if payment.status not in ("pending", "review", "approved"):
                 return False, f"Невозможно отменить: статус {payment.status}"
 
             if user_id and payment.user_id != user_id:
                 return False, "Вы можете отменять только свои запросы"
 
-            # Возвращаем средства
-            cursor = self.connection.cursor()
-            cursor.execute('''UPDATE users SET balance = balance + ? WHERE telegram_id = ?''', (payment.amount, payment.user_id))
-
-            self.payment_model.update_payment_status(payment_id, "cancelled")
-            self.database.commit()
+            # Возврат средств и смена статуса - одна транзакция
+            with self.transaction() as tx:
+                # Перевод уже отправлялся и мог пройти: вернуть средства может только администратор
+                tx.execute('SELECT attempts FROM payments WHERE payment_id = ?', (payment_id,))
+                row = tx.fetchone()
+                if row and row[0]:
+                    return False, "Перевод уже отправлялся, отмена невозможна"
+                if not self.payment_model.transition(payment_id, payment.status, "cancelled",
+                                                     version=payment.version, cursor=tx):
+                    return False, "Платеж уже обрабатывается"
+                tx.execute('UPDATE users SET balance = balance + ? WHERE telegram_id = ?',
+                           (payment.amount, payment.user_id))
 
             logger.info(f"✅ Вывод отменен: {payment_id}")
             return True, None
@@ -390,23 +434,94 @@ class PaymentManager:
         """Получение истории платежей пользователя"""
         return self.payment_model.get_user_payments(user_id, limit, payment_type)
 
-    async def check_pending_payments(self):
-        """Проверка pending платежей (для cron задачи)"""
+    def get_user_payments_page(self, user_id: int, page_cursor: str = None, page_size: int = 10,
+                               payment_type: str = None) -> Page:
+        """Страница истории платежей пользователя"""
+        return self.payment_model.get_user_payments_page(user_id, page_cursor, page_size, payment_type)
+
+    def get_payments_page(self, page_cursor: str = None, page_size: int = 15, status: str = None) -> Page:
+        """Страница всех платежей (админ-панель)"""
+        return self.payment_model.get_payments_page(page_cursor, page_size, status)
+
+    @tracer.traced()
+    async def check_pending_payments(
+            self,
+            hours: int = None,
+            chunk_size: int = 100,
+            concurrency: int = 4
+    ) -> Dict[str, int]:
+        """
+        Пакетная сверка pending депозитов с Crypto Pay (для cron задачи)
+
+        Вместо запроса на каждый платеж инвойсы проверяются пачками через
+        getInvoices, а все зачисления применяются в одной транзакции.
+        Депозит истекает только по явному статусу expired от API: платеж
+        без статуса (не вернулся в ответе, пачка не загрузилась) остается
+        pending до следующей проверки. Окно проверки по умолчанию - срок
+        жизни чека плюс час запаса.
+
+        Returns:
+            {"checked": ..., "completed": ..., "expired": ...}
+        """
+        result = {"checked": 0, "completed": 0, "expired": 0}
+
         try:
-            pending_payments = self.payment_model.get_pending_payments(hours=24)
+            if hours is None:
+                hours = CHECK_LIFETIME // 3600 + 1
+            pending = self.payment_model.get_pending_deposits(hours=hours)
+            if not pending:
+                return result
+
+            statuses = await self.crypto_pay.get_invoice_statuses(
+                [str(row[3]) for row in pending],
+                chunk_size=chunk_size,
+                concurrency=concurrency
+            )
 
-            for payment_data in pending_payments:
-                payment_id = payment_data[0]
-                payment_type = payment_data[3]
+            paid, expired = [], []
+            for payment_id, user_id, amount, crypto_pay_id, created_at in pending:
+                status = statuses.get(str(crypto_pay_id))
+                if status == "paid":
+                    paid.append((payment_id, user_id, amount))
+                elif status == "expired":
+                    expired.append(payment_id)
 
-                if payment_type == "deposit":
-                    await self.check_deposit_status(payment_id)
-                # Для выводов нужна ручная обработка
+            result["checked"] = len(pending)
+            result["completed"], result["expired"] = self._apply_deposit_results(paid, expired)
 
-            logger.info(f"✅ Проверено {len(pending_payments)} pending платежей")
+            logger.info(
+                f"✅ Проверено {result['checked']} pending депозитов: "
+                f"зачислено {result['completed']}, истекло {result['expired']}"
+            )
 
         except Exception as e:
-            logger.error(f"❌ Ошибка проверки pending платежей: {e}")
+            logger.error(f"❌ Ошибка проверки pending платежей: {e}", exc_info=True)
+
+        return result
+
+    def _apply_deposit_results(self, paid: List[tuple], expired: List[str]) -> Tuple[int, int]:
+        """
+        Применяет результаты сверки в одной транзакции
+
+        Статус меняется только у платежей, которые все еще pending,
+        поэтому повторная сверка не зачислит депозит дважды.
+        """
+        completed = 0
+        with self.transaction() as cursor:
+            for payment_id, user_id, amount in paid:
+                if self.payment_model.transition(payment_id, "pending", "completed", cursor=cursor):
+                    cursor.execute(
+                        'UPDATE users SET balance = balance + ? WHERE telegram_id = ?',
+                        (amount, user_id)
+                    )
+                    completed += 1
+
+            expired_count = sum(
+                self.payment_model.transition(payment_id, "pending", "expired", cursor=cursor)
+                for payment_id in expired
+            )
+
+        return completed, expired_count
 
     def link_crypto_pay_account(self, user_id: int, crypto_pay_id: str) -> bool:
         """Привязка Crypto Pay аккаунта пользователя"""
@@ -422,7 +537,7 @@ class PaymentManager:
             return False
 
     def get_payment_stats(self, user_id: int = None) -> Dict[str, Any]:
-        """Статистика по платежам"""
+        """Статистика по платежам (общая - из счетчиков StatsService)"""
         stats = {
             "total_deposits": 0,
             "total_withdrawals": 0,
@@ -432,12 +547,17 @@ class PaymentManager:
         }
 
         try:
-            if user_id:
+            if user_id is None and self.stats:
+                counters = self.stats.get()
+                results = [(counters["deposits"], counters["withdrawals"],
+                            counters["pending_withdrawals"], int(counters["payments"]))]
+            elif user_id:
                 results = self._execute_query('''
                     SELECT 
                         SUM(CASE WHEN payment_type = 'deposit' AND status = 'completed' THEN amount ELSE 0 END),
                         SUM(CASE WHEN payment_type = 'withdraw' AND status = 'completed' THEN amount ELSE 0 END),
-                        SUM(CASE WHEN payment_type = 'withdraw' AND status = 'pending' THEN amount ELSE 0 END),
+                        SUM(CASE WHEN payment_type = 'withdraw'
+                                 AND status IN ('pending', 'review', 'approved', 'processing') THEN amount ELSE 0 END),
                         COUNT(*) as total_payments
                     FROM payments 
                     WHERE user_id = ?
@@ -447,7 +567,8 @@ class PaymentManager:
                     SELECT 
                         SUM(CASE WHEN payment_type = 'deposit' AND status = 'completed' THEN amount ELSE 0 END),
                         SUM(CASE WHEN payment_type = 'withdraw' AND status = 'completed' THEN amount ELSE 0 END),
-                        SUM(CASE WHEN payment_type = 'withdraw' AND status = 'pending' THEN amount ELSE 0 END),
+                        SUM(CASE WHEN payment_type = 'withdraw'
+                                 AND status IN ('pending', 'review', 'approved', 'processing') THEN amount ELSE 0 END),
                         COUNT(*) as total_payments
                     FROM payments
                 ''')
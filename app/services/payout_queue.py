@@ -0,0 +1,248 @@
+# app/services/payout_queue.py
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.services.metrics import registry
+from app.services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+PAYOUTS_TOTAL = registry.counter(
+    'dicebot_payouts_total', 'Обработанные выплаты', ('outcome',))
+PAYOUT_BATCH_SIZE = registry.histogram(
+    'dicebot_payout_batch_size', 'Размер пачки выплат', buckets=(1, 5, 10, 25, 50, 100, 250))
+
+# Статус после записи исхода -> счетчик прохода
+RECORDED_OUTCOMES = {"completed": "completed", "approved": "retry", "failed": "failed", "review": "review"}
+
+
+class PayoutPolicy:
+    """
+    Правила автоматического одобрения выплат
+
+    Выплата уходит без участия администратора, если она не больше
+    max_auto_amount и суммарные выплаты пользователя за сутки
+    не превышают daily_limit. Остальные ждут /approve_payout.
+    """
+
+    def __init__(self, max_auto_amount: float = 100.0, daily_limit: float = 500.0):
+        self.max_auto_amount = max_auto_amount
+        self.daily_limit = daily_limit
+
+    def review(self, amount: float, paid_today: float) -> Tuple[bool, Optional[str]]:
+        """(одобрено, причина ручной проверки)"""
+        if amount > self.max_auto_amount:
+            return False, f"сумма ${amount:.2f} больше ${self.max_auto_amount:.2f}"
+        if paid_today + amount > self.daily_limit:
+            return False, f"суточный лимит ${self.daily_limit:.2f} (уже ${paid_today:.2f})"
+        return True, None
+
+
+class PayoutItem(NamedTuple):
+    payment_id: str
+    user_id: int
+    amount: float
+    status: str
+    attempts: int
+
+
+class PayoutQueue:
+    """
+    Очередь выплат: фоновый обработчик pending выводов
+
+    За один проход: забирает пачку выводов (pending -> processing в одной
+    транзакции), применяет PayoutPolicy, выполняет переводы параллельно
+    (не более concurrency одновременно) и записывает результаты одной
+    транзакцией. spend_id = payment_id, поэтому повтор после сбоя
+    не приведет к двойной выплате на стороне Crypto Pay.
+    """
+
+    MAX_ATTEMPTS = 3
+
+    def __init__(self, payment_manager, policy: Optional[PayoutPolicy] = None,
+                 batch_size: int = 50, concurrency: int = 5):
+        self.payment_manager = payment_manager
+        self.policy = policy or PayoutPolicy()
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._running = False
+        self._recover_processing()
+
+    # ==================== ПРОХОД ОЧЕРЕДИ ====================
+
+    @tracer.traced()
+    async def run_once(self) -> Dict[str, int]:
+        """Один проход очереди; возвращает счетчики по исходам"""
+        result = {"completed": 0, "retry": 0, "failed": 0, "review": 0}
+        if self._running:
+            return result
+
+        self._running = True
+        try:
+            batch = self._claim_batch()
+            if not batch:
+                return result
+
+            PAYOUT_BATCH_SIZE.observe(len(batch))
+            approved, held = self._apply_policy(batch)
+            result["review"] = len(held)
+
+            outcomes = await self._transfer_all(approved)
+            for outcome in self._record_results(approved, outcomes, held).values():
+                result[outcome] += 1
+                PAYOUTS_TOTAL.inc(outcome)
+            if held:
+                PAYOUTS_TOTAL.inc("review", amount=len(held))
+
+            logger.info(
+                f"💸 Выплаты: {result['completed']} выполнено, {result['retry']} на повтор, "
+                f"{result['failed']} ошибок, {result['review']} на проверку"
+            )
+            return result
+        finally:
+            self._running = False
+
+    def _claim_batch(self) -> List[PayoutItem]:
+        """Забирает пачку выводов; статус processing исключает повторную обработку"""
+        with self.payment_manager.transaction() as cursor:
+            cursor.execute('''
+                SELECT payment_id, user_id, amount, status, attempts FROM payments
+                WHERE payment_type = 'withdraw' AND status IN ('pending', 'approved')
+                ORDER BY created_at
+                LIMIT ?
+            ''', (self.batch_size,))
+            rows = cursor.fetchall()
+
+            # Дедупликация по spend_id (= payment_id); забираем только то, что никто не забрал раньше
+            batch = []
+            for item in {row[0]: PayoutItem(*row) for row in rows}.values():
+                if self.payment_manager.payment_model.transition(
+                        item.payment_id, item.status, "processing", cursor=cursor):
+                    batch.append(item)
+        return batch
+
+    def _apply_policy(self, batch: List[PayoutItem]) -> Tuple[List[PayoutItem], List[Tuple[PayoutItem, str]]]:
+        """Делит пачку на одобренные и требующие ручной проверки"""
+        paid_today = self._paid_today({item.user_id for item in batch if item.status == 'pending'})
+
+        approved, held = [], []
+        for item in batch:
+            if item.status == 'approved':
+                approved.append(item)
+                continue
+
+            ok, reason = self.policy.review(item.amount, paid_today.get(item.user_id, 0.0))
+            if ok:
+                approved.append(item)
+                paid_today[item.user_id] = paid_today.get(item.user_id, 0.0) + item.amount
+            else:
+                held.append((item, reason))
+        return approved, held
+
+    def _paid_today(self, user_ids) -> Dict[int, float]:
+        if not user_ids:
+            return {}
+        since = (datetime.now() - timedelta(days=1)).isoformat()
+        placeholders = ','.join('?' * len(user_ids))
+        with self.payment_manager.transaction() as cursor:
+            cursor.execute(f'''
+                SELECT user_id, SUM(amount) FROM payments
+                WHERE payment_type = 'withdraw' AND status = 'completed'
+                AND created_at > ? AND user_id IN ({placeholders})
+                GROUP BY user_id
+            ''', (since, *user_ids))
+            return {user_id: total or 0.0 for user_id, total in cursor.fetchall()}
+
+    async def _transfer_all(self, items: List[PayoutItem]) -> Dict[str, str]:
+        """Переводы с ограничением параллельности; {payment_id: исход send_withdrawal}"""
+        if not items:
+            return {}
+
+        crypto_pay_ids = self._crypto_pay_ids({item.user_id for item in items})
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+
+        async def transfer(item: PayoutItem) -> str:
+            async with semaphore:
+                return await self.payment_manager.send_withdrawal(
+                    item.payment_id, item.amount, crypto_pay_ids.get(item.user_id))
+
+        results = await asyncio.gather(*(transfer(item) for item in items))
+        return dict(zip((item.payment_id for item in items), results))
+
+    def _crypto_pay_ids(self, user_ids) -> Dict[int, str]:
+        placeholders = ','.join('?' * len(user_ids))
+        with self.payment_manager.transaction() as cursor:
+            cursor.execute(
+                f'SELECT telegram_id, crypto_pay_id FROM users WHERE telegram_id IN ({placeholders})',
+                tuple(user_ids)
+            )
+            return dict(cursor.fetchall())
+
+    def _record_results(self, items: List[PayoutItem], outcomes: Dict[str, str],
+                        held: List[Tuple[PayoutItem, str]]) -> Dict[str, str]:
+        """
+        Записывает результаты пачки одной транзакцией
+
+        Неудачный перевод возвращается в approved (повтор с тем же spend_id).
+        После MAX_ATTEMPTS попыток вывод отменяется с возвратом средств, только
+        если API явно отклонил перевод; при неизвестном исходе (таймаут)
+        перевод мог пройти, и вывод уходит на ручную проверку.
+        """
+        model = self.payment_manager.payment_model
+        recorded = {}
+        with self.payment_manager.transaction() as cursor:
+            for item in items:
+                status = self.payment_manager.record_withdrawal(
+                    cursor, item.payment_id, item.user_id, item.amount,
+                    outcomes.get(item.payment_id, "unknown"),
+                    retry=item.attempts + 1 < self.MAX_ATTEMPTS
+                )
+                recorded[item.payment_id] = RECORDED_OUTCOMES[status]
+
+            for item, _ in held:
+                model.transition(item.payment_id, "processing", "review", cursor=cursor)
+
+        for item, reason in held:
+            logger.info("🔍 Вывод %s на ручную проверку: %s", item.payment_id, reason)
+        for payment_id, outcome in recorded.items():
+            if outcome == "review":
+                logger.warning(f"⚠️ Вывод {payment_id}: исход перевода неизвестен, нужна проверка")
+        return recorded
+
+    def _recover_processing(self):
+        """
+        После перезапуска незавершенные выплаты возвращаются в очередь
+
+        Перевод мог уйти до сбоя, поэтому попытка засчитывается:
+        такой вывод уже нельзя отменить с возвратом средств.
+        """
+        with self.payment_manager.transaction() as cursor:
+            cursor.execute(
+                "UPDATE payments SET status = 'approved', attempts = attempts + 1, version = version + 1 "
+                "WHERE payment_type = 'withdraw' AND status = 'processing'"
+            )
+            if cursor.rowcount:
+                logger.warning(f"⚠️ {cursor.rowcount} незавершенных выплат возвращено в очередь")
+
+    # ==================== РУЧНАЯ ПРОВЕРКА ====================
+
+    def get_review_queue(self, limit: int = 20) -> list:
+        """Выводы, ожидающие решения администратора"""
+        with self.payment_manager.transaction() as cursor:
+            cursor.execute('''
+                SELECT payment_id, user_id, amount, created_at FROM payments
+                WHERE payment_type = 'withdraw' AND status = 'review'
+                ORDER BY created_at
+                LIMIT ?
+            ''', (limit,))
+            return cursor.fetchall()
+
+    def approve(self, payment_id: str) -> Tuple[bool, Optional[str]]:
+        """Одобрение вывода администратором"""
+        with self.payment_manager.transaction() as cursor:
+            if not self.payment_manager.payment_model.transition(payment_id, "review", "approved", cursor=cursor):
+                return False, "Вывод не найден или не ожидает проверки"
+        logger.info("✅ Вывод %s одобрен администратором", payment_id)
+        return True, None
@@ -0,0 +1,227 @@
+# app/services/rollups.py
+import logging
+from typing import Dict, List, NamedTuple, Optional
+
+from app.services.metrics import registry
+from app.services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_ROWS_TOTAL = registry.counter(
+    'dicebot_rollup_rows_total', 'Строки, агрегированные в почасовые/посуточные срезы', ('source',))
+
+GRANULARITIES = ('hour', 'day')
+
+
+class Bucket(NamedTuple):
+    bucket: str
+    games: int
+    bets: float
+    turnover: float
+    commission: float
+    deposits: float
+    withdrawals: float
+    active_users: int
+
+    @property
+    def average_bet(self) -> float:
+        return self.bets / self.games if self.games else 0.0
+
+
+class RollupService:
+    """
+    Почасовые и посуточные агрегаты по играм и платежам
+
+    Завершенные игры и проведенные платежи попадают в срезы ровно один раз:
+    строка агрегируется и помечается rolled_up = 1 в одной транзакции.
+    Частичные индексы по rolled_up = 0 содержат только необработанные строки,
+    поэтому периодический проход стоит O(новых строк), а бэкфилл истории -
+    тот же проход, выполняемый пачками до конца.
+    """
+
+    def __init__(self, database, commission_rate: float = 0.08, chunk_size: int = 1000):
+        self.db = database
+        self.commission_rate = commission_rate
+        self.chunk_size = chunk_size
+        self._init_schema()
+
+    def _init_schema(self):
+        conn = self.db.get_connection()
+        try:
+            with conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS rollups (
+                        granularity TEXT NOT NULL,
+                        bucket TEXT NOT NULL,
+                        games INTEGER DEFAULT 0,
+                        bets REAL DEFAULT 0,
+                        turnover REAL DEFAULT 0,
+                        commission REAL DEFAULT 0,
+                        deposits REAL DEFAULT 0,
+                        withdrawals REAL DEFAULT 0,
+                        PRIMARY KEY (granularity, bucket)
+                    )
+                ''')
+                # Уникальные игроки среза (активные пользователи не суммируются по часам)
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS rollup_players (
+                        granularity TEXT NOT NULL,
+                        bucket TEXT NOT NULL,
+                        user_id INTEGER NOT NULL,
+                        PRIMARY KEY (granularity, bucket, user_id)
+                    ) WITHOUT ROWID
+                ''')
+
+                # Частичный индекс по необработанным строкам: (таблица, ключ, условие)
+                pending = (('games', 'id', 'finished'), ('payments', 'payment_id', 'completed'))
+                for table, key, status in pending:
+                    columns = [column[1] for column in conn.execute(f"PRAGMA table_info({table})")]
+                    if not columns:
+                        continue
+                    if 'rolled_up' not in columns:
+                        conn.execute(f'ALTER TABLE {table} ADD COLUMN rolled_up INTEGER DEFAULT 0')
+                    conn.execute(f'''
+                        CREATE INDEX IF NOT EXISTS idx_{table}_rollup_pending ON {table}({key})
+                        WHERE rolled_up = 0 AND status = '{status}'
+                    ''')
+        finally:
+            conn.close()
+
+    # ==================== АГРЕГАЦИЯ ====================
+
+    @tracer.traced()
+    def run_once(self, max_chunks: Optional[int] = None) -> Dict[str, int]:
+        """Агрегирует необработанные строки пачками; {'games': N, 'payments': M}"""
+        result = {"games": 0, "payments": 0}
+        chunks = 0
+        while max_chunks is None or chunks < max_chunks:
+            games, payments = self._process_chunk()
+            if not games and not payments:
+                break
+            result["games"] += games
+            result["payments"] += payments
+            chunks += 1
+
+        if result["games"] or result["payments"]:
+            logger.info(f"📈 Срезы обновлены: {result['games']} игр, {result['payments']} платежей")
+        return result
+
+    def _process_chunk(self):
+        conn = self.db.get_connection()
+        try:
+            with conn:
+                # IMMEDIATE: два параллельных прохода не посчитают одну строку дважды
+                conn.execute('BEGIN IMMEDIATE')
+                games = conn.execute('''
+                    SELECT id, strftime('%Y-%m-%d %H:00', COALESCE(finished_at, created_at)),
+                           bet_amount, winner_id IS NOT NULL, player1_id, player2_id
+                    FROM games
+                    WHERE rolled_up = 0 AND status = 'finished'
+                    LIMIT ?
+                ''', (self.chunk_size,)).fetchall()
+                payments = conn.execute('''
+                    SELECT payment_id, strftime('%Y-%m-%d %H:00', COALESCE(completed_at, created_at)),
+                           amount, payment_type
+                    FROM payments
+                    WHERE rolled_up = 0 AND status = 'completed'
+                    LIMIT ?
+                ''', (self.chunk_size,)).fetchall()
+
+                deltas: Dict[tuple, List[float]] = {}
+                players = set()
+
+                def add(hour: str, index: int, value: float):
+                    for key in (('hour', hour), ('day', hour[:10])):
+                        deltas.setdefault(key, [0, 0.0, 0.0, 0.0, 0.0, 0.0])[index] += value
+
+                for _, hour, bet, has_winner, player1, player2 in games:
+                    add(hour, 0, 1)
+                    add(hour, 1, bet)
+                    add(hour, 2, bet * 2)
+                    if has_winner:
+                        add(hour, 3, bet * 2 * self.commission_rate)
+                    for player in (player1, player2):
+                        if player is not None:
+                            players.update({('hour', hour, player), ('day', hour[:10], player)})
+
+                for _, hour, amount, payment_type in payments:
+                    if payment_type == 'deposit':
+                        add(hour, 4, amount)
+                    elif payment_type == 'withdraw':
+                        add(hour, 5, amount)
+
+                conn.executemany('''
+                    INSERT INTO rollups (granularity, bucket, games, bets, turnover, commission, deposits, withdrawals)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (granularity, bucket) DO UPDATE SET
+                        games = games + excluded.games,
+                        bets = bets + excluded.bets,
+                        turnover = turnover + excluded.turnover,
+                        commission = commission + excluded.commission,
+                        deposits = deposits + excluded.deposits,
+                        withdrawals = withdrawals + excluded.withdrawals
+                ''', [key + tuple(values) for key, values in deltas.items()])
+                conn.executemany('INSERT OR IGNORE INTO rollup_players VALUES (?, ?, ?)', players)
+
+                conn.executemany('UPDATE games SET rolled_up = 1 WHERE id = ?', [(row[0],) for row in games])
+                conn.executemany('UPDATE payments SET rolled_up = 1 WHERE payment_id = ?',
+                                 [(row[0],) for row in payments])
+        finally:
+            conn.close()
+
+        ROLLUP_ROWS_TOTAL.inc("games", amount=len(games))
+        ROLLUP_ROWS_TOTAL.inc("payments", amount=len(payments))
+        return len(games), len(payments)
+
+    def reset(self):
+        """Сбрасывает срезы и отметки; следующий run_once пересчитает всю историю"""
+        conn = self.db.get_connection()
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute('DELETE FROM rollups')
+                conn.execute('DELETE FROM rollup_players')
+                conn.execute('UPDATE games SET rolled_up = 0 WHERE rolled_up = 1')
+                conn.execute('UPDATE payments SET rolled_up = 0 WHERE rolled_up = 1')
+        finally:
+            conn.close()
+        logger.warning("⚠️ Срезы аналитики сброшены")
+
+    # ==================== ЧТЕНИЕ ====================
+
+    def get_range(self, granularity: str = 'hour', limit: int = 24) -> List[Bucket]:
+        """Последние limit срезов (от старых к новым)"""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Неизвестный интервал: {granularity}")
+
+        conn = self.db.get_connection()
+        try:
+            rows = conn.execute('''
+                SELECT r.bucket, r.games, r.bets, r.turnover, r.commission, r.deposits, r.withdrawals,
+                       (SELECT COUNT(*) FROM rollup_players p
+                        WHERE p.granularity = r.granularity AND p.bucket = r.bucket)
+                FROM rollups r
+                WHERE r.granularity = ?
+                ORDER BY r.bucket DESC
+                LIMIT ?
+            ''', (granularity, limit)).fetchall()
+        finally:
+            conn.close()
+        return [Bucket(*row) for row in reversed(rows)]
+
+
+def format_rollups(buckets: List[Bucket], width: int = 12) -> str:
+    """Текстовый график оборота и таблица по срезам"""
+    if not buckets:
+        return "📭 Нет данных за выбранный период"
+
+    peak = max(bucket.turnover for bucket in buckets) or 1.0
+    lines = []
+    for bucket in buckets:
+        bar = '█' * round(bucket.turnover / peak * width)
+        lines.append(
+            f"{bucket.bucket} {bar:<{width}} ${bucket.turnover:.2f}\n"
+            f"   🎮 {bucket.games} | ср. ${bucket.average_bet:.2f} | 👥 {bucket.active_users} | "
+            f"💼 ${bucket.commission:.2f} | ⬇️ ${bucket.deposits:.2f} | ⬆️ ${bucket.withdrawals:.2f}"
+        )
+    return "\n".join(lines)
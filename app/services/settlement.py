@@ -0,0 +1,246 @@
+# app/services/settlement.py
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from app.services.metrics import registry
+from app.services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+SETTLEMENTS_TOTAL = registry.counter(
+    'dicebot_settlements_total', 'Проведенные расчеты по играм', ('source', 'outcome'))
+SETTLEMENT_COMMISSION_TOTAL = registry.counter(
+    'dicebot_settlement_commission_usd_total', 'Комиссия, удержанная при расчетах', ('source',))
+
+
+def to_cents(amount: float) -> int:
+    return int(round(amount * 100))
+
+
+class Settlement(NamedTuple):
+    """Расчет по одной игре: суммы в долларах, в леджере - в центах"""
+    settlement_id: str
+    source: str  # game, duel, lobby
+    ref_id: str
+    outcome: str  # win, draw, cancel
+    stakes: Dict[int, float]  # игрок -> ставка
+    payouts: Dict[int, float]  # игрок -> зачислено (выигрыш или возврат)
+    commission: float
+
+    @property
+    def pot(self) -> float:
+        return round(sum(self.stakes.values()), 2)
+
+    def payout(self, user_id: int) -> float:
+        return self.payouts.get(user_id, 0.0)
+
+
+class Reconciliation(NamedTuple):
+    settlements: int
+    stakes: float
+    paid_out: float
+    commission: float
+    unbalanced: List[str]  # settlement_id, где ставки != выплаты + комиссия
+
+    @property
+    def balanced(self) -> bool:
+        return not self.unbalanced
+
+
+class SettlementService:
+    """
+    Расчеты по играм 1 на 1, дуэлям и играм лобби через леджер
+
+    plan() считает банк, комиссию и выплаты: победители делят банк за
+    вычетом комиссии, при ничьей и отмене ставки возвращаются целиком.
+    settle_many() проводит пачку расчетов одной транзакцией: строка в
+    settlements, проводки в ledger_entries и зачисления на балансы.
+    settlement_id = "<source>:<ref_id>" - первичный ключ, поэтому повторный
+    расчет той же игры пропускается, а двойной выплаты не будет.
+
+    Ставки списываются с баланса раньше (при создании/входе в игру), в
+    леджер они попадают проводкой stake при расчете. Суммы в леджере -
+    целые центы, поэтому reconcile() сверяет «ставки = выплаты + комиссия»
+    точно, без погрешности float.
+    """
+
+    def __init__(self, database, commission_rate: float = 0.08):
+        self.db = database
+        self.commission_rate = commission_rate
+        self._init_schema()
+
+    def _init_schema(self):
+        conn = self.db.get_connection()
+        try:
+            with conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS settlements (
+                        settlement_id TEXT PRIMARY KEY,
+                        source TEXT NOT NULL,
+                        ref_id TEXT NOT NULL,
+                        outcome TEXT NOT NULL,
+                        pot_cents INTEGER NOT NULL,
+                        commission_cents INTEGER NOT NULL,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    ) WITHOUT ROWID
+                ''')
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS ledger_entries (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        settlement_id TEXT NOT NULL,
+                        kind TEXT NOT NULL,  -- stake, payout, refund, commission
+                        user_id INTEGER,  -- NULL у комиссии
+                        amount_cents INTEGER NOT NULL,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_ledger_settlement ON ledger_entries(settlement_id)')
+        finally:
+            conn.close()
+
+    # ==================== РАСЧЕТ ====================
+
+    def plan(self, source: str, ref_id, stakes: Dict[int, float], winners: Sequence[int] = (),
+             cancelled: bool = False) -> Settlement:
+        """Расчет без записи: победителей нет или отмена - возврат ставок"""
+        unknown = [winner for winner in winners if winner not in stakes]
+        if unknown:
+            raise ValueError(f"Победители {unknown} не делали ставок")
+
+        stake_cents = {user_id: to_cents(amount) for user_id, amount in stakes.items()}
+        pot = sum(stake_cents.values())
+
+        if cancelled or not winners:
+            outcome = "cancel" if cancelled else "draw"
+            commission, payouts = 0, dict(stake_cents)
+        else:
+            outcome = "win"
+            commission = int(round(pot * self.commission_rate))
+            share, rest = divmod(pot - commission, len(winners))
+            # Неделимые центы - первым победителям, чтобы банк сходился точно
+            payouts = {winner: share + (1 if i < rest else 0) for i, winner in enumerate(winners)}
+
+        return Settlement(
+            settlement_id=f"{source}:{ref_id}",
+            source=source,
+            ref_id=str(ref_id),
+            outcome=outcome,
+            stakes={user_id: cents / 100 for user_id, cents in stake_cents.items()},
+            payouts={user_id: cents / 100 for user_id, cents in payouts.items()},
+            commission=commission / 100
+        )
+
+    def settle(self, source: str, ref_id, stakes: Dict[int, float], winners: Sequence[int] = (),
+               cancelled: bool = False) -> Tuple[Optional[Settlement], Optional[str]]:
+        """Проводит расчет одной игры"""
+        try:
+            settlement = self.plan(source, ref_id, stakes, winners, cancelled)
+            if not self.settle_many([settlement]):
+                return None, "Расчет по игре уже проведен"
+            return settlement, None
+        except Exception as e:
+            logger.error(f"❌ Ошибка расчета {source}:{ref_id}: {e}")
+            return None, f"Ошибка расчета: {str(e)}"
+
+    @tracer.traced()
+    def settle_many(self, settlements: Iterable[Settlement]) -> List[Settlement]:
+        """
+        Проводит пачку расчетов одной транзакцией
+
+        Возвращает проведенные; уже проведенные ранее пропускаются.
+        """
+        applied, entries, credits = [], [], []
+        conn = self.db.get_connection()
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                for settlement in settlements:
+                    inserted = conn.execute('''
+                        INSERT OR IGNORE INTO settlements
+                        (settlement_id, source, ref_id, outcome, pot_cents, commission_cents)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', (settlement.settlement_id, settlement.source, settlement.ref_id, settlement.outcome,
+                          to_cents(settlement.pot), to_cents(settlement.commission))).rowcount
+                    if not inserted:
+                        logger.warning(f"⚠️ Расчет {settlement.settlement_id} уже проведен, пропускаем")
+                        continue
+
+                    credit_kind = "payout" if settlement.outcome == "win" else "refund"
+                    entries += [(settlement.settlement_id, "stake", user_id, to_cents(amount))
+                                for user_id, amount in settlement.stakes.items()]
+                    entries += [(settlement.settlement_id, credit_kind, user_id, to_cents(amount))
+                                for user_id, amount in settlement.payouts.items()]
+                    if settlement.commission:
+                        entries.append((settlement.settlement_id, "commission", None,
+                                        to_cents(settlement.commission)))
+                    credits += [(amount, user_id) for user_id, amount in settlement.payouts.items() if amount]
+                    applied.append(settlement)
+
+                conn.executemany('''
+                    INSERT INTO ledger_entries (settlement_id, kind, user_id, amount_cents)
+                    VALUES (?, ?, ?, ?)
+                ''', entries)
+                conn.executemany('UPDATE users SET balance = balance + ? WHERE telegram_id = ?', credits)
+        finally:
+            conn.close()
+
+        for settlement in applied:
+            SETTLEMENTS_TOTAL.inc(settlement.source, settlement.outcome)
+            if settlement.commission:
+                SETTLEMENT_COMMISSION_TOTAL.inc(settlement.source, amount=settlement.commission)
+            logger.info("💰 Расчет %s (%s): банк $%.2f, комиссия $%.2f", settlement.settlement_id,
+                        settlement.outcome, settlement.pot, settlement.commission)
+        return applied
+
+    def get(self, source: str, ref_id) -> Optional[Settlement]:
+        """Проведенный расчет по игре"""
+        settlement_id = f"{source}:{ref_id}"
+        conn = self.db.get_connection()
+        try:
+            row = conn.execute('SELECT outcome, commission_cents FROM settlements WHERE settlement_id = ?',
+                               (settlement_id,)).fetchone()
+            if not row:
+                return None
+            entries = conn.execute('SELECT kind, user_id, amount_cents FROM ledger_entries WHERE settlement_id = ?',
+                                   (settlement_id,)).fetchall()
+        finally:
+            conn.close()
+
+        stakes = {user_id: cents / 100 for kind, user_id, cents in entries if kind == "stake"}
+        payouts = {user_id: cents / 100 for kind, user_id, cents in entries if kind in ("payout", "refund")}
+        return Settlement(settlement_id, source, str(ref_id), row[0], stakes, payouts, row[1] / 100)
+
+    # ==================== СВЕРКА ====================
+
+    @tracer.traced()
+    def reconcile(self) -> Reconciliation:
+        """Сверка леджера: по каждому расчету ставки = выплаты + комиссия = банк"""
+        conn = self.db.get_connection()
+        try:
+            rows = conn.execute('''
+                SELECT s.settlement_id, s.pot_cents, s.commission_cents,
+                       COALESCE(SUM(CASE WHEN l.kind = 'stake' THEN l.amount_cents END), 0),
+                       COALESCE(SUM(CASE WHEN l.kind IN ('payout', 'refund') THEN l.amount_cents END), 0),
+                       COALESCE(SUM(CASE WHEN l.kind = 'commission' THEN l.amount_cents END), 0)
+                FROM settlements s
+                LEFT JOIN ledger_entries l ON l.settlement_id = s.settlement_id
+                GROUP BY s.settlement_id
+            ''').fetchall()
+        finally:
+            conn.close()
+
+        unbalanced = [settlement_id for settlement_id, pot, commission, stakes, paid, taken in rows
+                      if not stakes == paid + taken == pot or taken != commission]
+        result = Reconciliation(
+            settlements=len(rows),
+            stakes=sum(row[3] for row in rows) / 100,
+            paid_out=sum(row[4] for row in rows) / 100,
+            commission=sum(row[5] for row in rows) / 100,
+            unbalanced=unbalanced
+        )
+        if unbalanced:
+            logger.error(f"❌ Леджер не сходится по {len(unbalanced)} расчетам: {', '.join(unbalanced[:10])}")
+        else:
+            logger.info(f"✅ Леджер сходится: {result.settlements} расчетов, ставки ${result.stakes:.2f} = "
+                        f"выплаты ${result.paid_out:.2f} + комиссия ${result.commission:.2f}")
+        return result
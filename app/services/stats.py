@@ -0,0 +1,157 @@
+# app/services/stats.py
+import logging
+from typing import Dict
+
+from app.services.metrics import registry
+from app.services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+STATS_DRIFT_TOTAL = registry.counter(
+    'dicebot_stats_drift_total', 'Счетчики статистики, исправленные сверкой', ('counter',))
+
+# Счетчик -> выражение над строкой таблицы ({row} = NEW или OLD).
+# Вклад строки в счетчик; триггеры прибавляют вклад новой версии и вычитают старой.
+COUNTERS = {
+    'users': {
+        'users': '1',
+        'total_balance': 'COALESCE({row}.balance, 0)',
+    },
+    'games': {
+        'games_active': "({row}.status = 'active')",
+        'games_finished': "({row}.status = 'finished')",
+        'turnover': "CASE WHEN {row}.status = 'finished' THEN {row}.bet_amount * 2 ELSE 0 END",
+    },
+    'payments': {
+        'payments': '1',
+        'deposits': "CASE WHEN {row}.payment_type = 'deposit' AND {row}.status = 'completed' "
+                    "THEN {row}.amount ELSE 0 END",
+        'withdrawals': "CASE WHEN {row}.payment_type = 'withdraw' AND {row}.status = 'completed' "
+                       "THEN {row}.amount ELSE 0 END",
+        'pending_withdrawals': "CASE WHEN {row}.payment_type = 'withdraw' "
+                               "AND {row}.status IN ('pending', 'review', 'approved', 'processing') "
+                               "THEN {row}.amount ELSE 0 END",
+    },
+    'ledger_entries': {
+        'commission': "CASE WHEN {row}.kind = 'commission' THEN {row}.amount_cents / 100.0 ELSE 0 END",
+    },
+}
+
+# Колонки, от которых зависят счетчики (UPDATE других колонок триггер не вызывает)
+WATCHED_COLUMNS = {
+    'users': 'balance',
+    'games': 'status, bet_amount',
+    'payments': 'status, amount, payment_type',
+    'ledger_entries': 'kind, amount_cents',
+}
+
+
+class StatsService:
+    """
+    Агрегаты для админ-панели, поддерживаемые инкрементально
+
+    Триггеры SQLite обновляют таблицу stats_counters в той же транзакции,
+    что и запись в users/games/payments/ledger_entries, поэтому счетчики согласованы
+    с данными при любом пути записи. Чтение статистики - один SELECT.
+    reconcile() пересчитывает агрегаты полностью и исправляет расхождения.
+
+    Создается PaymentManager после таблицы payments; комиссия берется из
+    проводок SettlementService, поэтому он создается раньше.
+    """
+
+    def __init__(self, database):
+        self.db = database
+        self._init_schema()
+        self.reconcile(report=False)  # Заполняет новые счетчики по существующим данным
+
+    def _init_schema(self):
+        conn = self.db.get_connection()
+        try:
+            with conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS stats_counters (
+                        name TEXT PRIMARY KEY,
+                        value REAL NOT NULL DEFAULT 0
+                    )
+                ''')
+                tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+                for table, counters in COUNTERS.items():
+                    if table not in tables:
+                        logger.warning(f"⚠️ Таблица {table} не найдена, счетчики {', '.join(counters)} не ведутся")
+                        continue
+                    conn.executemany('INSERT OR IGNORE INTO stats_counters (name) VALUES (?)',
+                                     [(name,) for name in counters])
+                    for statement in self._trigger_statements(table, counters):
+                        conn.execute(statement)
+        finally:
+            conn.close()
+        logger.info("📊 Счетчики статистики инициализированы")
+
+    @staticmethod
+    def _trigger_statements(table: str, counters: Dict[str, str]):
+        """DROP/CREATE триггеров вставки, удаления и обновления для таблицы"""
+        events = {
+            'insert': ('INSERT', lambda expr: expr.format(row='NEW')),
+            'delete': ('DELETE', lambda expr: f"-({expr.format(row='OLD')})"),
+            'update': (f"UPDATE OF {WATCHED_COLUMNS[table]}",
+                       lambda expr: f"({expr.format(row='NEW')}) - ({expr.format(row='OLD')})"),
+        }
+        names = ', '.join(f"'{name}'" for name in counters)
+
+        for suffix, (event, delta) in events.items():
+            cases = ' '.join(f"WHEN '{name}' THEN {delta(expr)}" for name, expr in counters.items())
+            trigger = f"stats_{table}_{suffix}"
+            yield f"DROP TRIGGER IF EXISTS {trigger}"
+            yield f'''
+                CREATE TRIGGER {trigger} AFTER {event} ON {table}
+                BEGIN
+                    UPDATE stats_counters SET value = value + (CASE name {cases} END)
+                    WHERE name IN ({names});
+                END
+            '''
+
+    def get(self) -> Dict[str, float]:
+        """Текущие значения всех счетчиков"""
+        conn = self.db.get_connection()
+        try:
+            stats = {name: 0.0 for counters in COUNTERS.values() for name in counters}
+            stats.update(conn.execute('SELECT name, value FROM stats_counters').fetchall())
+            return stats
+        finally:
+            conn.close()
+
+    @tracer.traced()
+    def reconcile(self, report: bool = True) -> Dict[str, float]:
+        """
+        Полный пересчет агрегатов; расхождения записываются в stats_counters
+
+        Чтение и исправление идут в одной IMMEDIATE-транзакции, поэтому
+        параллельные изменения не теряются. Возвращает {счетчик: исправленная разница}.
+        """
+        drift = {}
+        conn = self.db.get_connection()
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')  # Блокируем запись на время пересчета
+                current = dict(conn.execute('SELECT name, value FROM stats_counters').fetchall())
+                for table, counters in COUNTERS.items():
+                    if not all(name in current for name in counters):
+                        continue
+                    columns = ', '.join(f"COALESCE(SUM({expr.format(row=table)}), 0)"
+                                        for expr in counters.values())
+                    actual = conn.execute(f'SELECT {columns} FROM {table}').fetchone()
+
+                    for name, value in zip(counters, actual):
+                        if abs(current[name] - value) > 1e-6:
+                            drift[name] = value - current[name]
+                            conn.execute('UPDATE stats_counters SET value = ? WHERE name = ?', (value, name))
+        finally:
+            conn.close()
+
+        if not report:
+            return drift
+
+        for name, delta in drift.items():
+            STATS_DRIFT_TOTAL.inc(name)
+            logger.warning(f"⚠️ Счетчик {name} расходился на {delta:+.2f}, исправлено сверкой")
+        return drift
@@ -0,0 +1,559 @@
+# app/services/tournament.py
+import asyncio
+import json
+import logging
+import secrets
+from array import array
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from app.models.lobby import TOURNAMENT_FORMATS, LobbyPlayer
+from app.services.lobby_rounds import LobbyRoundGame, RoundResult
+from app.services.metrics import registry
+from app.services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+FORMATS = tuple(TOURNAMENT_FORMATS)  # single, swiss
+BYE = -1  # пустой слот сетки (проход без игры)
+
+TOURNAMENT_MATCHES_TOTAL = registry.counter(
+    'dicebot_tournament_matches_total', 'Сыгранные матчи турниров', ('format',))
+TOURNAMENTS_TOTAL = registry.counter(
+    'dicebot_tournaments_total', 'Завершенные турниры', ('format',))
+
+
+class Match(NamedTuple):
+    round_number: int
+    slot: int
+    player_a: int
+    player_b: Optional[int]  # None - проход без игры
+    winner_id: Optional[int]  # None - матч еще идет
+
+
+def _seeding(size: int) -> List[int]:
+    """Порядок посева в сетке на size мест: 1-й и 2-й сеяные встречаются только в финале"""
+    order = [0]
+    while len(order) < size:
+        order = [seed for s in order for seed in (s, len(order) * 2 - 1 - s)]
+    return order
+
+
+class Bracket:
+    """
+    Сетка турнира: олимпийская система (single) или швейцарская (swiss)
+
+    Игроки хранятся один раз - списком по номеру посева, а раунды -
+    массивами array('i') номеров посева: пары [a0, b0, a1, b1, ...] и
+    победители по слотам. Сетка на 1024 игрока занимает ~12 КБ.
+    В олимпийской системе проигравший выбывает, пустые места первого
+    раунда (до степени двойки) - проходы сильнейших сеяных. В швейцарской
+    все играют ceil(log2(n)) раундов, пары - из соседей по очкам без
+    повторных встреч (насколько возможно), нечетному числу - проход
+    последнему без прохода. Проход засчитывается победой.
+    """
+
+    def __init__(self, players: Sequence[int], format: str = "single", total_rounds: Optional[int] = None):
+        if format not in FORMATS:
+            raise ValueError(f"Неизвестный формат турнира: {format}")
+        if len(players) < 2:
+            raise ValueError("Для турнира нужно минимум 2 игрока")
+
+        self.format = format
+        self.players = list(players)  # номер посева -> ID игрока
+        self.seeds = {player_id: seed for seed, player_id in enumerate(self.players)}
+        self.size = 1 << (len(self.players) - 1).bit_length()
+        self.total_rounds = total_rounds or self.size.bit_length() - 1
+        self.pairs: List[array] = []  # по раундам: номера посева парами, BYE - проход
+        self.winners: List[array] = []  # по раундам: победитель слота, BYE - матч идет
+        self.points = array('i', bytes(4 * len(self.players)))  # победы (швейцарская система)
+        self._open = 0  # незавершенные матчи текущего раунда
+
+    # ==================== РАУНДЫ ====================
+
+    @property
+    def round_number(self) -> int:
+        return len(self.pairs)
+
+    @property
+    def round_complete(self) -> bool:
+        return self._open == 0
+
+    @property
+    def finished(self) -> bool:
+        return self.round_complete and self.round_number >= self.total_rounds
+
+    def next_round(self) -> List[Match]:
+        """Составляет пары следующего раунда; проходы засчитываются сразу"""
+        if not self.round_complete:
+            raise ValueError("Текущий раунд еще не сыгран")
+        if self.finished:
+            raise ValueError("Турнир завершен")
+
+        if self.format == "single":
+            if self.pairs:
+                pairs = array('i', self.winners[-1])
+            else:
+                pairs = array('i', (seed if seed < len(self.players) else BYE for seed in _seeding(self.size)))
+        else:
+            pairs = self._swiss_pairs()
+
+        winners = array('i', [BYE] * (len(pairs) // 2))
+        self.pairs.append(pairs)
+        self.winners.append(winners)
+        self._open = len(winners)
+        for slot in range(len(winners)):
+            a, b = pairs[2 * slot], pairs[2 * slot + 1]
+            if b == BYE or a == BYE:
+                self._win(slot, a if b == BYE else b)
+        return self.matches(self.round_number)
+
+    def _swiss_pairs(self) -> array:
+        """Пары по очкам: соседи по таблице, без повторных встреч, если возможно"""
+        ranking = sorted(range(len(self.players)), key=lambda s: (-self.points[s], s))
+        played, had_bye = set(), set()
+        for pairs in self.pairs:
+            for i in range(0, len(pairs), 2):
+                a, b = pairs[i], pairs[i + 1]
+                if b == BYE:
+                    had_bye.add(a)
+                else:
+                    played.add((min(a, b), max(a, b)))
+
+        pairs = array('i')
+        bye = None
+        if len(ranking) % 2:
+            bye = next((s for s in reversed(ranking) if s not in had_bye), ranking[-1])
+            ranking.remove(bye)
+        while ranking:
+            a = ranking.pop(0)
+            b = next((s for s in ranking if (min(a, s), max(a, s)) not in played), ranking[0])
+            ranking.remove(b)
+            pairs.extend((a, b))
+        if bye is not None:
+            pairs.extend((bye, BYE))
+        return pairs
+
+    # ==================== РЕЗУЛЬТАТЫ ====================
+
+    def record(self, round_number: int, slot: int, winner_id: int) -> bool:
+        """Записывает победителя матча; True - раунд сыгран целиком"""
+        if round_number != self.round_number:
+            raise ValueError(f"Раунд {round_number} не текущий")
+        pairs, winners = self.pairs[-1], self.winners[-1]
+        if winners[slot] != BYE:
+            raise ValueError(f"Матч {round_number}/{slot} уже сыгран")
+        seed = self.seeds.get(winner_id)
+        if seed is None or seed not in (pairs[2 * slot], pairs[2 * slot + 1]):
+            raise ValueError(f"Игрок {winner_id} не играет в матче {round_number}/{slot}")
+        self._win(slot, seed)
+        return self.round_complete
+
+    def _win(self, slot: int, seed: int):
+        self.winners[-1][slot] = seed
+        self.points[seed] += 1
+        self._open -= 1
+
+    def matches(self, round_number: Optional[int] = None) -> List[Match]:
+        """Матчи раунда (по умолчанию - текущего)"""
+        round_number = round_number or self.round_number
+        return [self.match(round_number, slot) for slot in range(len(self.winners[round_number - 1]))]
+
+    def match(self, round_number: int, slot: int) -> Match:
+        pairs, winners = self.pairs[round_number - 1], self.winners[round_number - 1]
+        return Match(round_number, slot, self._player(pairs[2 * slot]), self._player(pairs[2 * slot + 1]),
+                     self._player(winners[slot]))
+
+    def _player(self, seed: int) -> Optional[int]:
+        return None if seed == BYE else self.players[seed]
+
+    # ==================== ИТОГИ ====================
+
+    def standings(self) -> List[Tuple[int, int]]:
+        """
+        (игрок, победы) от первого места
+
+        Равные по победам - по Бухгольцу (сумма побед соперников), затем по посеву.
+        """
+        buchholz = [0] * len(self.players)
+        for pairs in self.pairs:
+            for i in range(0, len(pairs), 2):
+                a, b = pairs[i], pairs[i + 1]
+                if a != BYE and b != BYE:
+                    buchholz[a] += self.points[b]
+                    buchholz[b] += self.points[a]
+        order = sorted(range(len(self.players)), key=lambda s: (-self.points[s], -buchholz[s], s))
+        return [(self.players[seed], self.points[seed]) for seed in order]
+
+    @property
+    def champion(self) -> Optional[int]:
+        if not self.finished:
+            return None
+        if self.format == "single":
+            return self.players[self.winners[-1][0]]
+        return self.standings()[0][0]
+
+    # ==================== СОХРАНЕНИЕ ====================
+
+    def match_rows(self, round_number: int) -> List[Tuple[int, int, int, Optional[int], Optional[int]]]:
+        """Строки tournament_matches раунда: (раунд, слот, игрок A, игрок B, победитель)"""
+        return [tuple(match) for match in self.matches(round_number)]
+
+    @classmethod
+    def restore(cls, players: Sequence[int], format: str, total_rounds: int,
+                rows: Sequence[Tuple[int, int, int, Optional[int], Optional[int]]]) -> 'Bracket':
+        """Сетка из сохраненных строк матчей (строки отсортированы по раунду и слоту)"""
+        bracket = cls(players, format, total_rounds)
+        for round_number, slot, player_a, player_b, winner_id in rows:
+            if round_number > bracket.round_number:
+                bracket.pairs.append(array('i'))
+                bracket.winners.append(array('i'))
+                bracket._open = 0
+            seed_b = BYE if player_b is None else bracket.seeds[player_b]
+            bracket.pairs[-1].extend((bracket.seeds[player_a], seed_b))
+            bracket.winners[-1].append(BYE)
+            bracket._open += 1
+            if winner_id is not None:
+                bracket._win(slot, bracket.seeds[winner_id])
+        return bracket
+
+
+class Tournament:
+    """Турнир, собранный из регистраций лобби (ID турнира = ID лобби)"""
+
+    def __init__(self, tournament_id: str, bet_amount: float, names: Dict[int, str], bracket: Bracket):
+        self.id = tournament_id
+        self.lobby_id = tournament_id
+        self.bet_amount = bet_amount
+        self.names = names
+        self.bracket = bracket
+        self.status = "active"  # active, finished, cancelled
+
+    @classmethod
+    def from_lobby(cls, lobby, bracket: Bracket) -> 'Tournament':
+        return cls(lobby.id, lobby.bet_amount, {player.id: player.username for player in lobby.players}, bracket)
+
+    def name(self, player_id: int) -> str:
+        return self.names.get(player_id, str(player_id))
+
+
+class TournamentManager:
+    """
+    Турниры на сотни игроков поверх лобби
+
+    Лобби с форматом турнира (Lobby.tournament) вместо одной общей игры
+    запускает сетку: каждый матч раунда - отдельная игра LobbyRoundGame
+    на двоих, все матчи раунда идут параллельно. Ничья в матче
+    переигрывается дополнительным раундом. Победитель матча проходит
+    дальше автоматически, сыгранный раунд сразу порождает следующий -
+    ручных действий по матчам нет, за не успевших бросает бот.
+
+    Сетка пишется в БД по мере игры: строка турнира при старте, строки
+    матчей раунда при жеребьевке и одна строка на каждый результат.
+    Взносы (ставка лобби) уже списаны при входе в лобби; банк за вычетом
+    комиссии получает чемпион одним расчетом через SettlementService.
+    После перезапуска resume() продолжает активные турниры по сетке из БД.
+    """
+
+    def __init__(self, db, settlement, games: Optional[Dict[str, LobbyRoundGame]] = None,
+                 match_rounds: int = 3, round_timeout: float = 30.0,
+                 on_round_opened: Optional[Callable[[Tournament, Match, LobbyRoundGame], Awaitable]] = None,
+                 on_match_finished: Optional[Callable[[Tournament, Match], Awaitable]] = None,
+                 on_finished: Optional[Callable[[Tournament, object], Awaitable]] = None):
+        self.db = db
+        self.settlement = settlement
+        self.games = games if games is not None else {}  # ID игры -> матч (общий с играми лобби)
+        self.match_rounds = match_rounds
+        self.round_timeout = round_timeout
+        self.on_round_opened = on_round_opened
+        self.on_match_finished = on_match_finished
+        self.on_finished = on_finished
+
+        self.tournaments: Dict[str, Tournament] = {}
+        self._matches: Dict[str, Tuple[Tournament, Match]] = {}  # ID игры -> турнир и матч
+        self._init_schema()
+
+    def _init_schema(self):
+        conn = self.db.get_connection()
+        try:
+            with conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS tournaments (
+                        id TEXT PRIMARY KEY,
+                        format TEXT NOT NULL,
+                        bet_amount REAL NOT NULL,
+                        players TEXT NOT NULL,  -- JSON: ID игроков по номеру посева
+                        total_rounds INTEGER NOT NULL,
+                        status TEXT NOT NULL,
+                        champion_id INTEGER,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        finished_at DATETIME
+                    ) WITHOUT ROWID
+                ''')
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS tournament_matches (
+                        tournament_id TEXT NOT NULL,
+                        round INTEGER NOT NULL,
+                        slot INTEGER NOT NULL,
+                        player_a INTEGER NOT NULL,
+                        player_b INTEGER,  -- NULL - проход
+                        winner_id INTEGER,  -- NULL - матч идет
+                        PRIMARY KEY (tournament_id, round, slot)
+                    ) WITHOUT ROWID
+                ''')
+        finally:
+            conn.close()
+
+    # ==================== СТАРТ ====================
+
+    @tracer.traced()
+    async def start(self, lobby) -> Tuple[Optional[Tournament], Optional[str]]:
+        """Жеребьевка по оплатившим игрокам лобби-турнира и запуск первого раунда"""
+        if lobby.tournament not in FORMATS:
+            return None, "Лобби не зарегистрировано как турнир"
+        if lobby.id in self.tournaments:
+            return None, "Турнир уже идет"
+        players = [player.id for player in lobby.players if player.paid]
+        if len(players) < 2:
+            return None, "Для турнира нужно минимум 2 игрока"
+
+        # Посев случайный: порядок входа в лобби не дает преимущества
+        secrets.SystemRandom().shuffle(players)
+        tournament = Tournament.from_lobby(lobby, Bracket(players, lobby.tournament))
+        self.tournaments[tournament.id] = tournament
+
+        matches = tournament.bracket.next_round()
+        self._save(tournament, new_round=True)
+        logger.info("🏆 Турнир %s (%s): %s игроков, %s раундов", tournament.id, lobby.tournament,
+                    len(players), tournament.bracket.total_rounds)
+        await self._start_matches(tournament, matches)
+        return tournament, None
+
+    async def _start_matches(self, tournament: Tournament, matches: List[Match]):
+        """Запускает матчи раунда параллельно (проходы уже засчитаны)"""
+        games = []
+        for match in matches:
+            if match.winner_id is not None:
+                continue
+            game_id = f"t_{tournament.id}_{match.round_number}_{match.slot}"
+            players = [LobbyPlayer(player_id, tournament.name(player_id))
+                       for player_id in (match.player_a, match.player_b)]
+            game = LobbyRoundGame(
+                game_id, tournament.lobby_id, players, tournament.bet_amount,
+                rounds=self.match_rounds,
+                round_timeout=self.round_timeout,
+                on_round_closed=self._on_match_round
+            )
+            self.games[game_id] = game
+            self._matches[game_id] = (tournament, match)
+            games.append((match, game))
+
+        async def launch(match: Match, game: LobbyRoundGame):
+            # Таймер матча стартует, когда кнопки уже у игроков
+            await self._notify(self.on_round_opened, tournament, match, game)
+            game.start()
+
+        await asyncio.gather(*(launch(match, game) for match, game in games))
+
+        # Раунд без единого матча (одни проходы) сам не закроется - сразу дальше
+        if not games:
+            await self._advance(tournament)
+
+    async def _on_match_round(self, game: LobbyRoundGame, result: RoundResult):
+        """Раунд матча закрыт: следующий раунд, переигровка ничьей или итог матча"""
+        tournament, match = self._matches[game.game_id]
+        if not result.finished:
+            await self._notify(self.on_round_opened, tournament, match, game)
+            return
+
+        (first, first_total, _), (second, second_total, _) = game.totals()
+        if first_total == second_total:
+            game.add_round()
+            await self._notify(self.on_round_opened, tournament, match, game)
+            return
+
+        self.games.pop(game.game_id, None)
+        del self._matches[game.game_id]
+        await self.report(tournament.id, match.round_number, match.slot, first.id)
+
+    @tracer.traced()
+    async def report(self, tournament_id: str, round_number: int, slot: int, winner_id: int) -> bool:
+        """Результат матча: победитель проходит дальше, сыгранный раунд запускает следующий"""
+        tournament = self.tournaments.get(tournament_id)
+        if not tournament:
+            return False
+
+        bracket = tournament.bracket
+        round_complete = bracket.record(round_number, slot, winner_id)
+        self._save_result(tournament_id, round_number, slot, winner_id)
+        TOURNAMENT_MATCHES_TOTAL.inc(bracket.format)
+
+        await self._notify(self.on_match_finished, tournament, bracket.match(round_number, slot))
+        if round_complete:
+            await self._advance(tournament)
+        return True
+
+    async def _advance(self, tournament: Tournament):
+        bracket = tournament.bracket
+        if bracket.finished:
+            await self._finish(tournament)
+            return
+        matches = bracket.next_round()
+        self._save(tournament, new_round=True)
+        logger.info("🏆 Турнир %s: раунд %s/%s, матчей: %s", tournament.id, bracket.round_number,
+                    bracket.total_rounds, len(matches))
+        await self._start_matches(tournament, matches)
+
+    async def _finish(self, tournament: Tournament):
+        """Чемпион получает банк турнира"""
+        bracket = tournament.bracket
+        champion = bracket.champion
+
+        # Сначала расчет, потом статус: после сбоя между ними турнир
+        # восстановится активным, а повторный расчет отсечет settlement_id
+        stakes = {player_id: tournament.bet_amount for player_id in bracket.players}
+        settlement, error = self.settlement.settle("tournament", tournament.id, stakes, winners=[champion])
+        if error:
+            settlement = self.settlement.get("tournament", tournament.id)
+            if not settlement:
+                logger.error(f"❌ Расчет по турниру {tournament.id} не проведен: {error}")
+
+        tournament.status = "finished"
+        self._save(tournament)
+        del self.tournaments[tournament.id]
+        TOURNAMENTS_TOTAL.inc(bracket.format)
+        logger.info(f"🏆 Турнир {tournament.id} завершен, чемпион: {tournament.name(champion)}")
+        await self._notify(self.on_finished, tournament, settlement)
+
+    # ==================== ПЕРЕЗАПУСК ====================
+
+    @tracer.traced()
+    async def resume(self) -> Dict[str, int]:
+        """
+        Восстанавливает активные турниры после перезапуска
+
+        Сетка читается из БД, недоигранные матчи текущего раунда начинаются
+        заново (броски незакрытых матчей жили только в памяти), сыгранный
+        раунд порождает следующий. Турнир, сетку которого не удалось
+        восстановить, отменяется с возвратом взносов.
+        """
+        result = {"resumed": 0, "refunded": 0}
+        conn = self.db.get_connection()
+        try:
+            rows = conn.execute(
+                "SELECT id, bet_amount, players FROM tournaments WHERE status = 'active'"
+            ).fetchall()
+        finally:
+            conn.close()
+
+        for tournament_id, bet_amount, players in rows:
+            if tournament_id in self.tournaments:
+                continue
+            try:
+                bracket = self.load_bracket(tournament_id)
+                tournament = Tournament(tournament_id, bet_amount, self._names(bracket.players), bracket)
+            except Exception as e:
+                logger.error(f"❌ Турнир {tournament_id} не восстановлен: {e}")
+                self._refund(tournament_id, bet_amount, json.loads(players))
+                result["refunded"] += 1
+                continue
+
+            self.tournaments[tournament_id] = tournament
+            result["resumed"] += 1
+            logger.info(f"🏆 Турнир {tournament_id} восстановлен: раунд {bracket.round_number}/{bracket.total_rounds}")
+            if bracket.round_complete:
+                await self._advance(tournament)
+            else:
+                await self._start_matches(tournament, bracket.matches())
+        return result
+
+    def _names(self, players: Sequence[int]) -> Dict[int, str]:
+        """Имена участников из users (имена из лобби жили только в памяти)"""
+        conn = self.db.get_connection()
+        try:
+            names = {}
+            for start in range(0, len(players), 500):
+                chunk = players[start:start + 500]
+                names.update(conn.execute(
+                    f"SELECT telegram_id, username FROM users WHERE telegram_id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall())
+        finally:
+            conn.close()
+        return {player_id: name for player_id, name in names.items() if name}
+
+    def _refund(self, tournament_id: str, bet_amount: float, players: Sequence[int]):
+        """Отмена турнира с возвратом взносов"""
+        stakes = {player_id: bet_amount for player_id in players}
+        _, error = self.settlement.settle("tournament", tournament_id, stakes, cancelled=True)
+        if error and not self.settlement.get("tournament", tournament_id):
+            logger.error(f"❌ Возврат взносов турнира {tournament_id} не проведен: {error}")
+            return
+
+        conn = self.db.get_connection()
+        try:
+            with conn:
+                conn.execute("UPDATE tournaments SET status = 'cancelled' WHERE id = ?", (tournament_id,))
+        finally:
+            conn.close()
+        logger.warning(f"⚠️ Турнир {tournament_id} отменен, взносы возвращены")
+
+    async def _notify(self, hook, *args):
+        if not hook:
+            return
+        try:
+            await hook(*args)
+        except Exception as e:
+            logger.error(f"❌ Ошибка уведомления турнира: {e}")
+
+    # ==================== БД ====================
+
+    def _save(self, tournament: Tournament, new_round: bool = False):
+        """Строка турнира и (при жеребьевке) строки матчей нового раунда одной транзакцией"""
+        bracket = tournament.bracket
+        conn = self.db.get_connection()
+        try:
+            with conn:
+                conn.execute('''
+                    INSERT INTO tournaments (id, format, bet_amount, players, total_rounds, status, champion_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (id) DO UPDATE SET
+                        status = excluded.status,
+                        champion_id = excluded.champion_id,
+                        finished_at = CASE WHEN excluded.status = 'finished' THEN CURRENT_TIMESTAMP END
+                ''', (tournament.id, bracket.format, tournament.bet_amount, json.dumps(bracket.players),
+                      bracket.total_rounds, tournament.status, bracket.champion))
+                if new_round:
+                    conn.executemany('''
+                        INSERT OR REPLACE INTO tournament_matches
+                        (tournament_id, round, slot, player_a, player_b, winner_id)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', [(tournament.id, *row) for row in bracket.match_rows(bracket.round_number)])
+        finally:
+            conn.close()
+
+    def _save_result(self, tournament_id: str, round_number: int, slot: int, winner_id: int):
+        conn = self.db.get_connection()
+        try:
+            with conn:
+                conn.execute('''
+                    UPDATE tournament_matches SET winner_id = ?
+                    WHERE tournament_id = ? AND round = ? AND slot = ?
+                ''', (winner_id, tournament_id, round_number, slot))
+        finally:
+            conn.close()
+
+    def load_bracket(self, tournament_id: str) -> Optional[Bracket]:
+        """Сетка турнира из БД (например, после перезапуска)"""
+        conn = self.db.get_connection()
+        try:
+            row = conn.execute('SELECT players, format, total_rounds FROM tournaments WHERE id = ?',
+                               (tournament_id,)).fetchone()
+            if not row:
+                return None
+            rows = conn.execute('''
+                SELECT round, slot, player_a, player_b, winner_id FROM tournament_matches
+                WHERE tournament_id = ? ORDER BY round, slot
+            ''', (tournament_id,)).fetchall()
+        finally:
+            conn.close()
+        return Bracket.restore(json.loads(row[0]), row[1], row[2], rows)
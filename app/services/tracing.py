@@ -0,0 +1,217 @@
+# app/services/tracing.py
+import json
+import time
+import uuid
+import queue
+import inspect
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_SPANS_PER_TRACE = 500
+
+_current_trace: ContextVar[Optional['Trace']] = ContextVar('current_trace', default=None)
+_current_span: ContextVar[Optional[int]] = ContextVar('current_span', default=None)
+
+
+class _NoopSpan:
+    """Пустой спан: используется, когда трассировка выключена или нет активной трассы"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, key: str, value: Any):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """Отрезок времени внутри трассы (обработчик, метод менеджера, SQL, HTTP)"""
+
+    __slots__ = ('trace', 'name', 'attrs', 'span_id', 'parent_id', 'start', 'duration', '_token')
+
+    def __init__(self, trace: 'Trace', name: str, attrs: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+        self.span_id = trace.next_span_id()
+        self.parent_id = _current_span.get()
+        self.start = 0.0
+        self.duration = 0.0
+        self._token = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self._token = _current_span.set(self.span_id)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.trace.add_span(self)
+        return False
+
+    def set(self, key: str, value: Any):
+        self.attrs[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.span_id,
+            'parent': self.parent_id,
+            'name': self.name,
+            'offset_ms': round((self.start - self.trace.start) * 1000, 3),
+            'duration_ms': round(self.duration * 1000, 3),
+            'attrs': self.attrs,
+        }
+
+
+class Trace:
+    """Трасса одного обновления Telegram"""
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.spans: List[Span] = []
+        self.dropped_spans = 0
+        self._span_counter = 0
+
+    def next_span_id(self) -> int:
+        self._span_counter += 1
+        return self._span_counter
+
+    def add_span(self, span: Span):
+        if len(self.spans) < MAX_SPANS_PER_TRACE:
+            self.spans.append(span)
+        else:
+            self.dropped_spans += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration * 1000, 3),
+            'attrs': self.attrs,
+            'dropped_spans': self.dropped_spans,
+            'spans': [span.to_dict() for span in sorted(self.spans, key=lambda s: s.start)],
+        }
+
+
+class Tracer:
+    """Легковесная трассировка: медленные трассы пишутся в JSONL-файл"""
+
+    def __init__(self, enabled: bool = False, slow_threshold_ms: float = 1000.0,
+                 export_path: str = 'slow_traces.jsonl'):
+        self.enabled = enabled
+        self.slow_threshold_ms = slow_threshold_ms
+        self.export_path = export_path
+        self.exported_count = 0
+        self._export_queue: Optional[queue.SimpleQueue] = None
+        self._writer: Optional[threading.Thread] = None
+
+    def configure(self, enabled: bool, slow_threshold_ms: float, export_path: str):
+        self.enabled = enabled
+        self.slow_threshold_ms = slow_threshold_ms
+        self.export_path = export_path
+        if enabled:
+            logger.info(f"🔬 Трассировка включена (порог {slow_threshold_ms:.0f} мс, файл {export_path})")
+
+    @contextmanager
+    def trace(self, name: str, **attrs):
+        """Корневая трасса (одна на обновление)"""
+        if not self.enabled:
+            yield None
+            return
+
+        trace = Trace(name, attrs)
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(None)
+        try:
+            yield trace
+        finally:
+            trace.duration = time.perf_counter() - trace.start
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            if trace.duration * 1000 >= self.slow_threshold_ms:
+                self._export(trace)
+
+    def span(self, name: str, **attrs):
+        """Спан внутри текущей трассы; без трассы возвращает пустой спан"""
+        trace = _current_trace.get()
+        if trace is None:
+            return NOOP_SPAN
+        return Span(trace, name, attrs)
+
+    def current_trace_id(self) -> Optional[str]:
+        trace = _current_trace.get()
+        return trace.trace_id if trace else None
+
+    def traced(self, name: Optional[str] = None):
+        """Декоратор: оборачивает вызов функции (sync или async) в спан"""
+
+        def decorator(func):
+            span_name = name or func.__qualname__
+
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if _current_trace.get() is None:
+                        return await func(*args, **kwargs)
+                    with self.span(span_name):
+                        return await func(*args, **kwargs)
+
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if _current_trace.get() is None:
+                    return func(*args, **kwargs)
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def _export(self, trace: Trace):
+        """Передает трассу фоновому потоку записи (файловый ввод-вывод вне event loop)"""
+        if self._writer is None:
+            self._export_queue = queue.SimpleQueue()
+            self._writer = threading.Thread(target=self._write_loop, name='trace-writer', daemon=True)
+            self._writer.start()
+
+        self.exported_count += 1
+        self._export_queue.put(trace.to_dict())
+        logger.warning("🐢 Медленное обновление %s: %.0f мс (trace_id=%s)",
+                       trace.name, trace.duration * 1000, trace.trace_id)
+
+    def _write_loop(self):
+        while True:
+            entry = self._export_queue.get()
+            try:
+                with open(self.export_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи трассы: {e}")
+
+
+# Глобальный трассировщик (выключен, пока не вызван configure)
+tracer = Tracer()
@@ -0,0 +1,110 @@
+# app/utils/logging_setup.py
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from typing import Dict, Optional
+
+# Маркер для частых событий (на каждое обновление): logger.info("...", extra=SAMPLED)
+SAMPLED = {'sampled': True}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает только каждую N-ю запись, помеченную как SAMPLED (отдельно для каждого логгера)"""
+
+    def __init__(self, sample_every: int = 1):
+        super().__init__()
+        self.sample_every = max(1, sample_every)
+        self.counters: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.sample_every == 1 or not getattr(record, 'sampled', False):
+            return True
+
+        # Предупреждения и ошибки никогда не отбрасываем
+        if record.levelno >= logging.WARNING:
+            return True
+
+        count = self.counters.get(record.name, 0)
+        self.counters[record.name] = count + 1
+        return count % self.sample_every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """Структурированный вывод: одна JSON-строка на запись"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """Разбирает строку вида 'app.handlers=WARNING,database=DEBUG'"""
+    levels = {}
+    for item in (spec or '').split(','):
+        if '=' not in item:
+            continue
+        name, level = item.split('=', 1)
+        level = logging.getLevelName(level.strip().upper())
+        if isinstance(level, int):
+            levels[name.strip()] = level
+    return levels
+
+
+def setup_logging(level: str = 'INFO', subsystem_levels: str = '',
+                  log_format: str = 'text', sample_every: int = 1):
+    """Настраивает неблокирующее логирование через очередь
+
+    Обработчики (stdout/файл) работают в отдельном потоке QueueListener,
+    поэтому ввод-вывод не блокирует event loop.
+    """
+    global _listener
+
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler()
+    if log_format == 'json':
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_every))
+
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(queue_handler)
+    root.setLevel(logging.getLevelName(level.upper()))
+
+    for name, subsystem_level in parse_levels(subsystem_levels).items():
+        logging.getLogger(name).setLevel(subsystem_level)
+
+    # httpx пишет строку на каждый запрос к Telegram
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Сбрасывает очередь логов и останавливает фоновый поток"""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,104 @@
+# app/utils/pagination.py
+import sqlite3
+from typing import List, NamedTuple, Optional, Tuple
+
+from telegram import InlineKeyboardButton
+
+# Направление курсора: 'a' - записи после якоря (старее), 'b' - до якоря (новее)
+PAGE_AFTER = 'a'
+PAGE_BEFORE = 'b'
+
+_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+class Page(NamedTuple):
+    rows: list
+    next_cursor: Optional[str]
+    prev_cursor: Optional[str]
+
+
+def encode_cursor(direction: str, rowid: int) -> str:
+    """Непрозрачный курсор для callback_data: направление + rowid якоря в base36"""
+    digits = ''
+    while True:
+        rowid, rest = divmod(rowid, 36)
+        digits = _DIGITS[rest] + digits
+        if not rowid:
+            return direction + digits
+
+
+def decode_cursor(token: Optional[str]) -> Optional[Tuple[str, int]]:
+    """(направление, rowid) или None для первой страницы и испорченных курсоров"""
+    if not token or token[0] not in (PAGE_AFTER, PAGE_BEFORE):
+        return None
+    try:
+        return token[0], int(token[1:], 36)
+    except ValueError:
+        return None
+
+
+def fetch_page(cursor: sqlite3.Cursor, table: str, columns: str, where: str = '',
+               params: tuple = (), sort_column: str = 'created_at',
+               page_cursor: Optional[str] = None, page_size: int = 10) -> Page:
+    """
+    Keyset-страница, отсортированная по (sort_column, rowid) от новых к старым
+
+    Курсор хранит только rowid граничной записи; ее ключ сортировки читается
+    по первичному ключу, а страница - диапазоном по индексу (..., sort_column),
+    поэтому стоимость страницы не зависит от глубины (без OFFSET).
+    """
+    anchor = decode_cursor(page_cursor)
+    conditions = [where] if where else []
+    params = tuple(params)
+
+    if anchor:
+        cursor.execute(f'SELECT {sort_column} FROM {table} WHERE rowid = ?', (anchor[1],))
+        row = cursor.fetchone()
+        if row is None:
+            anchor = None  # Якорь удален - начинаем с первой страницы
+        else:
+            operator = '<' if anchor[0] == PAGE_AFTER else '>'
+            conditions.append(f'({sort_column}, rowid) {operator} (?, ?)')
+            params += (row[0], anchor[1])
+
+    backwards = anchor is not None and anchor[0] == PAGE_BEFORE
+    order = 'ASC' if backwards else 'DESC'
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    cursor.execute(f'''
+        SELECT {columns}, rowid FROM {table}
+        {where_sql}
+        ORDER BY {sort_column} {order}, rowid {order}
+        LIMIT ?
+    ''', params + (page_size + 1,))
+    rows = cursor.fetchall()
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+    if not rows:
+        return Page([], None, None)
+
+    first, last = rows[0][-1], rows[-1][-1]
+    if backwards:
+        next_cursor = encode_cursor(PAGE_AFTER, last)
+        prev_cursor = encode_cursor(PAGE_BEFORE, first) if has_more else None
+    else:
+        next_cursor = encode_cursor(PAGE_AFTER, last) if has_more else None
+        prev_cursor = encode_cursor(PAGE_BEFORE, first) if anchor else None
+
+    return Page([row[:-1] for row in rows], next_cursor, prev_cursor)
+
+
+def page_buttons(page: Page, callback_prefix: str, suffix: str = '') -> List[InlineKeyboardButton]:
+    """Кнопки «новее / старее» для клавиатуры; callback_data: <prefix>:<курсор>[:suffix]"""
+    tail = f":{suffix}" if suffix else ''
+    buttons = []
+    if page.prev_cursor:
+        buttons.append(InlineKeyboardButton(
+            "⬅️ Новее", callback_data=f"{callback_prefix}:{page.prev_cursor}{tail}"))
+    if page.next_cursor:
+        buttons.append(InlineKeyboardButton(
+            "Старее ➡️", callback_data=f"{callback_prefix}:{page.next_cursor}{tail}"))
+    return buttons
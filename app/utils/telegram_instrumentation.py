@@ -0,0 +1,56 @@
+# app/utils/telegram_instrumentation.py
+import time
+import logging
+
+from telegram.ext import Application, BaseHandler, CommandHandler
+from telegram.request import HTTPXRequest
+
+from app.services.metrics import (
+    UPDATES_TOTAL, HANDLER_SECONDS, TELEGRAM_API_SECONDS, TELEGRAM_API_ERRORS_TOTAL, update_kind
+)
+from app.services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentedApplication(Application):
+    """Application, замеряющий время обработки каждого обновления (метрика + корневая трасса)"""
+
+    # Зарегистрированные команды - допустимые значения метки command:<имя>
+    commands: frozenset = frozenset()
+
+    def add_handler(self, handler: BaseHandler, group: int = 0) -> None:
+        super().add_handler(handler, group)
+        if isinstance(handler, CommandHandler):
+            self.commands = self.commands | handler.commands
+
+    async def process_update(self, update: object) -> None:
+        kind = update_kind(update, self.commands) if hasattr(update, 'callback_query') else 'other'
+        start = time.perf_counter()
+        try:
+            update_id = getattr(update, 'update_id', None)
+            with tracer.trace('update', kind=kind, update_id=update_id):
+                await super().process_update(update)
+        finally:
+            UPDATES_TOTAL.inc(kind)
+            HANDLER_SECONDS.observe(time.perf_counter() - start, kind)
+
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """HTTP-клиент Bot API с метриками по методам (sendMessage, sendDice, ...)"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            with tracer.span(f'telegram.{api_method}') as span:
+                status_code, payload = await super().do_request(url, method, *args, **kwargs)
+                span.set('status', status_code)
+            if status_code >= 400:
+                TELEGRAM_API_ERRORS_TOTAL.inc(api_method, str(status_code))
+            return status_code, payload
+        except Exception as e:
+            TELEGRAM_API_ERRORS_TOTAL.inc(api_method, type(e).__name__)
+            raise
+        finally:
+            TELEGRAM_API_SECONDS.observe(time.perf_counter() - start, api_method)
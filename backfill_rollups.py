@@ -0,0 +1,51 @@
+# backfill_rollups.py
+import time
+import logging
+import argparse
+
+from config import Config
+from database import Database
+from app.models.payment import PaymentModel
+from app.services.rollups import RollupService
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def backfill_rollups(db_path: str, chunk_size: int, rebuild: bool = False):
+    """Заполнение почасовых/посуточных срезов по истории игр и платежей"""
+    db = Database(db_path)
+    PaymentModel(db)  # Таблица payments нужна до создания срезов
+    rollups = RollupService(db, commission_rate=Config.COMMISSION_RATE, chunk_size=chunk_size)
+
+    if rebuild:
+        rollups.reset()
+
+    logger.info(f"🔄 Бэкфилл срезов пачками по {chunk_size} строк...")
+    started = time.perf_counter()
+    total = {"games": 0, "payments": 0}
+
+    # Пачка за пачкой: в памяти не больше chunk_size строк каждой таблицы
+    while True:
+        result = rollups.run_once(max_chunks=1)
+        if not result["games"] and not result["payments"]:
+            break
+        total["games"] += result["games"]
+        total["payments"] += result["payments"]
+        logger.info(f"   ... {total['games']} игр, {total['payments']} платежей")
+
+    logger.info(
+        f"✅ Бэкфилл завершен: {total['games']} игр, {total['payments']} платежей "
+        f"за {time.perf_counter() - started:.1f} сек"
+    )
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бэкфилл срезов аналитики")
+    parser.add_argument('--db', default='dice_game.db', help="Путь к базе данных")
+    parser.add_argument('--chunk-size', type=int, default=Config.ROLLUP_CHUNK_SIZE)
+    parser.add_argument('--rebuild', action='store_true', help="Сбросить срезы и пересчитать с нуля")
+    args = parser.parse_args()
+
+    backfill_rollups(args.db, args.chunk_size, args.rebuild)
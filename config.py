@@ -17,6 +17,81 @@ class Config:
     MIN_BET = 1.0
     MIN_WITHDRAWAL = 1.0
 
+    # Время жизни состояния ожидания ввода (секунды)
+    INPUT_STATE_TTL = int(os.getenv('INPUT_STATE_TTL', 600))
+
+    # Сколько групповых чатов фильтр помнит в статистике (давно молчавшие вытесняются)
+    GROUP_FILTER_MAX_CHATS = int(os.getenv('GROUP_FILTER_MAX_CHATS', 10000))
+
+    # Логирование
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_LEVELS = os.getenv('LOG_LEVELS', '')  # Например: app.handlers=WARNING,database=DEBUG
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # text или json
+    LOG_SAMPLE_EVERY = int(os.getenv('LOG_SAMPLE_EVERY', 20))  # Каждое N-е частое событие
+
+    # Метрики Prometheus (0 - отключить HTTP-эндпоинт /metrics)
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))
+
+    # Трассировка обновлений (медленные трассы пишутся в JSONL)
+    TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', 1000))
+    TRACE_EXPORT_PATH = os.getenv('TRACE_EXPORT_PATH', 'slow_traces.jsonl')
+
+    # Сверка pending депозитов с Crypto Pay
+    PAYMENT_POLL_INTERVAL = int(os.getenv('PAYMENT_POLL_INTERVAL', 120))  # секунды, 0 - отключить
+    INVOICE_BATCH_SIZE = int(os.getenv('INVOICE_BATCH_SIZE', 100))  # ID в одном запросе getInvoices
+    INVOICE_POLL_CONCURRENCY = int(os.getenv('INVOICE_POLL_CONCURRENCY', 4))
+
+    # Очередь выплат: интервал прохода (0 - отключить), пачка, параллельность, правила одобрения
+    PAYOUT_INTERVAL = int(os.getenv('PAYOUT_INTERVAL', 30))
+    PAYOUT_BATCH_SIZE = int(os.getenv('PAYOUT_BATCH_SIZE', 50))
+    PAYOUT_CONCURRENCY = int(os.getenv('PAYOUT_CONCURRENCY', 5))
+    PAYOUT_AUTO_MAX = float(os.getenv('PAYOUT_AUTO_MAX', 100))  # Больше - только вручную
+    PAYOUT_DAILY_LIMIT = float(os.getenv('PAYOUT_DAILY_LIMIT', 500))  # На пользователя за сутки
+
+    # Курсы валют: фоновое обновление и допустимый возраст снимка (секунды)
+    RATES_REFRESH_INTERVAL = int(os.getenv('RATES_REFRESH_INTERVAL', 60))
+    RATES_MAX_AGE = float(os.getenv('RATES_MAX_AGE', 300))
+    RATES_MAX_STALE = float(os.getenv('RATES_MAX_STALE', 3600))
+
+    # Лобби: время на бросок в раунде (все игроки бросают одновременно)
+    LOBBY_ROUND_TIMEOUT = float(os.getenv('LOBBY_ROUND_TIMEOUT', 30))
+    # Быстрый подбор соперника: период прохода и максимальное ожидание (секунды)
+    MATCHMAKING_INTERVAL = float(os.getenv('MATCHMAKING_INTERVAL', 1.0))
+    MATCHMAKING_MAX_WAIT = float(os.getenv('MATCHMAKING_MAX_WAIT', 300))
+
+    # Ключ перестановки коротких кодов игр/лобби/дуэлей (не менять на живой БД).
+    # Без ключа при первом запуске генерируется случайный и хранится в БД
+    ID_CODE_KEY = os.getenv('ID_CODE_KEY')
+
+    # Окно слияния записей лобби в БД (секунды, 0 - писать сразу)
+    LOBBY_FLUSH_DELAY = float(os.getenv('LOBBY_FLUSH_DELAY', 0.5))
+
+    # Полная сверка счетчиков админ-статистики (секунды, 0 - отключить)
+    STATS_RECONCILE_INTERVAL = int(os.getenv('STATS_RECONCILE_INTERVAL', 3600))
+
+    # Турниры поверх лобби: максимум участников, бросков в матче и время на бросок (секунды)
+    TOURNAMENT_MAX_PLAYERS = int(os.getenv('TOURNAMENT_MAX_PLAYERS', 1024))
+    TOURNAMENT_MATCH_ROUNDS = int(os.getenv('TOURNAMENT_MATCH_ROUNDS', 3))
+    TOURNAMENT_ROUND_TIMEOUT = float(os.getenv('TOURNAMENT_ROUND_TIMEOUT', 30))
+
+    # Лимиты одновременных открытых дуэлей: на групповой чат и на игрока
+    DUELS_PER_CHAT = int(os.getenv('DUELS_PER_CHAT', 20))
+    DUELS_PER_USER = int(os.getenv('DUELS_PER_USER', 3))
+
+    # Сверка леджера расчетов по играм (секунды, 0 - отключить)
+    LEDGER_RECONCILE_INTERVAL = int(os.getenv('LEDGER_RECONCILE_INTERVAL', 3600))
+
+    # Почасовые/посуточные срезы аналитики (секунды, 0 - отключить) и размер пачки
+    ROLLUP_INTERVAL = int(os.getenv('ROLLUP_INTERVAL', 300))
+    ROLLUP_CHUNK_SIZE = int(os.getenv('ROLLUP_CHUNK_SIZE', 1000))
+
+    # Вебхук Crypto Pay (invoice_paid); 0 - отключить, остается только сверка
+    CRYPTO_PAY_WEBHOOK_HOST = os.getenv('CRYPTO_PAY_WEBHOOK_HOST', '0.0.0.0')
+    CRYPTO_PAY_WEBHOOK_PORT = int(os.getenv('CRYPTO_PAY_WEBHOOK_PORT', 0))
+    CRYPTO_PAY_WEBHOOK_PATH = os.getenv('CRYPTO_PAY_WEBHOOK_PATH', '/crypto-pay/webhook')
+
     # Webhook settings for Render
     WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
     WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
@@ -2,9 +2,24 @@ from config import Config
 import sqlite3
 import logging
 import json
+import secrets
+
+from app.services.id_allocator import IdAllocator
+from app.services.metrics import InstrumentedConnection
+from app.services.tracing import tracer
+from app.utils.pagination import fetch_page
 
 logger = logging.getLogger(__name__)
 
+# Базовые колонки games в порядке схемы: индексы game_data[...] в менеджерах
+# опираются на этот порядок, поэтому колонки, добавленные позже через
+# ALTER TABLE, не должны сдвигать присоединенные поля (p1_tg_id и т.д.)
+GAME_COLUMNS = (
+    "g.id, g.player1_id, g.player2_id, g.bet_amount, g.player1_score, g.player2_score, "
+    "g.winner_id, g.status, g.game_code, g.created_at, g.finished_at, "
+    "g.player1_rolls, g.player2_rolls, g.player1_rolls_count, g.player2_rolls_count"
+)
+
 
 class Database:
     def __init__(self, db_path='dice_game.db'):
@@ -14,10 +29,14 @@ class Database:
         self.add_crypto_pay_column()
         self.update_games_table()
         self.add_game_code_column()
+        self.add_fast_roll_columns()
         self.create_lobbies_table()
+        self.create_conversation_states_table()
+        self.create_id_sequences_table()
+        self.game_codes = IdAllocator('game', self, length=6)
 
     def get_connection(self):
-        return sqlite3.connect(self.db_path, check_same_thread=False)
+        return sqlite3.connect(self.db_path, check_same_thread=False, factory=InstrumentedConnection)
 
     def add_game_code_column(self):
         """Добавляем поле game_code если его нет"""
@@ -26,9 +45,9 @@ class Database:
 
         try:
             cursor.execute('ALTER TABLE games ADD COLUMN game_code TEXT UNIQUE')
-            print("✅ Column game_code added successfully")
+            logger.info("✅ Column game_code added successfully")
         except sqlite3.OperationalError:
-            print("✅ Column game_code already exists")
+            logger.debug("Column game_code already exists")
 
         conn.commit()
         conn.close()
@@ -121,6 +140,9 @@ class Database:
                 )
             ''')
 
+            # Индекс (status, rowid) для keyset-страниц истории игр
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_games_status ON games(status)')
+
             conn.commit()
             logger.info("Database initialized successfully")
 
@@ -141,6 +163,7 @@ class Database:
         conn.commit()
         conn.close()
 
+    @tracer.traced()
     def save_dice_roll(self, game_id, telegram_id, roll_value):
         """Сохраняет бросок игрока и возвращает обновленные данные"""
         conn = self.get_connection()
@@ -212,6 +235,7 @@ class Database:
         conn.close()
         return result[0] >= 3 and result[1] >= 3
 
+    @tracer.traced()
     def calculate_final_scores(self, game_id):
         """Вычисляет финальные суммы бросков"""
         conn = self.get_connection()
@@ -260,20 +284,61 @@ class Database:
 
         try:
             cursor.execute('ALTER TABLE users ADD COLUMN crypto_pay_id INTEGER')
-            print("✅ Column crypto_pay_id added successfully")
+            logger.info("✅ Column crypto_pay_id added successfully")
         except sqlite3.OperationalError:
-            print("✅ Column crypto_pay_id already exists")
+            logger.debug("Column crypto_pay_id already exists")
 
         conn.commit()
         conn.close()
 
+    def add_fast_roll_columns(self):
+        """Поля быстрого режима: настройка игрока и сид бросков игры"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        for table, column in (('users', 'fast_roll INTEGER DEFAULT 0'), ('games', 'server_seed TEXT')):
+            try:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column}')
+                logger.info(f"✅ Column {column.split()[0]} added to {table}")
+            except sqlite3.OperationalError:
+                pass
+
+        conn.commit()
+        conn.close()
+
+    def get_fast_roll(self, telegram_id) -> bool:
+        """Включен ли у игрока быстрый режим бросков"""
+        conn = self.get_connection()
+        row = conn.execute('SELECT fast_roll FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()
+        conn.close()
+        return bool(row and row[0])
+
+    def set_fast_roll(self, telegram_id, enabled: bool):
+        conn = self.get_connection()
+        with conn:
+            conn.execute('UPDATE users SET fast_roll = ? WHERE telegram_id = ?', (int(enabled), telegram_id))
+        conn.close()
+
+    def set_game_seed(self, game_id, server_seed):
+        """Сохраняет сид быстрой игры (нужен для раскрытия после перезапуска)"""
+        conn = self.get_connection()
+        with conn:
+            conn.execute('UPDATE games SET server_seed = ? WHERE id = ?', (server_seed, game_id))
+        conn.close()
+
+    def get_game_seed(self, game_id):
+        conn = self.get_connection()
+        row = conn.execute('SELECT server_seed FROM games WHERE id = ?', (game_id,)).fetchone()
+        conn.close()
+        return row[0] if row else None
+
     def get_game(self, game_code):
         """Находит игру только по коду"""
         conn = self.get_connection()
         cursor = conn.cursor()
 
-        cursor.execute('''
-            SELECT g.*, u1.telegram_id as p1_tg_id, u2.telegram_id as p2_tg_id,
+        cursor.execute(f'''
+            SELECT {GAME_COLUMNS}, u1.telegram_id as p1_tg_id, u2.telegram_id as p2_tg_id,
                    u1.username as p1_username, u2.username as p2_username
             FROM games g 
             LEFT JOIN users u1 ON g.player1_id = u1.id 
@@ -283,47 +348,33 @@ class Database:
 
         game = cursor.fetchone()
 
-        # ОТЛАДКА СТРУКТУРЫ
-        if game:
-            print(f"🔍 DATABASE: get_game структура ({len(game)} элементов):")
-            print(f"   [0] id: {game[0]}")
-            print(f"   [1] player1_id: {game[1]}")
-            print(f"   [2] player2_id: {game[2]}")
-            print(f"   [3] bet_amount: {game[3]}")
-            print(f"   [15] p1_tg_id: {game[15]}")
-            print(f"   [16] p2_tg_id: {game[16]}")
-            print(f"   [17] p1_username: {game[17]}")
-            print(f"   [18] p2_username: {game[18]}")
-
         conn.close()
         return game
 
+    @tracer.traced()
     def join_game(self, game_code, user_id):
-        print(f"🔍 DATABASE: join_game вызван с кодом '{game_code}' для пользователя {user_id}")
+        logger.debug("join_game: код %s, пользователь %s", game_code, user_id)
 
         conn = self.get_connection()
         cursor = conn.cursor()
 
         try:
             # Ищем игру по коду
-            cursor.execute('''
-                SELECT g.*, u1.telegram_id as p1_tg_id
+            cursor.execute(f'''
+                SELECT {GAME_COLUMNS}, u1.telegram_id as p1_tg_id
                 FROM games g 
                 JOIN users u1 ON g.player1_id = u1.id 
                 WHERE g.game_code = ? AND g.status = 'waiting'
             ''', (game_code,))
 
             game = cursor.fetchone()
-            print(f"🔍 DATABASE: Найдена игра: {game}")
 
             if not game:
-                print("❌ DATABASE: Игра не найдена или статус не 'waiting'")
                 return False, "Игра не найдена или уже началась"
 
             # ПРАВИЛЬНЫЙ ИНДЕКС - p1_tg_id теперь на 16 позиции
             p1_tg_id = game[15]
             if p1_tg_id == user_id:
-                print("❌ DATABASE: Пользователь пытается присоединиться к своей игре")
                 return False, "Нельзя присоединиться к своей игре"
 
             # Получаем username пользователя
@@ -336,10 +387,8 @@ class Database:
             user_balance = cursor.fetchone()[0]
             bet_amount = game[3]  # bet_amount на 3 позиции
 
-            print(f"🔍 DATABASE: Баланс пользователя: {user_balance}, Ставка: {bet_amount}")
 
             if user_balance < bet_amount:
-                print("❌ DATABASE: Недостаточно средств")
                 return False, f"Недостаточно средств. Нужно: ${bet_amount}"
 
             # Получаем ID пользователя для вставки в player2_id
@@ -359,11 +408,11 @@ class Database:
             ''', (bet_amount, user_id))
 
             conn.commit()
-            print("✅ DATABASE: Игрок успешно присоединился к игре")
+            logger.debug("join_game: игрок %s присоединился к игре %s", user_id, game_code)
             return True, "Успешное присоединение"
 
         except Exception as e:
-            print(f"❌ DATABASE: Ошибка в join_game: {e}")
+            logger.error("❌ Ошибка в join_game: %s", e)
             conn.rollback()
             return False, f"Ошибка: {str(e)}"
         finally:
@@ -371,7 +420,7 @@ class Database:
 
     def debug_fix_join(self, game_code, user_id):
         """Временный фикс для join"""
-        print(f"🔧 DEBUG_FIX: join {game_code} для {user_id}")
+        logger.warning("🔧 DEBUG_FIX: join %s для %s", game_code, user_id)
 
         conn = self.get_connection()
         cursor = conn.cursor()
@@ -388,35 +437,86 @@ class Database:
 
         return True, "Фикс сработал"
 
+    @tracer.traced()
     def create_game(self, telegram_id, bet_amount):
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        # Генерируем уникальный код
-        game_code = self.generate_game_code()
-
-        print(f"🔍 DATABASE: Создаем игру с кодом {game_code} для пользователя {telegram_id}")
-
-        cursor.execute('''
-            INSERT INTO games (player1_id, bet_amount, status, game_code) 
-            VALUES ((SELECT id FROM users WHERE telegram_id = ?), ?, 'waiting', ?)
-        ''', (telegram_id, bet_amount, game_code))
-
-        game_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-
-        print(f"✅ DATABASE: Игра создана! ID: {game_id}, Код: {game_code}, Статус: waiting")
+        while True:
+            # Код берется до транзакции: резерв блока номеров открывает свое соединение
+            game_code = self.generate_game_code()
+            conn = self.get_connection()
+            try:
+                with conn:
+                    cursor = conn.execute('''
+                        INSERT INTO games (player1_id, bet_amount, status, game_code)
+                        VALUES ((SELECT id FROM users WHERE telegram_id = ?), ?, 'waiting', ?)
+                    ''', (telegram_id, bet_amount, game_code))
+                game_id = cursor.lastrowid
+                break
+            except sqlite3.IntegrityError as e:
+                self._check_code_collision(e, game_code)
+            finally:
+                conn.close()
+
+        logger.debug("create_game: игра %s (код %s) для %s", game_id, game_code, telegram_id)
         return game_id, game_code
 
+    @staticmethod
+    def _check_code_collision(error, game_code):
+        """
+        Коды из game_codes не повторяются, поэтому UNIQUE по game_code может
+        сработать только на старом случайном коде в БД - тогда берем следующий
+        """
+        if 'game_code' not in str(error):
+            raise error
+        logger.warning("⚠️ Код %s занят старой игрой, берем следующий", game_code)
+
+    @tracer.traced()
+    def create_matched_game(self, player1_telegram_id, player2_telegram_id, bet_amount, server_seed=None):
+        """
+        Игра из очереди подбора: оба игрока и обе ставки - одной транзакцией
+
+        Возвращает (game_id, game_code, None) или (None, None, telegram_id
+        игрока, у которого не хватило средств) - тогда ничего не списано.
+        """
+        while True:
+            game_code = self.generate_game_code()
+            conn = self.get_connection()
+            try:
+                with conn:
+                    conn.execute('BEGIN IMMEDIATE')
+                    for telegram_id in (player1_telegram_id, player2_telegram_id):
+                        updated = conn.execute('''
+                            UPDATE users SET balance = balance - ?
+                            WHERE telegram_id = ? AND balance >= ?
+                        ''', (bet_amount, telegram_id, bet_amount)).rowcount
+                        if not updated:
+                            conn.rollback()
+                            return None, None, telegram_id
+
+                    cursor = conn.execute('''
+                        INSERT INTO games (player1_id, player2_id, bet_amount, status, game_code, server_seed)
+                        VALUES ((SELECT id FROM users WHERE telegram_id = ?),
+                                (SELECT id FROM users WHERE telegram_id = ?), ?, 'active', ?, ?)
+                    ''', (player1_telegram_id, player2_telegram_id, bet_amount, game_code, server_seed))
+                    game_id = cursor.lastrowid
+                break
+            except sqlite3.IntegrityError as e:
+                # Транзакция откачена целиком, ставки не списаны
+                self._check_code_collision(e, game_code)
+            finally:
+                conn.close()
+
+        logger.debug("create_matched_game: игра %s (код %s): %s vs %s",
+                     game_id, game_code, player1_telegram_id, player2_telegram_id)
+        return game_id, game_code, None
+
 
     def get_game_by_id(self, game_id):
         """Находит игру по ID"""
         conn = self.get_connection()
         cursor = conn.cursor()
 
-        cursor.execute('''
-            SELECT g.*, u1.telegram_id as p1_tg_id, u2.telegram_id as p2_tg_id,
+        cursor.execute(f'''
+            SELECT {GAME_COLUMNS}, u1.telegram_id as p1_tg_id, u2.telegram_id as p2_tg_id,
                    u1.username as p1_username, u2.username as p2_username
             FROM games g 
             LEFT JOIN users u1 ON g.player1_id = u1.id 
@@ -433,8 +533,8 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
 
-        cursor.execute('''
-            SELECT g.*, u1.telegram_id as p1_tg_id, u2.telegram_id as p2_tg_id,
+        cursor.execute(f'''
+            SELECT {GAME_COLUMNS}, u1.telegram_id as p1_tg_id, u2.telegram_id as p2_tg_id,
                    u1.username as p1_username, u2.username as p2_username
             FROM games g 
             LEFT JOIN users u1 ON g.player1_id = u1.id 
@@ -446,10 +546,9 @@ class Database:
         conn.close()
         return game
 
+    @tracer.traced()
     def save_dice_roll(self, game_id, telegram_id, roll_value):
         """Сохраняет бросок игрока и возвращает обновленные данные"""
-        print(f"🔍 DATABASE: save_dice_roll для game_id {game_id}, user {telegram_id}, value {roll_value}")
-
         conn = self.get_connection()
         cursor = conn.cursor()
 
@@ -464,7 +563,7 @@ class Database:
             game = cursor.fetchone()
 
             if not game:
-                print("❌ DATABASE: Игра не найдена или игрок не участвует")
+                logger.debug("save_dice_roll: игра %s не найдена или %s не участвует", game_id, telegram_id)
                 return None
 
             player1_id, player2_id = game
@@ -511,16 +610,28 @@ class Database:
                 'player2_rolls_count': game_data[3]
             }
 
-            print(f"✅ DATABASE: Бросок сохранен: {result_data}")
+            logger.debug("save_dice_roll: игра %s, игрок %s, бросок %s", game_id, telegram_id, roll_value)
             return result_data
 
         except Exception as e:
-            print(f"❌ DATABASE: Ошибка в save_dice_roll: {e}")
+            logger.error("❌ Ошибка в save_dice_roll: %s", e)
             conn.rollback()
             return None
         finally:
             conn.close()
 
+    def get_games_page(self, status='finished', page_cursor=None, page_size=10):
+        """Keyset-страница игр с указанным статусом, от новых к старым"""
+        conn = self.get_connection()
+        try:
+            return fetch_page(
+                conn.cursor(), 'games', 'id, game_code, bet_amount, status, created_at',
+                'status = ?', (status,), sort_column='id',
+                page_cursor=page_cursor, page_size=page_size
+            )
+        finally:
+            conn.close()
+
     def get_user_telegram_id(self, user_id):
         conn = self.get_connection()
         cursor = conn.cursor()
@@ -550,120 +661,57 @@ class Database:
         return stats
 
     def generate_game_code(self):
-        """Генерирует уникальный короткий код для игры"""
-        import random
-        import string
-
-        while True:
-            # Генерируем код из 6 символов (буквы и цифры)
-            code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+        """Генерирует уникальный короткий код для игры (без запросов к БД)"""
+        return self.game_codes.next_code()
 
-            # Проверяем уникальность
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT id FROM games WHERE game_code = ?', (code,))
-            exists = cursor.fetchone()
-            conn.close()
-
-            if not exists:
-                return code
-
-    def finish_game(self, game_id, crypto_pay):
-        """Завершаем игру и создаем чек победителю"""
+    @tracer.traced()
+    def finish_game(self, game_id):
+        """Записываем итог игры и статистику игроков (деньги проводит SettlementService)"""
         conn = self.get_connection()
-        cursor = conn.cursor()
-
-        # Получаем данные игры
-        cursor.execute('''
-            SELECT g.bet_amount, g.player1_rolls, g.player2_rolls,
-                   u1.telegram_id as p1_id, u2.telegram_id as p2_id,
-                   u1.username as p1_username, u2.username as p2_username
-            FROM games g
-            JOIN users u1 ON g.player1_id = u1.id
-            JOIN users u2 ON g.player2_id = u2.id
-            WHERE g.id = ?
-        ''', (game_id,))
-        game = cursor.fetchone()
-
-        bet_amount, player1_rolls, player2_rolls, p1_id, p2_id, p1_username, p2_username = game
-
-        # Вычисляем суммы 3 бросков
-        player1_total = sum(json.loads(player1_rolls)) if player1_rolls else 0
-        player2_total = sum(json.loads(player2_rolls)) if player2_rolls else 0
-
-        total_bank = bet_amount * 2  # Общий банк
-        commission = total_bank * self.config.COMMISSION_RATE
-        winner_prize = total_bank - commission  # Чистый выигрыш
-
-        winner_id = None
-        winner_username = None
-
-        # Определяем победителя
-        if player1_total > player2_total:
-            winner_id = p1_id
-            winner_username = p1_username
-        elif player2_total > player1_total:
-            winner_id = p2_id
-            winner_username = p2_username
-
-        check_result = None
-
-        if winner_id:
-            try:
-                # СОЗДАЕМ ЧЕК ДЛЯ ПОБЕДИТЕЛЯ
-                check_result = crypto_pay.create_invoice(
-                    amount=winner_prize,
-                    asset="USDT",
-                    description=f"🎉 Выигрыш в игре #{game_id}",
-                    hidden_message=f"Поздравляем с победой! Ваш выигрыш: ${winner_prize:.2f}"
-                )
-
-                if check_result.get('ok'):
-                    # Обновляем статистику
-                    cursor.execute('UPDATE users SET games_won = games_won + 1 WHERE telegram_id = ?', (winner_id,))
-                    cursor.execute(
-                        'UPDATE games SET winner_id = (SELECT id FROM users WHERE telegram_id = ?), status = "finished" WHERE id = ?',
-                        (winner_id, game_id))
-
-                    # Сохраняем транзакцию
-                    cursor.execute('''
-                        INSERT INTO crypto_transactions (user_id, amount, type, status, crypto_asset, description)
-                        VALUES (?, ?, 'game_win', 'completed', 'USDT', ?)
-                    ''', (winner_id, winner_prize, f"Выигрыш в игре #{game_id}"))
-
-                else:
-                    # Если чек не создался - возвращаем средства игрокам
-                    cursor.execute('UPDATE users SET balance = balance + ? WHERE telegram_id = ?', (bet_amount, p1_id))
-                    cursor.execute('UPDATE users SET balance = balance + ? WHERE telegram_id = ?', (bet_amount, p2_id))
-                    cursor.execute('UPDATE games SET status = "failed" WHERE id = ?', (game_id,))
-
-            except Exception as e:
-                # В случае ошибки - возвращаем средства
-                cursor.execute('UPDATE users SET balance = balance + ? WHERE telegram_id = ?', (bet_amount, p1_id))
-                cursor.execute('UPDATE users SET balance = balance + ? WHERE telegram_id = ?', (bet_amount, p2_id))
-                cursor.execute('UPDATE games SET status = "failed" WHERE id = ?', (game_id,))
-                check_result = {'error': str(e)}
-        else:
-            # Ничья - возвращаем средства
-            cursor.execute('UPDATE users SET balance = balance + ? WHERE telegram_id = ?', (bet_amount, p1_id))
-            cursor.execute('UPDATE users SET balance = balance + ? WHERE telegram_id = ?', (bet_amount, p2_id))
-            cursor.execute('UPDATE games SET status = "finished" WHERE id = ?', (game_id,))
-
-        # Обновляем статистику игр
-        cursor.execute('UPDATE users SET games_played = games_played + 1 WHERE telegram_id IN (?, ?)', (p1_id, p2_id))
-
-        conn.commit()
-        conn.close()
+        try:
+            with conn:
+                cursor = conn.execute('''
+                    SELECT g.player1_rolls, g.player2_rolls,
+                           u1.telegram_id as p1_id, u2.telegram_id as p2_id,
+                           u1.username as p1_username, u2.username as p2_username
+                    FROM games g
+                    JOIN users u1 ON g.player1_id = u1.id
+                    JOIN users u2 ON g.player2_id = u2.id
+                    WHERE g.id = ?
+                ''', (game_id,))
+                player1_rolls, player2_rolls, p1_id, p2_id, p1_username, p2_username = cursor.fetchone()
+
+                # Вычисляем суммы 3 бросков
+                player1_total = sum(json.loads(player1_rolls)) if player1_rolls else 0
+                player2_total = sum(json.loads(player2_rolls)) if player2_rolls else 0
+
+                winner_id = None
+                winner_username = None
+                if player1_total > player2_total:
+                    winner_id, winner_username = p1_id, p1_username
+                elif player2_total > player1_total:
+                    winner_id, winner_username = p2_id, p2_username
+
+                # Статистика - только при первом завершении игры
+                updated = conn.execute('''
+                    UPDATE games SET winner_id = (SELECT id FROM users WHERE telegram_id = ?),
+                                     status = 'finished', finished_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND status != 'finished'
+                ''', (winner_id, game_id)).rowcount
+                if updated:
+                    conn.execute('UPDATE users SET games_played = games_played + 1 WHERE telegram_id IN (?, ?)',
+                                 (p1_id, p2_id))
+                    if winner_id:
+                        conn.execute('UPDATE users SET games_won = games_won + 1 WHERE telegram_id = ?',
+                                     (winner_id,))
+        finally:
+            conn.close()
 
         return {
             'player1_total': player1_total,
             'player2_total': player2_total,
             'winner_id': winner_id,
-            'winner_username': winner_username,
-            'winner_prize': winner_prize,
-            'commission': commission,
-            'check_result': check_result,
-            'success': bool(winner_id and check_result and check_result.get('ok'))
+            'winner_username': winner_username
         }
 
     def cancel_game(self, game_id: int) -> bool:
@@ -680,7 +728,7 @@ class Database:
             conn.close()
             return cursor.rowcount > 0
         except Exception as e:
-            print(f"Ошибка отмены игры {game_id}: {e}")
+            logger.error("Ошибка отмены игры %s: %s", game_id, e)
             return False
 
 
@@ -696,13 +744,92 @@ class Database:
                 creator_name TEXT,
                 max_players INTEGER,
                 bet_amount REAL,
-                players TEXT,  -- JSON список игроков
+                players TEXT,  -- JSON список игроков (устарело: игроки в lobby_players)
                 status TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
 
+        # Игроки лобби: строка на игрока, клик меняет одну строку
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS lobby_players (
+                lobby_id TEXT NOT NULL,
+                player_id INTEGER NOT NULL,
+                username TEXT,
+                ready INTEGER DEFAULT 0,
+                paid INTEGER DEFAULT 0,
+                last_roll INTEGER,
+                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (lobby_id, player_id)
+            ) WITHOUT ROWID
+        ''')
+
+        conn.commit()
+        conn.close()
+        logger.debug("Таблица lobbies создана/проверена")
+
+    def create_id_sequences_table(self):
+        """Создает таблицу счетчиков для выдачи коротких кодов"""
+        conn = self.get_connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS id_sequences (
+                name TEXT PRIMARY KEY,
+                next_value INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        conn.commit()
+        conn.close()
+
+    def get_id_code_key(self):
+        """
+        Ключ перестановки коротких кодов: ID_CODE_KEY из окружения или
+        случайный ключ, созданный при первом запуске и сохраненный в БД
+        (общий для всех процессов с этой БД)
+        """
+        if self.config.ID_CODE_KEY:
+            return self.config.ID_CODE_KEY
+        conn = self.get_connection()
+        try:
+            with conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS bot_secrets (
+                        name TEXT PRIMARY KEY,
+                        value TEXT NOT NULL
+                    ) WITHOUT ROWID
+                ''')
+                conn.execute("INSERT OR IGNORE INTO bot_secrets (name, value) VALUES ('id_code_key', ?)",
+                             (secrets.token_hex(32),))
+                return conn.execute("SELECT value FROM bot_secrets WHERE name = 'id_code_key'").fetchone()[0]
+        finally:
+            conn.close()
+
+    def reserve_id_block(self, name, size):
+        """Резервирует size номеров счетчика name, возвращает первый из них"""
+        conn = self.get_connection()
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute('INSERT OR IGNORE INTO id_sequences (name, next_value) VALUES (?, 0)', (name,))
+                start = conn.execute('SELECT next_value FROM id_sequences WHERE name = ?', (name,)).fetchone()[0]
+                conn.execute('UPDATE id_sequences SET next_value = ? WHERE name = ?', (start + size, name))
+        finally:
+            conn.close()
+        return start
+
+    def create_conversation_states_table(self):
+        """Создает таблицу состояний ввода пользователей"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_states (
+                user_id INTEGER PRIMARY KEY,
+                state TEXT NOT NULL,
+                data TEXT,  -- JSON с параметрами состояния
+                expires_at REAL NOT NULL
+            )
+        ''')
+
         conn.commit()
         conn.close()
-        print("✅ Таблица lobbies создана/проверена")
\ No newline at end of file
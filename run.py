@@ -1,12 +1,15 @@
 # run.py
-import logging
+from config import Config
+from app.utils.logging_setup import setup_logging
 from app.bot import DiceGameBot
 
 
 def main():
-    logging.basicConfig(
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        level=logging.INFO
+    setup_logging(
+        level=Config.LOG_LEVEL,
+        subsystem_levels=Config.LOG_LEVELS,
+        log_format=Config.LOG_FORMAT,
+        sample_every=Config.LOG_SAMPLE_EVERY
     )
 
     bot = DiceGameBot()
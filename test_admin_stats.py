@@ -0,0 +1,75 @@
+# test_admin_stats.py
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, '.')
+
+from database import Database
+from app.models.payment import Payment
+from app.services.payment_manager import PaymentManager
+from app.services.settlement import SettlementService
+from app.handlers.buttons import format_admin_stats
+
+print("🔍 Тестируем инкрементальные счетчики статистики...")
+
+db = Database(os.path.join(tempfile.mkdtemp(), 'test_admin_stats.db'))
+
+# Данные, существовавшие до появления счетчиков
+db.register_user(1, 'old', 'Old')
+db.update_balance(1, 50.0)
+
+settlement = SettlementService(db, commission_rate=0.08)  # Как в боте: до PaymentManager
+manager = PaymentManager(db, 'test-token')
+stats = manager.stats
+
+# 1. Новые счетчики заполнены по существующим данным
+assert stats.get()['users'] == 1 and stats.get()['total_balance'] == 50.0, stats.get()
+print("✅ Счетчики заполнены при первом запуске")
+
+# 2. Запись в таблицы обновляет счетчики в той же транзакции
+db.register_user(2, 'new', 'New')
+db.update_balance(2, 30.0)
+game_id, _ = db.create_game(1, 10.0)
+conn = db.get_connection()
+with conn:
+    conn.execute("UPDATE games SET status = 'active' WHERE id = ?", (game_id,))
+assert stats.get()['games_active'] == 1
+
+with conn:
+    conn.execute("UPDATE games SET status = 'finished' WHERE id = ?", (game_id,))
+
+model = manager.payment_model
+model.create_payment(Payment(payment_id='dep_1', user_id=2, amount=20.0, crypto_pay_id='1'))
+manager.apply_paid_invoice({'invoice_id': 1})
+model.create_payment(Payment(payment_id='wd_1', user_id=2, amount=5.0, payment_type='withdraw'))
+
+values = stats.get()
+assert values['users'] == 2
+assert values['games_active'] == 0 and values['games_finished'] == 1
+assert values['turnover'] == 20.0
+assert values['deposits'] == 20.0 and values['pending_withdrawals'] == 5.0
+assert values['total_balance'] == 100.0, values['total_balance']
+assert manager.get_payment_stats()['total_payments'] == 2
+print("✅ Счетчики обновляются при каждой записи")
+
+# Комиссия - из проводок леджера, а не разница депозитов и выводов
+settlement.settle("game", game_id, {1: 10.0, 2: 10.0}, winners=[1])
+settlement.settle("game", "draw", {1: 5.0, 2: 5.0})
+assert stats.get()['commission'] == 1.6
+assert "Комиссия бота: $1.60" in format_admin_stats(stats.get())
+print("✅ Комиссия считается по проводкам расчетов")
+
+# 3. Сверка не находит расхождений и исправляет испорченный счетчик
+assert stats.reconcile() == {}
+with conn:
+    conn.execute("UPDATE stats_counters SET value = 0 WHERE name = 'commission'")
+assert stats.reconcile() == {'commission': 1.6} and stats.get()['commission'] == 1.6
+with conn:
+    conn.execute("UPDATE stats_counters SET value = 999 WHERE name = 'users'")
+assert stats.reconcile() == {'users': 2 - 999}
+assert stats.get()['users'] == 2
+conn.close()
+print("✅ Сверка исправила расхождение")
+
+print("🎉 Тест счетчиков статистики завершен")
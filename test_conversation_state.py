@@ -0,0 +1,43 @@
+# test_conversation_state.py
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, '.')
+
+from database import Database
+from app.services.conversation_state import ConversationStateManager
+
+print("🔍 Тестируем состояния ввода...")
+
+db_path = os.path.join(tempfile.mkdtemp(), 'test_states.db')
+db = Database(db_path)
+
+# 1. Установка и чтение состояния
+states = ConversationStateManager(db, ttl_seconds=60)
+states.set_state(111, ConversationStateManager.BET, {'action': 'create_game'})
+state, data = states.get_state(111)
+assert state == ConversationStateManager.BET and data['action'] == 'create_game'
+assert states.has_pending(111) and not states.has_pending(222)
+print("✅ Состояние установлено")
+
+# 2. Восстановление после перезапуска
+restored = ConversationStateManager(db, ttl_seconds=60)
+assert restored.get_state(111)[0] == ConversationStateManager.BET
+print("✅ Состояние восстановлено из БД")
+
+# 3. Сброс
+assert restored.clear_state(111) == ConversationStateManager.BET
+assert ConversationStateManager(db).get_state(111)[0] is None
+print("✅ Состояние сброшено")
+
+# 4. Устаревание по TTL
+expiring = ConversationStateManager(db, ttl_seconds=0)
+expiring.set_state(333, ConversationStateManager.DEPOSIT)
+time.sleep(0.01)
+assert not expiring.has_pending(333)
+assert expiring.get_state(333)[0] is None
+print("✅ Устаревшее состояние сброшено")
+
+print("🎉 Тест состояний ввода завершен")
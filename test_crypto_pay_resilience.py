@@ -0,0 +1,132 @@
+# test_crypto_pay_resilience.py
+import sys
+import json
+import asyncio
+
+sys.path.insert(0, '.')
+
+import app.services.crypto_pay_service as crypto_pay_module
+from app.services.crypto_pay_service import CryptoPayService
+from app.services.http_client import CircuitBreaker, RequestPolicy
+
+
+class FaultyCryptoPay:
+    """Локальная заглушка Crypto Pay с внедрением сбоев"""
+
+    def __init__(self):
+        self.requests = 0
+        self.fail_next = 0  # Сколько следующих запросов получат 503
+        self.delay_next = 0  # Сколько следующих запросов будут "висеть"
+        self.delay = 0.0
+
+    async def handle(self, reader, writer):
+        await reader.readline()
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if line.lower().startswith(b'content-length:'):
+                length = int(line.split(b':')[1])
+        if length:
+            await reader.readexactly(length)
+
+        self.requests += 1
+        if self.delay_next > 0:
+            self.delay_next -= 1
+            try:
+                await asyncio.sleep(self.delay)
+            except asyncio.CancelledError:
+                return
+
+        if self.fail_next > 0:
+            self.fail_next -= 1
+            status, body = '503 Service Unavailable', b'{"ok": false}'
+        else:
+            status, body = '200 OK', json.dumps({'ok': True, 'result': {'items': [
+                {'invoice_id': 1, 'status': 'paid'}
+            ]}}).encode()
+
+        try:
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+                         f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+            await writer.drain()
+            writer.close()
+        except ConnectionError:
+            pass
+
+
+async def main():
+    print("🔍 Тестируем устойчивый клиент Crypto Pay...")
+
+    fake = FaultyCryptoPay()
+    server = await asyncio.start_server(fake.handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    service = CryptoPayService('test-token')
+    service.test_mode = False
+    service.base_url = f'http://127.0.0.1:{port}/api'
+    service.client.backoff_base = 0.01
+    service.client.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.3)
+
+    # 1. Временные 503 для идемпотентного чтения повторяются
+    fake.fail_next = 2
+    assert await service.is_invoice_paid('1')
+    assert fake.requests == 3, fake.requests
+    print("✅ Чтение повторено после 503")
+
+    # 2. Неидемпотентный createCheck не повторяется
+    fake.requests, fake.fail_next = 0, 1
+    assert await service.create_check(1.0, payload='dep_X') is None
+    assert fake.requests == 1, fake.requests
+    print("✅ createCheck не повторяется")
+
+    # 3. Медленный ответ: hedged-запрос возвращает результат раньше таймаута
+    crypto_pay_module.ENDPOINT_POLICIES['getInvoices'] = RequestPolicy(timeout=2.0, retries=0, hedge_after=0.05)
+    fake.requests, fake.delay_next, fake.delay = 0, 1, 1.0
+    started = asyncio.get_running_loop().time()
+    assert await service.is_invoice_paid('1')
+    assert asyncio.get_running_loop().time() - started < 0.5
+    assert fake.requests == 2, fake.requests
+    print("✅ Hedged-запрос обошел медленный ответ")
+
+    # 4. Предохранитель: после серии ошибок запросы не уходят на сервер
+    crypto_pay_module.ENDPOINT_POLICIES['getInvoices'] = RequestPolicy(timeout=2.0, retries=0)
+    fake.requests, fake.fail_next = 0, 100
+    for _ in range(3):
+        assert not await service.is_invoice_paid('1')
+    assert service.client.breaker.state == CircuitBreaker.OPEN
+    assert not await service.is_invoice_paid('1')
+    assert fake.requests == 3, fake.requests
+    print("✅ Предохранитель открыт, запросы отклоняются сразу")
+
+    # 5. После reset_timeout пробный запрос закрывает предохранитель
+    fake.fail_next = 0
+    await asyncio.sleep(0.35)
+    assert await service.is_invoice_paid('1')
+    assert service.client.breaker.state == CircuitBreaker.CLOSED
+    print("✅ Предохранитель закрыт после восстановления")
+
+    # 6. Отмененный пробный запрос не оставляет предохранитель в HALF_OPEN навсегда
+    fake.fail_next = 100
+    for _ in range(3):
+        assert not await service.is_invoice_paid('1')
+    fake.fail_next, fake.delay_next, fake.delay = 0, 1, 1.0
+    await asyncio.sleep(0.35)
+    probe = asyncio.create_task(service.is_invoice_paid('1'))
+    await asyncio.sleep(0.1)
+    assert service.client.breaker.state == CircuitBreaker.HALF_OPEN
+    probe.cancel()
+    await asyncio.gather(probe, return_exceptions=True)
+    assert await service.is_invoice_paid('1')
+    assert service.client.breaker.state == CircuitBreaker.CLOSED
+    print("✅ Отмена пробного запроса освобождает предохранитель")
+
+    await service.close()
+    server.close()
+    await server.wait_closed()
+    print("🎉 Тест устойчивого клиента завершен")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+# test_crypto_pay_webhook.py
+import os
+import sys
+import hmac
+import json
+import asyncio
+import hashlib
+import tempfile
+
+import httpx
+
+sys.path.insert(0, '.')
+
+from database import Database
+from app.models.payment import Payment
+from app.services.payment_manager import PaymentManager
+from app.services.crypto_pay_webhook import CryptoPayWebhookServer
+
+TOKEN = '12345:TEST_TOKEN'
+
+
+def sign(body: bytes, token: str = TOKEN) -> str:
+    secret = hashlib.sha256(token.encode()).digest()
+    return hmac.new(secret, body, hashlib.sha256).hexdigest()
+
+
+async def main():
+    print("🔍 Тестируем вебхук Crypto Pay...")
+
+    db = Database(os.path.join(tempfile.mkdtemp(), 'test_webhook.db'))
+    manager = PaymentManager(db, TOKEN)
+    db.register_user(777, 'payer', 'Payer')
+    manager.payment_model.create_payment(Payment(
+        payment_id='dep_WEBHOOK', user_id=777, amount=12.5, crypto_pay_id='4242'
+    ))
+
+    notified = []
+
+    async def on_deposit(payment):
+        notified.append(payment.payment_id)
+
+    server = CryptoPayWebhookServer(manager, TOKEN, host='127.0.0.1', port=0, on_deposit=on_deposit)
+    await server.start()
+    port = server.server.sockets[0].getsockname()[1]
+    url = f'http://127.0.0.1:{port}{server.path}'
+
+    body = json.dumps({
+        'update_id': 1,
+        'update_type': 'invoice_paid',
+        'payload': {'invoice_id': 4242, 'status': 'paid', 'payload': 'dep_WEBHOOK'}
+    }).encode()
+
+    async with httpx.AsyncClient() as client:
+        # 1. Неверная подпись отклоняется
+        response = await client.post(url, content=body, headers={'crypto-pay-api-signature': sign(body, 'other')})
+        assert response.status_code == 401
+        assert manager.get_user_balance(777) == 0.0
+        print("✅ Запрос с неверной подписью отклонен")
+
+        # 2. Верная подпись - зачисление
+        response = await client.post(url, content=body, headers={'crypto-pay-api-signature': sign(body)})
+        assert response.status_code == 200
+        assert manager.get_user_balance(777) == 12.5
+        assert notified == ['dep_WEBHOOK']
+        status, error = await manager.check_deposit_status('dep_WEBHOOK')
+        assert status == 'completed' and error is None
+        print("✅ Депозит зачислен по вебхуку")
+
+        # 3. Повторная доставка не зачисляет дважды
+        response = await client.post(url, content=body, headers={'crypto-pay-api-signature': sign(body)})
+        assert response.status_code == 200
+        assert manager.get_user_balance(777) == 12.5
+        assert notified == ['dep_WEBHOOK']
+        print("✅ Повторный вебхук проигнорирован")
+
+    await server.stop()
+    await manager.close()
+    print("🎉 Тест вебхука завершен")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+# test_duel_concurrency.py
+import os
+import sys
+import time
+import logging
+import tempfile
+
+sys.path.insert(0, '.')
+
+from database import Database
+from app.services.settlement import SettlementService
+from app.services.duel_manager import DuelManager
+
+logging.disable(logging.WARNING)
+
+CHAT = -500
+PLAYERS = 40
+
+
+def balance(db, user_id):
+    return round(db.get_user(user_id)[4], 2)
+
+
+def play(duels, duel, creator_rolls, opponent_rolls):
+    for player_id, values in ((duel.creator_id, creator_rolls), (duel.opponent_id, opponent_rolls)):
+        for value in values:
+            duels.process_duel_roll(duel.duel_id, player_id, value)
+
+
+print("🔍 Тестируем параллельные дуэли в одном чате...")
+
+db = Database(os.path.join(tempfile.mkdtemp(), 'test_duel_concurrency.db'))
+for user_id in range(1, PLAYERS + 1):
+    db.register_user(user_id, f'user{user_id}', f'User {user_id}')
+    db.update_balance(user_id, 100.0)
+duels = DuelManager(db, settlement=SettlementService(db), max_per_chat=20, max_per_user=2)
+
+# 1. Несколько дуэлей в одном чате идут одновременно
+first, error = duels.create_duel(CHAT, 1, 'user1', 10.0)
+second, error = duels.create_duel(CHAT, 2, 'user2', 5.0)
+assert error is None and first.duel_id != second.duel_id
+duels.accept_duel(first.duel_id, 3, 'user3')
+duels.accept_duel(second.duel_id, 4, 'user4')
+assert [d.duel_id for d in duels.get_chat_duels(CHAT)] == [first.duel_id, second.duel_id]
+
+# Броски идут вперемешку, каждая дуэль считается отдельно
+for value in (6, 6, 6):
+    duels.process_duel_roll(first.duel_id, 1, value)
+    duels.process_duel_roll(second.duel_id, 2, 1)
+for value in (1, 1, 1):
+    duels.process_duel_roll(first.duel_id, 3, value)
+    duels.process_duel_roll(second.duel_id, 4, 6)
+assert first.winner_id == 1 and second.winner_id == 4
+assert balance(db, 1) == 108.4 and balance(db, 3) == 90
+assert balance(db, 4) == 104.2 and balance(db, 2) == 95
+assert duels.get_chat_duels(CHAT) == [] and not duels.user_duels
+print("✅ Две дуэли в одном чате завершены независимо")
+
+# 2. Лимит открытых дуэлей на игрока: созданные и принятые
+a, _ = duels.create_duel(CHAT, 5, 'user5', 1.0)
+b, _ = duels.create_duel(CHAT - 1, 5, 'user5', 1.0)
+duel, error = duels.create_duel(CHAT, 5, 'user5', 1.0)
+assert duel is None and "2 открытых" in error
+c, _ = duels.create_duel(CHAT, 6, 'user6', 1.0)
+d, _ = duels.create_duel(CHAT, 7, 'user7', 1.0)
+duels.accept_duel(c.duel_id, 8, 'user8')
+duels.accept_duel(d.duel_id, 8, 'user8')
+e, _ = duels.create_duel(CHAT, 9, 'user9', 1.0)
+duel, error = duels.accept_duel(e.duel_id, 8, 'user8')
+assert duel is None and e.status == "waiting" and balance(db, 8) == 98
+
+# Отмена и завершение освобождают слот
+assert duels.cancel_duel(a.duel_id, 5)[0]
+assert duels.create_duel(CHAT, 5, 'user5', 1.0)[0] is not None
+play(duels, c, (2, 2, 2), (3, 3, 3))
+assert duels.accept_duel(e.duel_id, 8, 'user8')[0] is not None
+print("✅ Лимит на игрока: отмена и завершение освобождают слот")
+
+# 3. Лимит на чат, другие чаты не затронуты
+busy = -900
+for user_id in range(11, 31):
+    assert duels.create_duel(busy, user_id, f'user{user_id}', 1.0)[1] is None
+duel, error = duels.create_duel(busy, 31, 'user31', 1.0)
+assert duel is None and "20 открытых" in error and balance(db, 31) == 100
+assert duels.create_duel(busy - 1, 31, 'user31', 1.0)[0] is not None
+print("✅ Лимит на чат не мешает другим чатам")
+
+# 4. Очистка убирает дуэли из индексов
+for duel in duels.get_chat_duels(busy):
+    duel.created_at = duel.created_at.replace(year=duel.created_at.year - 1)
+duels.cleanup_old_duels(hours_old=24)
+assert duels.get_chat_duels(busy) == [] and all(balance(db, u) == 100 for u in range(11, 31))
+assert not any(u in duels.user_duels for u in range(11, 31))
+print("✅ Очистка возвращает ставки и освобождает лимиты")
+
+# 5. Скорость: много дуэлей в одном чате
+big = DuelManager(db, settlement=SettlementService(db), max_per_chat=1000, max_per_user=1000)
+started = time.perf_counter()
+created = [big.create_duel(CHAT * 10, 32 + i % 8, 'user', 0.01)[0] for i in range(800)]
+elapsed = time.perf_counter() - started
+assert len(big.get_chat_duels(CHAT * 10)) == 800
+for duel in created[:400]:
+    big.cancel_duel(duel.duel_id, duel.creator_id)
+assert len(big.get_chat_duels(CHAT * 10)) == 400
+print(f"✅ 800 дуэлей в одном чате за {elapsed * 1000:.0f} мс")
+
+# 6. Сбой выдачи ID дуэли не списывает ставку
+failing = DuelManager(db, settlement=SettlementService(db))
+failing.ids.next_code = lambda: 1 / 0  # Резерв блока ID в БД не удался
+before = balance(db, 1)
+duel, error = failing.create_duel(CHAT * 20, 1, 'user1', 10.0)
+assert duel is None and error.startswith("Ошибка создания дуэли")
+assert balance(db, 1) == before and not failing.user_duels and not failing.chat_duels
+print("✅ Ошибка ID дуэли не трогает баланс")
+
+print("🎉 Тест параллельных дуэлей завершен")
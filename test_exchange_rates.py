@@ -0,0 +1,94 @@
+# test_exchange_rates.py
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, '.')
+
+from app.services.crypto_pay_service import CurrencyConverter, RateUnavailableError
+
+
+class FakeCryptoPay:
+    """Заглушка get_exchange_rates в формате Crypto Pay"""
+
+    def __init__(self):
+        self.rates = [
+            {'is_valid': True, 'source': 'TON', 'target': 'USD', 'rate': '5.0'},
+            {'is_valid': True, 'source': 'BTC', 'target': 'USD', 'rate': '60000'},
+            {'is_valid': True, 'source': 'TON', 'target': 'EUR', 'rate': '4.6'},
+            {'is_valid': False, 'source': 'ETH', 'target': 'USD', 'rate': '1'},
+        ]
+
+    async def get_exchange_rates(self):
+        return self.rates
+
+
+async def main():
+    print("🔍 Тестируем снимок курсов валют...")
+
+    fake = FakeCryptoPay()
+    converter = CurrencyConverter(fake, max_age=0.05, max_stale=0.2)
+
+    # 1. Стартовый снимок до обновления: волатильные курсы не подтверждены API
+    assert converter.snapshot.source == "default"
+    try:
+        converter.usd_to_crypto(45.0, 'TON')
+        assert False, "стартовый курс TON не должен использоваться"
+    except RateUnavailableError:
+        pass
+    assert converter.usd_to_crypto(10.0, 'USDT') == 10.0
+    print("✅ Стартовые курсы считаются устаревшими, стейблкоин работает")
+
+    # 2. Обновление заменяет снимок, невалидные курсы игнорируются
+    snapshot = converter.snapshot
+    assert await converter.refresh()
+    assert converter.snapshot is not snapshot
+    assert converter.usd_to_crypto(50.0, 'TON') == 10.0
+    assert converter.crypto_to_usd(0.5, 'BTC') == 30000.0
+    try:
+        converter.get_rate('ETH')  # невалидный в ответе: стартовый курс не стал свежим
+        assert False, "стартовый курс ETH не должен использоваться"
+    except RateUnavailableError:
+        pass
+    print("✅ Курсы обновлены из API")
+
+    # 3. Ошибка обновления - остается последний снимок
+    fake.rates = None
+    assert not await converter.refresh()
+    time.sleep(0.1)
+    assert converter.usd_to_crypto(50.0, 'TON') == 10.0
+    print("✅ Используется последний известный снимок")
+
+    # 4. Слишком старый снимок не используется для волатильных активов
+    time.sleep(0.15)
+    try:
+        converter.usd_to_crypto(50.0, 'TON')
+        assert False, "ожидалась ошибка устаревшего курса"
+    except RateUnavailableError:
+        pass
+    assert converter.usd_to_crypto(10.0, 'USDT') == 10.0
+    print("✅ Устаревший курс отклонен, стейблкоин работает")
+
+    # 5. Возраст по активу: пропавший из ответа курс стареет, остальные свежие
+    fake.rates = [
+        {'is_valid': True, 'source': 'TON', 'target': 'USD', 'rate': '5.0'},
+        {'is_valid': True, 'source': 'BTC', 'target': 'USD', 'rate': '60000'},
+    ]
+    assert await converter.refresh()
+    time.sleep(0.15)
+    fake.rates = fake.rates[:1]
+    assert await converter.refresh()
+    time.sleep(0.1)
+    assert converter.usd_to_crypto(50.0, 'TON') == 10.0
+    try:
+        converter.usd_to_crypto(60000.0, 'BTC')
+        assert False, "курс BTC не обновлялся и должен устареть"
+    except RateUnavailableError:
+        pass
+    print("✅ Курс, которого нет в ответе API, устаревает отдельно")
+
+    print("🎉 Тест курсов валют завершен")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+# test_fair_dice.py
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+from collections import Counter
+
+sys.path.insert(0, '.')
+
+from database import Database
+from app.services.fair_dice import FairDice, derive_roll, hash_seed, verify_rolls
+from app.services.game_manager import GameManager
+
+logging.disable(logging.INFO)
+
+
+async def main():
+    print("🔍 Тестируем быстрый режим бросков...")
+
+    # 1. Броски детерминированы сидом и равномерны
+    dice = FairDice()
+    assert dice.seed_hash == hash_seed(dice.server_seed) and len(dice.server_seed) == 64
+    assert dice.roll_many(7, 3) == FairDice(dice.server_seed).roll_many(7, 3)
+    counts = Counter(derive_roll(dice.server_seed, player_id, 0) for player_id in range(60000))
+    assert set(counts) == {1, 2, 3, 4, 5, 6}
+    assert all(abs(count - 10000) < 500 for count in counts.values()), counts
+    print("✅ Броски детерминированы и равномерны")
+
+    # 2. Проверка: подмененный сид или бросок не проходят
+    rolls = dice.roll_many(7, 3)
+    assert verify_rolls(dice.server_seed, dice.seed_hash, 7, rolls)
+    assert not verify_rolls(FairDice().server_seed, dice.seed_hash, 7, rolls)
+    assert not verify_rolls(dice.server_seed, dice.seed_hash, 7, rolls[:2] + [rolls[2] % 6 + 1])
+    print("✅ Commit-reveal проверяется")
+
+    # 3. Полная быстрая игра 1 на 1
+    db = Database(os.path.join(tempfile.mkdtemp(), 'test_fair_dice.db'))
+    for user_id in (1, 2):
+        db.register_user(user_id, f'user{user_id}', f'User {user_id}')
+        db.update_balance(user_id, 100.0)
+    db.set_fast_roll(1, True)
+    db.set_fast_roll(2, True)
+    manager = GameManager(db)
+
+    started = time.perf_counter()
+    game, error = manager.create_game(1, 'user1', 10.0)
+    assert not error and game.fast and db.get_game_seed(game.id) == game.server_seed
+    seed_hash = game.seed_hash  # Публикуется до бросков
+
+    game, error = manager.join_game(game.game_code, 2, 'user2')
+    assert not error, error
+    for player_id in (1, 2):
+        game, rolls, error = await manager.process_fast_rolls(game.id, player_id)
+        assert not error and len(rolls) == 3, error
+    elapsed = time.perf_counter() - started
+
+    assert game.status == "finished"
+    assert verify_rolls(game.server_seed, seed_hash, 1, game.player1_rolls)
+    assert verify_rolls(game.server_seed, seed_hash, 2, game.player2_rolls)
+    assert (await manager.process_fast_rolls(game.id, 1))[2] == "Вы уже сделали все броски"
+    assert elapsed < 1.0, elapsed
+    print(f"✅ Быстрая игра сыграна за {elapsed * 1000:.0f} мс, броски проверяемы")
+
+    # 4. После перезапуска сид восстанавливается из БД; без настройки игра обычная
+    restarted = GameManager(db)
+    assert restarted.load_game(game.id).server_seed == game.server_seed
+    db.set_fast_roll(2, False)
+    regular, _ = manager.create_game(2, 'user2', 5.0)
+    assert not regular.fast and (await manager.process_fast_rolls(regular.id, 2))[2]
+    print("✅ Сид переживает перезапуск, обычные игры не затронуты")
+
+    # 5. Быстрый режим только по согласию обоих: иначе при входе игра становится обычной
+    for joining in (manager, GameManager(db)):  # Игра в памяти и после перезапуска
+        offered, _ = manager.create_game(1, 'user1', 5.0)
+        assert offered.fast and offered.seed_hash == hash_seed(offered.server_seed)
+        joined, error = joining.join_game(offered.game_code, 2, 'user2')
+        assert not error and not joined.fast and joined.seed_hash is None
+        assert db.get_game_seed(offered.id) is None and not GameManager(db).load_game(offered.id).fast
+        assert (await joining.process_fast_rolls(offered.id, 1))[2] == "Игра не в быстром режиме"
+    print("✅ Быстрый режим требует согласия обоих игроков")
+
+    print("🎉 Тест быстрого режима завершен")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+# test_group_filter.py
+import os
+import sys
+import asyncio
+import logging
+import tempfile
+from datetime import datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, '.')
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import ApplicationBuilder, ApplicationHandlerStop, TypeHandler
+
+from database import Database
+from app.services.conversation_state import ConversationStateManager
+from app.services.group_filter import GroupMessageFilter
+from app.handlers.ingest_filter import register_ingest_filter
+
+logging.disable(logging.WARNING)
+
+BOT = User(id=999, first_name='Dice', is_bot=True)
+OTHER_BOT = User(id=998, first_name='Other', is_bot=True)
+
+
+def group_update(update_id, chat_id, user_id, text, reply_to=None, chat_type=Chat.SUPERGROUP):
+    chat = Chat(id=chat_id, type=chat_type)
+    reply = Message(1, datetime.now(), chat, from_user=reply_to, text='...') if reply_to else None
+    message = Message(update_id, datetime.now(), chat, from_user=User(id=user_id, first_name='U', is_bot=False),
+                      text=text, reply_to_message=reply)
+    return Update(update_id, message=message)
+
+
+async def main():
+    print("🔍 Тестируем фильтр групповых сообщений...")
+
+    db = Database(os.path.join(tempfile.mkdtemp(), 'test_group_filter.db'))
+    states = ConversationStateManager(db, ttl_seconds=60)
+    group_filter = GroupMessageFilter(states, bot_id=BOT.id, max_chats=3)
+
+    # 1. Команды, ответы боту и ожидаемый ввод проходят, болтовня отбрасывается
+    assert group_filter.should_process(group_update(1, -100, 1, '/start'))
+    assert group_filter.should_process(group_update(2, -100, 1, 'да', reply_to=BOT))
+    assert not group_filter.should_process(group_update(3, -100, 1, 'да', reply_to=OTHER_BOT))
+    assert not group_filter.should_process(group_update(4, -100, 2, 'всем привет'))
+    states.set_state(2, ConversationStateManager.BET, {'action': 'create_game'})
+    assert group_filter.should_process(group_update(5, -100, 2, '10'))
+    assert group_filter.should_process(group_update(6, 2, 2, 'привет', chat_type=Chat.PRIVATE))
+    assert group_filter.get_chat_stats(-100) == (3, 2) and group_filter.get_chat_stats(2) == (0, 0)
+    print("✅ Фильтр пропускает команды, ответы боту и ожидаемый ввод")
+
+    # 2. Статистика хранится только по последним активным чатам, итоги не теряются
+    for chat_id in (-200, -300, -100, -400):
+        group_filter.should_process(group_update(7, chat_id, 1, 'шум'))
+    assert list(group_filter.chat_stats) == [-300, -100, -400]  # -200 молчал дольше всех
+    assert group_filter.get_totals() == (3, 6)
+    assert group_filter.get_top_chats(limit=1) == [(-100, 3, 3)]
+    for chat_id in range(-1000, -11000, -1):
+        group_filter.should_process(group_update(8, chat_id, 1, 'шум'))
+    assert len(group_filter.chat_stats) == 3 and group_filter.get_totals() == (3, 10006)
+    print("✅ Статистика чатов ограничена, общие итоги сохраняются")
+
+    # 3. TypeHandler в group=-1 останавливает отброшенные обновления до обработчиков
+    bot = SimpleNamespace(group_filter=GroupMessageFilter(states, bot_id=BOT.id))
+    application = ApplicationBuilder().token('1:test').build()
+    register_ingest_filter(application, bot)
+    (handler,) = application.handlers[-1]
+    assert isinstance(handler, TypeHandler) and min(application.handlers) == -1
+
+    stopped = []
+    for update in (group_update(10, -100, 1, 'шум'), group_update(11, -100, 1, '/help'),
+                   group_update(12, -100, 3, 'шум', reply_to=BOT),
+                   group_update(13, 5, 5, 'шум', chat_type=Chat.PRIVATE)):
+        assert handler.check_update(update)
+        try:
+            await handler.callback(update, None)
+        except ApplicationHandlerStop:
+            stopped.append(update.update_id)
+    assert stopped == [10] and bot.group_filter.get_totals() == (2, 1)
+    print("✅ Отброшенные сообщения не доходят до обработчиков")
+
+    print("🎉 Тест фильтра групповых сообщений завершен")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+# test_id_allocator.py
+import os
+import sys
+import time
+import logging
+import tempfile
+
+sys.path.insert(0, '.')
+
+from database import Database
+from app.services.id_allocator import CodePermutation, IdAllocator, ALPHABET
+from app.services.lobby_manager import LobbyManager
+from app.services.duel_manager import DuelManager
+
+logging.disable(logging.WARNING)
+
+CODES = 100000
+
+print("🔍 Тестируем выдачу коротких кодов...")
+
+# 1. Перестановка: разные номера -> разные коды той же длины, декодируются обратно
+permutation = CodePermutation('test-key', 6)
+started = time.perf_counter()
+codes = [permutation.encode(n) for n in range(CODES)]
+elapsed = time.perf_counter() - started
+assert len(set(codes)) == CODES
+assert all(len(code) == 6 and set(code) <= set(ALPHABET) for code in codes)
+assert all(permutation.decode(code) == n for n, code in enumerate(codes[:1000]))
+assert permutation.decode(permutation.encode(permutation.size - 1)) == permutation.size - 1
+assert permutation.decode('abc') is None
+assert codes[:5] != sorted(codes[:5]) or codes[5:10] != sorted(codes[5:10])  # Не подряд
+assert CodePermutation('other-key', 6).encode(0) != codes[0]
+print(f"✅ {CODES} кодов без повторов за {elapsed * 1000:.0f} мс")
+
+# 2. Блоки из БД не пересекаются между процессами и после перезапуска
+db_path = os.path.join(tempfile.mkdtemp(), 'test_id_allocator.db')
+db = Database(db_path)
+first = IdAllocator('lobby', db, length=8, block_size=10)
+second = IdAllocator('lobby', Database(db_path), length=8, block_size=10)
+numbers = [first.next_number() for _ in range(15)] + [second.next_number() for _ in range(15)]
+restarted = IdAllocator('lobby', Database(db_path), length=8, block_size=10)
+numbers += [restarted.next_number() for _ in range(5)]
+assert len(set(numbers)) == len(numbers)
+assert IdAllocator('duel', db, block_size=10).next_number() == 0  # Свой счетчик
+print("✅ Блоки номеров не пересекаются между экземплярами")
+
+# Ключ кодов случайный для каждой БД и общий для всех ее экземпляров
+key = db.get_id_code_key()
+assert len(key) == 64 and Database(db_path).get_id_code_key() == key
+assert first.permutation.encode(0) == second.permutation.encode(0)
+other = Database(os.path.join(tempfile.mkdtemp(), 'test_id_key.db'))
+assert other.get_id_code_key() != key
+assert other.game_codes.permutation.encode(0) != db.game_codes.permutation.encode(0)
+print("✅ Ключ кодов случайный и хранится в БД")
+
+# 3. Игры получают коды без проверочных запросов, старый код пропускается
+for user_id in (1, 2):
+    db.register_user(user_id, f'user{user_id}', f'User {user_id}')
+    db.update_balance(user_id, 100.0)
+
+game_codes = {db.create_game(1, 1.0)[1] for _ in range(300)}
+assert len(game_codes) == 300
+
+allocator = db.game_codes
+taken = allocator.permutation.encode(allocator._next)  # Следующий код уже занят «старой» игрой
+conn = db.get_connection()
+conn.execute("INSERT INTO games (player1_id, bet_amount, status, game_code) VALUES (1, 1, 'finished', ?)", (taken,))
+conn.commit()
+conn.close()
+game_id, game_code = db.create_game(1, 1.0)
+assert game_code != taken and db.get_game(game_code)
+
+game_id, game_code, short = db.create_matched_game(1, 2, 5.0)
+assert short is None and db.get_game_by_id(game_id)[8] == game_code
+try:
+    db.create_game(999, 1.0)  # Нет пользователя: ошибка не принимается за коллизию кода
+    assert False
+except Exception as e:
+    assert 'player1_id' in str(e)
+print("✅ Коды игр уникальны, занятый старой игрой код пропускается")
+
+# 4. Лобби и дуэли берут ID из общего сервиса
+lobby_manager = LobbyManager(db)
+lobby_ids = {lobby_manager.create_lobby(i, f'user{i}', 1.0, 2).id for i in range(500)}
+assert len(lobby_ids) == 500 and all(len(lobby_id) == 8 for lobby_id in lobby_ids)
+
+duel_manager = DuelManager(db, max_per_user=50)
+duels = [duel_manager.create_duel(chat_id, 1, 'user1', 1.0)[0] for chat_id in range(50)]
+assert len({duel.duel_id for duel in duels}) == 50
+print("✅ ID лобби и дуэлей без повторов")
+
+print("🎉 Тест выдачи кодов завершен")
@@ -0,0 +1,126 @@
+# test_invoice_polling.py
+import os
+import sys
+import json
+import asyncio
+import tempfile
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, '.')
+
+from database import Database
+from app.models.payment import Payment
+from app.services.payment_manager import PaymentManager
+
+LATENCY = 0.05
+INVOICES = 250
+CHUNK_SIZE = 40
+CONCURRENCY = 3
+
+
+class FakeCryptoPay:
+    """
+    Локальная заглушка Crypto Pay: getInvoices с задержкой, четные инвойсы оплачены
+
+    Инвойсы 9000+ истекли, 5000-8999 API не возвращает.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @staticmethod
+    def status(invoice_id):
+        if invoice_id >= 9000:
+            return 'expired'
+        return 'paid' if invoice_id % 2 == 0 else 'active'
+
+    async def handle(self, reader, writer):
+        request_line = (await reader.readline()).decode()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(LATENCY)
+        self.in_flight -= 1
+
+        query = parse_qs(urlparse(request_line.split()[1]).query)
+        ids = query['invoice_ids'][0].split(',')
+        items = [{'invoice_id': int(i), 'status': self.status(int(i))} for i in ids if not 5000 <= int(i) < 9000]
+        body = json.dumps({'ok': True, 'result': {'items': items}}).encode()
+
+        writer.write(
+            b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+            + f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+        writer.close()
+
+
+async def main():
+    print("🔍 Тестируем пакетную сверку депозитов...")
+
+    db = Database(os.path.join(tempfile.mkdtemp(), 'test_polling.db'))
+    manager = PaymentManager(db, 'test-token')
+
+    fake = FakeCryptoPay()
+    server = await asyncio.start_server(fake.handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    manager.crypto_pay.test_mode = False
+    manager.crypto_pay.base_url = f'http://127.0.0.1:{port}/api'
+
+    # Пользователи и pending депозиты по $5
+    for i in range(INVOICES):
+        db.register_user(1000 + i, f'user{i}', f'User {i}')
+        manager.payment_model.create_payment(Payment(
+            payment_id=f'dep_{i}', user_id=1000 + i, amount=5.0, crypto_pay_id=str(i)
+        ))
+
+    # 1. Пачки и ограничение параллельности
+    result = await manager.check_pending_payments(chunk_size=CHUNK_SIZE, concurrency=CONCURRENCY)
+    expected_requests = -(-INVOICES // CHUNK_SIZE)
+    assert fake.requests == expected_requests, fake.requests
+    assert fake.max_in_flight <= CONCURRENCY, fake.max_in_flight
+    assert result['checked'] == INVOICES and result['completed'] == INVOICES // 2, result
+    print(f"✅ {INVOICES} инвойсов проверено за {fake.requests} запросов "
+          f"(не более {fake.max_in_flight} одновременно)")
+
+    # 2. Зачисления применены
+    assert manager.get_user_balance(1000) == 5.0
+    assert manager.get_user_balance(1001) == 0.0
+    assert manager.payment_model.get_payment('dep_0').status == 'completed'
+    assert manager.payment_model.get_payment('dep_1').status == 'pending'
+    print("✅ Оплаченные депозиты зачислены")
+
+    # 3. Повторная сверка не зачисляет дважды
+    result = await manager.check_pending_payments(chunk_size=CHUNK_SIZE, concurrency=CONCURRENCY)
+    assert result['checked'] == INVOICES // 2 and result['completed'] == 0, result
+    assert manager.get_user_balance(1000) == 5.0
+    print("✅ Повторная сверка идемпотентна")
+
+    # 4. Истекает только депозит со статусом expired: старый депозит без статуса ждет
+    for payment_id, crypto_pay_id in (('dep_lost', '5000'), ('dep_expired', '9000')):
+        manager.payment_model.create_payment(Payment(
+            payment_id=payment_id, user_id=1001, amount=5.0, crypto_pay_id=crypto_pay_id
+        ))
+    with db.get_connection() as conn:
+        conn.execute("UPDATE payments SET created_at = datetime('now', '-3 hours') "
+                     "WHERE payment_id IN ('dep_lost', 'dep_expired')")
+    result = await manager.check_pending_payments(chunk_size=CHUNK_SIZE, concurrency=CONCURRENCY)
+    assert result['expired'] == 1, result
+    assert manager.payment_model.get_payment('dep_expired').status == 'expired'
+    assert manager.payment_model.get_payment('dep_lost').status == 'pending'
+    assert manager.payment_model.get_payment('dep_1').status == 'pending'
+    print("✅ Без статуса от API депозит не истекает")
+
+    server.close()
+    await server.wait_closed()
+    await manager.close()
+    print("🎉 Тест пакетной сверки завершен")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+# test_lobby_game.py
+import os
+import sys
+import asyncio
+import logging
+import tempfile
+from types import SimpleNamespace
+
+sys.path.insert(0, '.')
+
+from database import Database
+from app.services.lobby_manager import LobbyManager
+from app.services.lobby_rounds import LobbyRoundGame
+from app.services.settlement import SettlementService
+from app.handlers import lobby_handlers
+from app.handlers.lobby_handlers import finish_lobby_game
+
+logging.disable(logging.CRITICAL)
+
+
+class TelegramStub:
+    """Отправленные сообщения вместо Bot API"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def balance(db, user_id):
+    return round(db.get_user(user_id)[4], 2)
+
+
+def make_bot(db, settlement):
+    telegram = TelegramStub()
+    bot = SimpleNamespace(db=db, settlement=settlement, lobby_manager=LobbyManager(db, flush_delay=0),
+                          active_lobby_games={}, application=SimpleNamespace(bot=telegram))
+    return bot, telegram
+
+
+def start_game(bot, players, bet):
+    """Лобби с оплаченными взносами и сыгранная игра (первый игрок выигрывает)"""
+    db, lobbies = bot.db, bot.lobby_manager
+    lobby = lobbies.create_lobby(players[0], f'user{players[0]}', bet, len(players))
+    db.update_balance(players[0], -bet)
+    for user_id in players[1:]:
+        lobbies.join_lobby(lobby.id, user_id, f'user{user_id}')
+        db.update_balance(user_id, -bet)
+        lobby.mark_player_paid(user_id)
+    lobbies.start_lobby(lobby)
+
+    game = LobbyRoundGame(f'lobby_{lobby.id}', lobby.id, lobby.players, bet, rounds=1)
+    for user_id in players:
+        game.rolls[user_id] = [6 if user_id == players[0] else 1]
+    game.status = "finished"
+    bot.active_lobby_games[game.game_id] = game
+    return lobby, game
+
+
+async def main():
+    print("🔍 Тестируем завершение игры лобби...")
+
+    db = Database(os.path.join(tempfile.mkdtemp(), 'test_lobby_game.db'))
+    for user_id in range(1, 7):
+        db.register_user(user_id, f'user{user_id}', f'User {user_id}')
+        db.update_balance(user_id, 100.0)
+    settlement = SettlementService(db, commission_rate=0.08)
+
+    # 1. Ставки берутся по игрокам игры, даже если состав лобби разошелся с игрой
+    bot, telegram = make_bot(db, settlement)
+    lobby, game = start_game(bot, [1, 2, 3], 10.0)
+    lobby.remove_player(1)  # Победитель пропал из лобби: расчет все равно по участникам игры
+    await finish_lobby_game(game.game_id, lobby, bot)
+    assert balance(db, 1) == round(90 + 30 * 0.92, 2) and balance(db, 2) == 90.0
+    assert settlement.get("lobby", game.game_id).pot == 30.0 and settlement.reconcile().balanced
+    assert not bot.active_lobby_games and not bot.lobby_manager.get_lobby(lobby.id)
+    assert {chat_id for chat_id, _ in telegram.sent} >= {1, 2, 3}
+    print("✅ Банк собран со всех участников игры, победитель получил выигрыш")
+
+    # 2. Ошибка расчета: выигрыш не объявляется, лобби и игра ждут повторной попытки
+    lobby_handlers.SETTLE_RETRY_SECONDS = 0.01
+    failures = {"left": 1}
+
+    def flaky_settle_many(settlements):
+        if failures["left"]:
+            failures["left"] -= 1
+            raise RuntimeError("database is locked")
+        return settlement.settle_many(settlements)
+
+    flaky = SimpleNamespace(plan=settlement.plan, get=settlement.get, settle_many=flaky_settle_many)
+    bot, telegram = make_bot(db, flaky)
+    lobby, game = start_game(bot, [4, 5], 10.0)
+    await finish_lobby_game(game.game_id, lobby, bot)
+    assert not any("зачислен" in text or "ПОБЕДИТЕЛЬ" in text for _, text in telegram.sent)
+    assert any("задерживается" in text for _, text in telegram.sent)
+    assert bot.active_lobby_games and bot.lobby_manager.get_lobby(lobby.id)
+    assert balance(db, 4) == 90.0 and settlement.get("lobby", game.game_id) is None
+
+    await asyncio.sleep(0.1)  # Повторная попытка проходит
+    assert balance(db, 4) == round(90 + 20 * 0.92, 2) and settlement.get("lobby", game.game_id).outcome == "win"
+    assert any("зачислен" in text for _, text in telegram.sent)
+    assert not bot.active_lobby_games and not bot.lobby_manager.get_lobby(lobby.id)
+    print("✅ Без расчета выигрыш не объявлен, расчет повторен")
+
+    # 3. Расчет не проходит все попытки - ставки возвращаются
+    failures["left"] = lobby_handlers.SETTLE_ATTEMPTS
+    bot, telegram = make_bot(db, flaky)
+    lobby, game = start_game(bot, [4, 6], 10.0)
+    await finish_lobby_game(game.game_id, lobby, bot)
+    await asyncio.sleep(0.1)
+    assert settlement.get("lobby", game.game_id).outcome == "cancel"
+    assert balance(db, 6) == 100.0 and balance(db, 4) == round(90 + 20 * 0.92, 2)  # Взнос вернулся
+    assert any("игра отменена" in text for _, text in telegram.sent)
+    assert not any("зачислен" in text for _, text in telegram.sent)
+    assert not bot.active_lobby_games and settlement.reconcile().balanced
+    print("✅ После неудачных попыток ставки возвращены")
+
+    print("🎉 Тест завершения игры лобби завершен")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
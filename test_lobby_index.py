@@ -0,0 +1,100 @@
+# test_lobby_index.py
+import sys
+import time
+import random
+import logging
+
+sys.path.insert(0, '.')
+
+from app.services.lobby_manager import LobbyManager
+from app.handlers.lobby_handlers import format_lobby_browser
+
+logging.disable(logging.INFO)
+
+LOBBIES = 20000
+BETS = (1, 5, 10, 25, 50, 100)
+
+print("🔍 Тестируем поиск лобби...")
+
+# Без БД: сохранение в этом тесте не вызывается
+manager = LobbyManager(db=None)
+random.seed(7)
+
+started = time.perf_counter()
+for i in range(LOBBIES):
+    lobby = manager.create_lobby(i, f'user{i}', random.choice(BETS), random.randint(2, 6))
+    for j in range(random.randint(0, lobby.max_players - 1)):
+        manager.join_lobby(lobby.id, LOBBIES + i * 10 + j, 'guest')
+print(f"✅ {LOBBIES} лобби проиндексированы за {time.perf_counter() - started:.2f} сек")
+
+
+def brute_force(bet=None):
+    """Эталон: полный обход всех лобби"""
+    return {lobby.id for lobby in manager.lobbies.values()
+            if lobby.status == "waiting" and not lobby.is_full()
+            and (bet is None or lobby.bet_amount == bet)}
+
+
+def sort_key(lobby_id):
+    lobby = manager.lobbies[lobby_id]
+    return lobby.bet_amount, lobby.max_players - lobby.get_player_count()
+
+
+# 1. Случайные входы, выходы и старты поддерживают индекс
+lobby_ids = list(manager.lobbies)
+for _ in range(5000):
+    lobby = manager.lobbies.get(random.choice(lobby_ids))
+    if not lobby:
+        continue
+    action = random.random()
+    if action < 0.5:
+        manager.join_lobby(lobby.id, random.randint(10 ** 6, 10 ** 7), 'guest')
+    elif action < 0.8 and lobby.get_player_count() > 1:
+        manager.leave_lobby(lobby.id, list(lobby.players)[-1].id)
+    elif action < 0.9:
+        manager.lobbies[lobby.id].status = "active"
+        manager.index.update(lobby)
+    else:
+        manager.lobbies.pop(lobby.id)
+        manager.index.remove(lobby.id)
+
+for bet in (None, 10, 100):
+    expected = brute_force(bet)
+    ordered = list(manager.index.iter_open(bet, bet))
+    assert set(ordered) == expected and len(ordered) == len(expected)
+    assert [sort_key(i) for i in ordered] == sorted(sort_key(i) for i in ordered)
+    assert manager.index.count_open(bet) == len(expected)
+    page, has_more = manager.browse_lobbies(bet, 0, 8)
+    assert [l.id for l in page] == ordered[:8] and has_more == (len(ordered) > 8)
+    page, _ = manager.browse_lobbies(bet, 3, 8)
+    assert [l.id for l in page] == ordered[24:32]
+print("✅ Индекс совпадает с полным обходом после 5000 изменений")
+
+# 2. Поиск по ставке и местам не зависит от числа лобби
+started = time.perf_counter()
+for _ in range(10000):
+    lobby_id = manager.index.find(min_bet=20, max_bet=60, min_free=2)
+elapsed = time.perf_counter() - started
+lobby = manager.lobbies[lobby_id]
+assert 20 <= lobby.bet_amount <= 60 and lobby.max_players - lobby.get_player_count() >= 2
+print(f"✅ 10000 поисков за {elapsed * 1000:.0f} мс")
+
+# 3. Заполненное лобби пропадает из поиска, освободившееся - возвращается
+lobby = manager.create_lobby(1, 'solo', 777, 2)
+assert manager.index.find(777, 777) == lobby.id
+manager.join_lobby(lobby.id, 2, 'guest')
+assert manager.index.find(777, 777) is None and lobby.id in manager.get_active_lobbies()
+manager.leave_lobby(lobby.id, 2)
+assert manager.index.find(777, 777) == lobby.id
+manager.index.update(lobby)  # Повторное обновление без изменений
+assert manager.index.count_open(777) == 1
+print("✅ Лобби переходят между корзинами при входе и выходе")
+
+text, markup = format_lobby_browser(manager, 10, 1)
+assert 'ставка $10' in text
+callbacks = [button.callback_data for row in markup.inline_keyboard for button in row]
+assert "lobby_browse:10:0" in callbacks and "lobby_browse:10:2" in callbacks
+assert all(len(data.encode()) <= 64 for data in callbacks)
+print("✅ Клавиатура поиска с фильтром и страницами")
+
+print("🎉 Тест поиска лобби завершен")
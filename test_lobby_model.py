@@ -0,0 +1,67 @@
+# test_lobby_model.py
+import sys
+import time
+import random
+
+sys.path.insert(0, '.')
+
+from app.models.lobby import Lobby, LobbyPlayer
+
+PLAYERS = 500
+
+print("🔍 Тестируем модель лобби...")
+
+lobby = Lobby(id='BIG', creator_id=0, creator_name='player0', max_players=PLAYERS, bet_amount=5.0)
+for i in range(PLAYERS):
+    assert lobby.add_player(LobbyPlayer(id=i, username=f'player{i}', paid=i == 0))
+assert not lobby.add_player(LobbyPlayer(id=1, username='dup'))
+assert not lobby.add_player(LobbyPlayer(id=PLAYERS, username='extra'))
+print(f"✅ {PLAYERS} игроков, дубликаты и переполнение отклонены")
+
+# 1. Счетчики совпадают с пересчетом после случайных действий
+random.seed(42)
+started = time.perf_counter()
+for _ in range(20000):
+    user_id = random.randrange(PLAYERS + 10)
+    action = random.random()
+    if action < 0.6:
+        lobby.toggle_player_ready(user_id)
+    elif action < 0.8:
+        lobby.mark_player_paid(user_id)
+    elif action < 0.9:
+        lobby.remove_player(user_id)
+    else:
+        lobby.add_player(LobbyPlayer(id=user_id, username=f'player{user_id}', ready=True, paid=True))
+elapsed = time.perf_counter() - started
+
+assert lobby.ready_count == sum(1 for p in lobby.players if p.ready)
+assert lobby.paid_count == sum(1 for p in lobby.players if p.paid)
+print(f"✅ Счетчики готовности/оплаты верны после 20000 действий ({elapsed * 1000:.0f} мс)")
+
+# 2. Готовность меняется только через лобби
+player = lobby.first_player()
+try:
+    player.ready = True
+    assert False, "ожидалась ошибка"
+except AttributeError:
+    pass
+print("✅ Прямое изменение готовности запрещено")
+
+# 3. Порядок входа и сериализация
+small = Lobby(id='S', creator_id=1, creator_name='a', max_players=3)
+for i in (1, 2, 3):
+    small.add_player(LobbyPlayer(id=i, username=str(i)))
+small.set_player_ready(3, True)
+small.remove_player(1)
+assert [p.id for p in small.players] == [2, 3] and small.first_player().id == 2
+assert not small.all_players_ready()
+
+restored = Lobby.from_dict(small.to_dict())
+assert [p.id for p in restored.players] == [2, 3]
+assert restored.ready_count == 1 and restored.paid_count == 0
+restored.set_player_ready(2, True)
+restored.add_player(LobbyPlayer(id=4, username='4', ready=True))
+assert restored.all_players_ready() and restored.is_full()
+print("✅ Порядок игроков и счетчики переживают сериализацию")
+
+print("🎉 Тест модели лобби завершен")
@@ -0,0 +1,77 @@
+# test_lobby_persistence.py
+import os
+import sys
+import asyncio
+import logging
+import tempfile
+
+sys.path.insert(0, '.')
+
+from database import Database
+from app.models.lobby import LobbyPlayer
+from app.services.lobby_manager import LobbyManager, LOBBY_WRITES_TOTAL
+
+logging.disable(logging.INFO)
+
+PLAYERS = 200
+
+
+def db_players(db, lobby_id):
+    conn = db.get_connection()
+    rows = conn.execute('SELECT player_id, ready, paid FROM lobby_players WHERE lobby_id = ? ORDER BY player_id',
+                        (lobby_id,)).fetchall()
+    conn.close()
+    return rows
+
+
+async def main():
+    print("🔍 Тестируем сохранение лобби...")
+
+    db = Database(os.path.join(tempfile.mkdtemp(), 'test_lobby_persistence.db'))
+    manager = LobbyManager(db, flush_delay=0.05)
+
+    # 1. Вне event loop запись сразу
+    lobby = manager.create_lobby(0, 'player0', 5.0, PLAYERS)
+    for i in range(1, PLAYERS):
+        lobby.add_player(LobbyPlayer(id=i, username=f'player{i}'))
+    await asyncio.to_thread(manager.save_lobby_to_db, lobby)
+    assert len(db_players(db, lobby.id)) == PLAYERS
+    print(f"✅ Лобби на {PLAYERS} игроков сохранено построчно")
+
+    # 2. Серия кликов сливается в одну запись только измененных игроков
+    lobbies_before = LOBBY_WRITES_TOTAL.get("lobby")
+    rows_before = LOBBY_WRITES_TOTAL.get("player")
+    for click in range(100):
+        player_id = click % 3 + 1
+        lobby.toggle_player_ready(player_id)
+        manager.save_lobby_to_db(lobby)
+    assert db_players(db, lobby.id)[1][1] == 0  # Еще не записано
+    await asyncio.sleep(0.1)
+
+    assert LOBBY_WRITES_TOTAL.get("lobby") - lobbies_before == 1
+    assert LOBBY_WRITES_TOTAL.get("player") - rows_before == 3
+    saved = {row[0]: row[1] for row in db_players(db, lobby.id)}
+    assert all(saved[p.id] == p.ready for p in lobby.players)
+    print("✅ 100 кликов = 1 запись, 3 строки игроков")
+
+    # 3. Выход игрока удаляет одну строку, удаление лобби - все
+    manager.leave_lobby(lobby.id, 5)
+    lobby.mark_player_paid(6)
+    manager.save_lobby_to_db(lobby)
+    manager.flush()
+    rows = db_players(db, lobby.id)
+    assert len(rows) == PLAYERS - 1 and 5 not in [r[0] for r in rows]
+    assert [r[2] for r in rows if r[0] == 6] == [1]
+
+    lobby.toggle_player_ready(7)
+    manager.save_lobby_to_db(lobby)
+    manager.delete_lobby(lobby.id)
+    await asyncio.sleep(0.1)
+    assert db_players(db, lobby.id) == []
+    print("✅ Выход и удаление лобби отражаются в БД")
+
+    print("🎉 Тест сохранения лобби завершен")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
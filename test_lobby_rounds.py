@@ -0,0 +1,100 @@
+# test_lobby_rounds.py
+import sys
+import time
+import random
+import asyncio
+
+sys.path.insert(0, '.')
+
+from app.models.lobby import LobbyPlayer
+from app.services.lobby_rounds import LobbyRoundGame
+
+PLAYERS = 10
+
+
+async def main():
+    print("🔍 Тестируем раунды лобби с одновременными ходами...")
+
+    players = [LobbyPlayer(id=i, username=f'player{i}') for i in range(PLAYERS)]
+    closed = []
+
+    async def on_round_closed(game, result):
+        closed.append(result)
+
+    # 1. Все игроки бросают параллельно: игра длится O(раундов)
+    game = LobbyRoundGame('lobby_TEST', 'TEST', players, 10.0, rounds=3,
+                          round_timeout=5.0, on_round_closed=on_round_closed)
+    game.start()
+    started = time.perf_counter()
+
+    async def player_turn(player_id, round_number):
+        await asyncio.sleep(random.random() * 0.02)  # Нажатия приходят вперемешку
+        return await game.roll(player_id, random.randint(1, 6), round_number)
+
+    for round_number in range(1, 4):
+        results = await asyncio.gather(*(player_turn(p.id, round_number) for p in players))
+        assert all(ok for ok, _ in results), results
+        await game.wait_notified()  # Следующий раунд открывается после рассылки итогов
+
+    assert game.status == "finished"
+    assert [r.round_number for r in closed] == [1, 2, 3] and closed[-1].finished
+    assert all(len(rolls) == 3 for rolls in game.rolls.values())
+    print(f"✅ {PLAYERS} игроков × 3 броска за {time.perf_counter() - started:.2f} сек")
+
+    # 2. Повторный бросок и бросок в закрытом раунде отклоняются
+    closed.clear()
+    game = LobbyRoundGame('lobby_T2', 'T2', players[:3], 10.0, rounds=2,
+                          round_timeout=0.1, on_round_closed=on_round_closed)
+    game.start()
+    assert (await game.roll(0, 6, 1))[0]
+    assert not (await game.roll(0, 6, 1))[0]
+    assert not (await game.roll(99, 6, 1))[0]
+    print("✅ Повторный бросок и чужой игрок отклонены")
+
+    # 3. Дедлайн: за не успевших бросает бот, раунд закрывается сам
+    await asyncio.sleep(0.15)
+    assert closed and closed[0].auto_rolled == [1, 2], closed
+    assert game.round_number == 2
+    ok, error = await game.roll(0, 6, 1)
+    assert not ok and error == "Раунд уже закрыт"
+    await asyncio.sleep(0.15)
+    assert game.status == "finished"
+    assert all(len(rolls) == 2 and all(1 <= v <= 6 for v in rolls) for rolls in game.rolls.values())
+    print("✅ Раунды закрываются по дедлайну")
+
+    # 4. Долгое уведомление (анимация, рассылка) не съедает дедлайн следующего раунда
+    closed.clear()
+
+    notified = []
+
+    async def slow_round_closed(game, result):
+        closed.append(result)
+        assert not game._lock.locked()  # Уведомление идет вне замка
+        await asyncio.sleep(0.3)
+        notified.append(result.round_number)
+
+    game = LobbyRoundGame('lobby_T3', 'T3', players[:2], 10.0, rounds=3,
+                          round_timeout=0.2, on_round_closed=slow_round_closed)
+    game.start()
+    for round_number in (1, 2, 3):
+        assert (await game.roll(0, 6, round_number))[0]
+        last = asyncio.create_task(game.roll(1, 5, round_number))
+        await asyncio.sleep(0.05)
+        # Последний бросок не ждет рассылки итогов (обработчик обновления свободен)
+        assert last.done() and (await last)[0] and round_number not in notified
+        if round_number < 3:
+            # Итоги еще рассылаются: номер следующего раунда известен, но раунд закрыт
+            assert game.round_number == round_number + 1
+            ok, error = await game.roll(0, 6, round_number + 1)
+            assert not ok and "еще не начался" in error, error
+        await game.wait_notified()
+        assert notified[-1] == round_number
+    assert [r.auto_rolled for r in closed] == [[], [], []], closed
+    assert game.rolls == {0: [6, 6, 6], 1: [5, 5, 5]}
+    print("✅ Итоги рассылаются в фоне, таймер следующего раунда стартует после них")
+
+    print("🎉 Тест раундов лобби завершен")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
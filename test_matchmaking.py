@@ -0,0 +1,119 @@
+# test_matchmaking.py
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+
+sys.path.insert(0, '.')
+
+from database import Database
+from app.services.game_manager import GameManager
+from app.services.matchmaking import (
+    MatchmakingService, MATCHMAKING_MATCHES_TOTAL, MATCHMAKING_WAIT_SECONDS, MATCHMAKING_QUEUE_DEPTH
+)
+
+logging.disable(logging.INFO)
+
+PLAYERS = 200
+
+
+async def main():
+    print("🔍 Тестируем подбор соперников...")
+
+    db = Database(os.path.join(tempfile.mkdtemp(), 'test_matchmaking.db'))
+    for user_id in range(1, PLAYERS + 4):
+        db.register_user(user_id, f'user{user_id}', f'User {user_id}')
+        db.update_balance(user_id, 100.0)
+
+    matched, dropped = [], []
+
+    async def on_match(game):
+        matched.append(game)
+
+    async def on_dropped(user_id, reason):
+        dropped.append((user_id, reason))
+
+    manager = GameManager(db)
+    service = MatchmakingService(manager, on_match=on_match, on_dropped=on_dropped)
+
+    # 1. Очередь: дубликаты, неизвестная ставка, отмена
+    assert service.enqueue(1, 'user1', 10)[0]
+    assert not service.enqueue(1, 'user1', 5)[0]
+    assert not service.enqueue(2, 'user2', 7)[0]
+    assert service.dequeue(1) and not service.is_queued(1)
+    print("✅ Очередь отклоняет дубли и неизвестные ставки")
+
+    # 2. Пачка игроков сводится в пары одним проходом
+    matches_before = MATCHMAKING_MATCHES_TOTAL.get("10")
+    for user_id in range(1, PLAYERS + 1):
+        assert service.enqueue(user_id, f'user{user_id}', 10 if user_id % 2 else 25)[0]
+    assert MATCHMAKING_QUEUE_DEPTH.get() == PLAYERS
+
+    started = time.perf_counter()
+    await service.run_once()
+    elapsed = time.perf_counter() - started
+
+    assert len(matched) == PLAYERS // 2 and service.queue_depth() == 0
+    assert MATCHMAKING_MATCHES_TOTAL.get("10") - matches_before == PLAYERS // 4
+    assert MATCHMAKING_WAIT_SECONDS.count("25") >= PLAYERS // 2
+    for game in matched:
+        row = db.get_game_by_id(game.id)
+        assert row[7] == 'active' and {row[15], row[16]} == {game.player1_id, game.player2_id}
+        assert (game.player1_id - game.player2_id) % 2 == 0  # Одна ставка в паре
+    assert db.get_user(1)[4] == 90.0 and db.get_user(2)[4] == 75.0
+    print(f"✅ {PLAYERS // 2} игр создано за {elapsed * 1000:.0f} мс, ставки списаны")
+
+    # 3. Нехватка средств: выбывает только этот игрок, пара ждет следующего
+    matched.clear()
+    service.enqueue(PLAYERS + 1, 'poor', 50)
+    service.enqueue(PLAYERS + 2, 'rich', 50)
+    db.update_balance(PLAYERS + 1, -95.0)
+    await service.run_once()
+    assert not matched and dropped == [(PLAYERS + 1, "insufficient_funds")]
+    assert db.get_user(PLAYERS + 2)[4] == 100.0 and service.is_queued(PLAYERS + 2)
+
+    service.enqueue(PLAYERS + 3, 'late', 50)
+    await service.run_once()
+    assert len(matched) == 1 and matched[0].player1_id == PLAYERS + 2
+    print("✅ Игрок без средств выбывает, его пара остается первой в очереди")
+
+    # 4. Истекшее ожидание снимает с очереди
+    dropped.clear()
+    service.max_wait = 0
+    assert service.enqueue(1, 'user1', 50)[0]
+    await service.run_once()
+    assert dropped == [(1, "timeout")] and not service.is_queued(1)
+    print("✅ Ожидание ограничено по времени")
+
+    # 5. Сбой создания игры: созданные игры уведомляются, пара возвращается в начало очереди
+    matched.clear()
+    dropped.clear()
+    service.max_wait = 300
+    create_matched_game = manager.create_matched_game
+    calls = []
+
+    def flaky(*args):
+        calls.append(args)
+        if len(calls) == 2:
+            raise RuntimeError("database is locked")
+        return create_matched_game(*args)
+
+    manager.create_matched_game = flaky
+    for user_id in (3, 4, 5, 6):
+        assert service.enqueue(user_id, f'user{user_id}', 5)[0]
+    await service.run_once()
+    assert len(matched) == 1 and not dropped
+    assert list(service._queues[5]) == [5, 6]
+
+    manager.create_matched_game = create_matched_game
+    await service.run_once()
+    assert len(matched) == 2 and matched[1].player1_id == 5 and service.queue_depth() == 0
+    print("✅ Сбой создания игры не теряет созданные игры и очередь")
+
+    print("🎉 Тест подбора соперников завершен")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
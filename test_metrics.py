@@ -0,0 +1,122 @@
+# test_metrics.py
+import sys
+import asyncio
+import logging
+from types import SimpleNamespace
+
+sys.path.insert(0, '.')
+
+from telegram.ext import ApplicationBuilder, CommandHandler
+
+from app.services.metrics import MetricsRegistry, MetricsServer, sql_operation, update_kind
+from app.utils.telegram_instrumentation import InstrumentedApplication
+
+logging.disable(logging.ERROR)  # Ошибка колбэка gauge ожидаема
+
+
+def message_update(text):
+    return SimpleNamespace(callback_query=None, edited_message=None, message=SimpleNamespace(text=text))
+
+
+def callback_update(data):
+    return SimpleNamespace(callback_query=SimpleNamespace(data=data), message=None, edited_message=None)
+
+
+print("🔍 Тестируем метрики...")
+
+# 1. Метки обновлений: только зарегистрированные команды, остальное - command:other
+application = ApplicationBuilder().token('1:test').application_class(InstrumentedApplication).build()
+application.add_handler(CommandHandler("start", lambda update, context: None))
+application.add_handlers([CommandHandler(["duel", "join_lobby"], lambda update, context: None)])
+commands = application.commands
+assert commands == {'start', 'duel', 'join_lobby'}
+
+assert update_kind(message_update('/start'), commands) == 'command:start'
+assert update_kind(message_update('/DUEL@dice_bot 5'), commands) == 'command:duel'
+assert update_kind(message_update('/join_lobby ABCD1234'), commands) == 'command:join_lobby'
+labels = {update_kind(message_update(f'/spam{i}'), commands) for i in range(1000)}
+assert labels == {'command:other'}
+assert update_kind(message_update('/'), commands) == 'command:other'
+assert update_kind(message_update('/start')) == 'command:other'  # Без списка команд
+assert update_kind(message_update('привет'), commands) == 'message'
+assert update_kind(callback_update('join_game:ABC123'), commands) == 'callback:join_game'
+assert update_kind(callback_update('123'), commands) == 'callback'
+print("✅ Метки команд ограничены зарегистрированными")
+
+# 2. Реестр: повторная регистрация возвращает ту же метрику, значения по меткам
+registry = MetricsRegistry()
+requests = registry.counter('test_requests_total', 'Запросы', ('endpoint', 'outcome'))
+assert registry.counter('test_requests_total', 'Другое описание', ('endpoint', 'outcome')) is requests
+requests.inc('getMe', 'ok')
+requests.inc('getMe', 'ok', amount=2)
+requests.inc('transfer', 'error')
+assert requests.get('getMe', 'ok') == 3.0 and requests.get('transfer', 'ok') == 0.0
+
+latency = registry.histogram('test_latency_seconds', 'Задержка', ('endpoint',), buckets=(0.1, 1.0))
+for value in (0.05, 0.1, 0.5, 3.0):
+    latency.observe(value, 'getMe')
+assert latency.count('getMe') == 4 and latency.count('transfer') == 0
+
+queue_depth = registry.gauge('test_queue_depth', 'Глубина очереди')
+queue_depth.set(5)
+broken = registry.gauge('test_broken', 'Сломанный колбэк')
+broken.set_function(lambda: 1 / 0)
+assert queue_depth.get() == 5 and broken.get() == 0.0
+queue_depth.set_function(lambda: 7)
+print("✅ Счетчики, гистограммы и gauge считают по меткам")
+
+# 3. Текстовый формат Prometheus: HELP/TYPE, кумулятивные корзины, +Inf, сумма и количество
+lines = registry.render().splitlines()
+assert lines[:5] == [
+    '# HELP test_requests_total Запросы',
+    '# TYPE test_requests_total counter',
+    'test_requests_total{endpoint="getMe",outcome="ok"} 3.0',
+    'test_requests_total{endpoint="transfer",outcome="error"} 1.0',
+    '# HELP test_latency_seconds Задержка',
+]
+assert lines[5:11] == [
+    '# TYPE test_latency_seconds histogram',
+    'test_latency_seconds_bucket{endpoint="getMe",le="0.1"} 2',
+    'test_latency_seconds_bucket{endpoint="getMe",le="1.0"} 3',
+    'test_latency_seconds_bucket{endpoint="getMe",le="+Inf"} 4',
+    'test_latency_seconds_sum{endpoint="getMe"} 3.65',
+    'test_latency_seconds_count{endpoint="getMe"} 4',
+]
+assert lines[11:] == [
+    '# HELP test_queue_depth Глубина очереди', '# TYPE test_queue_depth gauge', 'test_queue_depth 7.0',
+    '# HELP test_broken Сломанный колбэк', '# TYPE test_broken gauge', 'test_broken 0.0',
+]
+assert registry.render().endswith('\n')
+assert MetricsRegistry().render() == '\n'
+assert sql_operation('  select * from users') == 'SELECT' and sql_operation('') == 'OTHER'
+print("✅ Экспозиция в текстовом формате Prometheus")
+
+
+
+# 4. GET /metrics отдает тот же текст, остальные пути - 404
+async def fetch(port, path):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+    response = await reader.read()
+    writer.close()
+    return response.decode('utf-8')
+
+
+async def serve():
+    server = MetricsServer(registry, port=0)
+    await server.start()
+    port = server.server.sockets[0].getsockname()[1]
+    try:
+        response = await fetch(port, '/metrics?x=1')
+        headers, body = response.split('\r\n\r\n', 1)
+        assert headers.startswith('HTTP/1.1 200 OK') and 'version=0.0.4' in headers
+        assert body == registry.render()
+        assert (await fetch(port, '/other')).startswith('HTTP/1.1 404')
+    finally:
+        await server.stop()
+
+
+asyncio.run(serve())
+print("✅ /metrics отдает экспозицию по HTTP")
+
+print("🎉 Тест метрик завершен")
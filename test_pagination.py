@@ -0,0 +1,73 @@
+# test_pagination.py
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, '.')
+
+from database import Database
+from app.models.payment import Payment, PaymentModel
+from app.utils.pagination import encode_cursor, decode_cursor
+
+print("🔍 Тестируем keyset-пагинацию...")
+
+db = Database(os.path.join(tempfile.mkdtemp(), 'test_pagination.db'))
+model = PaymentModel(db)
+
+# 1. Курсор компактный и переживает round-trip
+assert decode_cursor(encode_cursor('a', 1234567)) == ('a', 1234567)
+assert decode_cursor('garbage') is None and decode_cursor(None) is None
+assert len(encode_cursor('a', 10 ** 9)) <= 8
+print("✅ Курсор кодируется и декодируется")
+
+# 2. 250 платежей, по 5 с одинаковым created_at - порядок не должен терять записи
+with model.transaction() as cursor:
+    for i in range(250):
+        payment = Payment(payment_id=f'p_{i:04d}', user_id=i % 2, amount=float(i),
+                          created_at=f'2024-01-01T00:{i // 5 // 60:02d}:{i // 5 % 60:02d}')
+        model.create_payment(payment, cursor=cursor)
+
+seen, page_cursor, pages = [], None, []
+while True:
+    page = model.get_payments_page(page_cursor, page_size=15)
+    pages.append(page)
+    seen.extend(row[0] for row in page.rows)
+    if not page.next_cursor:
+        break
+    page_cursor = page.next_cursor
+
+assert len(seen) == 250 and len(set(seen)) == 250, len(seen)
+assert seen == sorted(seen, reverse=True)
+assert pages[0].prev_cursor is None
+print(f"✅ Все 250 платежей просмотрены за {len(pages)} страниц без повторов")
+
+# 3. Назад: кнопка «новее» возвращает предыдущую страницу целиком
+back = model.get_payments_page(pages[3].prev_cursor, page_size=15)
+assert back.rows == pages[2].rows
+assert back.next_cursor and back.prev_cursor
+print("✅ Навигация назад возвращает ту же страницу")
+
+# 4. История пользователя и фильтр статуса
+user_rows = []
+page = model.get_user_payments_page(1, page_size=40)
+user_rows.extend(page.rows)
+while page.next_cursor:
+    page = model.get_user_payments_page(1, page.next_cursor, page_size=40)
+    user_rows.extend(page.rows)
+assert len(user_rows) == 125
+assert model.get_payments_page(status='completed').rows == []
+print("✅ История пользователя и фильтр по статусу")
+
+# 5. Страница идет по индексу без сортировки во временном B-дереве
+conn = db.get_connection()
+plan = conn.execute('''
+    EXPLAIN QUERY PLAN SELECT payment_id, rowid FROM payments
+    WHERE user_id = ? AND (created_at, rowid) < (?, ?)
+    ORDER BY created_at DESC, rowid DESC LIMIT 11
+''', (1, '2024', 10)).fetchall()
+conn.close()
+plan_text = ' '.join(row[-1] for row in plan)
+assert 'idx_payments_user_created' in plan_text and 'TEMP B-TREE' not in plan_text, plan_text
+print("✅ Запрос страницы использует составной индекс")
+
+print("🎉 Тест пагинации завершен")
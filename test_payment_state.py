@@ -0,0 +1,67 @@
+# test_payment_state.py
+import os
+import sys
+import asyncio
+import tempfile
+import threading
+
+sys.path.insert(0, '.')
+
+from database import Database
+from app.models.payment import Payment, InvalidTransitionError
+from app.services.payment_manager import PaymentManager
+
+print("🔍 Тестируем машину состояний платежей...")
+
+db = Database(os.path.join(tempfile.mkdtemp(), 'test_payment_state.db'))
+manager = PaymentManager(db, 'test-token')
+model = manager.payment_model
+db.register_user(1, 'payer', 'Payer')
+
+# 1. Compare-and-swap по версии
+model.create_payment(Payment(payment_id='dep_1', user_id=1, amount=10.0, crypto_pay_id='11'))
+payment = model.get_payment('dep_1')
+assert model.transition('dep_1', 'pending', 'pending', version=payment.version, crypto_pay_id='12')
+assert not model.transition('dep_1', 'pending', 'expired', version=payment.version)
+assert model.get_payment('dep_1').version == payment.version + 1
+print("✅ Устаревшая версия отклонена")
+
+# 2. Недопустимый переход
+try:
+    model.transition('dep_1', 'completed', 'pending')
+    assert False, "ожидалась ошибка перехода"
+except InvalidTransitionError:
+    pass
+print("✅ Недопустимый переход запрещен")
+
+# 3. Параллельное зачисление одного инвойса - только один раз
+errors = []
+
+
+def apply():
+    try:
+        manager.apply_paid_invoice({'invoice_id': 12})
+    except Exception as e:
+        errors.append(e)
+
+
+threads = [threading.Thread(target=apply) for _ in range(8)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+
+assert not errors, errors
+assert manager.get_user_balance(1) == 10.0, manager.get_user_balance(1)
+assert model.get_payment('dep_1').status == 'completed'
+print("✅ Параллельное зачисление выполнено ровно один раз")
+
+# 4. Отмена вывода: возврат и смена статуса атомарны, повтор ничего не делает
+db.update_balance(1, 5.0)
+model.create_payment(Payment(payment_id='wd_1', user_id=1, amount=5.0, payment_type='withdraw'))
+assert asyncio.run(manager.cancel_withdrawal('wd_1', 1))[0]
+assert not asyncio.run(manager.cancel_withdrawal('wd_1', 1))[0]
+assert manager.get_user_balance(1) == 20.0
+print("✅ Повторная отмена не возвращает средства дважды")
+
+print("🎉 Тест машины состояний завершен")
@@ -0,0 +1,79 @@
+# test_payment_stress.py
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+
+sys.path.insert(0, '.')
+
+from database import Database
+from app.services.payment_manager import PaymentManager
+
+USERS = 300
+START_BALANCE = 100.0
+DEPOSIT = 20.0
+WITHDRAW = 30.0
+
+logging.disable(logging.INFO)
+
+
+async def main():
+    print(f"🔍 Нагрузочный тест платежей: {USERS} депозитов и {USERS} выводов одновременно...")
+
+    db = Database(os.path.join(tempfile.mkdtemp(), 'test_stress.db'))
+    manager = PaymentManager(db, 'test-token')  # Тестовый режим Crypto Pay: без сети
+
+    for i in range(USERS):
+        db.register_user(i, f'user{i}', f'User {i}')
+        db.update_balance(i, START_BALANCE)
+        manager.link_crypto_pay_account(i, str(10000 + i))
+
+    started = time.perf_counter()
+
+    # 1. Депозиты и выводы вперемешку
+    deposits = [manager.create_deposit(i, DEPOSIT) for i in range(USERS)]
+    withdrawals = [manager.create_withdrawal(i, WITHDRAW) for i in range(USERS)]
+    results = await asyncio.gather(*deposits, *withdrawals)
+
+    deposit_results, withdraw_results = results[:USERS], results[USERS:]
+    assert all(payment for payment, _, _ in deposit_results), [e for _, _, e in deposit_results if e][:3]
+    assert all(payment for payment, _ in withdraw_results), [e for _, e in withdraw_results if e][:3]
+    print("✅ Все платежи созданы")
+
+    # 2. Параллельные зачисления из нескольких потоков (как вебхуки), каждый инвойс дважды
+    invoices = [{'invoice_id': manager.payment_model.get_payment(p.payment_id).crypto_pay_id}
+                for p, _, _ in deposit_results]
+    applied = await asyncio.gather(*(
+        asyncio.to_thread(manager.apply_paid_invoice, invoice) for invoice in invoices + invoices
+    ))
+    credited = sum(1 for payment, error in applied if payment)
+    assert credited == USERS, credited
+    print("✅ Каждый депозит зачислен ровно один раз")
+
+    # 3. Параллельная отмена выводов (двойное нажатие)
+    cancels = await asyncio.gather(*(
+        manager.cancel_withdrawal(p.payment_id, p.user_id)
+        for p, _ in withdraw_results + withdraw_results
+    ))
+    assert sum(1 for ok, _ in cancels if ok) == USERS
+    print("✅ Каждый вывод отменен ровно один раз")
+
+    # 4. Инвариант баланса: старт + депозит - вывод + возврат (сумма после комиссии 8%)
+    expected = START_BALANCE + DEPOSIT - WITHDRAW + WITHDRAW * 0.92
+    wrong = [i for i in range(USERS) if abs(manager.get_user_balance(i) - expected) > 1e-6]
+    assert not wrong, (wrong[:5], manager.get_user_balance(wrong[0]))
+
+    # 5. Счетчики статистики, обновляемые триггерами, совпадают с полным пересчетом
+    assert manager.stats.reconcile() == {}
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Балансы сошлись у всех {USERS} пользователей ({elapsed:.2f} сек)")
+
+    await manager.close()
+    print("🎉 Нагрузочный тест платежей завершен")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,157 @@
+# test_payout_queue.py
+import os
+import sys
+import json
+import asyncio
+import tempfile
+
+sys.path.insert(0, '.')
+
+from database import Database
+from app.models.payment import Payment
+from app.services.payment_manager import PaymentManager
+from app.services.payout_queue import PayoutQueue, PayoutPolicy
+
+LATENCY = 0.03
+CONCURRENCY = 4
+FAILING_ACCOUNT = 9999  # Переводы на этот аккаунт всегда отклоняются
+LOST_ACCOUNT = 9998  # Переводы на этот аккаунт без ответа: исход неизвестен
+
+
+class FakeTransferApi:
+    """Локальная заглушка Crypto Pay transfer с дедупликацией по spend_id"""
+
+    def __init__(self):
+        self.spend_ids = {}
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handle(self, reader, writer):
+        await reader.readline()
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if line.lower().startswith(b'content-length:'):
+                length = int(line.split(b':')[1])
+        request = json.loads(await reader.readexactly(length))
+
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(LATENCY)
+        self.in_flight -= 1
+
+        if request['user_id'] == LOST_ACCOUNT:
+            writer.write(b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n')
+            await writer.drain()
+            writer.close()
+            return
+        if request['user_id'] == FAILING_ACCOUNT:
+            response = {'ok': False, 'error': {'name': 'USER_NOT_FOUND'}}
+        else:
+            transfer = self.spend_ids.setdefault(request['spend_id'], {
+                'id': len(self.spend_ids) + 1, 'status': 'completed', 'amount': request['amount']
+            })
+            response = {'ok': True, 'result': transfer}
+
+        body = json.dumps(response).encode()
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                     + f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+        await writer.drain()
+        writer.close()
+
+
+def add_withdrawal(manager, payment_id, user_id, amount):
+    manager.payment_model.create_payment(Payment(
+        payment_id=payment_id, user_id=user_id, amount=amount, payment_type='withdraw'
+    ))
+
+
+async def main():
+    print("🔍 Тестируем очередь выплат...")
+
+    db = Database(os.path.join(tempfile.mkdtemp(), 'test_payouts.db'))
+    manager = PaymentManager(db, 'test-token')
+
+    fake = FakeTransferApi()
+    server = await asyncio.start_server(fake.handle, '127.0.0.1', 0)
+    manager.crypto_pay.test_mode = False
+    manager.crypto_pay.base_url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/api"
+
+    for i in range(20):
+        db.register_user(100 + i, f'user{i}', f'User {i}')
+        manager.link_crypto_pay_account(100 + i, str(5000 + i))
+        add_withdrawal(manager, f'wd_{i}', 100 + i, 10.0)
+
+    db.register_user(200, 'whale', 'Whale')
+    manager.link_crypto_pay_account(200, '6000')
+    add_withdrawal(manager, 'wd_BIG', 200, 250.0)
+
+    db.register_user(300, 'broken', 'Broken')
+    manager.link_crypto_pay_account(300, str(FAILING_ACCOUNT))
+    add_withdrawal(manager, 'wd_FAIL', 300, 5.0)
+
+    db.register_user(400, 'lost', 'Lost')
+    manager.link_crypto_pay_account(400, str(LOST_ACCOUNT))
+    add_withdrawal(manager, 'wd_LOST', 400, 5.0)
+
+    queue = PayoutQueue(manager, PayoutPolicy(max_auto_amount=100.0, daily_limit=500.0),
+                        batch_size=50, concurrency=CONCURRENCY)
+
+    # 1. Пачка: мелкие выплаты автоматически, крупная - на проверку
+    result = await queue.run_once()
+    assert result == {'completed': 20, 'retry': 2, 'failed': 0, 'review': 1}, result
+    assert fake.max_in_flight <= CONCURRENCY, fake.max_in_flight
+    assert manager.payment_model.get_payment('wd_0').status == 'completed'
+    assert manager.payment_model.get_payment('wd_BIG').status == 'review'
+    print(f"✅ Пачка обработана (не более {fake.max_in_flight} переводов одновременно)")
+
+    # 2. Одобрение администратором
+    assert [row[0] for row in queue.get_review_queue()] == ['wd_BIG']
+    assert queue.approve('wd_BIG')[0]
+    assert not queue.approve('wd_BIG')[0]
+    result = await queue.run_once()
+    assert result['completed'] == 1, result
+    print("✅ Крупная выплата выполнена после одобрения")
+
+    # 3. Повтор неудачного перевода, затем отмена с возвратом средств
+    await queue.run_once()
+    payment = manager.payment_model.get_payment('wd_FAIL')
+    assert payment.status == 'failed', payment.status
+    assert manager.get_user_balance(300) == 5.0
+    print("✅ Неудачная выплата отменена после 3 попыток, средства возвращены")
+
+    # Без ответа API перевод мог пройти: не возвращаем средства, ждем администратора
+    payment = manager.payment_model.get_payment('wd_LOST')
+    assert payment.status == 'review', payment.status
+    assert manager.get_user_balance(400) == 0.0
+    assert not (await manager.cancel_withdrawal('wd_LOST', 400))[0]
+    assert 'wd_LOST' in [row[0] for row in queue.get_review_queue()]
+    add_withdrawal(manager, 'wd_LOST2', 400, 5.0)
+    ok, error = await manager.process_withdrawal('wd_LOST2')
+    assert not ok and 'на проверку' in error, error
+    assert manager.payment_model.get_payment('wd_LOST2').status == 'review'
+    assert manager.get_user_balance(400) == 0.0
+    manager.crypto_pay.client.breaker.record_success()  # ответы 503 открыли предохранитель
+    print("✅ Выплата с неизвестным исходом ушла на проверку без возврата средств")
+
+    # 4. Зависшие выплаты возвращаются в очередь; spend_id не дает заплатить дважды
+    with manager.transaction() as cursor:
+        cursor.execute("UPDATE payments SET status = 'processing' WHERE payment_id = 'wd_0'")
+    transfers_before = len(fake.spend_ids)
+    result = await PayoutQueue(manager, batch_size=50, concurrency=CONCURRENCY).run_once()
+    assert result['completed'] == 1, result
+    assert len(fake.spend_ids) == transfers_before
+    print("✅ Повтор после сбоя не создал второй перевод")
+
+    server.close()
+    await server.wait_closed()
+    await manager.close()
+    print("🎉 Тест очереди выплат завершен")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+# test_rollups.py
+import os
+import sys
+import logging
+import tempfile
+
+sys.path.insert(0, '.')
+
+from database import Database
+from app.models.payment import Payment, PaymentModel
+from app.services.rollups import RollupService, format_rollups
+from backfill_rollups import backfill_rollups
+
+logging.disable(logging.INFO)
+
+print("🔍 Тестируем срезы аналитики...")
+
+db_path = os.path.join(tempfile.mkdtemp(), 'test_rollups.db')
+db = Database(db_path)
+model = PaymentModel(db)
+
+for i in range(1, 5):
+    db.register_user(i, f'user{i}', f'User {i}')
+
+# История: 30 игр за два дня (по 3 часа), у каждой третьей - ничья
+conn = db.get_connection()
+with conn:
+    for i in range(30):
+        day, hour = 1 + i // 15, 10 + i % 3
+        conn.execute('''
+            INSERT INTO games (player1_id, player2_id, bet_amount, status, winner_id, created_at, finished_at)
+            VALUES (?, ?, ?, 'finished', ?, ?, ?)
+        ''', (1 + i % 2, 3 + i % 2, 10.0, None if i % 3 == 0 else 1,
+              f'2024-05-0{day} {hour}:00:00', f'2024-05-0{day} {hour}:05:00'))
+    conn.execute("INSERT INTO games (player1_id, bet_amount, status) VALUES (1, 99.0, 'waiting')")
+conn.close()
+
+model.create_payment(Payment(payment_id='dep_1', user_id=1, amount=50.0, status='completed',
+                             created_at='2024-05-01T10:30:00'))
+model.create_payment(Payment(payment_id='wd_1', user_id=2, amount=20.0, payment_type='withdraw',
+                             status='completed', created_at='2024-05-02T11:00:00'))
+model.create_payment(Payment(payment_id='dep_2', user_id=1, amount=70.0, created_at='2024-05-02T11:00:00'))
+
+# 1. Бэкфилл мелкими пачками
+total = backfill_rollups(db_path, chunk_size=7)
+assert total == {'games': 30, 'payments': 2}, total
+
+rollups = RollupService(db, commission_rate=0.08)
+days = rollups.get_range('day', 10)
+assert [d.bucket for d in days] == ['2024-05-01', '2024-05-02']
+assert days[0].games == 15 and days[0].turnover == 300.0
+assert abs(days[0].commission - 10 * 20 * 0.08) < 1e-9, days[0].commission
+assert days[0].average_bet == 10.0 and days[0].active_users == 4
+assert days[0].deposits == 50.0 and days[1].withdrawals == 20.0
+hours = rollups.get_range('hour', 100)
+assert len(hours) == 6 and sum(h.games for h in hours) == 30
+print("✅ Бэкфилл пачками построил почасовые и посуточные срезы")
+
+# 2. Повторный проход ничего не считает дважды; новая строка добавляется инкрементально
+assert rollups.run_once() == {'games': 0, 'payments': 0}
+model.transition('dep_2', 'pending', 'completed')
+assert rollups.run_once() == {'games': 0, 'payments': 1}
+assert sum(d.deposits for d in rollups.get_range('day', 10)) == 50.0 + 70.0
+print("✅ Инкрементальный проход учитывает только новые строки")
+
+# 3. Пересборка с нуля дает тот же результат
+backfill_rollups(db_path, chunk_size=100, rebuild=True)
+rebuilt = rollups.get_range('day', 10)[0]
+assert rebuilt[:4] == days[0][:4] and abs(rebuilt.commission - days[0].commission) < 1e-9
+assert rebuilt[5:] == days[0][5:]
+print("✅ Пересборка совпадает с инкрементальными срезами")
+
+assert '2024-05-01' in format_rollups(days)
+
+# Колонка rolled_up не сдвигает присоединенные поля игры (p1_tg_id и т.д.)
+db.update_balance(2, 5.0)
+game_id, game_code = db.create_game(1, 5.0)
+assert db.get_game(game_code)[15] == 1 and db.get_game(game_code)[16] is None
+assert db.join_game(game_code, 2)[0] and db.get_game_by_id(game_id)[16] == 2
+print("🎉 Тест срезов аналитики завершен")
@@ -0,0 +1,134 @@
+# test_settlement.py
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, '.')
+
+from database import Database
+from app.services.settlement import SettlementService
+from app.services.game_manager import GameManager
+from app.services.duel_manager import DuelManager
+
+logging.disable(logging.WARNING)
+
+GAMES = 1000
+
+
+def balance(db, user_id):
+    return round(db.get_user(user_id)[4], 2)
+
+
+async def main():
+    print("🔍 Тестируем расчеты по играм...")
+
+    db = Database(os.path.join(tempfile.mkdtemp(), 'test_settlement.db'))
+    for user_id in range(1, 11):
+        db.register_user(user_id, f'user{user_id}', f'User {user_id}')
+        db.update_balance(user_id, 100.0)
+    settlement = SettlementService(db, commission_rate=0.08)
+
+    # 1. Банк, комиссия и выплаты сходятся до цента
+    plan = settlement.plan("lobby", "x", {1: 10, 2: 10, 3: 10}, winners=[2])
+    assert plan.pot == 30 and plan.commission == 2.4 and plan.payouts == {2: 27.6}
+    plan = settlement.plan("lobby", "y", {1: 0.33, 2: 0.33, 3: 0.33}, winners=[1, 3])
+    assert plan.commission == 0.08 and plan.payouts == {1: 0.46, 3: 0.45}
+    assert settlement.plan("duel", "z", {1: 5, 2: 5}).payouts == {1: 5, 2: 5}  # Ничья - возврат
+    try:
+        settlement.plan("duel", "z", {1: 5}, winners=[2])
+        assert False
+    except ValueError:
+        pass
+    print("✅ Банк делится без потери центов")
+
+    # 2. Игра 1 на 1: ставка второго игрока списывается один раз, выигрыш зачисляется один раз
+    manager = GameManager(db, settlement=settlement)
+    game, _ = manager.create_game(1, 'user1', 10.0, fast=False)
+    game, _ = manager.join_game(game.game_code, 2, 'user2')
+    assert balance(db, 1) == 90 and balance(db, 2) == 90
+    for value in (6, 6, 6):
+        await manager.process_dice_roll(game.id, 1, value)
+    for value in (1, 1, 1):
+        game, _ = await manager.process_dice_roll(game.id, 2, value)
+    assert game.status == "finished" and game.winner_id == 1
+    assert balance(db, 1) == 108.4 and balance(db, 2) == 90
+    assert manager.settle_game(game)[0] is None and balance(db, 1) == 108.4  # Повтор не платит
+    assert db.get_game_by_id(game.id)[7] == 'finished'
+
+    game, _ = manager.create_game(3, 'user3', 5.0, fast=False)
+    manager.join_game(game.game_code, 4, 'user4')
+    for player_id in (3, 4):
+        for value in (2, 3, 4):
+            game, _ = await manager.process_dice_roll(game.id, player_id, value)
+    assert game.winner_id is None and balance(db, 3) == 100 and balance(db, 4) == 100
+
+    game, _ = manager.create_game(5, 'user5', 7.0, fast=False)
+    assert (await manager.cancel_game(game.id, 5))[0] and balance(db, 5) == 100
+    assert not (await manager.cancel_game(game.id, 5))[0] and balance(db, 5) == 100
+    print("✅ Игры 1 на 1: выигрыш, ничья и отмена через леджер")
+
+    # 3. Дуэли: выплата, ничья, отмена и возврат старых дуэлей пачкой
+    duels = DuelManager(db, settlement=settlement)
+    duel, _ = duels.create_duel(-100, 6, 'user6', 10.0)
+    duels.accept_duel(duel.duel_id, 7, 'user7')
+    for player_id, values in ((6, (1, 2, 3)), (7, (6, 6, 5))):
+        for value in values:
+            duels.process_duel_roll(duel.duel_id, player_id, value)
+    assert duel.winner_id == 7 and balance(db, 7) == 108.4 and balance(db, 6) == 90
+
+    duel, _ = duels.create_duel(-101, 8, 'user8', 3.0)
+    duels.accept_duel(duel.duel_id, 9, 'user9')
+    for player_id in (8, 9):
+        for value in (4, 4, 4):
+            duels.process_duel_roll(duel.duel_id, player_id, value)
+    assert duel.winner_id is None and balance(db, 8) == 100 and balance(db, 9) == 100
+
+    duel, _ = duels.create_duel(-102, 10, 'user10', 4.0)
+    assert duels.cancel_duel(duel.duel_id, 10)[0] and balance(db, 10) == 100
+
+    stale = [duels.create_duel(-200 - i, 10, 'user10', 1.0)[0] for i in range(3)]
+    duels.accept_duel(stale[0].duel_id, 8, 'user8')
+    for duel in stale:
+        duel.created_at = datetime.now() - timedelta(hours=25)
+    assert balance(db, 10) == 97 and balance(db, 8) == 99
+    duels.cleanup_old_duels(hours_old=24)
+    assert balance(db, 10) == 100 and balance(db, 8) == 100
+    assert not any(duel.duel_id in duels.active_duels for duel in stale)
+    print("✅ Дуэли: выплата, ничья, отмена и очистка возвращают ставки")
+
+    # 4. Пачка расчетов - одна транзакция, сверка сходится
+    before = sum(balance(db, user_id) for user_id in range(1, 11))
+    plans = [settlement.plan("game", f"batch{i}", {1 + i % 5: 2.5, 6 + i % 5: 2.5},
+                             winners=[] if i % 10 == 0 else [1 + i % 5]) for i in range(GAMES)]
+    started = time.perf_counter()
+    assert len(settlement.settle_many(plans)) == GAMES
+    elapsed = time.perf_counter() - started
+    assert settlement.settle_many(plans[:10]) == []  # Повтор пачки пропускается
+
+    commission = sum(p.commission for p in plans)
+    after = sum(balance(db, user_id) for user_id in range(1, 11))
+    assert round(after - before, 2) == round(sum(p.pot for p in plans) - commission, 2)
+
+    report = settlement.reconcile()
+    assert report.balanced and report.settlements >= GAMES + 6
+    assert round(report.stakes, 2) == round(report.paid_out + report.commission, 2)
+    print(f"✅ {GAMES} расчетов за {elapsed * 1000:.0f} мс, ставки = выплаты + комиссия")
+
+    # 5. Сверка находит испорченную проводку
+    conn = db.get_connection()
+    conn.execute("UPDATE ledger_entries SET amount_cents = amount_cents + 1 "
+                 "WHERE settlement_id = 'game:batch1' AND kind = 'payout'")
+    conn.commit()
+    conn.close()
+    assert settlement.reconcile().unbalanced == ['game:batch1']
+    print("✅ Сверка находит расхождения")
+
+    print("🎉 Тест расчетов завершен")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,254 @@
+# test_tournament.py
+import os
+import sys
+import time
+import asyncio
+import logging
+import tempfile
+from types import SimpleNamespace
+
+sys.path.insert(0, '.')
+
+from database import Database
+from app.services.lobby_manager import LobbyManager
+from app.services.settlement import SettlementService
+from app.services.tournament import Bracket, TournamentManager
+from app.handlers.lobby_handlers import leave_lobby_callback, start_tournament
+
+logging.disable(logging.WARNING)
+
+PLAYERS = 1024
+
+
+def balance(db, user_id):
+    return round(db.get_user(user_id)[4], 2)
+
+
+def play_out(bracket, pick):
+    """Разыгрывает сетку без игр: pick(матч) -> победитель"""
+    while not bracket.finished:
+        for match in bracket.next_round():
+            if match.winner_id is None:
+                bracket.record(match.round_number, match.slot, pick(match))
+
+
+def registration(db, lobbies, players, bet, tournament):
+    """Лобби-турнир: взносы списаны при входе, как в обработчиках"""
+    creator = players[0]
+    db.update_balance(creator, -bet)
+    lobby = lobbies.create_lobby(creator, f'user{creator}', bet, len(players), tournament=tournament)
+    for user_id in players[1:]:
+        lobbies.join_lobby(lobby.id, user_id, f'user{user_id}')
+        db.update_balance(user_id, -bet)
+        lobby.mark_player_paid(user_id)
+    return lobby
+
+
+async def main():
+    print("🔍 Тестируем турнирные сетки...")
+
+    # 1. Олимпийская система: проходы сильнейшим сеяным, 1024 игрока - 10 раундов
+    bracket = Bracket([10, 20, 30, 40, 50])
+    first = bracket.next_round()
+    assert [(m.player_a, m.player_b) for m in first] == [(10, None), (40, 50), (20, None), (30, None)]
+    assert [m.winner_id for m in first] == [10, None, 20, 30]
+    assert bracket.record(1, 1, 50) and bracket.round_complete
+    assert [(m.player_a, m.player_b) for m in bracket.next_round()] == [(10, 50), (20, 30)]
+    for error_case in ((1, 0, 10), (2, 0, 20), (2, 1, 99)):
+        try:
+            bracket.record(*error_case)
+            assert False
+        except ValueError:
+            pass
+    bracket.record(2, 0, 10)
+    assert bracket.record(2, 1, 20)
+    play_out(bracket, lambda m: m.player_b)
+    assert bracket.finished and bracket.champion == 20
+
+    bracket = Bracket(list(range(1, PLAYERS + 1)))
+    play_out(bracket, lambda m: min(m.player_a, m.player_b))
+    assert bracket.total_rounds == 10 and bracket.champion == 1
+    assert sum(len(w) for w in bracket.winners) == PLAYERS - 1
+    size = sum(p.itemsize * len(p) for p in bracket.pairs) + sum(w.itemsize * len(w) for w in bracket.winners)
+    assert size <= 12 * 1024
+    print(f"✅ Олимпийская система: {PLAYERS} игроков, 10 раундов, сетка {size} байт")
+
+    # 2. Швейцарская система: все играют все раунды, без повторных встреч, проход нечетному
+    bracket = Bracket(list(range(1, 8)), "swiss")
+    play_out(bracket, lambda m: min(m.player_a, m.player_b))
+    pairs = [tuple(sorted((m.player_a, m.player_b))) for r in range(1, 4) for m in bracket.matches(r) if m.player_b]
+    assert len(pairs) == len(set(pairs)) == 9
+    byes = [m.player_a for r in range(1, 4) for m in bracket.matches(r) if m.player_b is None]
+    assert len(byes) == len(set(byes)) == 3
+    assert bracket.champion == 1 and bracket.standings()[0] == (1, 3)
+
+    started = time.perf_counter()
+    bracket = Bracket(list(range(1, PLAYERS + 1)), "swiss")
+    play_out(bracket, lambda m: min(m.player_a, m.player_b))
+    elapsed = time.perf_counter() - started
+    pairs = [tuple(sorted((m.player_a, m.player_b))) for r in range(1, 11) for m in bracket.matches(r)]
+    assert len(pairs) == len(set(pairs)) == PLAYERS // 2 * 10
+    assert bracket.champion == 1 and bracket.standings()[0] == (1, 10)
+    print(f"✅ Швейцарская система: {PLAYERS} игроков за {elapsed * 1000:.0f} мс, без повторных встреч")
+
+    # 3. Турнир на 1024 игрока: матчи - параллельные игры, бросает бот, чемпион получает банк
+    db = Database(os.path.join(tempfile.mkdtemp(), 'test_tournament.db'))
+    for user_id in range(1, PLAYERS + 1):
+        db.register_user(user_id, f'user{user_id}', f'User {user_id}')
+        db.update_balance(user_id, 100.0)
+    lobbies = LobbyManager(db, flush_delay=0)
+    settlement = SettlementService(db, commission_rate=0.08)
+
+    finished = asyncio.Event()
+    events = {"rounds": 0, "matches": 0}
+
+    async def on_round_opened(tournament, match, game):
+        events["rounds"] += 1
+
+    async def on_match_finished(tournament, match):
+        events["matches"] += 1
+
+    async def on_finished(tournament, result):
+        events["settlement"] = result
+        finished.set()
+
+    games = {}
+    manager = TournamentManager(db, settlement, games=games, round_timeout=0.01,
+                                on_round_opened=on_round_opened, on_match_finished=on_match_finished,
+                                on_finished=on_finished)
+    lobby = registration(db, lobbies, list(range(1, PLAYERS + 1)), 2.0, "single")
+    lobbies.start_lobby(lobby)
+    assert lobbies.join_lobby(lobby.id, 5000, 'late') == (False, "Игра уже началась")
+    # Выйти с возвратом взноса из начатого турнира нельзя: ставка уже в банке
+    assert lobbies.leave_lobby(lobby.id, 2) == (False, "Игра уже началась")
+    assert lobby.get_player(2) and balance(db, 2) == 98.0
+    answers = []
+
+    async def answer(text, show_alert=False):
+        answers.append(text)
+
+    query = SimpleNamespace(answer=answer)
+    await leave_lobby_callback(query, lobby.id, 2, SimpleNamespace(lobby_manager=lobbies, db=db))
+    assert answers == ["❌ Игра уже началась"] and balance(db, 2) == 98.0
+
+    # Турнир не запустился - лобби снова ждет игроков, из него можно выйти с возвратом
+    answers.clear()
+    waiting = registration(db, lobbies, [PLAYERS - 1, PLAYERS], 2.0, "single")
+    bot = SimpleNamespace(lobby_manager=lobbies, db=db, tournaments=SimpleNamespace(
+        start=lambda lobby: asyncio.sleep(0, (None, "Турнир уже идет"))))
+    await start_tournament(query, waiting, bot)
+    assert answers == ["❌ Турнир уже идет"] and waiting.status == "waiting"
+    assert waiting.id in lobbies.get_active_lobbies()
+    await leave_lobby_callback(query, waiting.id, PLAYERS, bot)
+    assert balance(db, PLAYERS) == 98.0 and not waiting.get_player(PLAYERS)
+
+    started = time.perf_counter()
+    tournament, error = await manager.start(lobby)
+    assert error is None and len(games) == PLAYERS // 2
+    assert (await manager.start(lobby))[1] == "Турнир уже идет"
+    await asyncio.wait_for(finished.wait(), 60)
+    elapsed = time.perf_counter() - started
+
+    champion = tournament.bracket.champion
+    prize = events["settlement"].payout(champion)
+    assert events["matches"] == PLAYERS - 1 and events["rounds"] >= 3 * (PLAYERS - 1)
+    assert prize == round(2.0 * PLAYERS * 0.92, 2) and balance(db, champion) == round(98 + prize, 2)
+    assert not games and not manager.tournaments and settlement.reconcile().balanced
+
+    # Сетка в БД совпадает с сеткой в памяти
+    restored = manager.load_bracket(tournament.id)
+    assert restored.pairs == tournament.bracket.pairs and restored.winners == tournament.bracket.winners
+    assert restored.finished and restored.champion == champion
+    print(f"✅ Турнир на {PLAYERS} игроков: {PLAYERS - 1} матчей за {elapsed:.1f} с, "
+          f"чемпион получил ${prize:.2f}")
+
+    # 4. Ничья в матче переигрывается, сетка в БД пишется по ходу турнира
+    opened = []
+
+    async def collect(tournament, match, game):
+        opened.append(game)
+
+    manager = TournamentManager(db, settlement, round_timeout=30, on_round_opened=collect)
+    lobby = registration(db, lobbies, [1, 2, 3], 1.0, "swiss")
+    tournament, _ = await manager.start(lobby)
+    game = opened[-1]
+    player_a, player_b = game.players
+    for round_number in (1, 2, 3):
+        await game.roll(player_a, 4, round_number)
+        await game.roll(player_b, 4, round_number)
+        await game.wait_notified()
+    assert game.status == "active" and game.rounds == 4 and opened[-1] is game
+    await game.roll(player_a, 6, 4)
+    await game.roll(player_b, 1, 4)
+    await game.wait_notified()
+
+    restored = manager.load_bracket(tournament.id)
+    assert restored.round_number == 2 and restored.match(1, 0).winner_id == player_a
+    assert restored.pairs == tournament.bracket.pairs
+    for game in manager.games.values():
+        game.cancel()
+    print("✅ Ничья переигрывается, результаты матчей сохраняются сразу")
+
+    # 5. Перезапуск: активный турнир продолжается, недоигранные матчи начинаются заново
+    db = Database(os.path.join(tempfile.mkdtemp(), 'test_tournament_restart.db'))
+    for user_id in range(11, 16):
+        db.register_user(user_id, f'user{user_id}', f'User {user_id}')
+        db.update_balance(user_id, 100.0)
+    lobbies = LobbyManager(db, flush_delay=0)
+    settlement = SettlementService(db, commission_rate=0.08)
+
+    opened.clear()
+    manager = TournamentManager(db, settlement, round_timeout=30, on_round_opened=collect)
+    lobby = registration(db, lobbies, [11, 12, 13, 14], 1.0, "single")
+    tournament, _ = await manager.start(lobby)
+    played, unfinished = opened[0], opened[1]
+    for round_number in (1, 2, 3):
+        for value, player_id in zip((6, 1), played.players):
+            await played.roll(player_id, value, round_number)
+        await played.wait_notified()
+    await unfinished.roll(next(iter(unfinished.players)), 6, 1)
+    for game in manager.games.values():
+        game.cancel()  # Бот остановлен посреди раунда
+
+    opened.clear()
+    started_before_notify = []
+
+    async def on_restart(tournament, match, game):
+        started_before_notify.append(game._round_open)
+        opened.append(game)
+
+    finished.clear()
+    restarted = TournamentManager(db, settlement, round_timeout=30, on_round_opened=on_restart,
+                                  on_finished=on_finished)
+    assert await restarted.resume() == {"resumed": 1, "refunded": 0}
+    assert len(opened) == 1 and set(opened[0].players) == set(unfinished.players)
+    assert opened[0].rolls == {player_id: [] for player_id in unfinished.players}
+    assert restarted.tournaments[tournament.id].name(11) == 'user11'
+
+    while not finished.is_set():
+        game = opened[-1]
+        for round_number in range(game.round_number, game.rounds + 1):
+            for value, player_id in zip((6, 1), game.players):
+                await game.roll(player_id, value, round_number)
+            await game.wait_notified()
+    assert started_before_notify and not any(started_before_notify)
+    champion = restarted.load_bracket(tournament.id).champion
+    assert events["settlement"].payout(champion) == round(4.0 * 0.92, 2)
+    assert not restarted.tournaments and settlement.reconcile().balanced
+
+    # Сетку не восстановить - турнир отменяется с возвратом взносов
+    db.update_balance(15, -1.0)
+    conn = db.get_connection()
+    with conn:
+        conn.execute("INSERT INTO tournaments (id, format, bet_amount, players, total_rounds, status) "
+                     "VALUES ('BROKEN', 'single', 1.0, '[15]', 1, 'active')")
+    conn.close()
+    assert await restarted.resume() == {"resumed": 0, "refunded": 1}
+    assert balance(db, 15) == 100.0 and await restarted.resume() == {"resumed": 0, "refunded": 0}
+    print("✅ После перезапуска турнир продолжается, невосстановимый - возвращает взносы")
+
+    print("🎉 Тест турниров завершен")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
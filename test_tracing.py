@@ -0,0 +1,109 @@
+# test_tracing.py
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import tempfile
+
+sys.path.insert(0, '.')
+
+from app.services.tracing import Tracer, NOOP_SPAN, MAX_SPANS_PER_TRACE
+
+logging.disable(logging.WARNING)
+
+
+def read_traces(path, count, timeout=5.0):
+    """Ждет, пока фоновый поток допишет count трасс"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                lines = f.read().splitlines()
+            if len(lines) >= count:
+                return [json.loads(line) for line in lines]
+        time.sleep(0.01)
+    raise AssertionError(f"За {timeout} с записано меньше {count} трасс")
+
+
+async def main():
+    print("🔍 Тестируем трассировку...")
+
+    export_path = os.path.join(tempfile.mkdtemp(), 'slow_traces.jsonl')
+    tracer = Tracer()
+
+    @tracer.traced()
+    async def load_game(game_id):
+        with tracer.span('sql', operation='SELECT'):
+            await asyncio.sleep(0.01)
+        return game_id
+
+    @tracer.traced('settle')
+    def settle():
+        with tracer.span('sql', operation='UPDATE') as span:
+            span.set('rows', 2)
+        raise ValueError("boom")
+
+    # 1. Выключенный трассировщик ничего не собирает и не пишет
+    with tracer.trace('update', kind='command:start') as trace:
+        assert trace is None and tracer.span('sql') is NOOP_SPAN
+        assert await load_game(1) == 1
+    assert tracer.span('sql') is NOOP_SPAN and tracer.current_trace_id() is None
+    assert tracer.exported_count == 0 and not os.path.exists(export_path)
+    print("✅ Без configure трассировка выключена")
+
+    # 2. Быстрые трассы не экспортируются, медленные пишутся в JSONL со спанами
+    tracer.configure(enabled=True, slow_threshold_ms=50, export_path=export_path)
+    with tracer.trace('update', kind='callback:roll'):
+        await load_game(1)
+    assert tracer.exported_count == 0
+
+    with tracer.trace('update', kind='command:start', update_id=7) as trace:
+        trace_id = tracer.current_trace_id()
+        assert trace_id == trace.trace_id
+        await load_game(2)
+        try:
+            settle()
+        except ValueError:
+            pass
+        await asyncio.sleep(0.06)
+    assert tracer.current_trace_id() is None and tracer.exported_count == 1
+
+    (entry,) = read_traces(export_path, 1)
+    assert entry['trace_id'] == trace_id and entry['name'] == 'update'
+    assert entry['attrs'] == {'kind': 'command:start', 'update_id': 7} and entry['duration_ms'] >= 50
+    spans = {span['name']: span for span in entry['spans']}
+    assert [span['name'] for span in entry['spans']] == ['main.<locals>.load_game', 'sql', 'settle', 'sql']
+    load, settle_span = spans['main.<locals>.load_game'], spans['settle']
+    assert load['parent'] is None and entry['spans'][1]['parent'] == load['id']
+    assert entry['spans'][3]['parent'] == settle_span['id'] and entry['spans'][3]['attrs']['rows'] == 2
+    assert settle_span['attrs'] == {'error': 'ValueError'}
+    assert all(span['offset_ms'] >= 0 for span in entry['spans'])
+    print("✅ Медленная трасса записана в JSONL с вложенными спанами")
+
+    # 3. Параллельные обновления не смешивают спаны, лишние спаны отбрасываются
+    tracer.slow_threshold_ms = 0
+
+    async def handle(update_id):
+        with tracer.trace('update', update_id=update_id):
+            for _ in range(3):
+                await load_game(update_id)
+
+    await asyncio.gather(*(handle(update_id) for update_id in range(10, 15)))
+    with tracer.trace('update', update_id=99):
+        for _ in range(MAX_SPANS_PER_TRACE + 5):
+            with tracer.span('sql'):
+                pass
+
+    entries = read_traces(export_path, 7)[1:]
+    assert sorted(e['attrs']['update_id'] for e in entries[:5]) == [10, 11, 12, 13, 14]
+    assert all(len(e['spans']) == 6 and e['dropped_spans'] == 0 for e in entries[:5])
+    assert len(entries[5]['spans']) == MAX_SPANS_PER_TRACE and entries[5]['dropped_spans'] == 5
+    print("✅ Трассы параллельных обновлений раздельны, размер трассы ограничен")
+
+    print("🎉 Тест трассировки завершен")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())